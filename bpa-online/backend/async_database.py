@@ -0,0 +1,310 @@
+"""
+Acesso assíncrono ao PostgreSQL para as rotas FastAPI (psycopg 3 + psycopg_pool)
+
+`BPADatabase` (psycopg2, ThreadedConnectionPool) bloqueia o event loop a cada
+consulta feita de um handler `async def`. `AsyncBPADatabase` espelha a mesma
+API com `await`:
+    - as leituras e escritas simples das rotas interativas rodam direto num
+      AsyncConnectionPool, com statements preparados e timeout por consulta;
+    - os demais métodos (cargas em lote, COPY, exportação em blocos) continuam
+      sendo os de BPADatabase, executados numa thread do pool do AnyIO.
+
+Sem o pacote psycopg 3 (ou antes de open()), tudo cai no segundo caminho:
+as rotas continuam funcionando, só sem o pool assíncrono.
+
+Configuração (env):
+    DB_ASYNC_POOL_MIN / DB_ASYNC_POOL_MAX   tamanho do pool por processo
+    DB_ASYNC_POOL_TIMEOUT                   espera por conexão livre (s)
+    DB_STATEMENT_TIMEOUT_MS                 statement_timeout padrão das conexões
+    DB_PREPARE_THRESHOLD                    execuções antes de preparar (vazio = nunca,
+                                            ex.: atrás de PgBouncer em modo transaction)
+    DB_PREPARED_MAX                         statements preparados mantidos por conexão
+"""
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+
+from anyio import to_thread
+from psycopg2.extras import RealDictCursor
+
+import database
+from database import BPADatabase, DATABASE_URL, _somar_resumo
+from services.db_metrics import (
+    POOL_ESGOTADO, POOL_WAIT, instrumentar_metodos, medicao_ativa, registrar_consulta
+)
+
+logger = logging.getLogger(__name__)
+
+try:
+    from psycopg.rows import dict_row
+    from psycopg_pool import AsyncConnectionPool, PoolTimeout
+    PSYCOPG_ASYNC_AVAILABLE = True
+except ImportError:
+    dict_row = None
+    AsyncConnectionPool = None
+    PoolTimeout = None
+    PSYCOPG_ASYNC_AVAILABLE = False
+
+DB_ASYNC_POOL_MIN = int(os.getenv('DB_ASYNC_POOL_MIN', '2'))
+DB_ASYNC_POOL_MAX = int(os.getenv('DB_ASYNC_POOL_MAX', '20'))
+DB_ASYNC_POOL_TIMEOUT = float(os.getenv('DB_ASYNC_POOL_TIMEOUT', '30'))
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', '30000'))
+_prepare_threshold = os.getenv('DB_PREPARE_THRESHOLD', '5')
+DB_PREPARE_THRESHOLD = int(_prepare_threshold) if _prepare_threshold.strip() else None
+DB_PREPARED_MAX = int(os.getenv('DB_PREPARED_MAX', '100'))
+
+
+class AsyncBPADatabase:
+    """
+    Espelho assíncrono de BPADatabase: mesmos métodos e retornos, com await
+
+    Métodos não implementados aqui são delegados a BPADatabase numa thread
+    (ver __getattr__), então `await adb.<qualquer método de BPADatabase>(...)`
+    sempre funciona.
+    """
+
+    def __init__(self, sync_db: Optional[BPADatabase] = None, pool=None):
+        self._sync_db = sync_db
+        self._pool = pool
+
+    @property
+    def sync_db(self) -> BPADatabase:
+        if self._sync_db is None:
+            self._sync_db = database.db
+        return self._sync_db
+
+    # ========== POOL ==========
+
+    async def open(self) -> None:
+        """Abre o pool (startup da aplicação); sem psycopg 3, segue pelas threads"""
+        if self._pool is not None:
+            return
+        if not PSYCOPG_ASYNC_AVAILABLE:
+            logger.warning("[DB] psycopg 3 não instalado: consultas assíncronas em threads (psycopg2)")
+            return
+        self._pool = AsyncConnectionPool(
+            DATABASE_URL,
+            min_size=DB_ASYNC_POOL_MIN,
+            max_size=DB_ASYNC_POOL_MAX,
+            timeout=DB_ASYNC_POOL_TIMEOUT,
+            kwargs={
+                'autocommit': True,
+                'row_factory': dict_row,
+                'prepare_threshold': DB_PREPARE_THRESHOLD,
+                'options': f'-c statement_timeout={DB_STATEMENT_TIMEOUT_MS}',
+            },
+            configure=self._configurar_conexao,
+            open=False,
+            name='bpa-async',
+        )
+        # wait=False: a API sobe mesmo com o banco fora; as conexões vêm em background
+        await self._pool.open(wait=False)
+        logger.info(f"[DB] Pool assíncrono inicializado: {DB_ASYNC_POOL_MIN}-{DB_ASYNC_POOL_MAX} conexões, "
+                    f"statement_timeout={DB_STATEMENT_TIMEOUT_MS}ms")
+
+    async def close(self) -> None:
+        if self._pool is not None:
+            await self._pool.close()
+            self._pool = None
+
+    @staticmethod
+    async def _configurar_conexao(conn) -> None:
+        conn.prepared_max = DB_PREPARED_MAX
+
+    @asynccontextmanager
+    async def connection(self, timeout_ms: Optional[int] = None):
+        """
+        Conexão do pool assíncrono
+
+        Com `timeout_ms`, abre uma transação com statement_timeout próprio
+        (SET LOCAL), que vale só para as consultas feitas dentro do bloco.
+        """
+        inicio = time.perf_counter()
+        try:
+            async with self._pool.connection() as conn:
+                POOL_WAIT.observe(time.perf_counter() - inicio, 'async')
+                if timeout_ms is None:
+                    yield conn
+                    return
+                async with conn.transaction():
+                    await conn.execute("SELECT set_config('statement_timeout', %s, true)", (str(int(timeout_ms)),))
+                    yield conn
+        except Exception as e:
+            if PoolTimeout is not None and isinstance(e, PoolTimeout):
+                POOL_ESGOTADO.inc('async')
+            raise
+
+    async def _consultar(self, sql: str, params=None, modo: str = 'all', timeout_ms: Optional[int] = None):
+        """
+        Executa um comando: modo 'all' (lista de dicts), 'one' (dict ou None)
+        ou 'rowcount'. As conexões são autocommit: cada comando é atômico.
+        """
+        if self._pool is None:
+            return await to_thread.run_sync(self._consultar_sync, sql, params, modo, timeout_ms)
+
+        async with self.connection(timeout_ms) as conn:
+            if not medicao_ativa():
+                return await self._resultado(await conn.execute(sql, params), modo)
+            inicio = time.perf_counter()
+            try:
+                cursor = await conn.execute(sql, params)
+            except Exception:
+                registrar_consulta(sql, params, time.perf_counter() - inicio, erro=True)
+                raise
+            registrar_consulta(sql, params, time.perf_counter() - inicio, cursor.rowcount)
+            return await self._resultado(cursor, modo)
+
+    @staticmethod
+    async def _resultado(cursor, modo: str):
+        if modo == 'rowcount':
+            return cursor.rowcount
+        if modo == 'one':
+            return await cursor.fetchone()
+        return await cursor.fetchall()
+
+    @staticmethod
+    def _consultar_sync(sql: str, params, modo: str, timeout_ms: Optional[int]):
+        """Mesma consulta pelo pool psycopg2 (sem psycopg 3 ou com o pool fechado)"""
+        with database.get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                if timeout_ms is not None:
+                    cursor.execute("SELECT set_config('statement_timeout', %s, true)", (str(int(timeout_ms)),))
+                cursor.execute(sql, params)
+                if modo == 'rowcount':
+                    resultado = cursor.rowcount
+                elif modo == 'one':
+                    row = cursor.fetchone()
+                    resultado = dict(row) if row else None
+                else:
+                    resultado = [dict(row) for row in cursor.fetchall()]
+                conn.commit()
+                return resultado
+
+    def __getattr__(self, nome: str):
+        """Métodos de BPADatabase sem versão nativa: executados numa thread"""
+        if nome.startswith('_'):
+            raise AttributeError(nome)
+        metodo = getattr(self.sync_db, nome)
+        if not callable(metodo):
+            return metodo
+
+        async def em_thread(*args, **kwargs):
+            return await to_thread.run_sync(lambda: metodo(*args, **kwargs))
+
+        em_thread.__name__ = nome
+        return em_thread
+
+    # ========== PROFISSIONAIS ==========
+
+    async def save_profissional(self, data: Dict) -> int:
+        """Salva profissional"""
+        row = await self._consultar('''
+            INSERT INTO profissionais (cnes, cns, cpf, nome, cbo, ine, vinculo)
+            VALUES (%(cnes)s, %(cns)s, %(cpf)s, %(nome)s, %(cbo)s, %(ine)s, %(vinculo)s)
+            ON CONFLICT (cnes, cns) DO UPDATE SET
+                nome = EXCLUDED.nome, cbo = EXCLUDED.cbo, ine = EXCLUDED.ine,
+                vinculo = EXCLUDED.vinculo, updated_at = CURRENT_TIMESTAMP
+            RETURNING id
+        ''', data, modo='one')
+        return row['id']
+
+    async def get_profissional(self, cnes: str, cns: str) -> Optional[Dict]:
+        """Busca profissional por CNES e CNS"""
+        return await self._consultar(
+            "SELECT * FROM profissionais WHERE cnes = %s AND cns = %s", (cnes, cns), modo='one'
+        )
+
+    async def list_profissionais(self, cnes: str) -> List[Dict]:
+        """Lista profissionais de um CNES"""
+        return await self._consultar("SELECT * FROM profissionais WHERE cnes = %s ORDER BY nome", (cnes,))
+
+    # ========== PACIENTES ==========
+
+    async def get_paciente(self, cns: str) -> Optional[Dict]:
+        """Busca paciente pelo CNS"""
+        return await self._consultar("SELECT * FROM pacientes WHERE cns = %s", (cns,), modo='one')
+
+    async def search_pacientes(self, termo: str, limit: int = 20) -> List[Dict]:
+        """Busca pacientes por nome ou CNS"""
+        return await self._consultar('''
+            SELECT * FROM pacientes
+            WHERE nome ILIKE %s OR cns LIKE %s
+            ORDER BY nome LIMIT %s
+        ''', (f'%{termo}%', f'%{termo}%', limit))
+
+    # ========== BPA ==========
+
+    async def get_bpa_individualizado(self, id: int) -> Optional[Dict]:
+        """Busca BPA-I por ID"""
+        return await self._consultar("SELECT * FROM bpa_individualizado WHERE id = %s", (id,), modo='one')
+
+    async def delete_bpa_individualizado(self, id: int) -> bool:
+        """Remove registro BPA-I"""
+        return await self._consultar(
+            "DELETE FROM bpa_individualizado WHERE id = %s", (id,), modo='rowcount'
+        ) > 0
+
+    async def _list_bpa(self, tabela: str, cnes: str, competencia: str = None, exportado: bool = None,
+                        limit: int = None, offset: int = 0, after_id: int = None) -> List[Dict]:
+        query, params = self.sync_db._list_bpa_query(tabela, cnes, competencia, exportado, after_id)
+        if limit is not None:
+            query += " LIMIT %s OFFSET %s"
+            params.extend([limit, offset])
+        return await self._consultar(query, params)
+
+    async def list_bpa_individualizado(self, cnes: str, competencia: str = None,
+                                       exportado: bool = None, limit: int = None, offset: int = 0,
+                                       after_id: int = None) -> List[Dict]:
+        """Lista registros BPA-I com filtros (after_id: paginação por keyset)"""
+        return await self._list_bpa('bpa_individualizado', cnes, competencia, exportado, limit, offset, after_id)
+
+    async def list_bpa_consolidado(self, cnes: str, competencia: str = None,
+                                   exportado: bool = None, limit: int = None, offset: int = 0,
+                                   after_id: int = None) -> List[Dict]:
+        """Lista registros BPA-C com filtros (after_id: paginação por keyset)"""
+        return await self._list_bpa('bpa_consolidado', cnes, competencia, exportado, limit, offset, after_id)
+
+    # ========== ESTATÍSTICAS ==========
+
+    async def get_producao_resumo(self, cnes: str = None, competencia: str = None) -> List[Dict]:
+        """Resumo da produção por tipo ('bpa_i'/'bpa_c'), CNES e competência"""
+        return await self._consultar(*BPADatabase._resumo_sql(cnes, competencia))
+
+    async def get_bpa_stats(self, cnes: str, competencia: str = None) -> Dict:
+        """bpai_/bpac_ total, pendente e exportado (ver BPADatabase.get_bpa_stats)"""
+        return _somar_resumo(await self.get_producao_resumo(cnes, competencia))
+
+    async def get_stats_by_cnes(self, cnes: str) -> Dict:
+        """Obtém estatísticas específicas de um CNES"""
+        resumo = await self.get_producao_resumo(cnes)
+        contagens = await self._consultar('''
+            SELECT (SELECT COUNT(*) FROM profissionais WHERE cnes = %s) AS profissionais,
+                   (SELECT COUNT(*) FROM pacientes) AS pacientes
+        ''', (cnes,), modo='one')
+
+        stats = _somar_resumo(resumo)
+        stats['bpai_competencias'] = [r['competencia'] for r in resumo if r['tipo'] == 'bpa_i']
+        stats['bpac_competencias'] = [r['competencia'] for r in resumo if r['tipo'] == 'bpa_c']
+        stats['profissionais'] = contagens['profissionais']
+        stats['pacientes'] = contagens['pacientes']
+        stats['ultimas_exportacoes'] = []
+        return stats
+
+    async def versoes_dados(self, bpa=None, cadastro: bool = False, sigtap: Optional[str] = None) -> Dict[str, Any]:
+        """services.response_cache.versoes_dados pelo pool assíncrono (para cached_async)"""
+        from services.response_cache import _versoes_consulta, _versoes_encontradas
+
+        consulta = _versoes_consulta(bpa, cadastro, sigtap)
+        encontradas = {}
+        if consulta:
+            rows = await self._consultar(*consulta)
+            encontradas = {row['escopo']: row['versao'] for row in rows}
+        return _versoes_encontradas(encontradas, bpa, cadastro, sigtap)
+
+
+instrumentar_metodos(AsyncBPADatabase, ignorar=('open', 'close', 'connection'))
+
+# Instância global (pool aberto no startup do FastAPI)
+adb = AsyncBPADatabase()
@@ -2,15 +2,24 @@
 BPA Online - Banco de Dados PostgreSQL
 Usa nomes de colunas compatíveis com Firebird (PRD_*)
 """
+import io
+import json
 import os
+import time
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2.extras import RealDictCursor, execute_values
 from psycopg2 import pool
-from typing import Dict, List, Optional, Any
+from typing import Dict, Iterable, Iterator, List, Optional, Any
 from contextlib import contextmanager
+from itertools import islice
 from datetime import datetime
 import logging
 
+from services.db_indices import INDICES_CONSULTAS, INDICES_OBSOLETOS, garantir_indices  # noqa: F401
+from services.db_metrics import (
+    DB_METRICS_ENABLED, POOL_ESGOTADO, POOL_WAIT, instrumentar_metodos, medicao_ativa, registrar_consulta
+)
+
 logger = logging.getLogger(__name__)
 
 # Configuração do banco PostgreSQL
@@ -42,6 +51,56 @@ def parse_database_url(url: str) -> Dict:
 
 DB_CONFIG = parse_database_url(DATABASE_URL)
 
+class _CursorMedido:
+    """Mede cada comando do cursor (tempo, linhas, consultas lentas; ver services.db_metrics)"""
+
+    def _medir(self, executar, query, vars):
+        if not medicao_ativa():
+            return executar()
+        inicio = time.perf_counter()
+        try:
+            resultado = executar()
+        except Exception:
+            registrar_consulta(self._sql_texto(query), vars, time.perf_counter() - inicio, erro=True)
+            raise
+        registrar_consulta(self._sql_texto(query), vars, time.perf_counter() - inicio, self.rowcount)
+        return resultado
+
+    def _sql_texto(self, query):
+        return query if isinstance(query, (str, bytes)) else query.as_string(self.connection)
+
+    def execute(self, query, vars=None):
+        return self._medir(lambda: super(_CursorMedido, self).execute(query, vars), query, vars)
+
+    def executemany(self, query, vars_list):
+        return self._medir(lambda: super(_CursorMedido, self).executemany(query, vars_list), query, None)
+
+    def copy_expert(self, sql, file, size=8192):
+        return self._medir(lambda: super(_CursorMedido, self).copy_expert(sql, file, size), sql, None)
+
+
+_cursores_medidos: Dict[type, type] = {}
+
+
+def _cursor_medido(factory: type) -> type:
+    classe = _cursores_medidos.get(factory)
+    if classe is None:
+        classe = _cursores_medidos[factory] = type(f'{factory.__name__}Medido', (_CursorMedido, factory), {})
+    return classe
+
+
+class _ConexaoMedida(psycopg2.extensions.connection):
+    """Conexão cujos cursores (inclusive RealDictCursor e nomeados) são medidos"""
+
+    def cursor(self, *args, **kwargs):
+        if len(args) < 2:
+            factory = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+            kwargs['cursor_factory'] = _cursor_medido(factory)
+        return super().cursor(*args, **kwargs)
+
+
+_CONNECTION_FACTORY = _ConexaoMedida if DB_METRICS_ENABLED else None
+
 # Pool de conexões
 connection_pool = None
 
@@ -56,7 +115,8 @@ def init_pool():
             port=DB_CONFIG["port"],
             database=DB_CONFIG["database"],
             user=DB_CONFIG["user"],
-            password=DB_CONFIG["password"]
+            password=DB_CONFIG["password"],
+            connection_factory=_CONNECTION_FACTORY
         )
         print(f"[DB] Pool PostgreSQL inicializado: {DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}")
     except Exception as e:
@@ -74,14 +134,21 @@ def get_connection():
     conn = None
     try:
         if connection_pool:
-            conn = connection_pool.getconn()
+            inicio = time.perf_counter()
+            try:
+                conn = connection_pool.getconn()
+            except pool.PoolError:
+                POOL_ESGOTADO.inc('psycopg2')
+                raise
+            POOL_WAIT.observe(time.perf_counter() - inicio, 'psycopg2')
         else:
             conn = psycopg2.connect(
                 host=DB_CONFIG["host"],
                 port=DB_CONFIG["port"],
                 database=DB_CONFIG["database"],
                 user=DB_CONFIG["user"],
-                password=DB_CONFIG["password"]
+                password=DB_CONFIG["password"],
+                connection_factory=_CONNECTION_FACTORY
             )
         yield conn
     except Exception as e:
@@ -95,6 +162,557 @@ def get_connection():
                 conn.close()
 
 
+# Linhas lidas por vez do cursor server-side nas exportações
+EXPORT_CHUNK_SIZE = int(os.getenv('EXPORT_CHUNK_SIZE', '5000'))
+
+# Colunas gravadas em bpa_individualizado (ordem usada no INSERT e no COPY)
+BPAI_COLUMNS = (
+    'prd_uid', 'prd_cmp', 'prd_flh', 'prd_seq',
+    'prd_cnsmed', 'prd_cbo', 'prd_ine',
+    'prd_cnspac', 'prd_cpf_pcnte', 'prd_nmpac', 'prd_dtnasc',
+    'prd_sexo', 'prd_raca', 'prd_nac', 'prd_ibge', 'prd_idade',
+    'prd_cep_pcnte', 'prd_lograd_pcnte', 'prd_end_pcnte', 'prd_num_pcnte',
+    'prd_compl_pcnte', 'prd_bairro_pcnte', 'prd_ddtel_pcnte', 'prd_tel_pcnte', 'prd_email_pcnte',
+    'prd_dtaten', 'prd_pa', 'prd_qt_p', 'prd_cid', 'prd_caten',
+    'prd_naut', 'prd_cnpj', 'prd_servico', 'prd_classificacao',
+    'prd_etnia', 'prd_eqp_area', 'prd_eqp_seq', 'prd_mvm', 'prd_org'
+)
+
+
+def _bpai_params(data: Dict) -> Dict:
+    """Monta parâmetros de INSERT BPA-I aplicando os defaults do layout"""
+    return {
+        'prd_uid': data.get('prd_uid'),
+        'prd_cmp': data.get('prd_cmp'),
+        'prd_flh': data.get('prd_flh', 1),
+        'prd_seq': data.get('prd_seq', 1),
+        'prd_cnsmed': data.get('prd_cnsmed'),
+        'prd_cbo': data.get('prd_cbo'),
+        'prd_ine': data.get('prd_ine', ''),
+        'prd_cnspac': data.get('prd_cnspac'),
+        'prd_cpf_pcnte': data.get('prd_cpf_pcnte'),
+        'prd_nmpac': data.get('prd_nmpac'),
+        'prd_dtnasc': data.get('prd_dtnasc'),
+        'prd_sexo': data.get('prd_sexo'),
+        'prd_raca': data.get('prd_raca', '99'),
+        'prd_nac': data.get('prd_nac', '010'),
+        'prd_ibge': data.get('prd_ibge'),
+        'prd_idade': data.get('prd_idade'),
+        'prd_cep_pcnte': data.get('prd_cep_pcnte'),
+        'prd_lograd_pcnte': data.get('prd_lograd_pcnte'),
+        'prd_end_pcnte': data.get('prd_end_pcnte'),
+        'prd_num_pcnte': data.get('prd_num_pcnte'),
+        'prd_compl_pcnte': data.get('prd_compl_pcnte'),
+        'prd_bairro_pcnte': data.get('prd_bairro_pcnte'),
+        'prd_ddtel_pcnte': data.get('prd_ddtel_pcnte'),
+        'prd_tel_pcnte': data.get('prd_tel_pcnte'),
+        'prd_email_pcnte': data.get('prd_email_pcnte'),
+        'prd_dtaten': data.get('prd_dtaten'),
+        'prd_pa': data.get('prd_pa'),
+        'prd_qt_p': data.get('prd_qt_p', 1),
+        'prd_cid': data.get('prd_cid'),
+        'prd_caten': data.get('prd_caten', '01'),
+        'prd_naut': data.get('prd_naut', ''),
+        'prd_cnpj': data.get('prd_cnpj', ''),
+        'prd_servico': data.get('prd_servico', ''),
+        'prd_classificacao': data.get('prd_classificacao', ''),
+        'prd_etnia': data.get('prd_etnia', ''),
+        'prd_eqp_area': data.get('prd_eqp_area', ''),
+        'prd_eqp_seq': data.get('prd_eqp_seq', ''),
+        'prd_mvm': data.get('prd_mvm') or data.get('prd_cmp'),  # MVM = competência
+        'prd_org': data.get('prd_org', 'BPI')
+    }
+
+
+def _bpac_chave(data: Dict) -> tuple:
+    """
+    Chave de agregação BPA-C (uid, cmp, cbo, pa, idade) sem NULLs.
+
+    O índice único de pendentes não casa NULLs, então chaves ausentes viram
+    '' (e '000' na idade) antes de qualquer UPSERT.
+    """
+    return (
+        data.get('prd_uid') or '',
+        data.get('prd_cmp') or '',
+        data.get('prd_cbo') or '',
+        data.get('prd_pa') or '',
+        data.get('prd_idade') or '000'
+    )
+
+
+def _copy_value(value: Any) -> str:
+    """Formata um valor para COPY ... FROM STDIN (formato text)"""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    return (
+        str(value)
+        .replace('\\', '\\\\')
+        .replace('\t', '\\t')
+        .replace('\n', '\\n')
+        .replace('\r', '\\r')
+    )
+
+
+def _copy_rows(cursor, table: str, columns: tuple, rows) -> None:
+    """Envia linhas (tuplas na ordem de `columns`) via COPY FROM STDIN"""
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(_copy_value(v) for v in row))
+        buffer.write('\n')
+    buffer.seek(0)
+    cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN", buffer)
+
+
+# Versão dos dados por (escopo, CNES, competência) para o cache de respostas
+# (services/response_cache.py). Todo INSERT/UPDATE/DELETE na produção incrementa
+# a versão da unidade/competência tocada (trigger de producao_resumo); cadastros
+# incrementam o escopo 'cadastro' e a SIGTAP o escopo 'sigtap'. Os valores vêm de
+# uma sequência, então o máximo de um CNES também muda a cada escrita.
+DADOS_VERSAO_SQL = """
+    CREATE SEQUENCE IF NOT EXISTS dados_versao_seq;
+
+    CREATE TABLE IF NOT EXISTS dados_versao (
+        escopo VARCHAR(10) NOT NULL,
+        cnes VARCHAR(7) NOT NULL DEFAULT '',
+        competencia VARCHAR(6) NOT NULL DEFAULT '',
+        versao BIGINT NOT NULL,
+        atualizado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (escopo, cnes, competencia)
+    );
+
+    CREATE OR REPLACE FUNCTION dados_versao_incrementar(
+        p_escopo VARCHAR, p_cnes VARCHAR, p_competencia VARCHAR
+    ) RETURNS BIGINT LANGUAGE sql AS $$
+        INSERT INTO dados_versao (escopo, cnes, competencia, versao)
+        VALUES (p_escopo, COALESCE(p_cnes, ''), COALESCE(p_competencia, ''), nextval('dados_versao_seq'))
+        ON CONFLICT (escopo, cnes, competencia) DO UPDATE
+            SET versao = EXCLUDED.versao, atualizado_em = CURRENT_TIMESTAMP
+        RETURNING versao
+    $$;
+
+    CREATE OR REPLACE FUNCTION dados_versao_trigger() RETURNS TRIGGER LANGUAGE plpgsql AS $$
+    BEGIN
+        PERFORM dados_versao_incrementar(TG_ARGV[0], '', '');
+        RETURN NULL;
+    END;
+    $$;
+"""
+
+# Tabelas de cadastro que versionam o escopo 'cadastro' (contagens do dashboard)
+DADOS_VERSAO_CADASTROS = ('profissionais', 'pacientes')
+
+# Valores e nomes da SIGTAP no Postgres, uma versão por competência SIGTAP
+# (carregada na importação/ativação por services/sigtap_precos.py), para o
+# dashboard financeiro valorar a produção com joins em vez de lookups em Python.
+# Competência 'LEGACY' = diretório SIGTAP legado (nenhuma competência importada).
+SIGTAP_PRECO_SQL = """
+    CREATE TABLE IF NOT EXISTS sigtap_preco_versao (
+        competencia VARCHAR(6) PRIMARY KEY,
+        procedimentos INTEGER NOT NULL DEFAULT 0,
+        ocupacoes INTEGER NOT NULL DEFAULT 0,
+        carregado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    CREATE TABLE IF NOT EXISTS sigtap_preco (
+        competencia VARCHAR(6) NOT NULL,
+        co_procedimento VARCHAR(10) NOT NULL,
+        no_procedimento VARCHAR(250) NOT NULL,
+        vl_sa NUMERIC(15,2) NOT NULL DEFAULT 0,
+        vl_sh NUMERIC(15,2) NOT NULL DEFAULT 0,
+        vl_sp NUMERIC(15,2) NOT NULL DEFAULT 0,
+        PRIMARY KEY (competencia, co_procedimento)
+    );
+
+    CREATE TABLE IF NOT EXISTS sigtap_preco_ocupacao (
+        competencia VARCHAR(6) NOT NULL,
+        co_ocupacao VARCHAR(6) NOT NULL,
+        no_ocupacao VARCHAR(150) NOT NULL,
+        PRIMARY KEY (competencia, co_ocupacao)
+    );
+"""
+
+# Tabela de produção -> tipo no resumo (mesmos rótulos do overview do admin)
+PRODUCAO_RESUMO_TIPOS = {'bpa_individualizado': 'bpa_i', 'bpa_consolidado': 'bpa_c'}
+
+# Resumo por (tipo, CNES, competência) mantido por triggers de statement com
+# tabelas de transição: cada INSERT/UPDATE/DELETE (inclusive COPY e os DELETE
+# em massa do admin) soma a diferença agregada das linhas tocadas, uma vez por
+# unidade/competência, em vez de por linha.
+PRODUCAO_RESUMO_SQL = """
+    CREATE TABLE IF NOT EXISTS producao_resumo (
+        tipo VARCHAR(5) NOT NULL,
+        prd_uid VARCHAR(7) NOT NULL,
+        prd_cmp VARCHAR(6) NOT NULL,
+        total BIGINT NOT NULL DEFAULT 0,
+        pendentes BIGINT NOT NULL DEFAULT 0,
+        exportados BIGINT NOT NULL DEFAULT 0,
+        quantidade BIGINT NOT NULL DEFAULT 0,
+        quantidade_pendente BIGINT NOT NULL DEFAULT 0,
+        primeira_insercao TIMESTAMP,
+        ultima_insercao TIMESTAMP,
+        atualizado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (tipo, prd_uid, prd_cmp)
+    );
+
+    CREATE OR REPLACE FUNCTION producao_resumo_somar(
+        p_tabela TEXT, p_tipo VARCHAR, p_uid VARCHAR, p_cmp VARCHAR,
+        p_total BIGINT, p_pendentes BIGINT, p_exportados BIGINT,
+        p_quantidade BIGINT, p_quantidade_pendente BIGINT,
+        p_primeira TIMESTAMP, p_ultima TIMESTAMP,
+        p_primeira_removida TIMESTAMP, p_ultima_removida TIMESTAMP
+    ) RETURNS VOID LANGUAGE plpgsql AS $$
+    BEGIN
+        IF p_total = 0 AND p_pendentes = 0 AND p_exportados = 0 AND p_quantidade = 0
+           AND p_quantidade_pendente = 0 AND p_primeira IS NULL THEN
+            RETURN;
+        END IF;
+
+        INSERT INTO producao_resumo AS r (
+            tipo, prd_uid, prd_cmp, total, pendentes, exportados,
+            quantidade, quantidade_pendente, primeira_insercao, ultima_insercao
+        ) VALUES (
+            p_tipo, p_uid, p_cmp, p_total, p_pendentes, p_exportados,
+            p_quantidade, p_quantidade_pendente, p_primeira, p_ultima
+        )
+        ON CONFLICT (tipo, prd_uid, prd_cmp) DO UPDATE SET
+            total = r.total + EXCLUDED.total,
+            pendentes = r.pendentes + EXCLUDED.pendentes,
+            exportados = r.exportados + EXCLUDED.exportados,
+            quantidade = r.quantidade + EXCLUDED.quantidade,
+            quantidade_pendente = r.quantidade_pendente + EXCLUDED.quantidade_pendente,
+            primeira_insercao = LEAST(r.primeira_insercao, EXCLUDED.primeira_insercao),
+            ultima_insercao = GREATEST(r.ultima_insercao, EXCLUDED.ultima_insercao),
+            atualizado_em = CURRENT_TIMESTAMP;
+
+        DELETE FROM producao_resumo
+        WHERE tipo = p_tipo AND prd_uid = p_uid AND prd_cmp = p_cmp AND total <= 0;
+
+        -- Saíram linhas da borda: relê primeira/última inserção só dessa unidade/competência
+        IF p_total < 0 THEN
+            EXECUTE format(
+                'UPDATE producao_resumo r
+                 SET primeira_insercao = t.primeira, ultima_insercao = t.ultima
+                 FROM (SELECT MIN(created_at) AS primeira, MAX(created_at) AS ultima
+                       FROM %I WHERE prd_uid = $2 AND prd_cmp = $3) t
+                 WHERE r.tipo = $1 AND r.prd_uid = $2 AND r.prd_cmp = $3
+                   AND ($4 <= r.primeira_insercao OR $5 >= r.ultima_insercao)',
+                p_tabela
+            ) USING p_tipo, p_uid, p_cmp, p_primeira_removida, p_ultima_removida;
+        END IF;
+    END;
+    $$;
+
+    CREATE OR REPLACE FUNCTION producao_resumo_trigger() RETURNS TRIGGER LANGUAGE plpgsql AS $$
+    DECLARE
+        v_tipo VARCHAR := CASE TG_TABLE_NAME WHEN 'bpa_individualizado' THEN 'bpa_i' ELSE 'bpa_c' END;
+        v_colunas CONSTANT TEXT := 'COALESCE(prd_uid, '''') AS uid, COALESCE(prd_cmp, '''') AS cmp, '
+                                   'prd_exportado, prd_qt_p, created_at';
+        v_linhas TEXT;
+    BEGIN
+        IF TG_OP = 'TRUNCATE' THEN
+            DELETE FROM producao_resumo WHERE tipo = v_tipo;
+            UPDATE dados_versao SET versao = nextval('dados_versao_seq'), atualizado_em = CURRENT_TIMESTAMP
+            WHERE escopo = 'bpa';
+            RETURN NULL;
+        END IF;
+
+        -- Linhas novas somam (+1) e antigas subtraem (-1)
+        v_linhas := CASE TG_OP
+            WHEN 'INSERT' THEN 'SELECT 1 AS sinal, ' || v_colunas || ' FROM novos'
+            WHEN 'DELETE' THEN 'SELECT -1 AS sinal, ' || v_colunas || ' FROM antigos'
+            ELSE 'SELECT -1 AS sinal, ' || v_colunas || ' FROM antigos UNION ALL '
+                 'SELECT 1 AS sinal, ' || v_colunas || ' FROM novos'
+        END;
+
+        EXECUTE format(
+            'SELECT producao_resumo_somar(%L, %L, uid, cmp,
+                SUM(sinal),
+                COALESCE(SUM(sinal) FILTER (WHERE prd_exportado = FALSE), 0),
+                COALESCE(SUM(sinal) FILTER (WHERE prd_exportado = TRUE), 0),
+                COALESCE(SUM(sinal * prd_qt_p), 0),
+                COALESCE(SUM(sinal * prd_qt_p) FILTER (WHERE prd_exportado = FALSE), 0),
+                CASE WHEN SUM(sinal) > 0 THEN MIN(created_at) FILTER (WHERE sinal > 0) END,
+                CASE WHEN SUM(sinal) > 0 THEN MAX(created_at) FILTER (WHERE sinal > 0) END,
+                MIN(created_at) FILTER (WHERE sinal < 0),
+                MAX(created_at) FILTER (WHERE sinal < 0))
+             FROM (%s) t
+             GROUP BY uid, cmp',
+            TG_TABLE_NAME, v_tipo, v_linhas
+        );
+
+        -- Qualquer escrita (mesmo sem mudar contagens) invalida o cache da unidade/competência
+        EXECUTE format(
+            'SELECT dados_versao_incrementar(''bpa'', uid, cmp) FROM (%s) t GROUP BY uid, cmp',
+            v_linhas
+        );
+        RETURN NULL;
+    END;
+    $$;
+"""
+
+PRODUCAO_RESUMO_TRIGGERS = (
+    ('ins', "AFTER INSERT", "REFERENCING NEW TABLE AS novos FOR EACH STATEMENT"),
+    ('upd', "AFTER UPDATE", "REFERENCING OLD TABLE AS antigos NEW TABLE AS novos FOR EACH STATEMENT"),
+    ('del', "AFTER DELETE", "REFERENCING OLD TABLE AS antigos FOR EACH STATEMENT"),
+    ('trunc', "AFTER TRUNCATE", "FOR EACH STATEMENT"),
+)
+
+
+# Produção particionada por competência (LIST em prd_cmp): uma partição por mês,
+# {tabela}_{AAAAMM}, criada na primeira gravação do mês. Consultas por
+# prd_cmp tocam só a partição do mês (pruning), DELETE/UPDATE de um mês não
+# incham o resto da tabela, e remover/arquivar um mês inteiro é DROP/DETACH.
+# Não há partição DEFAULT: com ela, cada nova partição travaria a DEFAULT.
+PARTICIONAMENTO_SQL = """
+    CREATE OR REPLACE FUNCTION bpa_particao_nome(p_tabela TEXT, p_competencia TEXT)
+    RETURNS TEXT LANGUAGE sql IMMUTABLE AS $$
+        SELECT p_tabela || '_' || CASE WHEN p_competencia ~ '^[0-9]{6}$' THEN p_competencia
+                                       ELSE 'x' || substr(md5(p_competencia), 1, 8) END
+    $$;
+
+    -- Cria (se faltar) a partição da competência. A tabela nova é anexada com
+    -- ATTACH, que só pede SHARE UPDATE EXCLUSIVE na tabela-mãe: leituras e
+    -- gravações seguem enquanto a transação que criou a partição não termina.
+    CREATE OR REPLACE FUNCTION bpa_garantir_particao(p_tabela TEXT, p_competencia TEXT)
+    RETURNS TEXT LANGUAGE plpgsql AS $$
+    DECLARE
+        v_particao TEXT := bpa_particao_nome(p_tabela, p_competencia);
+    BEGIN
+        IF (SELECT relkind FROM pg_class WHERE oid = to_regclass(p_tabela)) IS DISTINCT FROM 'p' THEN
+            RETURN NULL;  -- tabela ainda não particionada
+        END IF;
+        IF to_regclass(v_particao) IS NOT NULL THEN
+            RETURN v_particao;
+        END IF;
+        PERFORM pg_advisory_xact_lock(hashtext('bpa_particao:' || v_particao));
+        IF to_regclass(v_particao) IS NOT NULL THEN
+            RETURN v_particao;
+        END IF;
+        EXECUTE format('CREATE TABLE %I (LIKE %I INCLUDING DEFAULTS)', v_particao, p_tabela);
+        EXECUTE format('ALTER TABLE %I ATTACH PARTITION %I FOR VALUES IN (%L)',
+                       p_tabela, v_particao, p_competencia);
+        RETURN v_particao;
+    END;
+    $$;
+
+    -- Remove (DROP) ou arquiva (DETACH + RENAME arquivo_*) a partição inteira de
+    -- uma competência. DROP/DETACH não disparam os triggers da produção: o
+    -- resumo, as versões do cache e as inconsistências são ajustados aqui.
+    -- Com p_cnes, só remove se a partição tiver apenas registros desse CNES,
+    -- conferido com a partição travada (nenhuma gravação entra entre a
+    -- conferência e o DROP). Retorna quantos registros saíram, ou NULL se não
+    -- há partição ou se ela tem outras unidades (o chamador cai no DELETE).
+    DROP FUNCTION IF EXISTS bpa_remover_particao(TEXT, TEXT, BOOLEAN);
+    CREATE OR REPLACE FUNCTION bpa_remover_particao(
+        p_tabela TEXT, p_competencia TEXT, p_arquivar BOOLEAN, p_cnes TEXT DEFAULT NULL
+    )
+    RETURNS BIGINT LANGUAGE plpgsql AS $$
+    DECLARE
+        v_particao TEXT := bpa_particao_nome(p_tabela, p_competencia);
+        v_tipo TEXT := CASE p_tabela WHEN 'bpa_individualizado' THEN 'bpa_i' ELSE 'bpa_c' END;
+        v_total BIGINT;
+        v_outras BOOLEAN;
+    BEGIN
+        IF NOT EXISTS (
+            SELECT 1 FROM pg_inherits
+            WHERE inhrelid = to_regclass(v_particao) AND inhparent = to_regclass(p_tabela)
+        ) THEN
+            RETURN NULL;
+        END IF;
+
+        EXECUTE format('LOCK TABLE %I IN ACCESS EXCLUSIVE MODE', v_particao);
+        IF p_cnes IS NOT NULL THEN
+            EXECUTE format('SELECT EXISTS (SELECT 1 FROM %I WHERE prd_uid IS DISTINCT FROM %L)',
+                           v_particao, p_cnes)
+            INTO v_outras;
+            IF v_outras THEN
+                RETURN NULL;
+            END IF;
+        END IF;
+
+        SELECT COALESCE(SUM(total), 0) INTO v_total
+        FROM producao_resumo WHERE tipo = v_tipo AND prd_cmp = p_competencia;
+        PERFORM dados_versao_incrementar('bpa', prd_uid, prd_cmp)
+        FROM producao_resumo WHERE tipo = v_tipo AND prd_cmp = p_competencia;
+        DELETE FROM producao_resumo WHERE tipo = v_tipo AND prd_cmp = p_competencia;
+
+        IF p_tabela = 'bpa_individualizado' THEN
+            DELETE FROM bpa_inconsistencias WHERE prd_cmp = p_competencia;
+        END IF;
+
+        EXECUTE format('ALTER TABLE %I DETACH PARTITION %I', p_tabela, v_particao);
+        IF p_arquivar THEN
+            EXECUTE format('ALTER TABLE %I RENAME TO %I', v_particao, 'arquivo_' || v_particao);
+        ELSE
+            EXECUTE format('DROP TABLE %I', v_particao);
+        END IF;
+        RETURN v_total;
+    END;
+    $$;
+"""
+
+
+def garantir_particoes(cursor, tabela: str, competencias: Iterable[Optional[str]]) -> None:
+    """
+    Cria, se faltar, a partição de cada competência antes de gravar
+
+    Roda na transação do cursor (a partição nasce junto com os registros).
+    A ordem fixa evita deadlock entre gravações de vários meses.
+    """
+    competencias = sorted({c for c in competencias if c is not None})
+    if competencias:
+        cursor.execute(
+            'SELECT bpa_garantir_particao(%s, c) FROM unnest(%s::text[]) AS c',
+            (tabela, competencias)
+        )
+
+
+def remover_producao(cursor, tabela: str, cnes: str, competencia: Optional[str] = None) -> int:
+    """
+    Remove a produção de um CNES (numa competência ou em todas) na transação do cursor
+
+    Competências em que o CNES é a única unidade viram DROP da partição do
+    mês; nas demais o DELETE fica restrito à partição. O resumo só indica
+    candidatas: bpa_remover_particao confere de novo com a partição travada e,
+    se outra unidade gravou no meio tempo, devolve NULL e o DELETE assume.
+    Retorna quantos registros foram removidos.
+    """
+    tipo = PRODUCAO_RESUMO_TIPOS[tabela]
+    filtro = 'AND prd_cmp = %s' if competencia else ''
+    params = [cnes, tipo, tipo, cnes] + ([competencia] if competencia else [])
+    cursor.execute(f'''
+        SELECT prd_cmp, bool_and(prd_uid = %s) AS exclusiva
+        FROM producao_resumo
+        WHERE tipo = %s AND prd_cmp IN (
+            SELECT prd_cmp FROM producao_resumo WHERE tipo = %s AND prd_uid = %s {filtro}
+        )
+        GROUP BY prd_cmp
+        ORDER BY prd_cmp
+    ''', params)
+    competencias = cursor.fetchall()
+
+    removidos = 0
+    for prd_cmp, exclusiva in competencias:
+        if exclusiva:
+            cursor.execute('SELECT bpa_remover_particao(%s, %s, FALSE, %s)', (tabela, prd_cmp, cnes))
+            total = cursor.fetchone()[0]
+            if total is not None:
+                logger.info(f"[DB] Partição {tabela}/{prd_cmp} removida ({total} registros)")
+                removidos += total
+                continue
+        cursor.execute(f'DELETE FROM {tabela} WHERE prd_uid = %s AND prd_cmp = %s', (cnes, prd_cmp))
+        removidos += cursor.rowcount
+    return removidos
+
+
+# NOT EXISTS (anti-join por idx_bpai_cnspac) em vez de NOT IN (SELECT DISTINCT ...),
+# que materializa todos os CNS da produção e não usa índice
+PACIENTES_SEM_PRODUCAO_SQL = '''
+    DELETE FROM pacientes p
+    WHERE NOT EXISTS (
+        SELECT 1 FROM bpa_individualizado b WHERE b.prd_cnspac = p.cns
+    )
+'''
+
+
+def remover_pacientes_sem_producao(cursor) -> int:
+    """Remove pacientes sem nenhum BPA-I vinculado; retorna quantos"""
+    cursor.execute(PACIENTES_SEM_PRODUCAO_SQL)
+    return cursor.rowcount
+
+
+def _preparar_tabela_legada(cursor, tabela: str) -> Optional[str]:
+    """
+    Tabela de produção ainda não particionada: renomeia para {tabela}_legado
+    (liberando sequência, chave e nomes de índices) para o CREATE TABLE
+    seguinte criar a versão particionada. Retorna o nome da legada, ou None.
+    """
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (tabela,))
+    row = cursor.fetchone()
+    if not row or row[0] != 'r':
+        return None
+
+    legado = f'{tabela}_legado'
+    cursor.execute(f'ALTER TABLE {tabela} ALTER COLUMN id DROP DEFAULT')
+    cursor.execute(f'ALTER SEQUENCE IF EXISTS {tabela}_id_seq OWNED BY NONE')
+    cursor.execute(f'ALTER TABLE {tabela} RENAME TO {legado}')
+    cursor.execute(f'ALTER TABLE {legado} RENAME CONSTRAINT {tabela}_pkey TO {legado}_pkey')
+    cursor.execute('''
+        SELECT indexname FROM pg_indexes
+        WHERE schemaname = current_schema() AND tablename = %s AND indexname <> %s
+    ''', (legado, f'{legado}_pkey'))
+    for (indice,) in cursor.fetchall():
+        cursor.execute(f'DROP INDEX {indice}')
+    logger.info(f"[DB] {tabela} será migrada para tabela particionada por competência")
+    return legado
+
+
+def _migrar_tabela_legada(cursor, tabela: str, legado: str) -> int:
+    """Copia {tabela}_legado para a tabela particionada (uma partição por competência) e a remove"""
+    cursor.execute('''
+        SELECT table_name, column_name FROM information_schema.columns
+        WHERE table_schema = current_schema() AND table_name IN (%s, %s)
+        ORDER BY ordinal_position
+    ''', (tabela, legado))
+    colunas_por_tabela: Dict[str, List[str]] = {}
+    for nome, coluna in cursor.fetchall():
+        colunas_por_tabela.setdefault(nome, []).append(coluna)
+    antigas = set(colunas_por_tabela.get(legado, []))
+    colunas = [c for c in colunas_por_tabela.get(tabela, []) if c in antigas]
+    select = ', '.join("COALESCE(prd_cmp, '')" if c == 'prd_cmp' else c for c in colunas)
+
+    cursor.execute(f'''
+        SELECT bpa_garantir_particao(%s, c)
+        FROM (SELECT DISTINCT COALESCE(prd_cmp, '') AS c FROM {legado}) t
+        ORDER BY c
+    ''', (tabela,))
+    cursor.execute(f'INSERT INTO {tabela} ({", ".join(colunas)}) SELECT {select} FROM {legado}')
+    migrados = cursor.rowcount
+    cursor.execute(f'DROP TABLE {legado} CASCADE')
+    logger.info(f"[DB] {tabela}: {migrados} registros migrados para partições por competência")
+    return migrados
+
+
+def _rebuild_producao_resumo(cursor) -> Dict[str, int]:
+    """Recalcula producao_resumo a partir das tabelas (bloqueia escritas enquanto isso)"""
+    cursor.execute('LOCK TABLE bpa_individualizado, bpa_consolidado IN SHARE MODE')
+    cursor.execute('DELETE FROM producao_resumo')
+    linhas = {}
+    for tabela, tipo in PRODUCAO_RESUMO_TIPOS.items():
+        cursor.execute(f'''
+            INSERT INTO producao_resumo (
+                tipo, prd_uid, prd_cmp, total, pendentes, exportados,
+                quantidade, quantidade_pendente, primeira_insercao, ultima_insercao
+            )
+            SELECT %s, COALESCE(prd_uid, ''), COALESCE(prd_cmp, ''),
+                   COUNT(*),
+                   COUNT(*) FILTER (WHERE prd_exportado = FALSE),
+                   COUNT(*) FILTER (WHERE prd_exportado = TRUE),
+                   COALESCE(SUM(prd_qt_p), 0),
+                   COALESCE(SUM(prd_qt_p) FILTER (WHERE prd_exportado = FALSE), 0),
+                   MIN(created_at), MAX(created_at)
+            FROM {tabela}
+            GROUP BY 2, 3
+        ''', (tipo,))
+        linhas[tipo] = cursor.rowcount
+    logger.info(f"[DB] producao_resumo recalculado: {linhas}")
+    return linhas
+
+
+def _somar_resumo(resumo: Iterable[Dict]) -> Dict[str, int]:
+    """Totais bpai_*/bpac_* (total, pendente, exportado) de linhas de producao_resumo"""
+    stats = {f'{prefixo}_{campo}': 0 for prefixo in ('bpai', 'bpac')
+             for campo in ('total', 'pendente', 'exportado')}
+    for row in resumo:
+        prefixo = 'bpai' if row['tipo'] == 'bpa_i' else 'bpac'
+        stats[f'{prefixo}_total'] += row['total']
+        stats[f'{prefixo}_pendente'] += row['pendentes']
+        stats[f'{prefixo}_exportado'] += row['exportados']
+    return stats
+
+
 def init_database():
     """Inicializa as tabelas do banco de dados - Nomes compatíveis com Firebird"""
     try:
@@ -144,12 +762,18 @@ def init_database():
                     )
                 ''')
                 
+                # Produção particionada por competência (tabelas comuns antigas são migradas)
+                cursor.execute(PARTICIONAMENTO_SQL)
+                legado_bpai = _preparar_tabela_legada(cursor, 'bpa_individualizado')
+                legado_bpac = _preparar_tabela_legada(cursor, 'bpa_consolidado')
+
                 # Tabela BPA Individualizado - Nomes compatíveis com Firebird S_PRD
+                cursor.execute('CREATE SEQUENCE IF NOT EXISTS bpa_individualizado_id_seq')
                 cursor.execute('''
                     CREATE TABLE IF NOT EXISTS bpa_individualizado (
-                        id SERIAL PRIMARY KEY,
+                        id INTEGER NOT NULL DEFAULT nextval('bpa_individualizado_id_seq'),
                         prd_uid VARCHAR(7),
-                        prd_cmp VARCHAR(6),
+                        prd_cmp VARCHAR(6) NOT NULL,
                         prd_flh INTEGER DEFAULT 1,
                         prd_seq INTEGER DEFAULT 1,
                         
@@ -205,22 +829,19 @@ def init_database():
                         prd_exportado BOOLEAN DEFAULT FALSE,
                         data_exportacao TIMESTAMP,
                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        PRIMARY KEY (id, prd_cmp)
+                    ) PARTITION BY LIST (prd_cmp)
                 ''')
-                
-                # Índices BPA-I
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_bpai_uid ON bpa_individualizado(prd_uid)')
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_bpai_cmp ON bpa_individualizado(prd_cmp)')
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_bpai_uid_cmp ON bpa_individualizado(prd_uid, prd_cmp)')
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_bpai_exportado ON bpa_individualizado(prd_exportado)')
+                cursor.execute('ALTER SEQUENCE bpa_individualizado_id_seq OWNED BY bpa_individualizado.id')
                 
                 # Tabela BPA Consolidado
+                cursor.execute('CREATE SEQUENCE IF NOT EXISTS bpa_consolidado_id_seq')
                 cursor.execute('''
                     CREATE TABLE IF NOT EXISTS bpa_consolidado (
-                        id SERIAL PRIMARY KEY,
+                        id INTEGER NOT NULL DEFAULT nextval('bpa_consolidado_id_seq'),
                         prd_uid VARCHAR(7),
-                        prd_cmp VARCHAR(6),
+                        prd_cmp VARCHAR(6) NOT NULL,
                         prd_flh INTEGER DEFAULT 1,
                         prd_cnsmed VARCHAR(15),
                         prd_cbo VARCHAR(6),
@@ -231,14 +852,73 @@ def init_database():
                         prd_exportado BOOLEAN DEFAULT FALSE,
                         data_exportacao TIMESTAMP,
                         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        PRIMARY KEY (id, prd_cmp)
+                    ) PARTITION BY LIST (prd_cmp)
                 ''')
+                cursor.execute('ALTER SEQUENCE bpa_consolidado_id_seq OWNED BY bpa_consolidado.id')
                 
-                # Índices BPA-C
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_bpac_uid ON bpa_consolidado(prd_uid)')
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_bpac_cmp ON bpa_consolidado(prd_cmp)')
-                cursor.execute('CREATE INDEX IF NOT EXISTS idx_bpac_exportado ON bpa_consolidado(prd_exportado)')
+                # Índices das consultas (INDICES_CONSULTAS); bases grandes: migrations/indices_consultas.py
+                garantir_indices(cursor)
+
+                # Migração dos dados das tabelas antigas (não particionadas)
+                if legado_bpai:
+                    # Materializado (recalculado sob demanda); recriado abaixo com a FK composta
+                    cursor.execute('DROP TABLE IF EXISTS bpa_inconsistencias')
+                    _migrar_tabela_legada(cursor, 'bpa_individualizado', legado_bpai)
+                if legado_bpac:
+                    _migrar_tabela_legada(cursor, 'bpa_consolidado', legado_bpac)
+
+                # Chave de agregação BPA-C (apenas pendentes). Antes de criar o
+                # índice único, funde duplicatas antigas somando as quantidades.
+                cursor.execute('''
+                    WITH dup AS (
+                        SELECT MIN(id) AS keep_id, SUM(prd_qt_p) AS qt, ARRAY_AGG(id) AS ids
+                        FROM bpa_consolidado
+                        WHERE prd_exportado = FALSE
+                        GROUP BY prd_uid, prd_cmp, prd_cbo, prd_pa, prd_idade
+                        HAVING COUNT(*) > 1
+                    ), merged AS (
+                        UPDATE bpa_consolidado b
+                        SET prd_qt_p = dup.qt, updated_at = CURRENT_TIMESTAMP
+                        FROM dup WHERE b.id = dup.keep_id
+                    )
+                    DELETE FROM bpa_consolidado b
+                    USING dup
+                    WHERE b.id = ANY(dup.ids) AND b.id <> dup.keep_id
+                ''')
+                cursor.execute('''
+                    CREATE UNIQUE INDEX IF NOT EXISTS uq_bpac_agregacao_pendente
+                    ON bpa_consolidado(prd_uid, prd_cmp, prd_cbo, prd_pa, prd_idade)
+                    WHERE prd_exportado = FALSE
+                ''')
+
+                # Versões dos dados para o cache de respostas
+                cursor.execute(DADOS_VERSAO_SQL)
+                for tabela in DADOS_VERSAO_CADASTROS:
+                    cursor.execute(f'DROP TRIGGER IF EXISTS trg_dados_versao ON {tabela}')
+                    cursor.execute(f'''
+                        CREATE TRIGGER trg_dados_versao
+                        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON {tabela}
+                        FOR EACH STATEMENT EXECUTE FUNCTION dados_versao_trigger('cadastro')
+                    ''')
+
+                # Valores SIGTAP por competência (dashboard financeiro)
+                cursor.execute(SIGTAP_PRECO_SQL)
+
+                # Resumo da produção por (tipo, CNES, competência) mantido por triggers
+                cursor.execute("SELECT to_regclass('producao_resumo') IS NULL AS novo")
+                resumo_novo = cursor.fetchone()[0]
+                cursor.execute(PRODUCAO_RESUMO_SQL)
+                for tabela in PRODUCAO_RESUMO_TIPOS:
+                    for sufixo, evento, referencia in PRODUCAO_RESUMO_TRIGGERS:
+                        cursor.execute(f'DROP TRIGGER IF EXISTS trg_producao_resumo_{sufixo} ON {tabela}')
+                        cursor.execute(f'''
+                            CREATE TRIGGER trg_producao_resumo_{sufixo} {evento} ON {tabela}
+                            {referencia} EXECUTE FUNCTION producao_resumo_trigger()
+                        ''')
+                if resumo_novo or legado_bpai or legado_bpac:
+                    _rebuild_producao_resumo(cursor)
                 
                 # Tabela de exportações
                 cursor.execute('''
@@ -256,6 +936,62 @@ def init_database():
                     )
                 ''')
                 
+                # Jobs em background (extrações e relatórios longos)
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS jobs (
+                        id VARCHAR(36) PRIMARY KEY,
+                        tipo VARCHAR(50) NOT NULL,
+                        status VARCHAR(20) NOT NULL DEFAULT 'pending',
+                        params JSONB,
+                        progress INTEGER DEFAULT 0,
+                        current INTEGER DEFAULT 0,
+                        total INTEGER,
+                        message TEXT,
+                        result JSONB,
+                        error TEXT,
+                        cancel_requested BOOLEAN DEFAULT FALSE,
+                        usuario_id INTEGER,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        started_at TIMESTAMP,
+                        finished_at TIMESTAMP,
+                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                ''')
+                # Dono (processo worker) e batimento do job em execução: na subida,
+                # só jobs sem batimento recente são dados como interrompidos
+                cursor.execute('ALTER TABLE jobs ADD COLUMN IF NOT EXISTS worker_id VARCHAR(100)')
+                cursor.execute('ALTER TABLE jobs ADD COLUMN IF NOT EXISTS heartbeat_at TIMESTAMP')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status)')
+                cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_created_at ON jobs(created_at DESC)')
+
+                # Resultado das regras de correção por registro BPA-I (relatório de inconsistências)
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS bpa_inconsistencias (
+                        bpa_id INTEGER PRIMARY KEY,
+                        prd_uid VARCHAR(7) NOT NULL,
+                        prd_cmp VARCHAR(6) NOT NULL,
+                        regras_versao VARCHAR(32) NOT NULL,
+                        registro_atualizado_em TIMESTAMP,
+                        tipo VARCHAR(10),
+                        regras TEXT[] NOT NULL DEFAULT '{}',
+                        corrections JSONB NOT NULL DEFAULT '[]',
+                        delete_reason TEXT,
+                        calculado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        FOREIGN KEY (bpa_id, prd_cmp)
+                            REFERENCES bpa_individualizado(id, prd_cmp) ON DELETE CASCADE
+                    )
+                ''')
+                # Versão do escopo 'cadastro' usada no cálculo (só registros que consultam pacientes)
+                cursor.execute('ALTER TABLE bpa_inconsistencias ADD COLUMN IF NOT EXISTS cadastro_versao BIGINT')
+                cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_bpa_inconsistencias_uid_cmp_tipo
+                    ON bpa_inconsistencias(prd_uid, prd_cmp, tipo, bpa_id)
+                ''')
+                cursor.execute('''
+                    CREATE INDEX IF NOT EXISTS idx_bpa_inconsistencias_regras
+                    ON bpa_inconsistencias USING GIN (regras)
+                ''')
+
                 conn.commit()
                 logger.info("[DB] Tabelas PostgreSQL inicializadas com sucesso")
     except Exception as e:
@@ -379,7 +1115,52 @@ class BPADatabase:
                 ''', (nome_norm, data_nascimento))
                 row = cursor.fetchone()
                 return dict(row) if row else None
-    
+
+    def get_pacientes_by_nome_nascimento(self, pares: Iterable[tuple]) -> Dict[tuple, Dict]:
+        """
+        Busca em lote pacientes por (nome, data_nascimento), numa única consulta
+
+        Mesma comparação de get_paciente_by_nome_nascimento (nome em maiúsculas,
+        sem espaços extras). Com mais de um cadastro para o par, vale o de menor id.
+
+        Args:
+            pares: Pares (nome, data_nascimento) como vêm dos registros
+
+        Returns:
+            {par: paciente} apenas para os pares encontrados (chave = par recebido)
+        """
+        por_chave: Dict[tuple, List[tuple]] = {}
+        for nome, data_nascimento in pares:
+            if not nome or not data_nascimento:
+                continue
+            chave = (' '.join(str(nome).upper().split()), str(data_nascimento))
+            por_chave.setdefault(chave, []).append((nome, data_nascimento))
+        if not por_chave:
+            return {}
+
+        nomes = [nome for nome, _ in por_chave]
+        datas = [data for _, data in por_chave]
+        with get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute('''
+                    SELECT DISTINCT ON (UPPER(TRIM(p.nome)), p.data_nascimento)
+                           p.*, UPPER(TRIM(p.nome)) AS _nome_busca
+                    FROM pacientes p
+                    JOIN unnest(%s::text[], %s::text[]) AS busca(nome, data_nascimento)
+                      ON UPPER(TRIM(p.nome)) = busca.nome
+                     AND p.data_nascimento = busca.data_nascimento
+                    ORDER BY UPPER(TRIM(p.nome)), p.data_nascimento, p.id
+                ''', (nomes, datas))
+                rows = cursor.fetchall()
+
+        encontrados = {}
+        for row in rows:
+            paciente = dict(row)
+            chave = (paciente.pop('_nome_busca'), paciente['data_nascimento'])
+            for par in por_chave.get(chave, ()):
+                encontrados[par] = paciente
+        return encontrados
+
     def search_pacientes(self, termo: str, limit: int = 20) -> List[Dict]:
         """Busca pacientes por nome ou CNS"""
         with get_connection() as conn:
@@ -397,6 +1178,7 @@ class BPADatabase:
         """Salva registro BPA-I usando nomes compatíveis com Firebird"""
         with get_connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                garantir_particoes(cursor, 'bpa_individualizado', [data.get('prd_cmp')])
                 cursor.execute('''
                     INSERT INTO bpa_individualizado (
                         prd_uid, prd_cmp, prd_flh, prd_seq,
@@ -420,47 +1202,7 @@ class BPADatabase:
                         %(prd_etnia)s, %(prd_eqp_area)s, %(prd_eqp_seq)s, %(prd_mvm)s, %(prd_org)s
                     )
                     RETURNING id
-                ''', {
-                    'prd_uid': data.get('prd_uid'),
-                    'prd_cmp': data.get('prd_cmp'),
-                    'prd_flh': data.get('prd_flh', 1),
-                    'prd_seq': data.get('prd_seq', 1),
-                    'prd_cnsmed': data.get('prd_cnsmed'),
-                    'prd_cbo': data.get('prd_cbo'),
-                    'prd_ine': data.get('prd_ine', ''),
-                    'prd_cnspac': data.get('prd_cnspac'),
-                    'prd_cpf_pcnte': data.get('prd_cpf_pcnte'),
-                    'prd_nmpac': data.get('prd_nmpac'),
-                    'prd_dtnasc': data.get('prd_dtnasc'),
-                    'prd_sexo': data.get('prd_sexo'),
-                    'prd_raca': data.get('prd_raca', '99'),
-                    'prd_nac': data.get('prd_nac', '010'),
-                    'prd_ibge': data.get('prd_ibge'),
-                    'prd_idade': data.get('prd_idade'),
-                    'prd_cep_pcnte': data.get('prd_cep_pcnte'),
-                    'prd_lograd_pcnte': data.get('prd_lograd_pcnte'),
-                    'prd_end_pcnte': data.get('prd_end_pcnte'),
-                    'prd_num_pcnte': data.get('prd_num_pcnte'),
-                    'prd_compl_pcnte': data.get('prd_compl_pcnte'),
-                    'prd_bairro_pcnte': data.get('prd_bairro_pcnte'),
-                    'prd_ddtel_pcnte': data.get('prd_ddtel_pcnte'),
-                    'prd_tel_pcnte': data.get('prd_tel_pcnte'),
-                    'prd_email_pcnte': data.get('prd_email_pcnte'),
-                    'prd_dtaten': data.get('prd_dtaten'),
-                    'prd_pa': data.get('prd_pa'),
-                    'prd_qt_p': data.get('prd_qt_p', 1),
-                    'prd_cid': data.get('prd_cid'),
-                    'prd_caten': data.get('prd_caten', '01'),
-                    'prd_naut': data.get('prd_naut', ''),
-                    'prd_cnpj': data.get('prd_cnpj', ''),
-                    'prd_servico': data.get('prd_servico', ''),
-                    'prd_classificacao': data.get('prd_classificacao', ''),
-                    'prd_etnia': data.get('prd_etnia', ''),
-                    'prd_eqp_area': data.get('prd_eqp_area', ''),
-                    'prd_eqp_seq': data.get('prd_eqp_seq', ''),
-                    'prd_mvm': data.get('prd_mvm') or data.get('prd_cmp'),  # MVM = competência
-                    'prd_org': data.get('prd_org', 'BPI')
-                })
+                ''', _bpai_params(data))
                 result = cursor.fetchone()
                 conn.commit()
                 
@@ -488,7 +1230,132 @@ class BPADatabase:
                     logger.warning(f"Erro ao salvar paciente no cache: {e}")
                 
                 return result['id']
-    
+
+    def save_bpa_individualizado_bulk(self, records: Iterable[Dict], chunk_size: int = 5000,
+                                      return_ids: bool = True) -> Dict[str, Any]:
+        """
+        Salva registros BPA-I em lote (COPY para tabela de staging).
+
+        Cada bloco de `chunk_size` registros é gravado e confirmado na sua
+        própria transação: COPY -> INSERT ... SELECT em bpa_individualizado ->
+        UPSERT em pacientes. Se um bloco falha, ele é desfeito e regravado
+        registro a registro: só os registros com erro ficam de fora.
+
+        `records` pode ser um gerador: é consumido em blocos de `chunk_size`,
+        então só um bloco fica em memória. Uma exceção lançada pelo gerador é
+        propagada; os blocos anteriores continuam gravados. Com
+        `return_ids=False` os IDs não são devolvidos.
+
+        Returns:
+            Dict com success (nenhuma falha), saved, failed, ids (dos gravados,
+            na ordem de entrada), pacientes e errors
+        """
+        result = {'success': True, 'saved': 0, 'failed': 0, 'ids': [], 'pacientes': 0, 'errors': []}
+        records = iter(records)
+        start = 0
+
+        while True:
+            chunk = list(islice(records, chunk_size))
+            if not chunk:
+                break
+            rows = [
+                (ord_,) + tuple(_bpai_params(data)[c] for c in BPAI_COLUMNS)
+                for ord_, data in enumerate(chunk, start=start)
+            ]
+            start += len(chunk)
+
+            try:
+                ids, saved, pacientes = self._save_bpai_staging(rows, return_ids)
+            except Exception as e:
+                logger.warning(
+                    f"Bloco BPA-I {rows[0][0]}-{rows[-1][0]} falhou ({e}); gravando registro a registro"
+                )
+                ids, saved, pacientes = [], 0, 0
+                for row in rows:
+                    try:
+                        row_ids, row_saved, row_pacientes = self._save_bpai_staging([row], return_ids)
+                    except Exception as row_error:
+                        result['failed'] += 1
+                        if len(result['errors']) < 100:
+                            result['errors'].append(f"registro {row[0]}: {row_error}")
+                        continue
+                    ids.extend(row_ids)
+                    saved += row_saved
+                    pacientes += row_pacientes
+
+            result['ids'].extend(ids)
+            result['saved'] += saved
+            result['pacientes'] += pacientes
+
+        if result['failed']:
+            result['success'] = False
+            logger.error(
+                f"Salvamento em lote BPA-I: {result['failed']} registros com erro, "
+                f"{result['saved']} gravados"
+            )
+        return result
+
+    def _save_bpai_staging(self, rows: List[tuple], return_ids: bool) -> tuple[List[int], int, int]:
+        """Grava um bloco de linhas (ord + BPAI_COLUMNS) em uma transação: (ids, saved, pacientes)"""
+        columns = ('ord',) + BPAI_COLUMNS
+        cols_sql = ', '.join(BPAI_COLUMNS)
+        # INSERT ... SELECT ... ORDER BY não garante a ordem do RETURNING: com
+        # return_ids os IDs são sorteados na staging e lidos de volta por ord
+        insert_cols = f'id, {cols_sql}' if return_ids else cols_sql
+
+        with get_connection() as conn:
+            try:
+                with conn.cursor() as cursor:
+                    cursor.execute(f'''
+                        CREATE TEMP TABLE _bpai_staging ON COMMIT DROP AS
+                        SELECT 0::integer AS ord, id, {cols_sql}
+                        FROM bpa_individualizado WITH NO DATA
+                    ''')
+                    _copy_rows(cursor, '_bpai_staging', columns, rows)
+
+                    cursor.execute('SELECT DISTINCT prd_cmp FROM _bpai_staging')
+                    garantir_particoes(cursor, 'bpa_individualizado', [row[0] for row in cursor.fetchall()])
+                    if return_ids:
+                        cursor.execute("UPDATE _bpai_staging SET id = nextval('bpa_individualizado_id_seq')")
+                    cursor.execute(f'''
+                        INSERT INTO bpa_individualizado ({insert_cols})
+                        SELECT {insert_cols} FROM _bpai_staging ORDER BY ord
+                    ''')
+                    saved = cursor.rowcount
+                    ids = []
+                    if return_ids:
+                        cursor.execute('SELECT id FROM _bpai_staging ORDER BY ord')
+                        ids = [row[0] for row in cursor.fetchall()]
+
+                    # Cache de pacientes: último registro de cada CNS prevalece
+                    cursor.execute('''
+                        INSERT INTO pacientes (
+                            cns, cpf, nome, data_nascimento, sexo, raca_cor,
+                            nacionalidade, municipio_ibge, cep, logradouro_codigo,
+                            endereco, numero, complemento, bairro, telefone, email
+                        )
+                        SELECT DISTINCT ON (prd_cnspac)
+                            prd_cnspac, prd_cpf_pcnte, prd_nmpac, prd_dtnasc, prd_sexo, prd_raca,
+                            prd_nac, prd_ibge, prd_cep_pcnte, prd_lograd_pcnte,
+                            prd_end_pcnte, prd_num_pcnte, prd_compl_pcnte, prd_bairro_pcnte,
+                            prd_tel_pcnte, prd_email_pcnte
+                        FROM _bpai_staging
+                        WHERE COALESCE(prd_cnspac, '') <> '' AND prd_nmpac IS NOT NULL
+                        ORDER BY prd_cnspac, ord DESC
+                        ON CONFLICT (cns) DO UPDATE SET
+                            nome = EXCLUDED.nome, data_nascimento = EXCLUDED.data_nascimento,
+                            sexo = EXCLUDED.sexo, telefone = EXCLUDED.telefone,
+                            updated_at = CURRENT_TIMESTAMP
+                    ''')
+                    pacientes = cursor.rowcount
+
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+        return ids, saved, pacientes
+
     def get_bpa_individualizado(self, id: int) -> Optional[Dict]:
         """Busca BPA-I pelo ID"""
         with get_connection() as conn:
@@ -497,30 +1364,44 @@ class BPADatabase:
                 row = cursor.fetchone()
                 return dict(row) if row else None
     
-    def list_bpa_individualizado(self, cnes: str, competencia: str = None, 
-                                  exportado: bool = None, limit: int = None, offset: int = 0) -> List[Dict]:
-        """Lista registros BPA-I com filtros"""
+    def _list_bpa_query(self, tabela: str, cnes: str, competencia: str = None,
+                        exportado: bool = None, after_id: int = None) -> tuple[str, List]:
+        """SELECT de uma listagem BPA em ordem de id (after_id = keyset: só ids maiores)"""
+        query = f"SELECT * FROM {tabela} WHERE prd_uid = %s"
+        params: List[Any] = [cnes]
+        
+        if competencia:
+            query += " AND prd_cmp = %s"
+            params.append(competencia)
+        
+        if exportado is not None:
+            query += " AND prd_exportado = %s"
+            params.append(exportado)
+        
+        if after_id is not None:
+            query += " AND id > %s"
+            params.append(after_id)
+        
+        query += " ORDER BY id"
+        return query, params
+
+    def _list_bpa(self, tabela: str, cnes: str, competencia: str = None, exportado: bool = None,
+                  limit: int = None, offset: int = 0, after_id: int = None) -> List[Dict]:
+        query, params = self._list_bpa_query(tabela, cnes, competencia, exportado, after_id)
+        if limit is not None:
+            query += " LIMIT %s OFFSET %s"
+            params.extend([limit, offset])
+        
         with get_connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                query = "SELECT * FROM bpa_individualizado WHERE prd_uid = %s"
-                params = [cnes]
-                
-                if competencia:
-                    query += " AND prd_cmp = %s"
-                    params.append(competencia)
-                
-                if exportado is not None:
-                    query += " AND prd_exportado = %s"
-                    params.append(exportado)
-                
-                query += " ORDER BY id"
-                
-                if limit is not None:
-                    query += " LIMIT %s OFFSET %s"
-                    params.extend([limit, offset])
-                
                 cursor.execute(query, params)
                 return [dict(row) for row in cursor.fetchall()]
+
+    def list_bpa_individualizado(self, cnes: str, competencia: str = None, 
+                                  exportado: bool = None, limit: int = None, offset: int = 0,
+                                  after_id: int = None) -> List[Dict]:
+        """Lista registros BPA-I com filtros (after_id: paginação por keyset em vez de offset)"""
+        return self._list_bpa('bpa_individualizado', cnes, competencia, exportado, limit, offset, after_id)
     
     def update_bpa_individualizado(self, id: int, data: Dict) -> bool:
         """Atualiza registro BPA-I"""
@@ -562,9 +1443,11 @@ class BPADatabase:
     # ========== BPA CONSOLIDADO ==========
     
     def save_bpa_consolidado(self, data: Dict) -> int:
-        """Salva registro BPA-C"""
+        """Salva registro BPA-C (soma a quantidade se a chave já estiver pendente)"""
+        uid, cmp, cbo, pa, idade = _bpac_chave(data)
         with get_connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                garantir_particoes(cursor, 'bpa_consolidado', [cmp])
                 cursor.execute('''
                     INSERT INTO bpa_consolidado (
                         prd_uid, prd_cmp, prd_flh,
@@ -575,16 +1458,21 @@ class BPADatabase:
                         %(prd_cnsmed)s, %(prd_cbo)s,
                         %(prd_pa)s, %(prd_qt_p)s, %(prd_idade)s, %(prd_org)s
                     )
+                    ON CONFLICT (prd_uid, prd_cmp, prd_cbo, prd_pa, prd_idade)
+                        WHERE prd_exportado = FALSE
+                    DO UPDATE SET
+                        prd_qt_p = bpa_consolidado.prd_qt_p + EXCLUDED.prd_qt_p,
+                        updated_at = CURRENT_TIMESTAMP
                     RETURNING id
                 ''', {
-                    'prd_uid': data.get('prd_uid'),
-                    'prd_cmp': data.get('prd_cmp'),
+                    'prd_uid': uid,
+                    'prd_cmp': cmp,
                     'prd_flh': data.get('prd_flh', 1),
                     'prd_cnsmed': data.get('prd_cnsmed'),
-                    'prd_cbo': data.get('prd_cbo'),
-                    'prd_pa': data.get('prd_pa'),
+                    'prd_cbo': cbo,
+                    'prd_pa': pa,
                     'prd_qt_p': data.get('prd_qt_p', 1),
-                    'prd_idade': data.get('prd_idade'),
+                    'prd_idade': idade,
                     'prd_org': data.get('prd_org', 'BPC')
                 })
                 result = cursor.fetchone()
@@ -592,90 +1480,64 @@ class BPADatabase:
                 return result['id']
 
     def save_bpa_consolidado_batch(self, records: List[Dict]) -> Dict[str, Any]:
-        """Salva múltiplos registros BPA-C agregando e evitando duplicações"""
+        """
+        Salva múltiplos registros BPA-C agregando e evitando duplicações.
+
+        Agrega o lote por (uid, cmp, cbo, pa, idade) e grava tudo com um único
+        INSERT ... ON CONFLICT, somando quantidades em registros pendentes.
+        """
         if not records:
             return {'success': True, 'saved': 0, 'inserted': 0, 'updated': 0, 'errors': []}
 
         # Agrega por chave para evitar duplicações no lote
         grouped: Dict[tuple, Dict] = {}
         for rec in records:
-            key = (
-                rec.get('prd_uid', ''),
-                rec.get('prd_cmp', ''),
-                rec.get('prd_cbo', ''),
-                rec.get('prd_pa', ''),
-                rec.get('prd_idade', '000') or '000'
-            )
+            key = _bpac_chave(rec)
             if key not in grouped:
                 grouped[key] = rec.copy()
                 grouped[key]['prd_qt_p'] = 0
             grouped[key]['prd_qt_p'] += int(rec.get('prd_qt_p', 1) or 1)
 
+        rows = [
+            (
+                key[0], key[1], rec.get('prd_flh', 1),
+                rec.get('prd_cnsmed'), key[2],
+                key[3], rec['prd_qt_p'], key[4], rec.get('prd_org', 'BPC')
+            )
+            for key, rec in grouped.items()
+        ]
+        grouped_cmps = [key[1] for key in grouped]
+
         inserted = 0
         updated = 0
         errors: List[str] = []
 
+        # Um único UPSERT sobre o índice parcial uq_bpac_agregacao_pendente.
+        # Tabela particionada não expõe xmax no RETURNING: linhas recém-inseridas
+        # têm created_at desta transação; as demais foram atualizadas.
         with get_connection() as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                for rec in grouped.values():
-                    try:
-                        cursor.execute('''
-                            SELECT id, prd_qt_p, prd_exportado
-                            FROM bpa_consolidado
-                            WHERE prd_uid = %s
-                              AND prd_cmp = %s
-                              AND prd_cbo = %s
-                              AND prd_pa = %s
-                              AND prd_idade = %s
-                              AND prd_exportado = FALSE
-                            LIMIT 1
-                        ''', (
-                            rec.get('prd_uid'),
-                            rec.get('prd_cmp'),
-                            rec.get('prd_cbo'),
-                            rec.get('prd_pa'),
-                            rec.get('prd_idade') or '000'
-                        ))
-                        existing = cursor.fetchone()
-
-                        if existing:
-                            cursor.execute('''
-                                UPDATE bpa_consolidado
-                                SET prd_qt_p = prd_qt_p + %s,
-                                    updated_at = CURRENT_TIMESTAMP
-                                WHERE id = %s
-                            ''', (
-                                int(rec.get('prd_qt_p', 1) or 1),
-                                existing['id']
-                            ))
-                            updated += 1
-                        else:
-                            cursor.execute('''
-                                INSERT INTO bpa_consolidado (
-                                    prd_uid, prd_cmp, prd_flh,
-                                    prd_cnsmed, prd_cbo,
-                                    prd_pa, prd_qt_p, prd_idade, prd_org
-                                ) VALUES (
-                                    %(prd_uid)s, %(prd_cmp)s, %(prd_flh)s,
-                                    %(prd_cnsmed)s, %(prd_cbo)s,
-                                    %(prd_pa)s, %(prd_qt_p)s, %(prd_idade)s, %(prd_org)s
-                                )
-                            ''', {
-                                'prd_uid': rec.get('prd_uid'),
-                                'prd_cmp': rec.get('prd_cmp'),
-                                'prd_flh': rec.get('prd_flh', 1),
-                                'prd_cnsmed': rec.get('prd_cnsmed'),
-                                'prd_cbo': rec.get('prd_cbo'),
-                                'prd_pa': rec.get('prd_pa'),
-                                'prd_qt_p': rec.get('prd_qt_p', 1),
-                                'prd_idade': rec.get('prd_idade') or '000',
-                                'prd_org': rec.get('prd_org', 'BPC')
-                            })
-                            inserted += 1
-                    except Exception as e:
-                        errors.append(str(e))
-
+            try:
+                with conn.cursor() as cursor:
+                    garantir_particoes(cursor, 'bpa_consolidado', grouped_cmps)
+                    results = execute_values(cursor, '''
+                        INSERT INTO bpa_consolidado (
+                            prd_uid, prd_cmp, prd_flh,
+                            prd_cnsmed, prd_cbo,
+                            prd_pa, prd_qt_p, prd_idade, prd_org
+                        ) VALUES %s
+                        ON CONFLICT (prd_uid, prd_cmp, prd_cbo, prd_pa, prd_idade)
+                            WHERE prd_exportado = FALSE
+                        DO UPDATE SET
+                            prd_qt_p = bpa_consolidado.prd_qt_p + EXCLUDED.prd_qt_p,
+                            updated_at = CURRENT_TIMESTAMP
+                        RETURNING (created_at = LOCALTIMESTAMP) AS inserted
+                    ''', rows, page_size=len(rows), fetch=True)
                 conn.commit()
+                inserted = sum(1 for (was_inserted,) in results if was_inserted)
+                updated = len(results) - inserted
+            except Exception as e:
+                conn.rollback()
+                errors.append(str(e))
 
         return {
             'success': len(errors) == 0,
@@ -686,29 +1548,10 @@ class BPADatabase:
         }
     
     def list_bpa_consolidado(self, cnes: str, competencia: str = None,
-                              exportado: bool = None, limit: int = None, offset: int = 0) -> List[Dict]:
-        """Lista registros BPA-C com filtros"""
-        with get_connection() as conn:
-            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                query = "SELECT * FROM bpa_consolidado WHERE prd_uid = %s"
-                params = [cnes]
-                
-                if competencia:
-                    query += " AND prd_cmp = %s"
-                    params.append(competencia)
-                
-                if exportado is not None:
-                    query += " AND prd_exportado = %s"
-                    params.append(exportado)
-                
-                query += " ORDER BY id"
-                
-                if limit is not None:
-                    query += " LIMIT %s OFFSET %s"
-                    params.extend([limit, offset])
-                
-                cursor.execute(query, params)
-                return [dict(row) for row in cursor.fetchall()]
+                              exportado: bool = None, limit: int = None, offset: int = 0,
+                              after_id: int = None) -> List[Dict]:
+        """Lista registros BPA-C com filtros (after_id: paginação por keyset em vez de offset)"""
+        return self._list_bpa('bpa_consolidado', cnes, competencia, exportado, limit, offset, after_id)
     
     def mark_exported_bpac(self, ids: List[int]) -> int:
         """Marca registros BPA-C como exportados"""
@@ -722,6 +1565,26 @@ class BPADatabase:
                 conn.commit()
                 return cursor.rowcount
 
+    def remover_competencia(self, competencia: str, tipo: str = "all", arquivar: bool = False) -> Dict:
+        """
+        Remove (DROP) ou arquiva (DETACH, tabela arquivo_*) a partição inteira de uma
+        competência, de todas as unidades
+
+        Args:
+            tipo: bpa_i, bpa_c ou all
+            arquivar: True mantém os registros em arquivo_{tabela}_{competencia}
+        """
+        tabelas = [t for t, nome in PRODUCAO_RESUMO_TIPOS.items() if tipo in (nome, "all")]
+        resultado = {}
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                for tabela in tabelas:
+                    cursor.execute('SELECT bpa_remover_particao(%s, %s, %s)', (tabela, competencia, arquivar))
+                    resultado[PRODUCAO_RESUMO_TIPOS[tabela]] = cursor.fetchone()[0] or 0
+                conn.commit()
+        logger.info(f"[DB] Competência {competencia} {'arquivada' if arquivar else 'removida'}: {resultado}")
+        return resultado
+
     def reset_export_status(self, cnes: str, competencia: str, tipo: str = "all") -> Dict:
         """Reseta status de exportação (prd_exportado/data_exportacao)"""
         results = {
@@ -757,28 +1620,10 @@ class BPADatabase:
     # ========== ESTATÍSTICAS ==========
     
     def get_stats(self) -> Dict:
-        """Retorna estatísticas gerais"""
+        """Retorna estatísticas gerais (BPA-I/BPA-C a partir de producao_resumo)"""
         with get_connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                stats = {}
-                
-                cursor.execute("SELECT COUNT(*) as total FROM bpa_individualizado")
-                stats['bpai_total'] = cursor.fetchone()['total']
-                
-                cursor.execute("SELECT COUNT(*) as total FROM bpa_individualizado WHERE prd_exportado = FALSE")
-                stats['bpai_pendente'] = cursor.fetchone()['total']
-                
-                cursor.execute("SELECT COUNT(*) as total FROM bpa_individualizado WHERE prd_exportado = TRUE")
-                stats['bpai_exportado'] = cursor.fetchone()['total']
-                
-                cursor.execute("SELECT COUNT(*) as total FROM bpa_consolidado")
-                stats['bpac_total'] = cursor.fetchone()['total']
-                
-                cursor.execute("SELECT COUNT(*) as total FROM bpa_consolidado WHERE prd_exportado = FALSE")
-                stats['bpac_pendente'] = cursor.fetchone()['total']
-                
-                cursor.execute("SELECT COUNT(*) as total FROM bpa_consolidado WHERE prd_exportado = TRUE")
-                stats['bpac_exportado'] = cursor.fetchone()['total']
+                stats = _somar_resumo(self._resumo(cursor))
                 
                 cursor.execute("SELECT COUNT(*) as total FROM profissionais")
                 stats['total_profissionais'] = cursor.fetchone()['total']
@@ -792,31 +1637,10 @@ class BPADatabase:
         """Obtém estatísticas específicas de um CNES"""
         with get_connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                stats = {}
-                
-                cursor.execute('SELECT COUNT(*) as total FROM bpa_individualizado WHERE prd_uid = %s', (cnes,))
-                stats['bpai_total'] = cursor.fetchone()['total']
-                
-                cursor.execute('SELECT COUNT(*) as total FROM bpa_individualizado WHERE prd_uid = %s AND prd_exportado = FALSE', (cnes,))
-                stats['bpai_pendente'] = cursor.fetchone()['total']
-                
-                cursor.execute('SELECT COUNT(*) as total FROM bpa_individualizado WHERE prd_uid = %s AND prd_exportado = TRUE', (cnes,))
-                stats['bpai_exportado'] = cursor.fetchone()['total']
-                
-                cursor.execute('SELECT DISTINCT prd_cmp FROM bpa_individualizado WHERE prd_uid = %s ORDER BY prd_cmp DESC', (cnes,))
-                stats['bpai_competencias'] = [row['prd_cmp'] for row in cursor.fetchall()]
-                
-                cursor.execute('SELECT COUNT(*) as total FROM bpa_consolidado WHERE prd_uid = %s', (cnes,))
-                stats['bpac_total'] = cursor.fetchone()['total']
-                
-                cursor.execute('SELECT COUNT(*) as total FROM bpa_consolidado WHERE prd_uid = %s AND prd_exportado = FALSE', (cnes,))
-                stats['bpac_pendente'] = cursor.fetchone()['total']
-                
-                cursor.execute('SELECT COUNT(*) as total FROM bpa_consolidado WHERE prd_uid = %s AND prd_exportado = TRUE', (cnes,))
-                stats['bpac_exportado'] = cursor.fetchone()['total']
-                
-                cursor.execute('SELECT DISTINCT prd_cmp FROM bpa_consolidado WHERE prd_uid = %s ORDER BY prd_cmp DESC', (cnes,))
-                stats['bpac_competencias'] = [row['prd_cmp'] for row in cursor.fetchall()]
+                resumo = self._resumo(cursor, cnes)
+                stats = _somar_resumo(resumo)
+                stats['bpai_competencias'] = [r['competencia'] for r in resumo if r['tipo'] == 'bpa_i']
+                stats['bpac_competencias'] = [r['competencia'] for r in resumo if r['tipo'] == 'bpa_c']
                 
                 cursor.execute('SELECT COUNT(*) as total FROM profissionais WHERE cnes = %s', (cnes,))
                 stats['profissionais'] = cursor.fetchone()['total']
@@ -833,12 +1657,9 @@ class BPADatabase:
         with get_connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cursor:
                 cursor.execute('''
-                    SELECT DISTINCT prd_cmp as competencia FROM (
-                        SELECT prd_cmp FROM bpa_individualizado WHERE prd_uid = %s
-                        UNION
-                        SELECT prd_cmp FROM bpa_consolidado WHERE prd_uid = %s
-                    ) t ORDER BY prd_cmp DESC
-                ''', (cnes, cnes))
+                    SELECT DISTINCT prd_cmp as competencia FROM producao_resumo
+                    WHERE prd_uid = %s ORDER BY prd_cmp DESC
+                ''', (cnes,))
                 return [row['competencia'] for row in cursor.fetchall()]
     
     # ========== ESTATÍSTICAS ==========
@@ -853,50 +1674,155 @@ class BPADatabase:
         """
         with get_connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                # Estatísticas BPA-I
-                where_i = "WHERE prd_uid = %s"
-                params_i = [cnes]
-                if competencia:
-                    where_i += " AND prd_cmp = %s"
-                    params_i.append(competencia)
-                
-                cursor.execute(f'''
-                    SELECT 
-                        COUNT(*) as total,
-                        SUM(CASE WHEN prd_exportado = FALSE THEN 1 ELSE 0 END) as pendente,
-                        SUM(CASE WHEN prd_exportado = TRUE THEN 1 ELSE 0 END) as exportado
-                    FROM bpa_individualizado
-                    {where_i}
-                ''', params_i)
-                
-                bpai = cursor.fetchone()
-                
-                # Estatísticas BPA-C
-                where_c = "WHERE prd_uid = %s"
-                params_c = [cnes]
-                if competencia:
-                    where_c += " AND prd_cmp = %s"
-                    params_c.append(competencia)
-                
-                cursor.execute(f'''
-                    SELECT 
-                        COUNT(*) as total,
-                        SUM(CASE WHEN prd_exportado = FALSE THEN 1 ELSE 0 END) as pendente,
-                        SUM(CASE WHEN prd_exportado = TRUE THEN 1 ELSE 0 END) as exportado
-                    FROM bpa_consolidado
-                    {where_c}
-                ''', params_c)
+                resumo = self._resumo(cursor, cnes, competencia)
+                stats = _somar_resumo(resumo)
+                return {chave: stats[chave] for chave in (
+                    'bpai_total', 'bpai_pendente', 'bpai_exportado',
+                    'bpac_total', 'bpac_pendente', 'bpac_exportado'
+                )}
+
+    @staticmethod
+    def _resumo_sql(cnes: str = None, competencia: str = None) -> tuple[str, List]:
+        """SELECT de producao_resumo (uma linha por tipo/CNES/competência)"""
+        where = []
+        params = []
+        if cnes:
+            where.append("prd_uid = %s")
+            params.append(cnes)
+        if competencia:
+            where.append("prd_cmp = %s")
+            params.append(competencia)
+        return f'''
+            SELECT tipo, prd_uid as cnes, prd_cmp as competencia, total, pendentes, exportados,
+                   quantidade, quantidade_pendente, primeira_insercao, ultima_insercao
+            FROM producao_resumo
+            {"WHERE " + " AND ".join(where) if where else ""}
+            ORDER BY prd_uid, prd_cmp DESC
+        ''', params
+
+    @classmethod
+    def _resumo(cls, cursor, cnes: str = None, competencia: str = None) -> List[Dict]:
+        """Linhas de producao_resumo (uma por tipo/CNES/competência)"""
+        cursor.execute(*cls._resumo_sql(cnes, competencia))
+        return cursor.fetchall()
+
+    def get_producao_resumo(self, cnes: str = None, competencia: str = None) -> List[Dict]:
+        """Resumo da produção por tipo ('bpa_i'/'bpa_c'), CNES e competência"""
+        with get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                return self._resumo(cursor, cnes, competencia)
+
+    def get_database_overview(self) -> Dict:
+        """Visão geral do admin: produção por CNES/competência e totais"""
+        with get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                resumo = self._resumo(cursor)
                 
-                bpac = cursor.fetchone()
+                cursor.execute("SELECT COUNT(*) as total FROM profissionais")
+                total_prof = cursor.fetchone()['total']
                 
-                return {
-                    'bpai_total': bpai['total'] or 0,
-                    'bpai_pendente': bpai['pendente'] or 0,
-                    'bpai_exportado': bpai['exportado'] or 0,
-                    'bpac_total': bpac['total'] or 0,
-                    'bpac_pendente': bpac['pendente'] or 0,
-                    'bpac_exportado': bpac['exportado'] or 0
-                }
+                cursor.execute("SELECT COUNT(*) as total FROM pacientes")
+                total_pac = cursor.fetchone()['total']
+
+        por_tipo = {'bpa_i': [], 'bpa_c': []}
+        for row in resumo:
+            por_tipo[row['tipo']].append({
+                "cnes": row['cnes'],
+                "competencia": row['competencia'],
+                "total": row['total'],
+                "pendentes": row['pendentes'],
+                "exportados": row['exportados'],
+                "quantidade": row['quantidade'],
+                "primeira_insercao": row['primeira_insercao'].isoformat() if row['primeira_insercao'] else None,
+                "ultima_insercao": row['ultima_insercao'].isoformat() if row['ultima_insercao'] else None,
+                "tipo": row['tipo']
+            })
+        cnes_list = sorted({row['cnes'] for row in resumo})
+        
+        return {
+            "success": True,
+            "cnes_list": cnes_list,
+            "total_cnes": len(cnes_list),
+            "bpa_i": por_tipo['bpa_i'],
+            "bpa_c": por_tipo['bpa_c'],
+            "totals": {
+                "bpa_i": sum(r['total'] for r in por_tipo['bpa_i']),
+                "bpa_c": sum(r['total'] for r in por_tipo['bpa_c']),
+                "profissionais": total_prof,
+                "pacientes": total_pac
+            }
+        }
+
+    def rebuild_producao_resumo(self) -> Dict[str, int]:
+        """Recalcula producao_resumo do zero (linhas por tipo)"""
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                linhas = _rebuild_producao_resumo(cursor)
+                conn.commit()
+                return linhas
+
+    @staticmethod
+    def _producao_dashboard_sql(
+        competencia_inicio: str = None,
+        competencia_fim: str = None,
+        cnes_list: List[str] = None,
+        tipo_bpa: str = None,
+        cbo: str = None,
+        procedimento: str = None
+    ) -> tuple[Optional[str], List]:
+        """
+        SELECT (competencia, procedimento, cbo, quantidade_total) da produção
+        filtrada, BPA-I e/ou BPA-C conforme tipo_bpa; None se nenhum tipo
+        """
+        tipo_norm = (tipo_bpa or '').strip().upper()
+        only_i = tipo_norm in ['BPA-I', 'BPAI', 'BPI', '02']
+        only_c = tipo_norm in ['BPA-C', 'BPAC', 'BPC', '01']
+
+        clauses = []
+        params: List[Any] = []
+        if competencia_inicio:
+            clauses.append("prd_cmp >= %s")
+            params.append(competencia_inicio)
+        if competencia_fim:
+            clauses.append("prd_cmp <= %s")
+            params.append(competencia_fim)
+        if cnes_list:
+            clauses.append("prd_uid = ANY(%s)")
+            params.append(cnes_list)
+        if cbo:
+            clauses.append("prd_cbo = %s")
+            params.append(cbo)
+        if procedimento:
+            clauses.append("prd_pa = %s")
+            params.append(procedimento)
+        where_sql = " AND ".join(clauses) if clauses else "1=1"
+
+        tabelas = []
+        if not only_c:
+            tabelas.append('bpa_individualizado')
+        if not only_i:
+            tabelas.append('bpa_consolidado')
+        if not tabelas:
+            return None, []
+
+        queries = [f'''
+            SELECT prd_cmp AS competencia,
+                   prd_pa AS procedimento,
+                   prd_cbo AS cbo,
+                   SUM(prd_qt_p) AS quantidade_total
+            FROM {tabela}
+            WHERE {where_sql}
+            GROUP BY prd_cmp, prd_pa, prd_cbo
+        ''' for tabela in tabelas]
+        if len(queries) == 1:
+            return queries[0], params
+
+        union_sql = " UNION ALL ".join(queries)
+        return f'''
+            SELECT competencia, procedimento, cbo, SUM(quantidade_total) AS quantidade_total
+            FROM ({union_sql}) t
+            GROUP BY competencia, procedimento, cbo
+        ''', params * len(queries)
 
     def get_production_for_dashboard(
         self,
@@ -908,77 +1834,85 @@ class BPADatabase:
         procedimento: str = None
     ) -> List[Dict]:
         """Agrega produção para dashboard financeiro (BPA-I/BPA-C)"""
-        tipo_norm = (tipo_bpa or '').strip().upper()
-        only_i = tipo_norm in ['BPA-I', 'BPAI', 'BPI', '02']
-        only_c = tipo_norm in ['BPA-C', 'BPAC', 'BPC', '01']
+        producao_sql, params = self._producao_dashboard_sql(
+            competencia_inicio, competencia_fim, cnes_list, tipo_bpa, cbo, procedimento
+        )
+        if producao_sql is None:
+            return []
+
+        with get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(f'SELECT * FROM ({producao_sql}) p ORDER BY competencia', params)
+                return [dict(row) for row in cursor.fetchall()]
 
-        def build_where() -> tuple[str, List]:
-            clauses = []
-            params: List[Any] = []
-            if competencia_inicio:
-                clauses.append("prd_cmp >= %s")
-                params.append(competencia_inicio)
-            if competencia_fim:
-                clauses.append("prd_cmp <= %s")
-                params.append(competencia_fim)
-            if cnes_list:
-                clauses.append("prd_uid = ANY(%s)")
-                params.append(cnes_list)
-            if cbo:
-                clauses.append("prd_cbo = %s")
-                params.append(cbo)
-            if procedimento:
-                clauses.append("prd_pa = %s")
-                params.append(procedimento)
-            where_sql = " AND ".join(clauses) if clauses else "1=1"
-            return where_sql, params
+    def get_financial_dashboard(
+        self,
+        competencia_precos: str,
+        competencia_inicio: str = None,
+        competencia_fim: str = None,
+        cnes_list: List[str] = None,
+        tipo_bpa: str = None,
+        cbo: str = None,
+        procedimento: str = None,
+        top: int = 10
+    ) -> List[Dict]:
+        """
+        Produção valorada pela versão de preços SIGTAP `competencia_precos`, numa consulta
+
+        Uma varredura da produção agregada com GROUPING SETS devolve as linhas
+        por grupo: 'total' (uma linha), 'evolucao' (por competência),
+        'procedimento' e 'cbo' (só os `top` de maior valor, com o nome da SIGTAP
+        e `itens` = quantos existem no grupo). Procedimentos sem preço valem 0.
+        """
+        producao_sql, params = self._producao_dashboard_sql(
+            competencia_inicio, competencia_fim, cnes_list, tipo_bpa, cbo, procedimento
+        )
+        if producao_sql is None:
+            return []
 
         with get_connection() as conn:
             with conn.cursor(cursor_factory=RealDictCursor) as cursor:
-                where_sql, params = build_where()
-
-                queries = []
-                all_params: List[Any] = []
-
-                if not only_c:
-                    queries.append(f'''
-                        SELECT prd_cmp AS competencia,
-                               prd_pa AS procedimento,
-                               prd_cbo AS cbo,
-                               SUM(prd_qt_p) AS quantidade_total
-                        FROM bpa_individualizado
-                        WHERE {where_sql}
-                        GROUP BY prd_cmp, prd_pa, prd_cbo
-                    ''')
-                    all_params.extend(params)
-
-                if not only_i:
-                    queries.append(f'''
-                        SELECT prd_cmp AS competencia,
-                               prd_pa AS procedimento,
-                               prd_cbo AS cbo,
-                               SUM(prd_qt_p) AS quantidade_total
-                        FROM bpa_consolidado
-                        WHERE {where_sql}
-                        GROUP BY prd_cmp, prd_pa, prd_cbo
-                    ''')
-                    all_params.extend(params)
-
-                if not queries:
-                    return []
-
-                if len(queries) == 1:
-                    cursor.execute(queries[0], all_params)
-                    return [dict(row) for row in cursor.fetchall()]
-
-                union_sql = " UNION ALL ".join(queries)
-                final_sql = f'''
-                    SELECT competencia, procedimento, cbo, SUM(quantidade_total) AS quantidade_total
-                    FROM ({union_sql}) t
-                    GROUP BY competencia, procedimento, cbo
-                    ORDER BY competencia
-                '''
-                cursor.execute(final_sql, all_params)
+                cursor.execute(f'''
+                    WITH valorada AS (
+                        SELECT p.competencia, p.procedimento,
+                               NULLIF(TRIM(p.cbo), '') AS cbo,
+                               p.quantidade_total AS quantidade,
+                               p.quantidade_total * COALESCE(s.vl_sa, 0) AS valor
+                        FROM ({producao_sql}) p
+                        LEFT JOIN sigtap_preco s
+                               ON s.competencia = %s AND s.co_procedimento = p.procedimento
+                    ), agregada AS (
+                        SELECT CASE WHEN GROUPING(competencia) = 0 THEN 'evolucao'
+                                    WHEN GROUPING(procedimento) = 0 THEN 'procedimento'
+                                    WHEN GROUPING(cbo) = 0 THEN 'cbo'
+                                    ELSE 'total' END AS grupo,
+                               competencia, procedimento, cbo,
+                               COALESCE(SUM(quantidade), 0) AS quantidade,
+                               COALESCE(SUM(valor), 0) AS valor
+                        FROM valorada
+                        GROUP BY GROUPING SETS ((), (competencia), (procedimento), (cbo))
+                    ), ranqueada AS (
+                        SELECT a.*,
+                               ROW_NUMBER() OVER (
+                                   PARTITION BY grupo
+                                   ORDER BY valor DESC, procedimento, cbo
+                               ) AS posicao,
+                               COUNT(*) OVER (PARTITION BY grupo) AS itens
+                        FROM agregada a
+                        WHERE grupo <> 'cbo' OR cbo IS NOT NULL
+                    )
+                    SELECT r.grupo, r.competencia, r.procedimento, r.cbo,
+                           r.quantidade, r.valor, r.itens,
+                           sp.no_procedimento, so.no_ocupacao
+                    FROM ranqueada r
+                    LEFT JOIN sigtap_preco sp
+                           ON r.grupo = 'procedimento' AND sp.competencia = %s
+                          AND sp.co_procedimento = r.procedimento
+                    LEFT JOIN sigtap_preco_ocupacao so
+                           ON r.grupo = 'cbo' AND so.competencia = %s AND so.co_ocupacao = r.cbo
+                    WHERE r.grupo IN ('total', 'evolucao') OR r.posicao <= %s
+                    ORDER BY r.grupo, r.competencia, r.posicao
+                ''', params + [competencia_precos, competencia_precos, competencia_precos, top])
                 return [dict(row) for row in cursor.fetchall()]
     
     # ========== EXPORTAÇÃO ==========
@@ -1005,6 +1939,106 @@ class BPADatabase:
                 ''', (cnes, competencia))
                 return [dict(row) for row in cursor.fetchall()]
     
+    def _iter_export_chunks(self, name: str, query: str, params: list, chunk_size: int) -> Iterator[List[Dict]]:
+        """
+        Executa a consulta num cursor nomeado (server-side) e entrega blocos de
+        até chunk_size linhas: só um bloco fica em memória por vez
+        """
+        with get_connection() as conn:
+            try:
+                with conn.cursor(name=name, cursor_factory=RealDictCursor) as cursor:
+                    cursor.itersize = chunk_size
+                    cursor.execute(query, params)
+                    while True:
+                        rows = cursor.fetchmany(chunk_size)
+                        if not rows:
+                            break
+                        yield [dict(row) for row in rows]
+            finally:
+                # Encerra a transação de leitura antes de devolver a conexão ao pool
+                conn.rollback()
+
+    def iter_bpai_for_export(self, cnes: str, competencia: str, exportado: Optional[bool] = False,
+                             procedimentos_corrigidos: Optional[Dict[str, str]] = None,
+                             chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[List[Dict]]:
+        """
+        BPA-I para exportação em blocos, já na ordem de BPACorrections.assign_sequence_bpi
+        (competência, CNS profissional, procedimento, data de atendimento, CNES; empate
+        pelo id). O procedimento entra na ordenação com `procedimentos_corrigidos`
+        aplicado (revogados), e COLLATE "C" compara como o sort do Python.
+        """
+        params: list = []
+        pa_expr = 'prd_pa'
+        if procedimentos_corrigidos:
+            whens = []
+            for antigo, novo in procedimentos_corrigidos.items():
+                whens.append('WHEN %s THEN %s')
+                params.extend([antigo, novo])
+            pa_expr = f"CASE prd_pa {' '.join(whens)} ELSE prd_pa END"
+
+        query = "SELECT * FROM bpa_individualizado WHERE prd_uid = %s AND prd_cmp = %s"
+        filtro = [cnes, competencia]
+        if exportado is not None:
+            query += " AND prd_exportado = %s"
+            filtro.append(exportado)
+        query += f'''
+            ORDER BY COALESCE(prd_cmp, '') COLLATE "C",
+                     COALESCE(prd_cnsmed, '') COLLATE "C",
+                     COALESCE({pa_expr}, '') COLLATE "C",
+                     COALESCE(prd_dtaten, '') COLLATE "C",
+                     COALESCE(prd_uid, '') COLLATE "C",
+                     id
+        '''
+        return self._iter_export_chunks('export_bpai', query, filtro + params, chunk_size)
+
+    def iter_bpac_for_export(self, cnes: str, competencia: str, exportado: Optional[bool] = None,
+                             chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[List[Dict]]:
+        """BPA-C para exportação em blocos, na ordem de list_bpa_consolidado (id)"""
+        query = "SELECT * FROM bpa_consolidado WHERE prd_uid = %s AND prd_cmp = %s"
+        params = [cnes, competencia]
+        if exportado is not None:
+            query += " AND prd_exportado = %s"
+            params.append(exportado)
+        query += " ORDER BY id"
+        return self._iter_export_chunks('export_bpac', query, params, chunk_size)
+
+    def iter_bpa_lista(self, tabela: str, cnes: str, competencia: str = None, exportado: bool = None,
+                       after_id: int = None, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[List[Dict]]:
+        """Mesma consulta de list_bpa_* (ordem de id) em blocos, por cursor server-side"""
+        if tabela not in PRODUCAO_RESUMO_TIPOS:
+            raise ValueError(f"Tabela inválida: {tabela}")
+        query, params = self._list_bpa_query(tabela, cnes, competencia, exportado, after_id)
+        return self._iter_export_chunks(f'lista_{tabela}', query, params, chunk_size)
+
+    # Ordenações aceitas por iter_bpa_for_report (cada arquivo do BPA Magnético
+    # lê os registros na ordem em que são impressos)
+    REPORT_ORDERS = {
+        ('bpa_individualizado', 'id'): 'id',
+        ('bpa_individualizado', 'profissional'): (
+            'COALESCE(prd_cnsmed, \'\') COLLATE "C", COALESCE(prd_cbo, \'\') COLLATE "C", '
+            'COALESCE(prd_dtaten, \'\') COLLATE "C", id'
+        ),
+        ('bpa_consolidado', 'id'): 'id',
+        ('bpa_consolidado', 'cbo'): 'COALESCE(prd_cbo, \'\') COLLATE "C", id',
+    }
+
+    def iter_bpa_for_report(self, tabela: str, cnes: str, competencia: str, ordem: str = 'id',
+                            chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[List[Dict]]:
+        """
+        Registros de uma competência em blocos (cursor server-side), para os
+        relatórios/remessa do BPA Magnético
+
+        Args:
+            tabela: 'bpa_individualizado' ou 'bpa_consolidado'
+            ordem: 'id'; 'profissional' (BPA-I: CNS, CBO, data de atendimento)
+                ou 'cbo' (BPA-C)
+        """
+        order_by = self.REPORT_ORDERS.get((tabela, ordem))
+        if order_by is None:
+            raise ValueError(f"Ordenação inválida para {tabela}: {ordem}")
+        query = f"SELECT * FROM {tabela} WHERE prd_uid = %s AND prd_cmp = %s ORDER BY {order_by}"
+        return self._iter_export_chunks(f'report_{tabela}', query, [cnes, competencia], chunk_size)
+
     def save_exportacao(self, data: Dict) -> int:
         """Registra uma exportação"""
         with get_connection() as conn:
@@ -1171,6 +2205,185 @@ class BPADatabase:
                 conn.commit()
                 return {'updated': updated, 'had_sigtap': bool(procs_map)}
 
+    # ========== JOBS EM BACKGROUND ==========
+
+    def create_job(self, job_id: str, tipo: str, params: Dict, usuario_id: int = None) -> Dict:
+        """Registra um job pendente"""
+        with get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute('''
+                    INSERT INTO jobs (id, tipo, status, params, usuario_id, message)
+                    VALUES (%s, %s, 'pending', %s, %s, 'Aguardando execução')
+                    RETURNING *
+                ''', (job_id, tipo, json.dumps(params, default=str), usuario_id))
+                row = cursor.fetchone()
+                conn.commit()
+                return dict(row)
+
+    def start_job(self, job_id: str, worker_id: str = None) -> bool:
+        """
+        Marca job como em execução por `worker_id` (False se foi cancelado
+        antes de começar ou se outro worker já o assumiu)
+        """
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute('''
+                    UPDATE jobs SET status = 'running', started_at = CURRENT_TIMESTAMP,
+                        updated_at = CURRENT_TIMESTAMP, message = 'Em execução',
+                        worker_id = %s, heartbeat_at = CURRENT_TIMESTAMP
+                    WHERE id = %s AND status = 'pending' AND NOT cancel_requested
+                ''', (worker_id, job_id))
+                started = cursor.rowcount == 1
+                conn.commit()
+                return started
+
+    def update_job_progress(self, job_id: str, current: int, total: int = None,
+                            message: str = None) -> bool:
+        """
+        Atualiza progresso do job.
+
+        Returns:
+            True se o cancelamento foi solicitado (lido na mesma consulta)
+        """
+        progress = min(100, int(current * 100 / total)) if total else None
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute('''
+                    UPDATE jobs SET current = %s, total = %s,
+                        progress = COALESCE(%s, progress),
+                        message = COALESCE(%s, message),
+                        updated_at = CURRENT_TIMESTAMP, heartbeat_at = CURRENT_TIMESTAMP
+                    WHERE id = %s
+                    RETURNING cancel_requested
+                ''', (current, total, progress, message, job_id))
+                row = cursor.fetchone()
+                conn.commit()
+                return bool(row and row[0])
+
+    def finish_job(self, job_id: str, status: str, result: Any = None,
+                   error: str = None, message: str = None):
+        """Finaliza job (completed, error ou cancelled)"""
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute('''
+                    UPDATE jobs SET status = %s, result = %s, error = %s,
+                        message = COALESCE(%s, message),
+                        progress = CASE WHEN %s = 'completed' THEN 100 ELSE progress END,
+                        finished_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+                    WHERE id = %s
+                ''', (
+                    status,
+                    json.dumps(result, default=str) if result is not None else None,
+                    error, message, status, job_id
+                ))
+                conn.commit()
+
+    def request_job_cancel(self, job_id: str) -> Optional[str]:
+        """
+        Solicita cancelamento. Jobs pendentes são cancelados na hora;
+        jobs em execução param no próximo ponto de progresso.
+
+        Returns:
+            Status resultante ou None se o job não existe
+        """
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute('''
+                    UPDATE jobs SET cancel_requested = TRUE,
+                        status = CASE WHEN status = 'pending' THEN 'cancelled' ELSE status END,
+                        finished_at = CASE WHEN status = 'pending' THEN CURRENT_TIMESTAMP ELSE finished_at END,
+                        updated_at = CURRENT_TIMESTAMP
+                    WHERE id = %s
+                    RETURNING status
+                ''', (job_id,))
+                row = cursor.fetchone()
+                conn.commit()
+                return row[0] if row else None
+
+    def get_job(self, job_id: str, include_result: bool = True) -> Optional[Dict]:
+        """Busca job pelo ID"""
+        columns = '*' if include_result else '''
+            id, tipo, status, params, progress, current, total, message, error,
+            cancel_requested, usuario_id, created_at, started_at, finished_at, updated_at
+        '''
+        with get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(f"SELECT {columns} FROM jobs WHERE id = %s", (job_id,))
+                row = cursor.fetchone()
+                return dict(row) if row else None
+
+    def list_jobs(self, usuario_id: int = None, status: str = None, limit: int = 50) -> List[Dict]:
+        """Lista jobs mais recentes (sem o resultado)"""
+        where = []
+        params: List[Any] = []
+        if usuario_id is not None:
+            where.append("usuario_id = %s")
+            params.append(usuario_id)
+        if status:
+            where.append("status = %s")
+            params.append(status)
+        where_clause = f"WHERE {' AND '.join(where)}" if where else ""
+        params.append(limit)
+
+        with get_connection() as conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(f'''
+                    SELECT id, tipo, status, params, progress, current, total, message, error,
+                        cancel_requested, usuario_id, created_at, started_at, finished_at, updated_at
+                    FROM jobs {where_clause}
+                    ORDER BY created_at DESC
+                    LIMIT %s
+                ''', params)
+                return [dict(row) for row in cursor.fetchall()]
+
+    def heartbeat_jobs(self, worker_id: str) -> int:
+        """Renova o batimento dos jobs em execução neste worker; retorna quantos"""
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute('''
+                    UPDATE jobs SET heartbeat_at = CURRENT_TIMESTAMP
+                    WHERE worker_id = %s AND status = 'running'
+                ''', (worker_id,))
+                updated = cursor.rowcount
+                conn.commit()
+                return updated
+
+    def fail_stale_jobs(self, stale_seconds: int) -> List[str]:
+        """
+        Marca como erro os jobs 'running' sem batimento há `stale_seconds`
+        (o worker dono morreu). Jobs de workers vivos não são tocados.
+        """
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute('''
+                    UPDATE jobs SET status = 'error', error = 'Interrompido: worker parou de responder',
+                        finished_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+                    WHERE status = 'running'
+                      AND COALESCE(heartbeat_at, updated_at) < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                    RETURNING id
+                ''', (stale_seconds,))
+                interrupted = [row[0] for row in cursor.fetchall()]
+                conn.commit()
+                return interrupted
+
+    def reset_interrupted_jobs(self, stale_seconds: int) -> Dict[str, List[str]]:
+        """
+        Ao iniciar o processo: jobs 'running' sem batimento recente ficaram
+        órfãos (erro) e jobs 'pending' devem ser reenfileirados.
+        """
+        interrupted = self.fail_stale_jobs(stale_seconds)
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(
+                    "SELECT id FROM jobs WHERE status = 'pending' ORDER BY created_at"
+                )
+                pending = [row[0] for row in cursor.fetchall()]
+                return {'interrupted': interrupted, 'pending': pending}
+
+
+# Latência e linhas por método em /metrics
+instrumentar_metodos(BPADatabase)
+
 
 # Flag para garantir inicialização única
 _db_initialized = False
@@ -6,8 +6,9 @@ Inclui correções automáticas baseadas nos scripts SQL do BPA-main
 import os
 import unicodedata
 import re
+from array import array
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import List, Dict, Iterator, Optional
 from database import BPADatabase
 from services.corrections import BPACorrections
 from constants.estabelecimentos import get_nome_estabelecimento
@@ -73,6 +74,15 @@ class FirebirdExporter:
         'prd_qt_p': 'quantidade',
     }
     
+    # Largura reservada para totais preenchidos ao final da exportação
+    TOTAL_WIDTH = 12
+    
+    # Buffer de escrita dos arquivos SQL
+    WRITE_BUFFER = 1024 * 1024
+    
+    # IDs marcados como exportados por UPDATE
+    MARK_EXPORTED_BATCH = 10000
+    
     def __init__(self, output_dir: str = None, cnes: str = None):
         self.db = BPADatabase()
         self.output_dir = output_dir or os.path.join(os.path.dirname(__file__), 'exports')
@@ -155,12 +165,60 @@ class FirebirdExporter:
             return 'NULL'
         return str(value)
     
+    def _write_total(self, f, prefixo: str, valor: Optional[int], sufixo: str = '') -> Optional[int]:
+        """
+        Escreve uma linha de total; com valor None reserva espaço fixo e devolve
+        a posição para preencher depois (exportação em streaming)
+        """
+        if valor is not None:
+            f.write(f"{prefixo}{valor}{sufixo}\n")
+            return None
+        f.write(prefixo)
+        posicao = f.tell()
+        f.write(' ' * (self.TOTAL_WIDTH + len(sufixo)) + '\n')
+        return posicao
+    
+    def _backfill_total(self, f, posicao: Optional[int], valor: int, sufixo: str = ''):
+        """Preenche um total reservado por _write_total (mesma largura)"""
+        if posicao is None:
+            return
+        fim = f.tell()
+        f.seek(posicao)
+        f.write(f"{valor}{sufixo}".ljust(self.TOTAL_WIDTH + len(sufixo)))
+        f.seek(fim)
+    
+    def write_correction_stats(self, f, correction_stats: Optional[dict]):
+        """Bloco de comentários com as estatísticas de correção"""
+        if not correction_stats:
+            return
+        # Estatísticas de correção (usa remove_accents para compatibilidade)
+        f.write(f"-- \n")
+        f.write(f"-- === CORRECOES APLICADAS AUTOMATICAMENTE ===\n")
+        f.write(f"-- Registros originais: {correction_stats.get('total_input', 0)}\n")
+        f.write(f"-- Registros excluidos: {correction_stats.get('deleted', 0)}\n")
+        f.write(f"-- Registros corrigidos: {correction_stats.get('corrected', 0)}\n")
+        
+        if correction_stats.get('delete_reasons'):
+            f.write(f"-- \n")
+            f.write(f"-- Motivos de exclusao:\n")
+            for reason, count in correction_stats['delete_reasons'].items():
+                f.write(f"--   - {remove_accents(reason)}: {count}\n")
+        
+        if correction_stats.get('correction_types'):
+            f.write(f"-- \n")
+            f.write(f"-- Correcoes aplicadas:\n")
+            for ctype, count in correction_stats['correction_types'].items():
+                f.write(f"--   - {remove_accents(ctype)}: {count}\n")
+    
     def generate_sql_header(self, f, cnes: str, competencia: str, 
-                           tipo: str, total: int, correction_stats: dict = None,
-                           bpai_count: int = 0, bpac_count: int = 0):
+                           tipo: str, total: Optional[int], correction_stats: dict = None,
+                           bpai_count: Optional[int] = 0, bpac_count: Optional[int] = 0) -> Dict[str, Optional[int]]:
         """
         Gera o cabeçalho SQL completo com todos objetos necessários
         Inclui: Generator, Trigger e instruções
+        
+        Totais None ficam reservados e são preenchidos ao final
+        (_backfill_total); as posições reservadas são retornadas.
         """
         # Cabeçalho informativo (sem acentos para compatibilidade latin-1)
         f.write(f"-- ============================================================\n")
@@ -170,31 +228,14 @@ class FirebirdExporter:
         f.write(f"-- Competencia: {competencia}\n")
         f.write(f"-- Data de exportacao: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}\n")
         
+        posicoes = {}
         if tipo == 'COMPLETO':
-            f.write(f"-- BPA-I: {bpai_count} registros\n")
-            f.write(f"-- BPA-C: {bpac_count} registros\n")
+            posicoes['bpai'] = self._write_total(f, "-- BPA-I: ", bpai_count, " registros")
+            posicoes['bpac'] = self._write_total(f, "-- BPA-C: ", bpac_count, " registros")
         
-        f.write(f"-- Total de registros: {total}\n")
+        posicoes['total'] = self._write_total(f, "-- Total de registros: ", total)
         
-        # Estatísticas de correção (usa remove_accents para compatibilidade)
-        if correction_stats:
-            f.write(f"-- \n")
-            f.write(f"-- === CORRECOES APLICADAS AUTOMATICAMENTE ===\n")
-            f.write(f"-- Registros originais: {correction_stats.get('total_input', 0)}\n")
-            f.write(f"-- Registros excluidos: {correction_stats.get('deleted', 0)}\n")
-            f.write(f"-- Registros corrigidos: {correction_stats.get('corrected', 0)}\n")
-            
-            if correction_stats.get('delete_reasons'):
-                f.write(f"-- \n")
-                f.write(f"-- Motivos de exclusao:\n")
-                for reason, count in correction_stats['delete_reasons'].items():
-                    f.write(f"--   - {remove_accents(reason)}: {count}\n")
-            
-            if correction_stats.get('correction_types'):
-                f.write(f"-- \n")
-                f.write(f"-- Correcoes aplicadas:\n")
-                for ctype, count in correction_stats['correction_types'].items():
-                    f.write(f"--   - {remove_accents(ctype)}: {count}\n")
+        self.write_correction_stats(f, correction_stats)
         
         f.write(f"-- \n")
         f.write(f"-- ============================================================\n")
@@ -233,6 +274,7 @@ class FirebirdExporter:
         f.write("-- ============================================================\n")
         f.write("-- INICIO DOS REGISTROS\n")
         f.write("-- ============================================================\n\n")
+        return posicoes
     
     def generate_bpai_insert(self, record: Dict) -> str:
         """Gera INSERT para um registro BPA-I"""
@@ -310,12 +352,64 @@ class FirebirdExporter:
 );"""
         return sql
     
+    def _stream_bpai(self, cnes: str, competencia: str, exportado: Optional[bool],
+                     aplicar_correcoes: bool, stats: Dict) -> Iterator[Dict]:
+        """
+        BPA-I mapeado, corrigido e sequenciado, lido do banco bloco a bloco
+        
+        O banco entrega os registros já na ordem de assign_sequence_bpi, então
+        a numeração de folha/sequência continua de um bloco para o outro.
+        `stats` acumula as estatísticas de correção (formato de process_batch).
+        """
+        revogados = self.corrections.PROCEDIMENTOS_REVOGADOS if aplicar_correcoes else None
+        estado = None
+        for chunk in self.db.iter_bpai_for_export(cnes, competencia, exportado, revogados):
+            records = [self.map_record(r, self.FIELD_MAP_BPAI) for r in chunk]
+            if aplicar_correcoes:
+                records, chunk_stats = self.corrections.process_batch(records, 'BPI')
+                BPACorrections.merge_stats(stats, chunk_stats)
+            else:
+                stats['total_input'] += len(records)
+                stats['total_output'] += len(records)
+            estado = self.corrections.sequence_bpi(records, estado)
+            yield from records
+    
+    def _stream_bpac(self, cnes: str, competencia: str, aplicar_correcoes: bool,
+                     stats: Dict, sequenciar: bool) -> Iterator[Dict]:
+        """BPA-C mapeado (e opcionalmente corrigido/sequenciado) bloco a bloco"""
+        estado = None
+        for chunk in self.db.iter_bpac_for_export(cnes, competencia):
+            records = [self.map_record(r, self.FIELD_MAP_BPAC) for r in chunk]
+            if aplicar_correcoes:
+                records, chunk_stats = self.corrections.process_batch(records, 'BPA')
+                BPACorrections.merge_stats(stats, chunk_stats)
+            else:
+                stats['total_input'] += len(records)
+                stats['total_output'] += len(records)
+            if sequenciar:
+                estado = self.corrections.sequence_bpa(records, estado)
+            yield from records
+    
+    def _mark_exported_bpai(self, ids: array):
+        """Marca os BPA-I exportados em lotes de UPDATE"""
+        for start in range(0, len(ids), self.MARK_EXPORTED_BATCH):
+            self.db.mark_exported_bpai(ids[start:start + self.MARK_EXPORTED_BATCH].tolist())
+    
+    def _remove_partial(self, filepath: str):
+        if os.path.exists(filepath):
+            os.remove(filepath)
+    
     def export_bpai(self, cnes: str, competencia: str, 
                     apenas_nao_exportados: bool = True,
                     aplicar_correcoes: bool = True) -> Dict:
         """
         Exporta BPA-I para arquivo SQL
         
+        Lê o banco com cursor server-side e escreve cada bloco assim que é
+        corrigido: a memória não cresce com o tamanho da competência. O total
+        do cabeçalho é preenchido ao final e as estatísticas de correção vão
+        no resumo do fim do arquivo.
+        
         Args:
             cnes: Código CNES
             competencia: Competência (YYYYMM)
@@ -329,99 +423,127 @@ class FirebirdExporter:
         # Atualiza correções com o CNES atual
         self.corrections = BPACorrections(cnes)
         
-        # Busca registros
         exportado_filter = False if apenas_nao_exportados else None
-        print(f"[EXPORT] Buscando BPA-I: cnes={cnes}, comp={competencia}, apenas_nao_exportados={apenas_nao_exportados}, exportado_filter={exportado_filter}")
-        raw_records = self.db.list_bpa_individualizado(cnes, competencia, exportado_filter)
-        print(f"[EXPORT] Encontrados {len(raw_records) if raw_records else 0} registros brutos")
-        
-        if not raw_records:
-            return {
-                'status': 'warning',
-                'message': 'Nenhum registro encontrado para exportação',
-                'total': 0,
-                'filename': None
-            }
-        
-        # Mapeia campos do banco para formato snake_case
-        records = [self.map_record(r, self.FIELD_MAP_BPAI) for r in raw_records]
-        
-        # Aplica correções se habilitado
-        correction_stats = None
-        if aplicar_correcoes:
-            print(f"[EXPORT] Aplicando correções em {len(records)} registros...")
-            records, correction_stats = self.corrections.process_batch(records, 'BPI')
-            print(f"[EXPORT] Após correções: {len(records)} registros restantes")
-            if correction_stats:
-                print(f"[EXPORT] Stats: corrigidos={correction_stats.get('corrected', 0)}, excluídos={correction_stats.get('deleted', 0)}")
-                if correction_stats.get('delete_reasons'):
-                    for reason, count in correction_stats['delete_reasons'].items():
-                        print(f"[EXPORT]   - {reason}: {count}")
-            
-            if not records:
-                return {
-                    'status': 'warning',
-                    'message': 'Todos os registros foram excluídos após correções',
-                    'total': 0,
-                    'filename': None,
-                    'correction_stats': correction_stats
-                }
-        
-        # Aplica sequenciamento (folha/sequência)
-        records = self.corrections.assign_sequence_bpi(records)
+        print(f"[EXPORT] Exportando BPA-I em streaming: cnes={cnes}, comp={competencia}, apenas_nao_exportados={apenas_nao_exportados}, exportado_filter={exportado_filter}")
         
-        # Gera arquivo SQL
         unit_name = self.get_unit_name(cnes)
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f'BPA_I_{cnes}_{unit_name}_{competencia}_{timestamp}.sql'
         filepath = os.path.join(self.output_dir, filename)
         
-        with open(filepath, 'w', encoding='latin-1') as f:
-            # Cabeçalho completo com Generator e Trigger
-            self.generate_sql_header(f, cnes, competencia, 'BPA-I', len(records), correction_stats)
-            
-            # INSERTs
-            for i, record in enumerate(records, 1):
-                f.write(f"-- Registro {i}/{len(records)}\n")
-                f.write(self.generate_bpai_insert(record))
-                f.write("\n\n")
-            
-            # Finaliza
-            f.write("SET TERM ; ^\n")
-            f.write("\nCOMMIT;\n")
-            f.write(f"\n-- ============================================================\n")
-            f.write(f"-- FIM DA EXPORTACAO: {len(records)} registros importados\n")
-            f.write(f"-- ============================================================\n")
+        stats = BPACorrections.empty_stats()
+        ids = array('q')
+        total = 0
+        try:
+            with open(filepath, 'w', encoding='latin-1', buffering=self.WRITE_BUFFER) as f:
+                # Cabeçalho completo com Generator e Trigger (total preenchido ao final)
+                posicoes = self.generate_sql_header(f, cnes, competencia, 'BPA-I', None)
+                
+                # INSERTs
+                for record in self._stream_bpai(cnes, competencia, exportado_filter, aplicar_correcoes, stats):
+                    total += 1
+                    f.write(f"-- Registro {total}\n")
+                    f.write(self.generate_bpai_insert(record))
+                    f.write("\n\n")
+                    if record.get('id') is not None:
+                        ids.append(record['id'])
+                
+                # Finaliza
+                f.write("SET TERM ; ^\n")
+                f.write("\nCOMMIT;\n")
+                self.write_correction_stats(f, stats if aplicar_correcoes else None)
+                f.write(f"\n-- ============================================================\n")
+                f.write(f"-- FIM DA EXPORTACAO: {total} registros importados\n")
+                f.write(f"-- ============================================================\n")
+                self._backfill_total(f, posicoes['total'], total)
+        except Exception:
+            self._remove_partial(filepath)
+            raise
+        
+        correction_stats = stats if aplicar_correcoes else None
+        print(f"[EXPORT] Lidos {stats['total_input']} registros, exportados {total}")
+        if correction_stats:
+            print(f"[EXPORT] Stats: corrigidos={correction_stats.get('corrected', 0)}, excluídos={correction_stats.get('deleted', 0)}")
+            if correction_stats.get('delete_reasons'):
+                for reason, count in correction_stats['delete_reasons'].items():
+                    print(f"[EXPORT]   - {reason}: {count}")
+        
+        if total == 0:
+            self._remove_partial(filepath)
+            if not stats['total_input']:
+                return {
+                    'status': 'warning',
+                    'message': 'Nenhum registro encontrado para exportação',
+                    'total': 0,
+                    'filename': None
+                }
+            return {
+                'status': 'warning',
+                'message': 'Todos os registros foram excluídos após correções',
+                'total': 0,
+                'filename': None,
+                'correction_stats': correction_stats
+            }
         
         # Marca registros como exportados
-        ids = [r['id'] for r in records if 'id' in r]
         if ids:
-            self.db.mark_exported_bpai(ids)
+            self._mark_exported_bpai(ids)
         
         result = {
             'status': 'success',
-            'message': f'Exportados {len(records)} registros',
-            'total': len(records),
+            'message': f'Exportados {total} registros',
+            'total': total,
             'filename': filename,
             'filepath': filepath
         }
         
         if correction_stats:
             result['correction_stats'] = correction_stats
-            result['message'] = f"Exportados {len(records)} registros ({correction_stats['corrected']} corrigidos, {correction_stats['deleted']} excluídos)"
+            result['message'] = f"Exportados {total} registros ({correction_stats['corrected']} corrigidos, {correction_stats['deleted']} excluídos)"
         
         return result
     
     def export_bpac(self, cnes: str, competencia: str,
                     aplicar_correcoes: bool = True) -> Dict:
-        """Exporta BPA-C para arquivo SQL"""
+        """Exporta BPA-C para arquivo SQL (streaming, total preenchido ao final)"""
         
         # Atualiza correções com o CNES atual
         self.corrections = BPACorrections(cnes)
         
-        raw_records = self.db.list_bpa_consolidado(cnes, competencia)
+        unit_name = self.get_unit_name(cnes)
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        filename = f'BPA_C_{cnes}_{unit_name}_{competencia}_{timestamp}.sql'
+        filepath = os.path.join(self.output_dir, filename)
+        
+        # Como antes, o BPA-C sai sem correções nem resequenciamento
+        stats = BPACorrections.empty_stats()
+        total = 0
+        try:
+            with open(filepath, 'w', encoding='latin-1', buffering=self.WRITE_BUFFER) as f:
+                f.write(f"-- BPA Consolidado - Exportacao\n")
+                f.write(f"-- CNES: {cnes}\n")
+                f.write(f"-- Competencia: {competencia}\n")
+                f.write(f"-- Data: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}\n")
+                posicao_total = self._write_total(f, "-- Total: ", None)
+                f.write("\n")
+                
+                f.write("SET TERM ^ ;\n\n")
+                
+                for record in self._stream_bpac(cnes, competencia, False, stats, sequenciar=False):
+                    total += 1
+                    f.write(f"-- Registro {total}\n")
+                    f.write(self.generate_bpac_insert(record))
+                    f.write("\n\n")
+                
+                f.write("SET TERM ; ^\n")
+                f.write("\nCOMMIT;\n")
+                self._backfill_total(f, posicao_total, total)
+        except Exception:
+            self._remove_partial(filepath)
+            raise
         
-        if not raw_records:
+        if total == 0:
+            self._remove_partial(filepath)
             return {
                 'status': 'warning',
                 'message': 'Nenhum registro BPA-C encontrado',
@@ -429,160 +551,119 @@ class FirebirdExporter:
                 'filename': None
             }
         
-        # Mapeia campos do banco para formato snake_case
-        records = [self.map_record(r, self.FIELD_MAP_BPAC) for r in raw_records]
-        
-        unit_name = self.get_unit_name(cnes)
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f'BPA_C_{cnes}_{unit_name}_{competencia}_{timestamp}.sql'
-        filepath = os.path.join(self.output_dir, filename)
-        
-        with open(filepath, 'w', encoding='latin-1') as f:
-            f.write(f"-- BPA Consolidado - Exportacao\n")
-            f.write(f"-- CNES: {cnes}\n")
-            f.write(f"-- Competencia: {competencia}\n")
-            f.write(f"-- Data: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}\n")
-            f.write(f"-- Total: {len(records)}\n\n")
-            
-            f.write("SET TERM ^ ;\n\n")
-            
-            for i, record in enumerate(records, 1):
-                f.write(f"-- Registro {i}\n")
-                f.write(self.generate_bpac_insert(record))
-                f.write("\n\n")
-            
-            f.write("SET TERM ; ^\n")
-            f.write("\nCOMMIT;\n")
-        
         return {
             'status': 'success',
-            'message': f'Exportados {len(records)} registros BPA-C',
-            'total': len(records),
+            'message': f'Exportados {total} registros BPA-C',
+            'total': total,
             'filename': filename,
             'filepath': filepath
         }
     
     def export_all(self, cnes: str, competencia: str,
                    aplicar_correcoes: bool = True) -> Dict:
-        """Exporta BPA-I e BPA-C em um único arquivo com correções"""
+        """
+        Exporta BPA-I e BPA-C em um único arquivo com correções
+        
+        Streaming como export_bpai: contagens do cabeçalho preenchidas ao final,
+        estatísticas de correção no resumo do fim do arquivo.
+        """
         
         # Atualiza correções com o CNES atual
         self.corrections = BPACorrections(cnes)
         
-        raw_bpai = self.db.list_bpa_individualizado(cnes, competencia, False)
-        raw_bpac = self.db.list_bpa_consolidado(cnes, competencia)
-        
-        # Mapeia campos do banco para formato snake_case
-        bpai_records = [self.map_record(r, self.FIELD_MAP_BPAI) for r in raw_bpai] if raw_bpai else []
-        bpac_records = [self.map_record(r, self.FIELD_MAP_BPAC) for r in raw_bpac] if raw_bpac else []
-        
-        # Aplica correções aos registros
-        bpai_stats = None
-        bpac_stats = None
-        
-        if aplicar_correcoes:
-            if bpai_records:
-                bpai_records, bpai_stats = self.corrections.process_batch(bpai_records, 'BPI')
-            if bpac_records:
-                bpac_records, bpac_stats = self.corrections.process_batch(bpac_records, 'BPA')
-        
-        # Aplica sequenciamento (folha/sequência)
-        if bpai_records:
-            bpai_records = self.corrections.assign_sequence_bpi(bpai_records)
-        if bpac_records:
-            bpac_records = self.corrections.assign_sequence_bpa(bpac_records)
-        
-        total = len(bpai_records) + len(bpac_records)
-        
-        if total == 0:
-            return {
-                'status': 'warning',
-                'message': 'Nenhum registro encontrado',
-                'total': 0,
-                'filename': None
-            }
-        
         unit_name = self.get_unit_name(cnes)
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f'BPA_COMPLETO_{cnes}_{unit_name}_{competencia}_{timestamp}.sql'
         filepath = os.path.join(self.output_dir, filename)
         
-        # Combina estatísticas para o header
-        combined_stats = None
-        if bpai_stats or bpac_stats:
-            combined_stats = {
-                'total_input': (bpai_stats.get('total_input', 0) if bpai_stats else 0) + 
-                               (bpac_stats.get('total_input', 0) if bpac_stats else 0),
-                'deleted': (bpai_stats.get('deleted', 0) if bpai_stats else 0) + 
-                           (bpac_stats.get('deleted', 0) if bpac_stats else 0),
-                'corrected': (bpai_stats.get('corrected', 0) if bpai_stats else 0) + 
-                             (bpac_stats.get('corrected', 0) if bpac_stats else 0),
-                'delete_reasons': {},
-                'correction_types': {}
-            }
-            # Combina motivos de exclusão
-            for stats in [bpai_stats, bpac_stats]:
-                if stats and stats.get('delete_reasons'):
-                    for reason, count in stats['delete_reasons'].items():
-                        combined_stats['delete_reasons'][reason] = combined_stats['delete_reasons'].get(reason, 0) + count
-                if stats and stats.get('correction_types'):
-                    for ctype, count in stats['correction_types'].items():
-                        combined_stats['correction_types'][ctype] = combined_stats['correction_types'].get(ctype, 0) + count
-        
-        with open(filepath, 'w', encoding='latin-1') as f:
-            # Cabeçalho completo com Generator e Trigger
-            self.generate_sql_header(f, cnes, competencia, 'COMPLETO', total, combined_stats,
-                                    bpai_count=len(bpai_records), bpac_count=len(bpac_records))
-            
-            # BPA-I
-            if bpai_records:
-                f.write("-- ========== BPA INDIVIDUALIZADO ==========\n\n")
-                for i, record in enumerate(bpai_records, 1):
-                    f.write(f"-- BPA-I #{i}\n")
+        bpai_stats = BPACorrections.empty_stats()
+        bpac_stats = BPACorrections.empty_stats()
+        ids = array('q')
+        bpai_count = 0
+        bpac_count = 0
+        try:
+            with open(filepath, 'w', encoding='latin-1', buffering=self.WRITE_BUFFER) as f:
+                # Cabeçalho completo com Generator e Trigger (contagens preenchidas ao final)
+                posicoes = self.generate_sql_header(f, cnes, competencia, 'COMPLETO', None,
+                                                    bpai_count=None, bpac_count=None)
+                
+                # BPA-I
+                for record in self._stream_bpai(cnes, competencia, False, aplicar_correcoes, bpai_stats):
+                    if bpai_count == 0:
+                        f.write("-- ========== BPA INDIVIDUALIZADO ==========\n\n")
+                    bpai_count += 1
+                    f.write(f"-- BPA-I #{bpai_count}\n")
                     f.write(self.generate_bpai_insert(record))
                     f.write("\n\n")
-            
-            # BPA-C
-            if bpac_records:
-                f.write("-- ========== BPA CONSOLIDADO ==========\n\n")
-                for i, record in enumerate(bpac_records, 1):
-                    f.write(f"-- BPA-C #{i}\n")
+                    if record.get('id') is not None:
+                        ids.append(record['id'])
+                
+                # BPA-C
+                for record in self._stream_bpac(cnes, competencia, aplicar_correcoes, bpac_stats, sequenciar=True):
+                    if bpac_count == 0:
+                        f.write("-- ========== BPA CONSOLIDADO ==========\n\n")
+                    bpac_count += 1
+                    f.write(f"-- BPA-C #{bpac_count}\n")
                     f.write(self.generate_bpac_insert(record))
                     f.write("\n\n")
-            
-            # Footer
-            f.write("SET TERM ; ^\n\n")
-            f.write("-- ============================================================\n")
-            f.write(f"-- RESUMO DA IMPORTACAO\n")
-            f.write("-- ============================================================\n")
-            f.write(f"-- Total de registros: {total}\n")
-            f.write(f"--   - BPA-I: {len(bpai_records)}\n")
-            f.write(f"--   - BPA-C: {len(bpac_records)}\n")
-            f.write("-- \n")
-            f.write("-- IMPORTANTE: Execute este script no Firebird com:\n")
-            f.write("-- isql -u SYSDBA -p masterkey BPAMAG.GDB < arquivo.sql\n")
-            f.write("-- ============================================================\n\n")
-            f.write("COMMIT;\n")
+                
+                total = bpai_count + bpac_count
+                
+                # Combina estatísticas para o resumo
+                combined_stats = None
+                if aplicar_correcoes and (bpai_stats['total_input'] or bpac_stats['total_input']):
+                    combined_stats = BPACorrections.merge_stats(
+                        BPACorrections.merge_stats(BPACorrections.empty_stats(), bpai_stats), bpac_stats
+                    )
+                
+                # Footer
+                f.write("SET TERM ; ^\n\n")
+                f.write("-- ============================================================\n")
+                f.write(f"-- RESUMO DA IMPORTACAO\n")
+                f.write("-- ============================================================\n")
+                f.write(f"-- Total de registros: {total}\n")
+                f.write(f"--   - BPA-I: {bpai_count}\n")
+                f.write(f"--   - BPA-C: {bpac_count}\n")
+                self.write_correction_stats(f, combined_stats)
+                f.write("-- \n")
+                f.write("-- IMPORTANTE: Execute este script no Firebird com:\n")
+                f.write("-- isql -u SYSDBA -p masterkey BPAMAG.GDB < arquivo.sql\n")
+                f.write("-- ============================================================\n\n")
+                f.write("COMMIT;\n")
+                
+                self._backfill_total(f, posicoes['bpai'], bpai_count, " registros")
+                self._backfill_total(f, posicoes['bpac'], bpac_count, " registros")
+                self._backfill_total(f, posicoes['total'], total)
+        except Exception:
+            self._remove_partial(filepath)
+            raise
+        
+        if total == 0:
+            self._remove_partial(filepath)
+            return {
+                'status': 'warning',
+                'message': 'Nenhum registro encontrado',
+                'total': 0,
+                'filename': None
+            }
         
         # Marca BPA-I como exportados
-        if bpai_records:
-            ids = [r['id'] for r in bpai_records if 'id' in r]
-            if ids:
-                self.db.mark_exported_bpai(ids)
+        if ids:
+            self._mark_exported_bpai(ids)
         
         result = {
             'status': 'success',
-            'message': f'Exportados {len(bpai_records)} BPA-I + {len(bpac_records)} BPA-C',
+            'message': f'Exportados {bpai_count} BPA-I + {bpac_count} BPA-C',
             'total': total,
-            'bpai_count': len(bpai_records),
-            'bpac_count': len(bpac_records),
+            'bpai_count': bpai_count,
+            'bpac_count': bpac_count,
             'filename': filename,
             'filepath': filepath
         }
         
-        if bpai_stats:
+        if aplicar_correcoes and bpai_stats['total_input']:
             result['bpai_stats'] = bpai_stats
-        if bpac_stats:
+        if aplicar_correcoes and bpac_stats['total_input']:
             result['bpac_stats'] = bpac_stats
         
         return result
@@ -6,6 +6,8 @@ from pathlib import Path
 import psycopg2
 from psycopg2.extras import execute_batch
 from services.sigtap_parser import SigtapParser
+from services.sigtap_precos import carregar_precos
+from database import SIGTAP_PRECO_SQL
 import os
 from dotenv import load_dotenv
 
@@ -35,6 +37,7 @@ def create_tables(conn):
     
     with conn.cursor() as cur:
         cur.execute(sql)
+        cur.execute(SIGTAP_PRECO_SQL)
     
     conn.commit()
     print("✓ Tabelas criadas com sucesso")
@@ -236,6 +239,13 @@ def main():
         import_procedimento_registro(conn, parser)
         print()
         
+        # Versão de preços da competência (dashboard financeiro)
+        competencia = parser.parse_procedimentos()[0]['DT_COMPETENCIA']
+        print(f"Carregando preços da competência {competencia}...")
+        totais = carregar_precos(conn, parser, competencia)
+        print(f"✓ {totais['procedimentos']} preços carregados")
+        print()
+        
         print("=" * 60)
         print("✓ IMPORTAÇÃO CONCLUÍDA COM SUCESSO!")
         print("=" * 60)
@@ -64,16 +64,22 @@ CREATE TABLE IF NOT EXISTS pacientes (
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Recuperação por nome + nascimento (mesma expressão de get_paciente_by_nome_nascimento)
+CREATE INDEX IF NOT EXISTS idx_pacientes_nome_nascimento ON pacientes((UPPER(TRIM(nome))), data_nascimento);
+
 -- ===========================================
 -- TABELA BPA INDIVIDUALIZADO (PRD_* - Firebird)
 -- ===========================================
 
+-- Particionada por competência (uma partição por mês, criada pela API na
+-- primeira gravação do mês: bpa_garantir_particao em database.py)
+CREATE SEQUENCE IF NOT EXISTS bpa_individualizado_id_seq;
 CREATE TABLE IF NOT EXISTS bpa_individualizado (
-    id SERIAL PRIMARY KEY,
+    id INTEGER NOT NULL DEFAULT nextval('bpa_individualizado_id_seq'),
     
     -- Identificação (PRD_*)
     prd_uid VARCHAR(7),           -- CNES
-    prd_cmp VARCHAR(6),           -- Competência
+    prd_cmp VARCHAR(6) NOT NULL,  -- Competência
     prd_flh INTEGER DEFAULT 1,    -- Folha (sempre 1)
     prd_seq INTEGER DEFAULT 1,    -- Sequência
     
@@ -135,26 +141,27 @@ CREATE TABLE IF NOT EXISTS bpa_individualizado (
     prd_exportado BOOLEAN DEFAULT FALSE,       -- Exportado
     data_exportacao TIMESTAMP,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, prd_cmp)
+) PARTITION BY LIST (prd_cmp);
+ALTER SEQUENCE bpa_individualizado_id_seq OWNED BY bpa_individualizado.id;
 
--- Índices para BPA-I
-CREATE INDEX IF NOT EXISTS idx_bpai_uid ON bpa_individualizado(prd_uid);
-CREATE INDEX IF NOT EXISTS idx_bpai_cmp ON bpa_individualizado(prd_cmp);
-CREATE INDEX IF NOT EXISTS idx_bpai_uid_cmp ON bpa_individualizado(prd_uid, prd_cmp);
-CREATE INDEX IF NOT EXISTS idx_bpai_exportado ON bpa_individualizado(prd_exportado);
+-- Índices para BPA-I (mesmos de INDICES_CONSULTAS em database.py)
+CREATE INDEX IF NOT EXISTS idx_bpai_uid_cmp_exportado ON bpa_individualizado(prd_uid, prd_cmp, prd_exportado);
+CREATE INDEX IF NOT EXISTS idx_bpai_uid_id ON bpa_individualizado(prd_uid, id);
 CREATE INDEX IF NOT EXISTS idx_bpai_cnspac ON bpa_individualizado(prd_cnspac);
 
 -- ===========================================
 -- TABELA BPA CONSOLIDADO (PRD_* - Firebird)
 -- ===========================================
 
+CREATE SEQUENCE IF NOT EXISTS bpa_consolidado_id_seq;
 CREATE TABLE IF NOT EXISTS bpa_consolidado (
-    id SERIAL PRIMARY KEY,
+    id INTEGER NOT NULL DEFAULT nextval('bpa_consolidado_id_seq'),
     
     -- Identificação
     prd_uid VARCHAR(7),           -- CNES
-    prd_cmp VARCHAR(6),           -- Competência
+    prd_cmp VARCHAR(6) NOT NULL,  -- Competência
     prd_flh INTEGER DEFAULT 1,    -- Folha
     
     -- Profissional
@@ -171,13 +178,19 @@ CREATE TABLE IF NOT EXISTS bpa_consolidado (
     prd_exportado BOOLEAN DEFAULT FALSE,
     data_exportacao TIMESTAMP,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, prd_cmp)
+) PARTITION BY LIST (prd_cmp);
+ALTER SEQUENCE bpa_consolidado_id_seq OWNED BY bpa_consolidado.id;
 
 -- Índices para BPA-C
-CREATE INDEX IF NOT EXISTS idx_bpac_uid ON bpa_consolidado(prd_uid);
-CREATE INDEX IF NOT EXISTS idx_bpac_cmp ON bpa_consolidado(prd_cmp);
-CREATE INDEX IF NOT EXISTS idx_bpac_exportado ON bpa_consolidado(prd_exportado);
+CREATE INDEX IF NOT EXISTS idx_bpac_uid_cmp_exportado ON bpa_consolidado(prd_uid, prd_cmp, prd_exportado);
+CREATE INDEX IF NOT EXISTS idx_bpac_uid_id ON bpa_consolidado(prd_uid, id);
+
+-- Chave de agregação BPA-C (apenas registros pendentes): usada pelo UPSERT em lote
+CREATE UNIQUE INDEX IF NOT EXISTS uq_bpac_agregacao_pendente
+    ON bpa_consolidado(prd_uid, prd_cmp, prd_cbo, prd_pa, prd_idade)
+    WHERE prd_exportado = FALSE;
 
 -- ===========================================
 -- TABELA DE EXPORTAÇÕES
@@ -235,6 +248,35 @@ CREATE INDEX IF NOT EXISTS idx_historico_cnes ON historico_extracoes(cnes);
 CREATE INDEX IF NOT EXISTS idx_historico_competencia ON historico_extracoes(competencia);
 CREATE INDEX IF NOT EXISTS idx_historico_created_at ON historico_extracoes(created_at DESC);
 
+-- ===========================================
+-- JOBS EM BACKGROUND (extrações e relatórios)
+-- ===========================================
+
+CREATE TABLE IF NOT EXISTS jobs (
+    id VARCHAR(36) PRIMARY KEY,
+    tipo VARCHAR(50) NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',  -- pending, running, completed, error, cancelled
+    params JSONB,
+    
+    -- Progresso (por página/lote)
+    progress INTEGER DEFAULT 0,
+    current INTEGER DEFAULT 0,
+    total INTEGER,
+    message TEXT,
+    
+    result JSONB,
+    error TEXT,
+    cancel_requested BOOLEAN DEFAULT FALSE,
+    usuario_id INTEGER,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    started_at TIMESTAMP,
+    finished_at TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs(status);
+CREATE INDEX IF NOT EXISTS idx_jobs_created_at ON jobs(created_at DESC);
+
 -- ===========================================
 -- USUÁRIO ADMIN PADRÃO
 -- ===========================================
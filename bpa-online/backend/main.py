@@ -4,13 +4,15 @@ Versão 3.0 - Com Autenticação por CNES
 """
 from fastapi import FastAPI, HTTPException, Query, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from typing import List, Optional
+from fastapi.responses import FileResponse, Response, StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from typing import Callable, List, Optional
 import uvicorn
 from datetime import datetime
 import os
 
-from database import BPADatabase, db, get_connection
+from database import BPADatabase, db, get_connection, remover_pacientes_sem_producao, remover_producao
+from async_database import adb
 from exporter import FirebirdExporter, exporter
 from auth import (
     create_user, authenticate_user, get_user_by_id,
@@ -29,6 +31,16 @@ from services.consolidation_service import get_consolidation_service
 from services.sigtap_filter_service import get_sigtap_filter_service
 from services.financial_service import get_financial_service
 from services.inconsistency_service import get_inconsistency_service
+from services.job_service import JobCancelled, get_job_service
+from services.remessa_batch import gerar_remessas_competencia
+from services.remessa_reader import reconciliar as reconciliar_arquivo
+from services.response_cache import cached_async, competencia_sigtap
+from services.db_metrics import (
+    DB_SLOW_QUERY_MS, PROMETHEUS_CONTENT_TYPE, consultas_lentas, metrics_autorizado, prometheus_text
+)
+from services.bpa_paginacao import (
+    NDJSON_MEDIA_TYPE, PAGE_MAX_LIMIT, CursorInvalido, ndjson_bpa, pagina_bpa_async
+)
 from constants.estabelecimentos import get_ibge_municipio
 from models.schemas import (
     ProfissionalCreate, ProfissionalResponse,
@@ -42,6 +54,7 @@ from models.schemas import (
 )
 from pydantic import BaseModel
 from routers.sigtap import router as sigtap_router
+from routers.jobs import router as jobs_router
 
 app = FastAPI(
     title="BPA Online API",
@@ -52,6 +65,9 @@ app = FastAPI(
 # Rotas SIGTAP
 app.include_router(sigtap_router)
 
+# Jobs em background (extrações e relatórios longos)
+app.include_router(jobs_router)
+
 # CORS
 app.add_middleware(
     CORSMiddleware,
@@ -277,13 +293,20 @@ async def admin_dashboard_stats(
         if isinstance(cnes_list, str):
             cnes_list = [cnes_list]
 
-        stats = service.get_dashboard_stats(
-            competencia_inicio=competencia_inicio,
-            competencia_fim=competencia_fim,
-            cnes_list=cnes_list if cnes_list else None,
-            tipo_bpa=tipo_bpa,
-            cbo=cbo,
-            procedimento=procedimento
+        params = {
+            "competencia_inicio": competencia_inicio,
+            "competencia_fim": competencia_fim,
+            "cnes_list": sorted(cnes_list) if cnes_list else None,
+            "tipo_bpa": tipo_bpa,
+            "cbo": cbo,
+            "procedimento": procedimento
+        }
+        stats = await cached_async(
+            'admin/dashboard/stats', params,
+            lambda: adb.versoes_dados(
+                bpa=(None, None), sigtap=competencia_sigtap(competencia_inicio or competencia_fim)
+            ),
+            lambda: run_in_threadpool(service.get_dashboard_stats, **params)
         )
 
         return {
@@ -327,6 +350,14 @@ async def health_check():
     return {"status": "healthy", "timestamp": datetime.now().isoformat()}
 
 
+@app.get("/metrics", include_in_schema=False)
+async def metrics(authorization: Optional[str] = Header(None)):
+    """Métricas do banco no formato do Prometheus (ver services.db_metrics)"""
+    if not metrics_autorizado(authorization):
+        raise HTTPException(status_code=401, detail="Token de métricas inválido")
+    return Response(prometheus_text(), media_type=PROMETHEUS_CONTENT_TYPE)
+
+
 # ========== DASHBOARD ==========
 
 @app.get("/api/dashboard/stats")
@@ -353,7 +384,11 @@ async def get_dashboard_stats(
                 "ultimas_exportacoes": []
             }
         
-        stats = db.get_stats_by_cnes(cnes)
+        stats = await cached_async(
+            'dashboard/stats', {'cnes': cnes},
+            lambda: adb.versoes_dados(bpa=(cnes, None), cadastro=True),
+            lambda: adb.get_stats_by_cnes(cnes)
+        )
         
         return {
             "cnes": cnes,
@@ -389,8 +424,11 @@ async def get_bpa_stats(
     try:
         # Usa CNES do query ou do usuário
         target_cnes = cnes if cnes else user["cnes"]
-        stats = db.get_bpa_stats(target_cnes, competencia)
-        return stats
+        return await cached_async(
+            'bpa/stats', {'cnes': target_cnes, 'competencia': competencia},
+            lambda: adb.versoes_dados(bpa=(target_cnes, competencia)),
+            lambda: adb.get_bpa_stats(target_cnes, competencia)
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -398,17 +436,26 @@ async def get_bpa_stats(
 # ========== GERENCIAMENTO DE DADOS ==========
 
 @app.get("/api/bpa/inconsistencies")
-async def get_bpa_inconsistencies(
+def get_bpa_inconsistencies(
     cnes: str = Query(..., description="CNES para analisar"),
     competencia: str = Query(..., description="Competência para analisar"),
+    page: int = Query(1, ge=1, description="Página dos detalhes"),
+    page_size: int = Query(100, ge=1, le=1000, description="Itens por página"),
+    tipo: Optional[str] = Query(None, description="critical ou warning"),
+    regra: Optional[str] = Query(None, description="Tipo de regra (ver summary.por_regra)"),
     user: dict = Depends(get_current_user)
 ):
     """
     Analisa inconsistências nos dados do banco sem alterá-los
+    
+    Resultados materializados por registro: só registros novos/alterados (ou
+    todos, quando as regras mudam) são reavaliados a cada consulta.
     """
     try:
         service = get_inconsistency_service()
-        report = service.get_inconsistency_report(cnes, competencia)
+        report = service.get_inconsistency_report(
+            cnes, competencia, page=page, page_size=page_size, tipo=tipo, regra=regra
+        )
         return report
     except Exception as e:
         logger.error(f"Erro ao buscar inconsistências: {e}")
@@ -422,112 +469,21 @@ async def get_database_overview(
     """
     Visão geral do banco de dados
     Lista todos os CNES com dados e estatísticas por competência
+    (lidos de producao_resumo, sem varrer as tabelas de produção)
     """
     try:
-        with get_connection() as conn:
-            cursor = conn.cursor()
-            
-            # Estatísticas gerais por CNES
-            cursor.execute("""
-                SELECT 
-                    prd_uid as cnes,
-                    prd_cmp as competencia,
-                    COUNT(*) as total_bpa_i,
-                    SUM(CASE WHEN prd_exportado = FALSE THEN 1 ELSE 0 END) as pendentes,
-                    SUM(CASE WHEN prd_exportado = TRUE THEN 1 ELSE 0 END) as exportados,
-                    MIN(created_at) as primeira_insercao,
-                    MAX(created_at) as ultima_insercao
-                FROM bpa_individualizado
-                GROUP BY prd_uid, prd_cmp
-                ORDER BY prd_uid, prd_cmp DESC;
-            """)
-            
-            bpa_i_data = []
-            for row in cursor.fetchall():
-                bpa_i_data.append({
-                    "cnes": row[0],
-                    "competencia": row[1],
-                    "total": row[2],
-                    "pendentes": row[3],
-                    "exportados": row[4],
-                    "primeira_insercao": row[5].isoformat() if row[5] else None,
-                    "ultima_insercao": row[6].isoformat() if row[6] else None,
-                    "tipo": "bpa_i"
-                })
-            
-            # BPA-C
-            cursor.execute("""
-                SELECT 
-                    prd_uid as cnes,
-                    prd_cmp as competencia,
-                    COUNT(*) as total_bpa_c,
-                    SUM(CASE WHEN prd_exportado = FALSE THEN 1 ELSE 0 END) as pendentes,
-                    SUM(CASE WHEN prd_exportado = TRUE THEN 1 ELSE 0 END) as exportados,
-                    MIN(created_at) as primeira_insercao,
-                    MAX(created_at) as ultima_insercao
-                FROM bpa_consolidado
-                GROUP BY prd_uid, prd_cmp
-                ORDER BY prd_uid, prd_cmp DESC;
-            """)
-            
-            bpa_c_data = []
-            for row in cursor.fetchall():
-                bpa_c_data.append({
-                    "cnes": row[0],
-                    "competencia": row[1],
-                    "total": row[2],
-                    "pendentes": row[3],
-                    "exportados": row[4],
-                    "primeira_insercao": row[5].isoformat() if row[5] else None,
-                    "ultima_insercao": row[6].isoformat() if row[6] else None,
-                    "tipo": "bpa_c"
-                })
-            
-            # Lista de CNES únicos
-            cursor.execute("""
-                SELECT DISTINCT prd_uid 
-                FROM bpa_individualizado
-                UNION
-                SELECT DISTINCT prd_uid 
-                FROM bpa_consolidado
-                ORDER BY prd_uid;
-            """)
-            
-            cnes_list = [row[0] for row in cursor.fetchall()]
-            
-            # Totais gerais
-            cursor.execute("SELECT COUNT(*) FROM bpa_individualizado;")
-            total_bpa_i = cursor.fetchone()[0]
-            
-            cursor.execute("SELECT COUNT(*) FROM bpa_consolidado;")
-            total_bpa_c = cursor.fetchone()[0]
-            
-            cursor.execute("SELECT COUNT(*) FROM profissionais;")
-            total_prof = cursor.fetchone()[0]
-            
-            cursor.execute("SELECT COUNT(*) FROM pacientes;")
-            total_pac = cursor.fetchone()[0]
-            
-            cursor.close()
-            
-            return {
-                "success": True,
-                "cnes_list": cnes_list,
-                "total_cnes": len(cnes_list),
-                "bpa_i": bpa_i_data,
-                "bpa_c": bpa_c_data,
-                "totals": {
-                    "bpa_i": total_bpa_i,
-                    "bpa_c": total_bpa_c,
-                    "profissionais": total_prof,
-                    "pacientes": total_pac
-                }
-            }
+        return await adb.get_database_overview()
     except Exception as e:
         logger.error(f"Erro ao buscar overview: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/api/admin/db/consultas-lentas")
+async def get_consultas_lentas(admin: dict = Depends(get_admin_user)):
+    """Consultas acima de DB_SLOW_QUERY_MS neste processo, com amostra de EXPLAIN"""
+    return {"limite_ms": DB_SLOW_QUERY_MS, "consultas": consultas_lentas()}
+
+
 @app.get("/api/admin/historico-extracoes")
 async def get_historico_extracoes(
     cnes: Optional[str] = Query(None, description="Filtrar por CNES"),
@@ -546,8 +502,7 @@ async def get_historico_extracoes(
     - Total de registros para paginação
     """
     try:
-        db = BPADatabase()
-        result = db.list_historico_extracoes(cnes=cnes, limit=limit, offset=offset)
+        result = await adb.list_historico_extracoes(cnes=cnes, limit=limit, offset=offset)
         
         # Formata datas
         for record in result['records']:
@@ -575,13 +530,12 @@ async def fix_encoding_historico(user: dict = Depends(get_current_user)):
         sigtap_dir = os.getenv("SIGTAP_DIR", "/app/sigtap")
         if os.path.exists(sigtap_dir):
             try:
-                from services.sigtap_parser import SigtapParser
-                sigtap_parser = SigtapParser(sigtap_dir)
+                from services.sigtap_index import get_sigtap_parser
+                sigtap_parser = get_sigtap_parser(sigtap_dir)
             except Exception as e:
                 logger.warning(f"Não foi possível carregar SIGTAP: {e}")
         
-        db = BPADatabase()
-        result = db.fix_encoding_historico(sigtap_parser=sigtap_parser)
+        result = await adb.fix_encoding_historico(sigtap_parser=sigtap_parser)
         
         msg = f"Encoding corrigido em {result['updated']} registros"
         if result.get('had_sigtap'):
@@ -615,33 +569,16 @@ async def delete_data(
             cursor = conn.cursor()
             deleted_count = 0
             
+            # Meses em que o CNES é a única unidade saem com DROP da partição
             if tipo == "bpa_i" or tipo == "all":
-                if competencia:
-                    cursor.execute(
-                        "DELETE FROM bpa_individualizado WHERE prd_uid = %s AND prd_cmp = %s",
-                        (cnes, competencia)
-                    )
-                else:
-                    cursor.execute(
-                        "DELETE FROM bpa_individualizado WHERE prd_uid = %s",
-                        (cnes,)
-                    )
-                deleted_count += cursor.rowcount
-                logger.info(f"Deletados {cursor.rowcount} registros de BPA-I")
+                removidos = remover_producao(cursor, 'bpa_individualizado', cnes, competencia)
+                deleted_count += removidos
+                logger.info(f"Deletados {removidos} registros de BPA-I")
             
             if tipo == "bpa_c" or tipo == "all":
-                if competencia:
-                    cursor.execute(
-                        "DELETE FROM bpa_consolidado WHERE prd_uid = %s AND prd_cmp = %s",
-                        (cnes, competencia)
-                    )
-                else:
-                    cursor.execute(
-                        "DELETE FROM bpa_consolidado WHERE prd_uid = %s",
-                        (cnes,)
-                    )
-                deleted_count += cursor.rowcount
-                logger.info(f"Deletados {cursor.rowcount} registros de BPA-C")
+                removidos = remover_producao(cursor, 'bpa_consolidado', cnes, competencia)
+                deleted_count += removidos
+                logger.info(f"Deletados {removidos} registros de BPA-C")
             
             if tipo == "profissionais" or tipo == "all":
                 cursor.execute(
@@ -653,12 +590,9 @@ async def delete_data(
             
             if tipo == "pacientes" or tipo == "all":
                 # Apenas deleta pacientes se não houver BPA-I vinculado
-                cursor.execute("""
-                    DELETE FROM pacientes 
-                    WHERE cns NOT IN (SELECT DISTINCT prd_cnspac FROM bpa_individualizado WHERE prd_cnspac IS NOT NULL)
-                """)
-                deleted_count += cursor.rowcount
-                logger.info(f"Deletados {cursor.rowcount} pacientes sem vínculos")
+                removidos = remover_pacientes_sem_producao(cursor)
+                deleted_count += removidos
+                logger.info(f"Deletados {removidos} pacientes sem vínculos")
             
             conn.commit()
             cursor.close()
@@ -677,13 +611,40 @@ async def delete_data(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.delete("/api/admin/competencias/{competencia}")
+async def remover_competencia(
+    competencia: str,
+    tipo: str = Query("all", description="bpa_i, bpa_c ou all"),
+    arquivar: bool = Query(False, description="Desanexa a partição (arquivo_*) em vez de apagá-la"),
+    admin: dict = Depends(get_admin_user)
+):
+    """
+    Remove ou arquiva uma competência inteira (todas as unidades)
+    DROP/DETACH da partição do mês, sem DELETE registro a registro
+    """
+    if tipo not in ("bpa_i", "bpa_c", "all"):
+        raise HTTPException(status_code=400, detail="tipo deve ser bpa_i, bpa_c ou all")
+    try:
+        resultado = await adb.remover_competencia(competencia, tipo, arquivar)
+    except Exception as e:
+        logger.error(f"Erro ao remover competência {competencia}: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+    return {
+        "success": True,
+        "competencia": competencia,
+        "arquivada": arquivar,
+        "removidos": resultado,
+        "deleted": sum(resultado.values())
+    }
+
+
 # ========== PROFISSIONAIS ==========
 
 @app.get("/api/profissionais", response_model=List[ProfissionalResponse])
 async def list_profissionais(user: dict = Depends(get_current_user)):
     """Lista profissionais do CNES"""
     try:
-        return db.list_profissionais(user["cnes"])
+        return await adb.list_profissionais(user["cnes"])
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -692,7 +653,7 @@ async def list_profissionais(user: dict = Depends(get_current_user)):
 async def get_profissional(cns: str, user: dict = Depends(get_current_user)):
     """Busca profissional pelo CNS"""
     try:
-        prof = db.get_profissional(cns)
+        prof = await adb.get_profissional(user["cnes"], cns)
         if not prof:
             raise HTTPException(status_code=404, detail="Profissional não encontrado")
         return prof
@@ -708,8 +669,8 @@ async def create_profissional(data: ProfissionalCreate, user: dict = Depends(get
     try:
         prof_data = data.dict()
         prof_data['cnes'] = user['cnes']
-        db.save_profissional(prof_data)
-        return db.get_profissional(data.cns)
+        await adb.save_profissional(prof_data)
+        return await adb.get_profissional(user['cnes'], data.cns)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -720,7 +681,7 @@ async def create_profissional(data: ProfissionalCreate, user: dict = Depends(get
 async def search_pacientes(q: str = Query(..., min_length=2), user: dict = Depends(get_current_user)):
     """Busca pacientes"""
     try:
-        return db.search_pacientes(q)
+        return await adb.search_pacientes(q)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -729,7 +690,7 @@ async def search_pacientes(q: str = Query(..., min_length=2), user: dict = Depen
 async def get_paciente(cns: str, user: dict = Depends(get_current_user)):
     """Busca paciente pelo CNS"""
     try:
-        pac = db.get_paciente(cns)
+        pac = await adb.get_paciente(cns)
         if not pac:
             raise HTTPException(status_code=404, detail="Paciente não encontrado")
         return pac
@@ -743,32 +704,53 @@ async def get_paciente(cns: str, user: dict = Depends(get_current_user)):
 async def create_paciente(data: PacienteCreate, user: dict = Depends(get_current_user)):
     """Cadastra paciente"""
     try:
-        db.save_paciente(data.dict())
-        return db.get_paciente(data.cns)
+        await adb.save_paciente(data.dict())
+        return await adb.get_paciente(data.cns)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 # ========== BPA INDIVIDUALIZADO ==========
 
+async def _listar_bpa(tabela: str, cnes: str, competencia: str, exportado: Optional[bool],
+                limit: Optional[int], cursor: Optional[str], format: str):
+    """
+    Listagem BPA: array completo (sem limit/cursor, como antes), página por
+    keyset ({data, next_cursor}) ou stream NDJSON de um cursor server-side
+    """
+    try:
+        if format == "ndjson":
+            linhas = ndjson_bpa(db, tabela, cnes, competencia, exportado, cursor)
+            return StreamingResponse(linhas, media_type=NDJSON_MEDIA_TYPE)
+        if limit is not None or cursor:
+            return await pagina_bpa_async(adb, tabela, cnes, competencia, exportado, limit, cursor)
+        if tabela == "bpa_individualizado":
+            return await adb.list_bpa_individualizado(cnes, competencia, exportado)
+        return await adb.list_bpa_consolidado(cnes, competencia)
+    except CursorInvalido as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.get("/api/bpa/individualizado")
 async def list_bpa_individualizado(
     competencia: str = Query(...),
     exportado: Optional[bool] = None,
+    limit: Optional[int] = Query(None, ge=1, le=PAGE_MAX_LIMIT, description="Tamanho da página (keyset)"),
+    cursor: Optional[str] = Query(None, description="next_cursor da página anterior"),
+    format: str = Query("json", enum=["json", "ndjson"]),
     user: dict = Depends(get_current_user)
 ):
-    """Lista registros BPA-I do CNES"""
-    try:
-        return db.list_bpa_individualizado(user["cnes"], competencia, exportado)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    """Lista registros BPA-I do CNES (paginado com limit/cursor ou em NDJSON)"""
+    return await _listar_bpa("bpa_individualizado", user["cnes"], competencia, exportado, limit, cursor, format)
 
 
 @app.get("/api/bpa/individualizado/{id}", response_model=BPAIndividualizadoResponse)
 async def get_bpa_individualizado(id: int, user: dict = Depends(get_current_user)):
     """Busca BPA-I pelo ID"""
     try:
-        record = db.get_bpa_individualizado(id)
+        record = await adb.get_bpa_individualizado(id)
         if not record:
             raise HTTPException(status_code=404, detail="Registro não encontrado")
         return record
@@ -802,15 +784,15 @@ async def create_bpa_individualizado(data: BPAIndividualizadoCreate, user: dict
         }
         
         # Cache profissional
-        db.save_profissional({
+        await adb.save_profissional({
             'cns': data.cns_profissional,
             'cbo': data.cbo,
             'cnes': user['cnes'],
             'ine': data.ine
         })
         
-        id = db.save_bpa_individualizado(bpa_data)
-        return db.get_bpa_individualizado(id)
+        id = await adb.save_bpa_individualizado(bpa_data)
+        return await adb.get_bpa_individualizado(id)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -819,7 +801,7 @@ async def create_bpa_individualizado(data: BPAIndividualizadoCreate, user: dict
 async def delete_bpa_individualizado(id: int, user: dict = Depends(get_current_user)):
     """Remove registro BPA-I"""
     try:
-        if db.delete_bpa_individualizado(id):
+        if await adb.delete_bpa_individualizado(id):
             return {"message": "Registro removido"}
         raise HTTPException(status_code=404, detail="Registro não encontrado")
     except HTTPException:
@@ -831,12 +813,15 @@ async def delete_bpa_individualizado(id: int, user: dict = Depends(get_current_u
 # ========== BPA CONSOLIDADO ==========
 
 @app.get("/api/bpa/consolidado")
-async def list_bpa_consolidado(competencia: str = Query(...), user: dict = Depends(get_current_user)):
-    """Lista registros BPA-C do CNES"""
-    try:
-        return db.list_bpa_consolidado(user["cnes"], competencia)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+async def list_bpa_consolidado(
+    competencia: str = Query(...),
+    limit: Optional[int] = Query(None, ge=1, le=PAGE_MAX_LIMIT, description="Tamanho da página (keyset)"),
+    cursor: Optional[str] = Query(None, description="next_cursor da página anterior"),
+    format: str = Query("json", enum=["json", "ndjson"]),
+    user: dict = Depends(get_current_user)
+):
+    """Lista registros BPA-C do CNES (paginado com limit/cursor ou em NDJSON)"""
+    return await _listar_bpa("bpa_consolidado", user["cnes"], competencia, None, limit, cursor, format)
 
 
 @app.post("/api/bpa/consolidado", response_model=BPAConsolidadoResponse)
@@ -845,8 +830,8 @@ async def create_bpa_consolidado(data: BPAConsolidadoCreate, user: dict = Depend
     try:
         bpa_data = data.dict()
         bpa_data['cnes'] = user['cnes']
-        id = db.save_bpa_consolidado(bpa_data)
-        records = db.list_bpa_consolidado(user['cnes'], data.competencia)
+        id = await adb.save_bpa_consolidado(bpa_data)
+        records = await adb.list_bpa_consolidado(user['cnes'], data.competencia)
         return next((r for r in records if r['id'] == id), None)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -880,13 +865,23 @@ async def search_procedimentos(q: str = Query(..., min_length=2)):
 
 
 @app.get("/api/procedimentos/{codigo}")
-async def get_procedimento(codigo: str):
-    """Busca procedimento pelo código"""
+def get_procedimento(codigo: str, competencia: Optional[str] = None):
+    """Busca procedimento pelo código (índice SIGTAP da competência)"""
     try:
-        proc = db.get_procedimento(codigo)
-        if proc:
-            return proc
-        raise HTTPException(status_code=404, detail="Procedimento não encontrado")
+        info = get_sigtap_filter_service().get_procedimento_info(codigo, competencia)
+        if not info:
+            raise HTTPException(status_code=404, detail=f"Procedimento {codigo} não encontrado")
+        return {
+            "codigo": info['codigo'],
+            "nome": info['nome'],
+            "descricao": info['nome'],  # Alias para compatibilidade
+            "valor_sa": info['valor_sa'],
+            "valor_sh": info['valor_sh'],
+            "valor_sp": info['valor_sp'],
+            "valor": info['valor_total'],
+            "complexidade": info['complexidade'],
+            "registros": info['registros'],
+        }
     except HTTPException:
         raise
     except Exception as e:
@@ -957,7 +952,7 @@ async def reset_export_status(request: ResetExportRequest, user: dict = Depends(
         if not target_cnes:
             raise HTTPException(status_code=400, detail="CNES obrigatório")
 
-        result = db.reset_export_status(target_cnes, request.competencia, request.tipo or "all")
+        result = await adb.reset_export_status(target_cnes, request.competencia, request.tipo or "all")
         return {
             "success": True,
             "cnes": target_cnes,
@@ -1002,7 +997,7 @@ async def import_from_julia(request: JuliaImportRequest, user: dict = Depends(ge
                         'prd_cid': reg.get('cid'),
                         'prd_org': 'JULIA'
                     }
-                    db.save_bpa_individualizado(data)
+                    await adb.save_bpa_individualizado(data)
                 else:
                     data = {
                         'prd_uid': user["cnes"],
@@ -1014,7 +1009,7 @@ async def import_from_julia(request: JuliaImportRequest, user: dict = Depends(ge
                         'prd_qt_p': reg.get('quantidade', 1),
                         'prd_org': 'JULIA'
                     }
-                    db.save_bpa_consolidado(data)
+                    await adb.save_bpa_consolidado(data)
                 imported += 1
             except Exception as e:
                 errors.append(f"Reg {i+1}: {e}")
@@ -1061,11 +1056,43 @@ async def get_carater():
     ]
 
 
+# ========== JOBS EM BACKGROUND ==========
+
+def submit_job(tipo: str, params: dict, user: dict) -> dict:
+    """Enfileira um job e retorna o id imediatamente"""
+    job = get_job_service().submit(tipo, params, usuario_id=user.get('id'))
+    return {
+        "success": True,
+        "job_id": job['id'],
+        "status": job['status'],
+        "status_url": f"/api/jobs/{job['id']}",
+        "result_url": f"/api/jobs/{job['id']}/result"
+    }
+
+
+@app.on_event("startup")
+async def abrir_pool_assincrono():
+    """Pool psycopg 3 das rotas assíncronas (ver async_database)"""
+    await adb.open()
+
+
+@app.on_event("shutdown")
+async def fechar_pool_assincrono():
+    await adb.close()
+
+
+@app.on_event("startup")
+def recover_background_jobs():
+    """Reenfileira jobs pendentes deixados por um processo anterior"""
+    get_job_service().recover()
+
+
 # ========== EXTRAÇÃO BISERVER API ==========
 
 from services.biserver_client import (
     BiServerAPIClient, 
     BiServerExtractionService,
+    StreamingBPAClassifier,
     get_extraction_service,
     ExtractionResult
 )
@@ -1178,6 +1205,7 @@ async def extract_and_separate_biserver(
     competencia: str = Query(..., description="Competência YYYYMM"),
     limit: Optional[int] = Query(None, description="Limite de registros (None = sem limite, extrai tudo)"),
     offset: int = Query(0, description="Offset para paginação"),
+    background: bool = Query(True, description="Executa como job em background e retorna job_id (false: executa na requisição)"),
     user: dict = Depends(get_current_user)
 ):
     """
@@ -1190,10 +1218,43 @@ async def extract_and_separate_biserver(
     4. Salva direto no banco PostgreSQL
     5. Salva histórico com estatísticas
     6. Retorna resumo completo
+    
+    Cada página é gravada assim que processada. Se a extração parar no meio,
+    o que foi gravado é mantido e a resposta traz `retomar` ({offset, limit})
+    para completar a competência.
+    
+    Por padrão roda como job e retorna {job_id} imediatamente; acompanhe em
+    /api/jobs/{job_id}. Com background=false executa na própria requisição.
+    """
+    params = {
+        "cnes": cnes,
+        "competencia": competencia,
+        "limit": limit,
+        "offset": offset,
+        "usuario_id": user.get('id')
+    }
+    if background:
+        return submit_job('extract_and_separate', params, user)
+    return await run_in_threadpool(run_extract_and_separate, **params)
+
+
+def run_extract_and_separate(
+    cnes: str,
+    competencia: str,
+    limit: Optional[int] = None,
+    offset: int = 0,
+    usuario_id: Optional[int] = None,
+    on_progress: Optional[Callable] = None
+) -> dict:
+    """
+    Execução síncrona de /api/biserver/extract-and-separate
+    
+    Roda em thread (threadpool ou worker de job), nunca no event loop.
+    on_progress(current, total, message) é chamado a cada página extraída.
     """
     import time
     from collections import Counter
-    from services.sigtap_parser import SigtapParser
+    from services.sigtap_index import get_sigtap_parser
     import os
     
     inicio = time.time()
@@ -1212,7 +1273,7 @@ async def extract_and_separate_biserver(
             msg = f"Diretório SIGTAP não encontrado: {sigtap_dir}"
             logger.error(f"[EXTRACT] {msg}")
             raise HTTPException(status_code=500, detail=msg)
-        sigtap_parser = SigtapParser(sigtap_dir)
+        sigtap_parser = get_sigtap_parser(sigtap_dir)
         logger.info(f"[EXTRACT] SIGTAP carregado de {sigtap_dir}")
         
         # Cache de nomes de procedimentos para evitar reprocessamento
@@ -1228,74 +1289,8 @@ async def extract_and_separate_biserver(
         
         # USA O SINGLETON para manter o cache
         service = get_extraction_service()
-        
-        # Extrai e separa
-        logger.info(f"[EXTRACT] Chamando extract_and_separate_bpa para CNES={cnes}, COMP={competencia}, limit={limit}, offset={offset}")
-        result = service.extract_and_separate_bpa(
-            cnes=cnes,
-            competencia=competencia,
-            limit=limit,
-            offset=offset
-        )
-        
-        if not result['success']:
-            logger.error(f"[EXTRACT] Falha na extração: {result.get('error')}")
-            raise HTTPException(status_code=500, detail=result.get('error', 'Erro na extração'))
-        
-        logger.info(f"[EXTRACT] Extração bem-sucedida: total={result['stats'].get('total', 0)}, removidos={result['stats'].get('removed', 0)}")
-        
-        # Aplica correções antes de salvar (CEP, sexo, logradouro, etc.)
         corrector = BPACorrections(cnes)
-        stats_corr_bpi = None
-        stats_corr_bpc = None
-
-        if result.get('bpa_i'):
-            logger.info(f"[EXTRACT] Aplicando correções BPA-I em {len(result['bpa_i'])} registros...")
-            result['bpa_i'], stats_corr_bpi = corrector.process_batch(result['bpa_i'], 'BPI')
-            if stats_corr_bpi:
-                logger.info(
-                    f"[EXTRACT] Correções BPA-I: corrigidos={stats_corr_bpi.get('corrected', 0)}, "
-                    f"removidos={stats_corr_bpi.get('deleted', 0)}"
-                )
-                if stats_corr_bpi.get('correction_types'):
-                    top = sorted(stats_corr_bpi['correction_types'].items(), key=lambda x: x[1], reverse=True)[:5]
-                    resumo = ", ".join([f"{k}={v}" for k, v in top])
-                    logger.info(f"[EXTRACT] Tipos correção BPA-I (top 5): {resumo}")
-                if stats_corr_bpi.get('delete_reasons'):
-                    top_del = sorted(stats_corr_bpi['delete_reasons'].items(), key=lambda x: x[1], reverse=True)[:3]
-                    resumo_del = ", ".join([f"{k}={v}" for k, v in top_del])
-                    logger.info(f"[EXTRACT] Motivos exclusão BPA-I (top 3): {resumo_del}")
-        else:
-            stats_corr_bpi = {
-                "total_input": 0,
-                "total_output": 0,
-                "deleted": 0,
-                "corrected": 0,
-                "unchanged": 0,
-                "delete_reasons": {},
-                "correction_types": {}
-            }
-
-        if result.get('bpa_c'):
-            logger.info(f"[EXTRACT] Aplicando correções BPA-C em {len(result['bpa_c'])} registros...")
-            result['bpa_c'], stats_corr_bpc = corrector.process_batch(result['bpa_c'], 'BPA')
-            if stats_corr_bpc:
-                logger.info(
-                    f"[EXTRACT] Correções BPA-C: corrigidos={stats_corr_bpc.get('corrected', 0)}, "
-                    f"removidos={stats_corr_bpc.get('deleted', 0)}"
-                )
-        else:
-            stats_corr_bpc = {
-                "total_input": 0,
-                "total_output": 0,
-                "deleted": 0,
-                "corrected": 0,
-                "unchanged": 0,
-                "delete_reasons": {},
-                "correction_types": {}
-            }
-
-        # Salva direto no banco
+        
         logger.info("[EXTRACT] Inicializando banco de dados...")
         db = BPADatabase()
         saved_bpa_i = 0
@@ -1333,88 +1328,177 @@ async def extract_and_separate_biserver(
         CNES_URGENCIA = ['2755289', '2492555', '2829606']
         carater = '02' if cnes in CNES_URGENCIA else '01'
         
-        logger.info(f"[EXTRACT] Salvando {len(result['bpa_i'])} registros BPA-I...")
-        
-        for seq, record in enumerate(result['bpa_i'], start=1):
-            if len(errors) >= max_errors:
-                stopped_early = True
-                logger.error(f"[EXTRACT] Stop point atingido após {len(errors)} erros em BPA-I. Abortando loop.")
-                break
-            try:
-                procedimento = str(record.get("prd_pa", ""))
-                quantidade = int(record.get("prd_qt_p", 1) or 1)
-                procedimentos_counter_i[procedimento] += quantidade
-                profissional_key = f"{record.get('prd_cnsmed', '')}_{record.get('prd_cbo', '')}"
-                profissionais_counter[profissional_key] += 1
-                
-                data_aten = sanitize_digits(record.get("prd_dtaten", ""), 8, "prd_dtaten")
-                data_nasc = sanitize_digits(record.get("prd_dtnasc", ""), 8, "prd_dtnasc")
-                cep = sanitize_digits(record.get("prd_cep_pcnte", ""), 8, "prd_cep_pcnte")
-                if len(data_aten) == 8:
-                    distribuicao_dias[data_aten[6:8]] += 1
-                
+        # Pipeline em streaming, página a página: API → classificação SIGTAP →
+        # correções → sanitização → COPY. Os BPA-I de cada página são gravados
+        # (e confirmados) antes da próxima ser lida, então nenhuma conexão fica
+        # presa durante a extração; os BPA-C da página só entram no agregado
+        # depois disso. Se a extração parar no meio, o banco tem exatamente as
+        # `consumidos` primeiras posições do fluxo: o BPA-C delas é gravado e a
+        # resposta traz o ponto de retomada (offset/limit).
+        classifier = StreamingBPAClassifier(service, competencia)
+        extracted_counts = {}
+        stats_corr_bpi = BPACorrections.empty_stats()
+        failed_bpa_i = 0
+        consumidos = 0
+        interrupcao = None
+        seq = 0
+        
+        def bpai_rows(page):
+            nonlocal seq, stopped_early, valor_total_bpa_i
+            for record in page:
+                seq += 1
+                if len(errors) >= max_errors:
+                    stopped_early = True
+                    logger.error(f"[EXTRACT] Stop point atingido após {len(errors)} erros em BPA-I. Abortando loop.")
+                    # O que já foi gravado continua gravado
+                    return
                 try:
-                    valores = sigtap_parser.get_procedimento_valor(procedimento)
+                    procedimento = str(record.get("prd_pa", ""))
+                    quantidade = int(record.get("prd_qt_p", 1) or 1)
+                    procedimentos_counter_i[procedimento] += quantidade
+                    profissional_key = f"{record.get('prd_cnsmed', '')}_{record.get('prd_cbo', '')}"
+                    profissionais_counter[profissional_key] += 1
+
+                    data_aten = sanitize_digits(record.get("prd_dtaten", ""), 8, "prd_dtaten")
+                    data_nasc = sanitize_digits(record.get("prd_dtnasc", ""), 8, "prd_dtnasc")
+                    cep = sanitize_digits(record.get("prd_cep_pcnte", ""), 8, "prd_cep_pcnte")
+                    if len(data_aten) == 8:
+                        distribuicao_dias[data_aten[6:8]] += 1
+
+                    try:
+                        valores = sigtap_parser.get_procedimento_valor(procedimento)
+                    except Exception as e:
+                        logger.warning(f"[EXTRACT] Falha ao obter valor SIGTAP {procedimento}: {e}")
+                        valores = {}
+                    valor_unit = float(valores.get('valor_ambulatorio', 0.0))
+                    valor_total_bpa_i += valor_unit * quantidade
+
+                    bpa_data = {
+                        "prd_uid": cnes,
+                        "prd_cmp": competencia,
+                        "prd_flh": 1,
+                        "prd_seq": seq,
+                        "prd_cnsmed": sanitize_text(record.get("prd_cnsmed", ""), 15, "prd_cnsmed"),
+                        "prd_cbo": sanitize_text(record.get("prd_cbo", ""), 6, "prd_cbo"),
+                        "prd_ine": "",
+                        "prd_cnspac": sanitize_text(record.get("prd_cnspac", ""), 15, "prd_cnspac"),
+                        # prd_cnspc da API BiServer contém o CPF do paciente (quando não tem CNS)
+                        "prd_cpf_pcnte": sanitize_digits(record.get("prd_cnspc", "") or record.get("prd_cpf_pcnte", "") or record.get("cpf_paciente", "") or "", 11, "prd_cpf_pcnte"),
+                        "prd_nmpac": sanitize_text(record.get("prd_nmpac", ""), 255, "prd_nmpac"),
+                        "prd_dtnasc": data_nasc,
+                        "prd_sexo": sanitize_text(record.get("prd_sexo", "M"), 1, "prd_sexo"),
+                        "prd_raca": sanitize_text(str(record.get("prd_raca", "99")).zfill(2), 2, "prd_raca"),
+                        "prd_idade": sanitize_text(record.get("prd_idade", ""), 3, "prd_idade"),
+                        "prd_ibge": "",
+                        "prd_cep_pcnte": cep,
+                        "prd_lograd_pcnte": sanitize_text(record.get("prd_lograd_pcnte", ""), 10, "prd_lograd_pcnte"),
+                        "prd_end_pcnte": sanitize_text(record.get("prd_end_pcnte", ""), 255, "prd_end_pcnte"),
+                        "prd_num_pcnte": sanitize_text(record.get("prd_num_pcnte", ""), 10, "prd_num_pcnte"),
+                        "prd_compl_pcnte": sanitize_text(record.get("prd_compl_pcnte", ""), 100, "prd_compl_pcnte"),
+                        "prd_bairro_pcnte": sanitize_text(record.get("prd_bairro_pcnte", ""), 30, "prd_bairro_pcnte"),
+                        "prd_tel_pcnte": sanitize_text(record.get("prd_tel_pcnte", ""), 20, "prd_tel_pcnte"),
+                        "prd_ddtel_pcnte": sanitize_text(record.get("prd_ddtel_pcnte", ""), 2, "prd_ddtel_pcnte"),
+                        "prd_email_pcnte": sanitize_text(record.get("prd_email_pcnte", "") or "", 255, "prd_email_pcnte"),
+                        "prd_dtaten": data_aten,
+                        "prd_pa": procedimento,
+                        "prd_qt_p": quantidade,
+                        "prd_cid": sanitize_text(record.get("prd_cid", ""), 10, "prd_cid"),
+                        "prd_caten": carater,
+                        "prd_naut": "",
+                        "prd_servico": "",
+                        "prd_classificacao": "",
+                        "prd_cnpj": "",
+                        "prd_nac": "010",
+                        "prd_etnia": "",
+                        "prd_eqp_area": "",
+                        "prd_eqp_seq": "",
+                        "prd_mvm": competencia,
+                        "prd_org": "BPI",
+                    }
                 except Exception as e:
-                    logger.warning(f"[EXTRACT] Falha ao obter valor SIGTAP {procedimento}: {e}")
-                    valores = {}
-                valor_unit = float(valores.get('valor_ambulatorio', 0.0))
-                valor_total_bpa_i += valor_unit * quantidade
-                
-                bpa_data = {
-                    "prd_uid": cnes,
-                    "prd_cmp": competencia,
-                    "prd_flh": 1,
-                    "prd_seq": seq,
-                    "prd_cnsmed": sanitize_text(record.get("prd_cnsmed", ""), 15, "prd_cnsmed"),
-                    "prd_cbo": sanitize_text(record.get("prd_cbo", ""), 6, "prd_cbo"),
-                    "prd_ine": "",
-                    "prd_cnspac": sanitize_text(record.get("prd_cnspac", ""), 15, "prd_cnspac"),
-                    # prd_cnspc da API BiServer contém o CPF do paciente (quando não tem CNS)
-                    "prd_cpf_pcnte": sanitize_digits(record.get("prd_cnspc", "") or record.get("prd_cpf_pcnte", "") or record.get("cpf_paciente", "") or "", 11, "prd_cpf_pcnte"),
-                    "prd_nmpac": sanitize_text(record.get("prd_nmpac", ""), 255, "prd_nmpac"),
-                    "prd_dtnasc": data_nasc,
-                    "prd_sexo": sanitize_text(record.get("prd_sexo", "M"), 1, "prd_sexo"),
-                    "prd_raca": sanitize_text(str(record.get("prd_raca", "99")).zfill(2), 2, "prd_raca"),
-                    "prd_idade": sanitize_text(record.get("prd_idade", ""), 3, "prd_idade"),
-                    "prd_ibge": "",
-                    "prd_cep_pcnte": cep,
-                    "prd_lograd_pcnte": sanitize_text(record.get("prd_lograd_pcnte", ""), 10, "prd_lograd_pcnte"),
-                    "prd_end_pcnte": sanitize_text(record.get("prd_end_pcnte", ""), 255, "prd_end_pcnte"),
-                    "prd_num_pcnte": sanitize_text(record.get("prd_num_pcnte", ""), 10, "prd_num_pcnte"),
-                    "prd_compl_pcnte": sanitize_text(record.get("prd_compl_pcnte", ""), 100, "prd_compl_pcnte"),
-                    "prd_bairro_pcnte": sanitize_text(record.get("prd_bairro_pcnte", ""), 30, "prd_bairro_pcnte"),
-                    "prd_tel_pcnte": sanitize_text(record.get("prd_tel_pcnte", ""), 20, "prd_tel_pcnte"),
-                    "prd_ddtel_pcnte": sanitize_text(record.get("prd_ddtel_pcnte", ""), 2, "prd_ddtel_pcnte"),
-                    "prd_email_pcnte": sanitize_text(record.get("prd_email_pcnte", "") or "", 255, "prd_email_pcnte"),
-                    "prd_dtaten": data_aten,
-                    "prd_pa": procedimento,
-                    "prd_qt_p": quantidade,
-                    "prd_cid": sanitize_text(record.get("prd_cid", ""), 10, "prd_cid"),
-                    "prd_caten": carater,
-                    "prd_naut": "",
-                    "prd_servico": "",
-                    "prd_classificacao": "",
-                    "prd_cnpj": "",
-                    "prd_nac": "010",
-                    "prd_etnia": "",
-                    "prd_eqp_area": "",
-                    "prd_eqp_seq": "",
-                    "prd_mvm": competencia,
-                    "prd_org": "BPI",
-                }
-                db.save_bpa_individualizado(bpa_data)
-                saved_bpa_i += 1
-            except Exception as e:
-                error_msg = str(e)
-                errors.append(f"BPA-I #{seq}: {error_msg}")
-                if len(errors) <= 3:
-                    logger.error(f"[EXTRACT] Erro ao salvar BPA-I #{seq}: {error_msg}")
+                    error_msg = str(e)
+                    errors.append(f"BPA-I #{seq}: {error_msg}")
+                    if len(errors) <= 3:
+                        logger.error(f"[EXTRACT] Erro ao preparar BPA-I #{seq}: {error_msg}")
+                    continue
+                yield bpa_data
+        
+        logger.info(f"[EXTRACT] Extraindo em streaming para CNES={cnes}, COMP={competencia}, limit={limit}, offset={offset}")
+        pages = service.iter_extracted_pages(cnes, competencia, limit=limit, offset=offset, counters=extracted_counts)
+        try:
+            for page_number, page_records in enumerate(pages, start=1):
+                if on_progress:
+                    on_progress(page_number, None, f"Página {page_number}: {classifier.total + len(page_records)} registros extraídos")
+                bpa_i_page = classifier.feed(page_records)
+                if bpa_i_page:
+                    # Aplica correções antes de salvar (CEP, sexo, logradouro, etc.)
+                    bpa_i_page, page_stats = corrector.process_batch(bpa_i_page, 'BPI')
+                    BPACorrections.merge_stats(stats_corr_bpi, page_stats)
+                    save_result = db.save_bpa_individualizado_bulk(bpai_rows(bpa_i_page), return_ids=False)
+                    saved_bpa_i += save_result.get('saved', 0)
+                    failed_bpa_i += save_result.get('failed', 0)
+                    for err in save_result.get('errors', [])[:5]:
+                        errors.append(f"BPA-I bulk: {err}")
+                classifier.confirmar()
+                consumidos += len(page_records)
+                if stopped_early:
+                    break
+        except HTTPException:
+            raise
+        except Exception as e:
+            # Inclui JobCancelled: o BPA-C das páginas gravadas é salvo antes de relançar
+            classifier.descartar()
+            interrupcao = e
+            logger.error(f"[EXTRACT] Extração interrompida após {consumidos} registros: {e}")
+        finally:
+            pages.close()
+        
+        if interrupcao is not None and not consumidos:
+            # Nada foi gravado
+            if isinstance(interrupcao, JobCancelled):
+                raise interrupcao
+            raise HTTPException(status_code=500, detail=str(interrupcao) or 'Erro na extração')
+        
+        logger.info(
+            f"[EXTRACT] BPA-I bulk: saved={saved_bpa_i}, failed={failed_bpa_i}"
+        )
+        if on_progress and interrupcao is None:
+            on_progress(classifier.total, classifier.total, "Extração concluída, gravando BPA-C")
+        
+        separated = classifier.finish()
+        extracted_stats = separated['stats']
+        extracted_stats['odonto'] = extracted_counts.get('odonto', 0)
+        logger.info(f"[EXTRACT] Extração {'interrompida' if interrupcao else 'bem-sucedida'}: total={extracted_stats.get('total', 0)}, removidos={extracted_stats.get('removed', 0)}")
+        
+        if stats_corr_bpi['total_input']:
+            logger.info(
+                f"[EXTRACT] Correções BPA-I: corrigidos={stats_corr_bpi.get('corrected', 0)}, "
+                f"removidos={stats_corr_bpi.get('deleted', 0)}"
+            )
+            if stats_corr_bpi.get('correction_types'):
+                top = sorted(stats_corr_bpi['correction_types'].items(), key=lambda x: x[1], reverse=True)[:5]
+                resumo = ", ".join([f"{k}={v}" for k, v in top])
+                logger.info(f"[EXTRACT] Tipos correção BPA-I (top 5): {resumo}")
+            if stats_corr_bpi.get('delete_reasons'):
+                top_del = sorted(stats_corr_bpi['delete_reasons'].items(), key=lambda x: x[1], reverse=True)[:3]
+                resumo_del = ", ".join([f"{k}={v}" for k, v in top_del])
+                logger.info(f"[EXTRACT] Motivos exclusão BPA-I (top 3): {resumo_del}")
+        
+        bpa_c_records = separated['bpa_c']
+        if bpa_c_records:
+            logger.info(f"[EXTRACT] Aplicando correções BPA-C em {len(bpa_c_records)} registros...")
+            bpa_c_records, stats_corr_bpc = corrector.process_batch(bpa_c_records, 'BPA')
+            logger.info(
+                f"[EXTRACT] Correções BPA-C: corrigidos={stats_corr_bpc.get('corrected', 0)}, "
+                f"removidos={stats_corr_bpc.get('deleted', 0)}"
+            )
+        else:
+            stats_corr_bpc = BPACorrections.empty_stats()
         
-        logger.info(f"[EXTRACT] Preparando {len(result['bpa_c'])} registros BPA-C...")
+        logger.info(f"[EXTRACT] Preparando {len(bpa_c_records)} registros BPA-C...")
         
         bpac_records_to_save = []
-        for seq, record in enumerate(result['bpa_c'], start=1):
+        for seq, record in enumerate(bpa_c_records, start=1):
             if len(errors) >= max_errors:
                 stopped_early = True
                 logger.error(f"[EXTRACT] Stop point atingido após {len(errors)} erros em BPA-C. Abortando loop.")
@@ -1461,7 +1545,9 @@ async def extract_and_separate_biserver(
             )
         
         duracao = int(time.time() - inicio)
-        status_hist = 'concluido' if not stopped_early else 'erro'
+        if interrupcao is not None:
+            errors.insert(0, f"Extração interrompida após {consumidos} registros: {interrupcao}")
+        status_hist = 'concluido' if not (stopped_early or interrupcao) else 'erro'
         
         logger.info(f"[EXTRACT] Salvamento concluído: BPA-I={saved_bpa_i}, BPA-C={saved_bpa_c}, Erros={len(errors)}, Tempo={duracao}s, Stop={stopped_early}")
         if truncation_counts:
@@ -1505,7 +1591,7 @@ async def extract_and_separate_biserver(
                 'competencia': competencia,
                 'total_bpa_i': saved_bpa_i,
                 'total_bpa_c': saved_bpa_c,
-                'total_removido': result['stats'].get('removed', 0),
+                'total_removido': extracted_stats.get('removed', 0),
                 'total_geral': saved_bpa_i + saved_bpa_c,
                 'valor_total_bpa_i': valor_total_bpa_i,
                 'valor_total_bpa_c': valor_total_bpa_c,
@@ -1513,7 +1599,7 @@ async def extract_and_separate_biserver(
                 'procedimentos_mais_usados': procedimentos_mais_usados,
                 'profissionais_mais_ativos': profissionais_mais_ativos,
                 'distribuicao_por_dia': dict(distribuicao_dias),
-                'usuario_id': user.get('id'),
+                'usuario_id': usuario_id,
                 'duracao_segundos': duracao,
                 'status': status_hist,
                 'erro': '; '.join(errors[:3]) if errors else None
@@ -1523,58 +1609,69 @@ async def extract_and_separate_biserver(
             logger.error(f"[EXTRACT] Erro ao salvar histórico: {e}")
             historico_id = None
         
+        stats = {
+            "extracted": extracted_stats,
+            "saved": {
+                "bpa_i": saved_bpa_i,
+                "bpa_c": saved_bpa_c
+            },
+            "failed": {
+                "bpa_i": failed_bpa_i
+            },
+            "corrections": {
+                "bpai": stats_corr_bpi,
+                "bpac": stats_corr_bpc
+            },
+            "valores": {
+                "bpa_i": float(valor_total_bpa_i),
+                "bpa_c": float(valor_total_bpa_c),
+                "total": float(valor_total_bpa_i + valor_total_bpa_c)
+            },
+            "procedimentos_mais_usados": procedimentos_mais_usados[:5],
+            "duracao_segundos": duracao
+        }
+        
+        if isinstance(interrupcao, JobCancelled):
+            raise interrupcao
+        
         if stopped_early:
             return {
                 "success": False,
                 "historico_id": historico_id,
                 "message": f"Interrompido após {len(errors)} erros. Veja logs.",
                 "errors": errors[:10],
-                "stats": {
-                    "extracted": result['stats'],
-                    "saved": {
-                        "bpa_i": saved_bpa_i,
-                        "bpa_c": saved_bpa_c
-                    },
-                    "corrections": {
-                        "bpai": stats_corr_bpi,
-                        "bpac": stats_corr_bpc
-                    },
-                    "valores": {
-                        "bpa_i": float(valor_total_bpa_i),
-                        "bpa_c": float(valor_total_bpa_c),
-                        "total": float(valor_total_bpa_i + valor_total_bpa_c)
-                    },
-                    "procedimentos_mais_usados": procedimentos_mais_usados[:5],
-                    "duracao_segundos": duracao
-                }
+                "stats": stats
+            }
+        
+        if interrupcao is not None:
+            # BPA-I e BPA-C gravados cobrem as `consumidos` primeiras posições:
+            # a mesma chamada com o offset/limit abaixo completa a competência
+            retomar = {
+                "offset": offset + consumidos,
+                "limit": None if limit is None else max(limit - consumidos, 0)
+            }
+            return {
+                "success": False,
+                "historico_id": historico_id,
+                "message": (
+                    f"Extração interrompida: {interrupcao}. Gravados {saved_bpa_i} BPA-I e {saved_bpa_c} BPA-C "
+                    f"das primeiras {consumidos} posições; retome com offset={retomar['offset']}"
+                ),
+                "retomar": retomar,
+                "errors": errors[:10],
+                "stats": stats
             }
         
         return {
             "success": True,
             "historico_id": historico_id,
-            "stats": {
-                "extracted": result['stats'],
-                "saved": {
-                    "bpa_i": saved_bpa_i,
-                    "bpa_c": saved_bpa_c
-                },
-                "corrections": {
-                    "bpai": stats_corr_bpi,
-                    "bpac": stats_corr_bpc
-                },
-                "valores": {
-                    "bpa_i": float(valor_total_bpa_i),
-                    "bpa_c": float(valor_total_bpa_c),
-                    "total": float(valor_total_bpa_i + valor_total_bpa_c)
-                },
-                "procedimentos_mais_usados": procedimentos_mais_usados[:5],
-                "duracao_segundos": duracao
-            },
+            "stats": stats,
             "errors": errors[:10] if errors else [],
             "message": f"✅ Salvos: {saved_bpa_i} BPA-I (R$ {valor_total_bpa_i:.2f}), {saved_bpa_c} BPA-C (R$ {valor_total_bpa_c:.2f}). Total: R$ {(valor_total_bpa_i + valor_total_bpa_c):.2f}"
+                       + (f" ⚠️ {failed_bpa_i} BPA-I não gravados (veja errors)" if failed_bpa_i else "")
         }
         
-    except HTTPException:
+    except (HTTPException, JobCancelled):
         raise
     except Exception as e:
         logger.error(f"[EXTRACT] ERRO CRÍTICO: {e}")
@@ -1596,6 +1693,7 @@ async def extract_all_biserver(
     batch_size: int = Query(5000, description="Tamanho de cada lote"),
     auto_save: bool = Query(True, description="Salvar automaticamente cada lote"),
     sigtap_filter: bool = Query(True, description="Filtrar apenas procedimentos válidos no SIGTAP"),
+    background: bool = Query(True, description="Executa como job em background e retorna job_id (false: executa na requisição)"),
     user: dict = Depends(get_current_user)
 ):
     """
@@ -1607,76 +1705,109 @@ async def extract_all_biserver(
     - Opcionalmente salva cada lote no banco
     - Filtra procedimentos pelo SIGTAP (padrão: ativo)
     
-    Retorna estatísticas completas da extração
+    Retorna estatísticas completas da extração.
+    Por padrão roda como job e retorna {job_id} imediatamente; acompanhe em
+    /api/jobs/{job_id}. Com background=false executa na própria requisição.
     """
+    params = {
+        "cnes": cnes,
+        "competencia": competencia,
+        "tipo": tipo,
+        "batch_size": batch_size,
+        "auto_save": auto_save,
+        "sigtap_filter": sigtap_filter
+    }
+    if background:
+        return submit_job('extract_all', params, user)
     try:
-        # Cria serviço com ou sem validação SIGTAP
-        from services.biserver_client import BiServerExtractionService
-        service = BiServerExtractionService(enable_sigtap_validation=sigtap_filter)
-        
-        # Função para salvar cada lote automaticamente
-        def save_batch(batch_num, total_batches, records):
-            if auto_save and records:
-                try:
-                    # Aplica correções antes de salvar
-                    corrector = BPACorrections(cnes)
-                    tipo_correcao = 'BPI' if tipo == 'bpa_i' else 'BPA'
-                    
-                    # logger.info(f"Aplicando correções em {len(records)} registros ({tipo_correcao})...")
-                    records, stats = corrector.process_batch(records, tipo_correcao)
-                    
-                    if stats['corrected'] > 0 or stats['deleted'] > 0:
-                        logger.info(f"Lote {batch_num}: {stats['corrected']} corrigidos, {stats['deleted']} removidos")
-                    else:
-                        logger.info(f"Lote {batch_num}: sem correções aplicadas")
-
-                    if stats.get('correction_types'):
-                        top = sorted(stats['correction_types'].items(), key=lambda x: x[1], reverse=True)[:5]
-                        resumo = ", ".join([f"{k}={v}" for k, v in top])
-                        logger.info(f"Lote {batch_num}: tipos de correção (top 5): {resumo}")
-
-                    if stats.get('delete_reasons'):
-                        top_del = sorted(stats['delete_reasons'].items(), key=lambda x: x[1], reverse=True)[:3]
-                        resumo_del = ", ".join([f"{k}={v}" for k, v in top_del])
-                        logger.info(f"Lote {batch_num}: motivos de exclusão (top 3): {resumo_del}")
-
-                    logger.info(f"Auto-salvando lote {batch_num}/{total_batches} ({len(records)} registros a salvar)")
-                    # Salva direto no banco via BPADatabase
-                    db = BPADatabase()
-                    if tipo == "bpa_i":
-                        db.save_bpa_individualizado(records)
-                    else:
-                        db.save_bpa_consolidado(records)
-                except Exception as e:
-                    logger.error(f"Erro ao auto-salvar lote {batch_num}: {e}")
-        
-        # Extrai tudo
-        if tipo == "bpa_i":
-            result = service.extract_all_bpa_individualizado(
-                cnes=cnes,
-                competencia=competencia,
-                batch_size=batch_size,
-                on_batch_complete=save_batch if auto_save else None
-            )
-        else:
-            result = service.extract_all_bpa_consolidado(
-                cnes=cnes,
-                competencia=competencia,
-                batch_size=batch_size,
-                on_batch_complete=save_batch if auto_save else None
-            )
-        
-        return {
-            **result,
-            "auto_saved": auto_save,
-            "tipo": tipo
-        }
-        
+        return await run_in_threadpool(run_extract_all, **params)
     except Exception as e:
         logger.error(f"Erro na extração completa: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def run_extract_all(
+    cnes: str,
+    competencia: str,
+    tipo: str = "bpa_i",
+    batch_size: int = 5000,
+    auto_save: bool = True,
+    sigtap_filter: bool = True,
+    on_progress: Optional[Callable] = None
+) -> dict:
+    """
+    Execução síncrona de /api/biserver/extract-all (roda em thread)
+    
+    on_progress(current, total, message) é chamado a cada lote, junto com on_batch_complete.
+    """
+    # Cria serviço com ou sem validação SIGTAP
+    from services.biserver_client import BiServerExtractionService
+    service = BiServerExtractionService(enable_sigtap_validation=sigtap_filter)
+    
+    # Função para salvar cada lote automaticamente
+    def save_batch(batch_num, total_batches, records):
+        if auto_save and records:
+            try:
+                # Aplica correções antes de salvar
+                corrector = BPACorrections(cnes)
+                tipo_correcao = 'BPI' if tipo == 'bpa_i' else 'BPA'
+                
+                # logger.info(f"Aplicando correções em {len(records)} registros ({tipo_correcao})...")
+                records, stats = corrector.process_batch(records, tipo_correcao)
+                
+                if stats['corrected'] > 0 or stats['deleted'] > 0:
+                    logger.info(f"Lote {batch_num}: {stats['corrected']} corrigidos, {stats['deleted']} removidos")
+                else:
+                    logger.info(f"Lote {batch_num}: sem correções aplicadas")
+
+                if stats.get('correction_types'):
+                    top = sorted(stats['correction_types'].items(), key=lambda x: x[1], reverse=True)[:5]
+                    resumo = ", ".join([f"{k}={v}" for k, v in top])
+                    logger.info(f"Lote {batch_num}: tipos de correção (top 5): {resumo}")
+
+                if stats.get('delete_reasons'):
+                    top_del = sorted(stats['delete_reasons'].items(), key=lambda x: x[1], reverse=True)[:3]
+                    resumo_del = ", ".join([f"{k}={v}" for k, v in top_del])
+                    logger.info(f"Lote {batch_num}: motivos de exclusão (top 3): {resumo_del}")
+
+                logger.info(f"Auto-salvando lote {batch_num}/{total_batches} ({len(records)} registros a salvar)")
+                # Salva direto no banco via BPADatabase
+                db = BPADatabase()
+                if tipo == "bpa_i":
+                    db.save_bpa_individualizado(records)
+                else:
+                    db.save_bpa_consolidado(records)
+            except Exception as e:
+                logger.error(f"Erro ao auto-salvar lote {batch_num}: {e}")
+    
+    def on_batch_complete(batch_num, total_batches, records):
+        save_batch(batch_num, total_batches, records)
+        if on_progress:
+            on_progress(batch_num, total_batches, f"Lote {batch_num}: {len(records)} registros")
+    
+    # Extrai tudo
+    if tipo == "bpa_i":
+        result = service.extract_all_bpa_individualizado(
+            cnes=cnes,
+            competencia=competencia,
+            batch_size=batch_size,
+            on_batch_complete=on_batch_complete if auto_save or on_progress else None
+        )
+    else:
+        result = service.extract_all_bpa_consolidado(
+            cnes=cnes,
+            competencia=competencia,
+            batch_size=batch_size,
+            on_batch_complete=on_batch_complete if auto_save or on_progress else None
+        )
+    
+    return {
+        **result,
+        "auto_saved": auto_save,
+        "tipo": tipo
+    }
+
+
 @app.post("/api/biserver/extract-pacientes")
 async def extract_pacientes(
     cnes: str = Query(...),
@@ -1750,47 +1881,11 @@ async def get_consolidation_stats(
     Mostra quantos BPA-I podem virar BPA-C
     """
     try:
-        consolidation_service = get_consolidation_service()
-        
-        # Busca BPA-I
-        bpai_records = db.list_bpa_individualizado(cnes, competencia, exportado=False)
-        
-        # Classifica por tipo
-        stats = {
-            'total_bpai': len(bpai_records),
-            'pode_consolidar_geral': 0,
-            'pode_consolidar_idade': 0,
-            'manter_bpai': 0,
-            'procedimentos_geral': [],
-            'procedimentos_idade': [],
-            'procedimentos_manter': []
-        }
-        
-        proc_geral = set()
-        proc_idade = set()
-        proc_manter = set()
-        
-        for record in bpai_records:
-            procedimento = record.get('prd_pa', '')
-            info = consolidation_service.verificar_procedimento(procedimento)
-            
-            if info['tipo'] == 'BPA-C':
-                if info['subtipo'] == 'geral':
-                    stats['pode_consolidar_geral'] += 1
-                    proc_geral.add(procedimento)
-                else:
-                    stats['pode_consolidar_idade'] += 1
-                    proc_idade.add(procedimento)
-            else:
-                stats['manter_bpai'] += 1
-                proc_manter.add(procedimento)
-        
-        stats['procedimentos_geral'] = sorted(list(proc_geral))
-        stats['procedimentos_idade'] = sorted(list(proc_idade))
-        stats['procedimentos_manter'] = sorted(list(proc_manter))
-        
-        return stats
-        
+        return await cached_async(
+            'consolidation/stats', {'cnes': cnes, 'competencia': competencia},
+            lambda: adb.versoes_dados(bpa=(cnes, competencia)),
+            lambda: run_in_threadpool(get_consolidation_service().estatisticas, cnes, competencia)
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1873,7 +1968,11 @@ EXTENSOES_MES = {
 }
 
 @app.post("/api/reports/generate")
-async def generate_bpa_reports(request: ReportRequest, user: dict = Depends(get_current_user)):
+async def generate_bpa_reports(
+    request: ReportRequest,
+    background: bool = Query(True, description="Executa como job em background e retorna job_id (false: executa na requisição)"),
+    user: dict = Depends(get_current_user)
+):
     """
     Gera os arquivos de relatório BPA (individual ou todos):
     - PA[SIGLA].[MES] (arquivo de remessa - extensão varia por mês)
@@ -1884,137 +1983,171 @@ async def generate_bpa_reports(request: ReportRequest, user: dict = Depends(get_
     Parâmetros:
     - tipo: 'remessa', 'relexp', 'bpai', 'bpac', 'all' (default: 'all')
     - cnes: CNES do estabelecimento (opcional, usa do usuário se não informado)
+    - background: (padrão) retorna {job_id} imediatamente; acompanhe em /api/jobs/{job_id}.
+      Com background=false executa na própria requisição
     """
-    try:
+    params = {
         # Usa CNES do request ou do usuário
-        cnes = request.cnes if request.cnes else user["cnes"]
-        competencia = request.competencia
-        sigla = request.sigla or "CAPSAD"
-        tipo = request.tipo or "all"
-        
-        # Extrai mês da competência para definir extensão
-        mes = competencia[4:6] if len(competencia) == 6 else "01"
-        extensao = EXTENSOES_MES.get(mes, "TXT")
-        
-        # Busca dados do banco (sem limite para relatórios)
-        bpai_records = db.list_bpa_individualizado(cnes, competencia, limit=10000)
-        bpac_records = db.list_bpa_consolidado(cnes, competencia, limit=10000)
-        
-        if not bpai_records and not bpac_records:
-            return {
-                "success": False,
-                "message": f"Nenhum registro encontrado para competência {competencia}",
-                "stats": {"bpai_count": 0, "bpac_count": 0},
-                "files": {}
-            }
-        
-        # Carrega parser SIGTAP para obter valores dos procedimentos
-        sigtap_parser = None
-        try:
-            from services.sigtap_parser import SigtapParser
-            sigtap_dir = os.path.join(os.path.dirname(__file__), '..', 'BPA-main', 'TabelaUnificada_202512_v2601161858')
-            if os.path.exists(sigtap_dir):
-                sigtap_parser = SigtapParser(sigtap_dir)
-                logger.info(f"[REPORT] SIGTAP parser carregado de {sigtap_dir}")
-        except Exception as e:
-            logger.warning(f"[REPORT] Não foi possível carregar SIGTAP: {e}")
-        
-        # Configura gerador
-        ibge_municipio = get_ibge_municipio(cnes)
-        config = BPAExportConfig(
-            cnes=cnes,
-            competencia=competencia,
-            sigla=sigla,
-            ibge_municipio=ibge_municipio
-        )
-        generator = BPAFileGenerator(config, sigtap_parser=sigtap_parser)
-        
-        # Gera arquivo de remessa
-        set_content, total_registros, total_bpas = generator.generate_set_file(
-            bpai_records, bpac_records
-        )
-        
-        # Campo de controle: fórmula do BPA Magnético
-        # (total_registros * 7 + total_bpas * 3) mod 10000
-        # Esta é a fórmula oficial usada pelo DATASUS para validação
-        campo_controle = str((total_registros * 7 + total_bpas * 3) % 10000).zfill(4)
-        
-        # Gera relatórios (passa extensão correta para o RELEXP)
-        relexp_content = generator.generate_relexp(total_registros, total_bpas, campo_controle, extensao)
-        bpai_rel_content = generator.generate_bpai_report(bpai_records)
-        bpac_rel_content = generator.generate_bpac_report(bpac_records)
-        
-        # Salva arquivos
-        reports_dir = os.path.join(os.path.dirname(__file__), 'reports')
-        os.makedirs(reports_dir, exist_ok=True)
-        
-        # Subdiretório por competência e CNES
-        export_dir = os.path.join(reports_dir, f"{cnes}_{competencia}")
-        os.makedirs(export_dir, exist_ok=True)
-        
-        files = {}
-        
-        # Define quais arquivos gerar baseado no tipo
-        # IMPORTANTE: remessa sempre gera junto com relexp (controle), pois são inseparáveis
-        gerar_remessa = tipo in ('remessa', 'all')
-        gerar_relexp = tipo in ('remessa', 'relexp', 'all')  # Sempre gera com remessa
-        gerar_bpai = tipo in ('bpai', 'all')
-        gerar_bpac = tipo in ('bpac', 'all')
-        
-        # Salva arquivo de remessa (extensão baseada no mês)
-        if gerar_remessa:
-            set_filename = f"PA{sigla}.{extensao}"
-            set_path = os.path.join(export_dir, set_filename)
-            with open(set_path, 'w', encoding='latin-1') as f:
-                f.write(set_content)
-            files[set_filename] = f"/api/reports/download/{cnes}_{competencia}/{set_filename}"
-        
-        # Salva RELEXP.PRN
-        if gerar_relexp:
-            relexp_path = os.path.join(export_dir, "RELEXP.PRN")
-            with open(relexp_path, 'w', encoding='latin-1') as f:
-                f.write(relexp_content)
-            files["RELEXP.PRN"] = f"/api/reports/download/{cnes}_{competencia}/RELEXP.PRN"
-        
-        # Salva BPAI_REL.TXT
-        if gerar_bpai:
-            bpai_path = os.path.join(export_dir, "BPAI_REL.TXT")
-            with open(bpai_path, 'w', encoding='latin-1') as f:
-                f.write(bpai_rel_content)
-            files["BPAI_REL.TXT"] = f"/api/reports/download/{cnes}_{competencia}/BPAI_REL.TXT"
-        
-        # Salva BPAC_REL.TXT
-        if gerar_bpac:
-            bpac_path = os.path.join(export_dir, "BPAC_REL.TXT")
-            with open(bpac_path, 'w', encoding='latin-1') as f:
-                f.write(bpac_rel_content)
-            files["BPAC_REL.TXT"] = f"/api/reports/download/{cnes}_{competencia}/BPAC_REL.TXT"
-        
-        tipo_msg = {
-            'remessa': 'Arquivo de remessa',
-            'relexp': 'Relatório de controle',
-            'bpai': 'Relatório BPA-I',
-            'bpac': 'Relatório BPA-C',
-            'all': 'Relatórios'
-        }
-        
+        "cnes": request.cnes if request.cnes else user["cnes"],
+        "competencia": request.competencia,
+        "sigla": request.sigla or "CAPSAD",
+        "tipo": request.tipo or "all"
+    }
+    if background:
+        return submit_job('generate_reports', params, user)
+    try:
+        return await run_in_threadpool(run_generate_reports, **params)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+def run_generate_reports(
+    cnes: str,
+    competencia: str,
+    sigla: str = "CAPSAD",
+    tipo: str = "all",
+    on_progress: Optional[Callable] = None
+) -> dict:
+    """
+    Execução síncrona de /api/reports/generate (roda em thread)
+    
+    on_progress(current, total, message) é chamado a cada etapa (leitura, geração, cada arquivo).
+    """
+    def progress(step: int, message: str):
+        if on_progress:
+            on_progress(step, 7, message)
+    
+    progress(0, "Contando registros do banco")
+    
+    # Extrai mês da competência para definir extensão
+    mes = competencia[4:6] if len(competencia) == 6 else "01"
+    extensao = EXTENSOES_MES.get(mes, "TXT")
+    
+    # Sem limite: os arquivos são gravados lendo o banco em blocos
+    counts = db.get_bpa_stats(cnes, competencia)
+    if not counts['bpai_total'] and not counts['bpac_total']:
         return {
-            "success": True,
-            "message": f"{tipo_msg.get(tipo, 'Relatórios')} gerado(s) com sucesso para competência {competencia}",
-            "stats": {
-                "total_registros": total_registros,
-                "total_bpas": total_bpas,
-                "bpai_count": len(bpai_records),
-                "bpac_count": len(bpac_records),
-                "campo_controle": campo_controle
-            },
-            "files": files
+            "success": False,
+            "message": f"Nenhum registro encontrado para competência {competencia}",
+            "stats": {"bpai_count": 0, "bpac_count": 0},
+            "files": {}
         }
-        
+    
+    # Carrega parser SIGTAP para obter valores dos procedimentos
+    sigtap_parser = None
+    try:
+        from services.sigtap_index import get_sigtap_parser
+        sigtap_dir = os.path.join(os.path.dirname(__file__), '..', 'BPA-main', 'TabelaUnificada_202512_v2601161858')
+        if os.path.exists(sigtap_dir):
+            sigtap_parser = get_sigtap_parser(sigtap_dir)
+            logger.info(f"[REPORT] SIGTAP parser carregado de {sigtap_dir}")
+    except Exception as e:
+        logger.warning(f"[REPORT] Não foi possível carregar SIGTAP: {e}")
+    
+    # Configura gerador
+    ibge_municipio = get_ibge_municipio(cnes)
+    config = BPAExportConfig(
+        cnes=cnes,
+        competencia=competencia,
+        sigla=sigla,
+        ibge_municipio=ibge_municipio
+    )
+    generator = BPAFileGenerator(config, sigtap_parser=sigtap_parser)
+    
+    reports_dir = os.path.join(os.path.dirname(__file__), 'reports')
+    os.makedirs(reports_dir, exist_ok=True)
+    
+    # Subdiretório por competência e CNES
+    export_dir = os.path.join(reports_dir, f"{cnes}_{competencia}")
+    os.makedirs(export_dir, exist_ok=True)
+    
+    progress(1, f"Gerando arquivos ({counts['bpai_total']} BPA-I, {counts['bpac_total']} BPA-C)")
+    
+    # Etapa de progresso de cada arquivo (remessa = 4)
+    etapas = {"RELEXP.PRN": 5, "BPAI_REL.TXT": 6, "BPAC_REL.TXT": 7}
+    resultado = generator.write_reports(
+        db, export_dir, extensao, tipo,
+        on_file=lambda nome: progress(etapas.get(nome, 4), f"{nome} gravado")
+    )
+    files = {
+        nome: f"/api/reports/download/{cnes}_{competencia}/{nome}"
+        for nome in resultado['files']
+    }
+    
+    tipo_msg = {
+        'remessa': 'Arquivo de remessa',
+        'relexp': 'Relatório de controle',
+        'bpai': 'Relatório BPA-I',
+        'bpac': 'Relatório BPA-C',
+        'all': 'Relatórios'
+    }
+    
+    return {
+        "success": True,
+        "message": f"{tipo_msg.get(tipo, 'Relatórios')} gerado(s) com sucesso para competência {competencia}",
+        "stats": {
+            "total_registros": resultado['total_registros'],
+            "total_bpas": resultado['total_bpas'],
+            "bpai_count": resultado['bpai_count'],
+            "bpac_count": resultado['bpac_count'],
+            "campo_controle": resultado['campo_controle']
+        },
+        "files": files
+    }
+
+
+class ReportBatchRequest(BaseModel):
+    competencia: str  # YYYYMM
+    cnes: Optional[List[str]] = None  # Se não informado, todas as unidades de constants/estabelecimentos.py
+    tipo: Optional[str] = "all"  # 'remessa', 'relexp', 'bpai', 'bpac', 'all'
+
+
+@app.post("/api/reports/generate-batch")
+async def generate_bpa_reports_batch(
+    request: ReportBatchRequest,
+    background: bool = Query(True, description="Executa como job em background e retorna job_id (false: executa na requisição)"),
+    admin: dict = Depends(get_admin_user)
+):
+    """
+    Gera os arquivos do BPA Magnético de todas as unidades de uma competência
+    (fechamento do mês), um processo por CNES, e um manifesto com os totais e
+    o campo de controle de cada unidade (reports/LOTE_<competencia>/MANIFESTO.json).
+    
+    Por padrão roda como job; acompanhe em /api/jobs/{job_id}.
+    """
+    params = {
+        "competencia": request.competencia,
+        "cnes_list": request.cnes,
+        "tipo": request.tipo or "all"
+    }
+    if background:
+        return submit_job('generate_reports_batch', params, admin)
+    try:
+        return await run_in_threadpool(gerar_remessas_competencia, **params)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# Handlers dos jobs: mesma execução dos endpoints síncronos, com progresso do job
+job_service = get_job_service()
+job_service.register(
+    'extract_and_separate',
+    lambda job, **params: run_extract_and_separate(on_progress=job.progress, **params)
+)
+job_service.register(
+    'extract_all',
+    lambda job, **params: run_extract_all(on_progress=job.progress, **params)
+)
+job_service.register(
+    'generate_reports',
+    lambda job, **params: run_generate_reports(on_progress=job.progress, **params)
+)
+job_service.register(
+    'generate_reports_batch',
+    lambda job, **params: gerar_remessas_competencia(on_progress=job.progress, **params)
+)
+
+
 @app.get("/api/reports/download/{folder}/{filename}")
 async def download_report(folder: str, filename: str, user: dict = Depends(get_current_user)):
     """Download de um arquivo de relatório"""
@@ -2051,6 +2184,42 @@ async def download_report(folder: str, filename: str, user: dict = Depends(get_c
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.get("/api/reports/reconcile/{folder}/{filename}")
+async def reconcile_report(
+    folder: str,
+    filename: str,
+    cnes: Optional[str] = Query(None, description="Padrão: da pasta <cnes>_<competencia>"),
+    competencia: Optional[str] = Query(None, description="Padrão: da pasta <cnes>_<competencia>"),
+    limite: int = Query(50, ge=0, le=1000, description="Exemplos de divergência por lado"),
+    user: dict = Depends(get_current_user)
+):
+    """
+    Confere um arquivo gerado (remessa, BPAI_REL.TXT ou BPAC_REL.TXT) com o banco:
+    valida o cabeçalho da remessa (totais e campo de controle) e compara os
+    registros por (folha, seq, procedimento, CNS), lendo o arquivo por mmap
+    """
+    reports_dir = os.path.realpath(os.path.join(os.path.dirname(__file__), 'reports'))
+    filepath = os.path.realpath(os.path.join(reports_dir, folder, filename))
+    if not filepath.startswith(reports_dir + os.sep) or not os.path.isfile(filepath):
+        raise HTTPException(status_code=404, detail="Arquivo não encontrado")
+
+    if not cnes or not competencia:
+        partes = folder.split('_')
+        if len(partes) != 2:
+            raise HTTPException(status_code=400, detail="Informe cnes e competencia")
+        cnes = cnes or partes[0]
+        competencia = competencia or partes[1]
+
+    try:
+        return await run_in_threadpool(
+            reconciliar_arquivo, filepath, BPADatabase(), cnes, competencia, limite
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @app.get("/api/reports/list")
 async def list_reports(user: dict = Depends(get_current_user)):
     """Lista relatórios gerados"""
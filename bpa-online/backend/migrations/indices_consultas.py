@@ -0,0 +1,141 @@
+"""
+Cria os índices de INDICES_CONSULTAS (services/db_indices.py) sem bloquear gravações
+
+init_database() cria os índices que faltam na subida da API com CREATE INDEX
+comum, que trava gravações na tabela durante a construção. Em bases grandes
+rode este script antes do deploy: cada partição ganha o índice com
+CREATE INDEX CONCURRENTLY e depois é anexada ao índice da tabela-mãe (criado
+com ON ONLY); índices de INDICES_OBSOLETOS são removidos no fim.
+
+Não importa database.py: a importação dele roda init_database(), que criaria
+os índices que faltam do jeito que trava. Conecta em DATABASE_URL (a da API).
+
+Uso:
+    python migrations/indices_consultas.py            # cria o que falta e confere
+    python migrations/indices_consultas.py --verificar
+"""
+import os
+import sys
+from contextlib import contextmanager
+from pathlib import Path
+
+import psycopg2
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from services.db_indices import INDICES_CONSULTAS, INDICES_OBSOLETOS  # noqa: E402
+
+
+@contextmanager
+def get_connection():
+    url = os.getenv('DATABASE_URL')
+    if not url:
+        sys.exit("Defina DATABASE_URL (mesma conexão da API)")
+    conn = psycopg2.connect(url)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def tipo_tabela(cursor, tabela: str):
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (tabela,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def indice_valido(cursor, nome: str):
+    """True/False conforme pg_index.indisvalid; None se o índice não existe"""
+    cursor.execute("SELECT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)", (nome,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def particoes_sem_indice(cursor, tabela: str, indice: str):
+    cursor.execute('''
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+          AND NOT EXISTS (
+              SELECT 1
+              FROM pg_inherits ii
+              JOIN pg_index x ON x.indexrelid = ii.inhrelid
+              WHERE ii.inhparent = to_regclass(%s) AND x.indrelid = c.oid
+          )
+        ORDER BY c.relname
+    ''', (tabela, indice))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def criar_concorrente(cursor, nome: str, tabela: str, definicao: str) -> None:
+    # Um CONCURRENTLY interrompido deixa o índice inválido: refaz do zero
+    if indice_valido(cursor, nome) is False:
+        cursor.execute(f'DROP INDEX CONCURRENTLY {nome}')
+    cursor.execute(f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {nome} ON {tabela} {definicao}')
+
+
+def criar_indice(cursor, nome: str, tabela: str, definicao: str) -> None:
+    relkind = tipo_tabela(cursor, tabela)
+    if relkind is None:
+        print(f"  {nome}: tabela {tabela} inexistente (rode init_database antes)")
+        return
+    if relkind != 'p':
+        criar_concorrente(cursor, nome, tabela, definicao)
+        print(f"  {nome}: ok")
+        return
+
+    # Tabela-mãe: índice só na definição (inválido até todas as partições anexarem)
+    cursor.execute(f'CREATE INDEX IF NOT EXISTS {nome} ON ONLY {tabela} {definicao}')
+    for particao in particoes_sem_indice(cursor, tabela, nome):
+        nome_particao = f"{particao}_{nome.removeprefix('idx_')}"
+        criar_concorrente(cursor, nome_particao, particao, definicao)
+        cursor.execute(f'ALTER INDEX {nome} ATTACH PARTITION {nome_particao}')
+        print(f"  {nome}: partição {particao} indexada")
+    print(f"  {nome}: ok")
+
+
+def situacao(cursor):
+    """[(nome, tabela, estado)] dos índices esperados e dos obsoletos que restam"""
+    linhas = []
+    for nome, tabela, _ in INDICES_CONSULTAS:
+        valido = indice_valido(cursor, nome)
+        estado = 'ausente' if valido is None else ('ok' if valido else 'incompleto')
+        linhas.append((nome, tabela, estado))
+    for nome in INDICES_OBSOLETOS:
+        if indice_valido(cursor, nome) is not None:
+            linhas.append((nome, '', 'obsoleto'))
+    return linhas
+
+
+def executar_migracao(apenas_verificar: bool = False) -> bool:
+    if not apenas_verificar:
+        print("\n=== CRIANDO ÍNDICES (CONCURRENTLY, pode demorar em bases grandes) ===")
+        with get_connection() as conn:
+            # CREATE INDEX CONCURRENTLY não roda dentro de transação
+            conn.autocommit = True
+            with conn.cursor() as cursor:
+                for nome, tabela, definicao in INDICES_CONSULTAS:
+                    criar_indice(cursor, nome, tabela, definicao)
+                for nome in INDICES_OBSOLETOS:
+                    cursor.execute(f'DROP INDEX IF EXISTS {nome}')
+
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            linhas = situacao(cursor)
+
+    print(f"\n{'Índice':<35} {'Tabela':<25} {'Estado':>10}")
+    print("-" * 72)
+    for nome, tabela, estado in linhas:
+        print(f"{nome:<35} {tabela:<25} {estado:>10}")
+
+    ok = all(estado == 'ok' for _, _, estado in linhas)
+    if ok:
+        print("\n=== ÍNDICES DAS CONSULTAS EM DIA ===")
+    else:
+        print("\n❌ Índices pendentes: rode sem --verificar")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if executar_migracao('--verificar' in sys.argv) else 1)
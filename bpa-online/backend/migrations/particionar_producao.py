@@ -0,0 +1,75 @@
+"""
+Migra bpa_individualizado e bpa_consolidado para tabelas particionadas por competência
+
+A migração é a mesma feita por init_database() na subida da API (tabelas comuns
+são renomeadas para *_legado, copiadas para uma partição por competência e
+removidas). Este script permite rodá-la antes do deploy, numa janela de
+manutenção, e confere o resultado.
+
+Uso:
+    python migrations/particionar_producao.py            # migra e lista as partições
+    python migrations/particionar_producao.py --verificar
+"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from database import PRODUCAO_RESUMO_TIPOS, get_connection, init_database  # noqa: E402
+
+
+def situacao(cursor, tabela: str) -> str:
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (tabela,))
+    row = cursor.fetchone()
+    if not row:
+        return 'inexistente'
+    return 'particionada' if row[0] == 'p' else 'comum'
+
+
+def listar_particoes(cursor, tabela: str):
+    cursor.execute('''
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), COALESCE(s.n_live_tup, 0)
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+        WHERE i.inhparent = to_regclass(%s)
+        ORDER BY c.relname
+    ''', (tabela,))
+    return cursor.fetchall()
+
+
+def executar_migracao(apenas_verificar: bool = False) -> bool:
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            antes = {t: situacao(cursor, t) for t in PRODUCAO_RESUMO_TIPOS}
+    print("\n=== SITUAÇÃO ATUAL ===\n")
+    for tabela, estado in antes.items():
+        print(f"{tabela:<25} {estado}")
+
+    if not apenas_verificar and 'comum' in antes.values():
+        print("\n=== MIGRANDO (pode demorar em bases grandes) ===")
+        init_database()
+
+    ok = True
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            for tabela in PRODUCAO_RESUMO_TIPOS:
+                estado = situacao(cursor, tabela)
+                print(f"\n{tabela}: {estado}")
+                if estado != 'particionada':
+                    ok = False
+                    continue
+                print(f"{'Partição':<35} {'Valores':<25} {'Linhas (aprox.)':>15}")
+                print("-" * 77)
+                for nome, limites, linhas in listar_particoes(cursor, tabela):
+                    print(f"{nome:<35} {limites:<25} {linhas:>15}")
+
+    if ok:
+        print("\n=== PRODUÇÃO PARTICIONADA POR COMPETÊNCIA ===")
+    else:
+        print("\n❌ Migração não concluída: veja o log '[DB] Aviso durante inicialização'")
+    return ok
+
+
+if __name__ == "__main__":
+    sys.exit(0 if executar_migracao('--verificar' in sys.argv) else 1)
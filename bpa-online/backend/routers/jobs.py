@@ -0,0 +1,56 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from typing import Optional
+from services.job_service import get_job_service
+from routers.admin import get_current_user
+
+router = APIRouter(prefix="/api/jobs", tags=["jobs"])
+
+
+def _get_own_job(job_id: str, user: dict, include_result: bool = False) -> dict:
+    """Busca job garantindo que pertence ao usuário (admin vê todos)"""
+    job = get_job_service().get(job_id, include_result=include_result)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    if not user.get('is_admin') and job.get('usuario_id') != user.get('id'):
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return job
+
+
+@router.get("")
+def list_jobs(
+    status: Optional[str] = Query(None, description="pending, running, completed, error, cancelled"),
+    limit: int = Query(50, le=500),
+    user: dict = Depends(get_current_user)
+):
+    """Lista jobs recentes (admin vê os de todos os usuários)"""
+    usuario_id = None if user.get('is_admin') else user.get('id')
+    return get_job_service().list(usuario_id=usuario_id, status=status, limit=limit)
+
+
+@router.get("/{job_id}")
+def get_job(job_id: str, user: dict = Depends(get_current_user)):
+    """Status e progresso do job (sem o resultado)"""
+    return _get_own_job(job_id, user)
+
+
+@router.get("/{job_id}/result")
+def get_job_result(job_id: str, user: dict = Depends(get_current_user)):
+    """Resultado do job (mesmo retorno do endpoint síncrono equivalente)"""
+    job = _get_own_job(job_id, user, include_result=True)
+    if job['status'] in ('pending', 'running'):
+        raise HTTPException(status_code=409, detail=f"Job ainda em execução ({job['status']})")
+    if job['status'] == 'error':
+        raise HTTPException(status_code=500, detail=job.get('error') or 'Erro no job')
+    return {
+        "job_id": job['id'],
+        "status": job['status'],
+        "result": job.get('result')
+    }
+
+
+@router.post("/{job_id}/cancel")
+def cancel_job(job_id: str, user: dict = Depends(get_current_user)):
+    """Solicita cancelamento (efetivo no próximo ponto de progresso)"""
+    _get_own_job(job_id, user)
+    status = get_job_service().cancel(job_id)
+    return {"job_id": job_id, "status": status, "cancel_requested": True}
@@ -6,6 +6,7 @@ from pathlib import Path
 
 from services.sigtap_manager_service import get_sigtap_manager
 from services.sigtap_filter_service import get_sigtap_filter_service
+from services.response_cache import cached, competencia_sigtap, versoes_dados
 
 router = APIRouter(prefix="/api/sigtap", tags=["sigtap"])
 
@@ -40,6 +41,7 @@ async def upload_competencia(
             shutil.copyfileobj(file.file, buffer)
             
         result = manager.import_competencia(str(temp_path), competencia)
+        get_sigtap_filter_service().reload_competencia(competencia)
         return result
         
     except Exception as e:
@@ -102,24 +104,45 @@ def search_procedimentos(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/procedimentos/lote")
+def get_procedimentos_lote(
+    codigos: List[str] = Query(..., description="Códigos de procedimento (repetir o parâmetro)"),
+    competencia: Optional[str] = None
+):
+    """Dados de vários procedimentos numa única chamada (códigos inexistentes são omitidos)"""
+    service = get_sigtap_filter_service()
+    try:
+        infos = service.get_procedimentos_info(codigos, competencia)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return {
+        codigo: {k: v for k, v in info.items() if k != 'raw'}
+        for codigo, info in infos.items()
+    }
+
+def _cached_sigtap(endpoint: str, competencia: Optional[str], calcular):
+    """Resposta SIGTAP em cache pela competência efetiva e sua versão"""
+    alvo = competencia_sigtap(competencia)
+    return cached(f'sigtap/{endpoint}', {'competencia': alvo}, lambda: versoes_dados(sigtap=alvo), calcular)
+
 @router.get("/estatisticas")
 def get_stats(competencia: Optional[str] = None):
     """Retorna estatísticas da tabela"""
     service = get_sigtap_filter_service()
-    return service.get_estatisticas(competencia)
+    return _cached_sigtap('estatisticas', competencia, lambda: service.get_estatisticas(competencia))
 
 @router.get("/cbos")
 def list_cbos(competencia: Optional[str] = None):
     service = get_sigtap_filter_service()
-    return service.get_cbos(competencia)
+    return _cached_sigtap('cbos', competencia, lambda: service.get_cbos(competencia))
 
 @router.get("/servicos")
 def list_servicos(competencia: Optional[str] = None):
     service = get_sigtap_filter_service()
-    return service.get_servicos(competencia)
+    return _cached_sigtap('servicos', competencia, lambda: service.get_servicos(competencia))
 
 @router.get("/registros")
 def list_registros(competencia: Optional[str] = None):
     """Lista todos os tipos de registros disponíveis (BPAI, BPAC, etc)"""
     service = get_sigtap_filter_service()
-    return service.get_registros(competencia)
+    return _cached_sigtap('registros', competencia, lambda: service.get_registros(competencia))
@@ -5,7 +5,10 @@ Adaptado de Django para FastAPI
 import requests
 import jwt
 import logging
-from time import time
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import time, monotonic, sleep
 from typing import Optional, Dict, Any, List
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
@@ -27,6 +30,9 @@ except ImportError:
     logger.warning("SIGTAP Filter Service não disponível - validação de procedimentos desabilitada")
     SIGTAP_AVAILABLE = False
 
+from services import bpa_columnar
+from services.job_errors import JobCancelled
+
 
 # ========== CONFIGURAÇÃO ==========
 
@@ -44,6 +50,50 @@ class BiServerConfig:
     TIMEOUT: int = int(os.getenv('BISERVER_TIMEOUT', '30'))
     # Modo mock para desenvolvimento quando API não está disponível
     MOCK_MODE: bool = os.getenv('BISERVER_MOCK_MODE', 'false').lower() == 'true'  # Desativado - API funcionando!
+    # Paginação concorrente: páginas simultâneas e limite de requisições/segundo
+    MAX_IN_FLIGHT: int = int(os.getenv('BISERVER_MAX_IN_FLIGHT', '4'))
+    RATE_LIMIT: float = float(os.getenv('BISERVER_RATE_LIMIT', '4'))
+    PAGE_SIZE: int = 500  # Página parcial (< PAGE_SIZE) indica a última página
+
+
+class TokenBucket:
+    """
+    Rate limiter token bucket (thread-safe).
+
+    Libera até `capacity` requisições imediatas e depois `rate` por segundo.
+    Substitui o sleep fixo entre páginas.
+    """
+
+    def __init__(self, rate: float, capacity: int = None):
+        self.rate = max(float(rate), 0.001)
+        self.capacity = float(capacity or max(1, int(rate)))
+        self._tokens = self.capacity
+        self._updated = monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Bloqueia até haver um token disponível"""
+        while True:
+            with self._lock:
+                now = monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            sleep(wait)
+
+
+def _put_unless_stopped(out: queue.Queue, item: Any, stop: threading.Event) -> bool:
+    """Coloca `item` na fila limitada, desistindo se `stop` for sinalizado"""
+    while not stop.is_set():
+        try:
+            out.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
 
 
 # ========== SCHEMAS ==========
@@ -296,6 +346,159 @@ class MockDataGenerator:
 
 # ========== SERVIÇO DE EXTRAÇÃO ==========
 
+class StreamingBPAClassifier:
+    """
+    Classificação BPA-I/BPA-C incremental, página a página.
+
+    Aplica as mesmas regras de `_classify_and_convert_bpa` (dual 01+02 -> BPA-C),
+    mas mantém apenas o dicionário de agregação BPA-C entre as páginas: a memória
+    cresce com o número de chaves (CNES, COMP, CBO, PA, IDADE), não com o volume
+    da competência. Os registros BPA-I de cada página são devolvidos por `feed`.
+
+    Os BPA-C de `feed` ficam pendentes até `confirmar` (chamado depois de gravar
+    os BPA-I da página); `descartar` abandona os de uma página não gravada e
+    `finish` confirma o que restar.
+    """
+
+    def __init__(self, service: 'BiServerExtractionService', competencia: str = None):
+        self.service = service
+        self.competencia = service._normalize_competencia(competencia or '')
+        self.enabled = service.enable_sigtap_validation
+        self.registro_map = service.sigtap._get_procedimento_registro_map() if self.enabled else {}
+        self.lookup = (
+            bpa_columnar.RegistroLookup.for_map(self.registro_map)
+            if self.enabled and bpa_columnar.NUMPY_AVAILABLE else None
+        )
+        self.grupos: Dict[tuple, Dict] = {}
+        self.pendentes: Dict[tuple, Dict] = {}  # BPA-C das páginas ainda não confirmadas
+        self._key_cache: Dict[tuple, tuple] = {}  # campos brutos -> chave BPA-C (caminho colunar)
+        self.total = 0
+        self.bpa_i = 0
+        self.bpa_c_raw = 0
+        self.converted = 0
+        self.removed_sem_registro = 0
+
+    def feed(self, records: List[Dict]) -> List[Dict]:
+        """Classifica uma página; retorna os BPA-I e acumula os BPA-C"""
+        self.total += len(records)
+        if not self.enabled:
+            self.bpa_i += len(records)
+            return records
+
+        if self.lookup is not None:
+            return self._feed_columnar(records)
+
+        bpa_i_records = []
+        for rec in records:
+            proc = rec.get('prd_pa', rec.get('procedimento', ''))
+            registros = self.registro_map.get(proc, set())
+
+            has_bpa_c = '01' in registros
+            has_bpa_i = '02' in registros
+
+            if has_bpa_c:
+                if has_bpa_i:
+                    self.converted += 1
+                self.service._accumulate_bpac(
+                    self.pendentes,
+                    self.service._convert_record_to_bpac(rec, fallback_competencia=self.competencia)
+                )
+                self.bpa_c_raw += 1
+            elif has_bpa_i:
+                bpa_i_records.append(rec)
+            else:
+                self.removed_sem_registro += 1
+
+        self.bpa_i += len(bpa_i_records)
+        return bpa_i_records
+
+    def _feed_columnar(self, records: List[Dict]) -> List[Dict]:
+        """`feed` com máscaras NumPy e soma agrupada dos BPA-C da página"""
+        tipos = self.lookup.classify(records)
+        bpa_c_mask = (tipos & bpa_columnar.SO_BPA_C) != 0
+        bpa_i_records = bpa_columnar.select(records, tipos == bpa_columnar.SO_BPA_I)
+        bpa_c_records = bpa_columnar.select(records, bpa_c_mask)
+
+        self.converted += bpa_columnar.count(tipos == bpa_columnar.DUAL)
+        self.removed_sem_registro += bpa_columnar.count(tipos == bpa_columnar.SEM_REGISTRO)
+        self.bpa_c_raw += len(bpa_c_records)
+        self.bpa_i += len(bpa_i_records)
+
+        bpa_columnar.accumulate_bpac(
+            self.pendentes,
+            bpa_c_records,
+            key_fn=lambda rec: self.service._bpac_key(rec, self.competencia),
+            convert_fn=lambda rec: self.service._convert_record_to_bpac(rec, fallback_competencia=self.competencia),
+            key_from_fields=self.service._bpac_key_from_fields,
+            key_cache=self._key_cache
+        )
+        return bpa_i_records
+
+    def confirmar(self) -> None:
+        """Soma ao agregado BPA-C os pendentes das páginas alimentadas desde a última confirmação"""
+        for chave, rec in self.pendentes.items():
+            existing = self.grupos.get(chave)
+            if existing is None:
+                self.grupos[chave] = rec
+            else:
+                existing['prd_qt_p'] += rec['prd_qt_p']
+                existing['_aggregation_count'] += rec['_aggregation_count']
+        self.pendentes = {}
+
+    def descartar(self) -> None:
+        """Abandona os BPA-C pendentes (página cujos BPA-I não foram gravados)"""
+        self.pendentes = {}
+
+    def finish(self) -> Dict[str, Any]:
+        """Retorna {'bpa_c': agregados, 'stats': ...} no formato de `_classify_and_convert_bpa`"""
+        self.confirmar()
+        if not self.enabled or not self.total:
+            logger.info(
+                "[TRATAMENTO] SIGTAP desabilitado ou sem registros. "
+                "Critérios: sem conversão/sem agregação, mantém todos em BPA-I."
+            )
+            return {
+                'bpa_c': [],
+                'stats': {
+                    'total': self.total,
+                    'bpa_i': self.total,
+                    'bpa_c': 0,
+                    'converted': 0,
+                    'removed_sem_registro': 0,
+                    'removed': 0
+                }
+            }
+
+        bpa_c_aggregated = list(self.grupos.values())
+
+        logger.info(f"📊 Classificação: {self.bpa_i} BPA-I, {len(bpa_c_aggregated)} BPA-C")
+        logger.info(f"   🔄 Convertidos (dual): {self.converted}")
+        if self.removed_sem_registro > 0:
+            logger.info(f"   ⚠ {self.removed_sem_registro} sem registro BPA (e-SUS, RAAS, etc)")
+        logger.info(
+            "[TRATAMENTO] Critérios: tipo_registro SIGTAP (01+02=dual->BPA-C), "
+            "agregação BPA-C por chave (CNES, COMP, CBO, PA, IDADE)."
+        )
+        logger.info(
+            f"[TRATAMENTO] Estatísticas: total={self.total}, bpa_i={self.bpa_i}, "
+            f"bpa_c_raw={self.bpa_c_raw}, bpa_c_agregado={len(bpa_c_aggregated)}, "
+            f"convertidos={self.converted}, removidos={self.removed_sem_registro}"
+        )
+
+        return {
+            'bpa_c': bpa_c_aggregated,
+            'stats': {
+                'total': self.total,
+                'bpa_i': self.bpa_i,
+                'bpa_c': len(bpa_c_aggregated),
+                'bpa_c_before_aggregation': self.bpa_c_raw,
+                'converted': self.converted,
+                'removed_sem_registro': self.removed_sem_registro,
+                'removed': self.removed_sem_registro
+            }
+        }
+
+
 class BiServerExtractionService:
     """
     Serviço de extração de dados do BiServer
@@ -386,19 +589,25 @@ class BiServerExtractionService:
         bpa_c_records = []
         removed_sem_registro = 0
         
-        for rec in records:
-            proc = rec.get('prd_pa', rec.get('procedimento', ''))
-            
-            # Separa por tipo de registro
-            registros = registro_map.get(proc, set())
-            
-            if '02' in registros:  # BPA-I
-                bpa_i_records.append(rec)
-            elif '01' in registros:  # BPA-C
-                bpa_c_records.append(rec)
-            else:
-                # Não tem registro BPA-I nem BPA-C (pode ser e-SUS, RAAS, etc)
-                removed_sem_registro += 1
+        if bpa_columnar.NUMPY_AVAILABLE:
+            tipos = bpa_columnar.RegistroLookup.for_map(registro_map).classify(records)
+            bpa_i_records = bpa_columnar.select(records, (tipos & bpa_columnar.SO_BPA_I) != 0)
+            bpa_c_records = bpa_columnar.select(records, tipos == bpa_columnar.SO_BPA_C)
+            removed_sem_registro = bpa_columnar.count(tipos == bpa_columnar.SEM_REGISTRO)
+        else:
+            for rec in records:
+                proc = rec.get('prd_pa', rec.get('procedimento', ''))
+                
+                # Separa por tipo de registro
+                registros = registro_map.get(proc, set())
+                
+                if '02' in registros:  # BPA-I
+                    bpa_i_records.append(rec)
+                elif '01' in registros:  # BPA-C
+                    bpa_c_records.append(rec)
+                else:
+                    # Não tem registro BPA-I nem BPA-C (pode ser e-SUS, RAAS, etc)
+                    removed_sem_registro += 1
         
         logger.info(f"📊 Separação: {len(bpa_i_records)} BPA-I, {len(bpa_c_records)} BPA-C")
         if removed_sem_registro > 0:
@@ -455,8 +664,7 @@ class BiServerExtractionService:
         except Exception:
             return '000'
 
-    def _convert_record_to_bpac(self, record: Dict, fallback_competencia: str = '') -> Dict:
-        """Converte um registro para formato BPA-C"""
+    def _bpac_competencia(self, record: Dict, fallback_competencia: str = '') -> str:
         prd_cmp = (
             record.get('prd_cmp')
             or record.get('competencia')
@@ -465,8 +673,9 @@ class BiServerExtractionService:
         )
         if not prd_cmp and fallback_competencia:
             prd_cmp = fallback_competencia
-        prd_cmp = self._normalize_competencia(prd_cmp)
+        return self._normalize_competencia(prd_cmp)
 
+    def _bpac_idade(self, record: Dict, prd_cmp: str) -> str:
         data_ref = (
             record.get('prd_dtaten')
             or record.get('data_atendimento')
@@ -486,6 +695,26 @@ class BiServerExtractionService:
                 or '',
                 data_ref
             )
+        return str(idade or '000').zfill(3)[:3]
+
+    def _bpac_key(self, record: Dict, fallback_competencia: str = '') -> tuple:
+        """Chave de agregação (uid, cmp, cbo, pa, idade) sem montar o registro BPA-C"""
+        prd_cmp = self._bpac_competencia(record, fallback_competencia)
+        return (
+            record.get('prd_uid') or record.get('cnes') or '',
+            prd_cmp,
+            record.get('prd_cbo') or record.get('cbo') or '',
+            record.get('prd_pa') or record.get('procedimento') or '',
+            self._bpac_idade(record, prd_cmp)
+        )
+
+    def _bpac_key_from_fields(self, uid: str, prd_cmp: str, cbo: str, pa: str, idade: str) -> tuple:
+        """`_bpac_key` quando os cinco campos vêm preenchidos (formato do BiServer)"""
+        return (uid, self._normalize_competencia(prd_cmp), cbo, pa, str(idade).zfill(3)[:3])
+
+    def _convert_record_to_bpac(self, record: Dict, fallback_competencia: str = '') -> Dict:
+        """Converte um registro para formato BPA-C"""
+        prd_cmp = self._bpac_competencia(record, fallback_competencia)
 
         return {
             'prd_uid': record.get('prd_uid') or record.get('cnes') or '',
@@ -493,34 +722,38 @@ class BiServerExtractionService:
             'prd_cnsmed': record.get('prd_cnsmed') or record.get('cns_profissional') or '',
             'prd_cbo': record.get('prd_cbo') or record.get('cbo') or '',
             'prd_pa': record.get('prd_pa') or record.get('procedimento') or '',
-            'prd_idade': str(idade or '000').zfill(3)[:3],
+            'prd_idade': self._bpac_idade(record, prd_cmp),
             'prd_qt_p': record.get('prd_qt_p') or record.get('quantidade') or 1,
             'prd_org': record.get('prd_org') or 'BPC_CONV'
         }
 
+    @staticmethod
+    def _accumulate_bpac(grupos: Dict[tuple, Dict], rec: Dict) -> None:
+        """Soma um registro BPA-C no agrupamento por chave única"""
+        key = (
+            rec.get('prd_uid', ''),
+            rec.get('prd_cmp', ''),
+            rec.get('prd_cbo', ''),
+            rec.get('prd_pa', ''),
+            rec.get('prd_idade', '000')
+        )
+
+        if key not in grupos:
+            grupos[key] = rec.copy()
+            grupos[key]['prd_qt_p'] = 0
+            grupos[key]['_aggregation_count'] = 0
+
+        grupos[key]['prd_qt_p'] += int(rec.get('prd_qt_p', 1) or 1)
+        grupos[key]['_aggregation_count'] += 1
+
     def _aggregate_bpac_records(self, records: List[Dict]) -> List[Dict]:
         """Agrega registros BPA-C por chave única e soma quantidades"""
         if not records:
             return []
 
         grupos: Dict[tuple, Dict] = {}
-
         for rec in records:
-            key = (
-                rec.get('prd_uid', ''),
-                rec.get('prd_cmp', ''),
-                rec.get('prd_cbo', ''),
-                rec.get('prd_pa', ''),
-                rec.get('prd_idade', '000')
-            )
-
-            if key not in grupos:
-                grupos[key] = rec.copy()
-                grupos[key]['prd_qt_p'] = 0
-                grupos[key]['_aggregation_count'] = 0
-
-            grupos[key]['prd_qt_p'] += int(rec.get('prd_qt_p', 1) or 1)
-            grupos[key]['_aggregation_count'] += 1
+            self._accumulate_bpac(grupos, rec)
 
         return list(grupos.values())
 
@@ -528,78 +761,11 @@ class BiServerExtractionService:
         """
         Classifica registros e converte para BPA-C quando procedimento é dual (01+02).
         """
-        competencia = self._normalize_competencia(competencia or '')
-        if not self.enable_sigtap_validation or not records:
-            logger.info(
-                "[TRATAMENTO] SIGTAP desabilitado ou sem registros. "
-                "Critérios: sem conversão/sem agregação, mantém todos em BPA-I."
-            )
-            return {
-                'bpa_i': records,
-                'bpa_c': [],
-                'stats': {
-                    'total': len(records),
-                    'bpa_i': len(records),
-                    'bpa_c': 0,
-                    'converted': 0,
-                    'removed_sem_registro': 0,
-                    'removed': 0
-                }
-            }
-
-        registro_map = self.sigtap._get_procedimento_registro_map()
-
-        bpa_i_records = []
-        bpa_c_raw = []
-        removed_sem_registro = 0
-        converted_count = 0
-
-        for rec in records:
-            proc = rec.get('prd_pa', rec.get('procedimento', ''))
-            registros = registro_map.get(proc, set())
-
-            has_bpa_c = '01' in registros
-            has_bpa_i = '02' in registros
-
-            if has_bpa_c and has_bpa_i:
-                bpa_c_raw.append(self._convert_record_to_bpac(rec, fallback_competencia=competencia))
-                converted_count += 1
-            elif has_bpa_i:
-                bpa_i_records.append(rec)
-            elif has_bpa_c:
-                bpa_c_raw.append(self._convert_record_to_bpac(rec, fallback_competencia=competencia))
-            else:
-                removed_sem_registro += 1
-
-        bpa_c_aggregated = self._aggregate_bpac_records(bpa_c_raw)
-
-        logger.info(f"📊 Classificação: {len(bpa_i_records)} BPA-I, {len(bpa_c_aggregated)} BPA-C")
-        logger.info(f"   🔄 Convertidos (dual): {converted_count}")
-        if removed_sem_registro > 0:
-            logger.info(f"   ⚠ {removed_sem_registro} sem registro BPA (e-SUS, RAAS, etc)")
-        logger.info(
-            "[TRATAMENTO] Critérios: tipo_registro SIGTAP (01+02=dual->BPA-C), "
-            "agregação BPA-C por chave (CNES, COMP, CBO, PA, IDADE)."
-        )
-        logger.info(
-            f"[TRATAMENTO] Estatísticas: total={len(records)}, bpa_i={len(bpa_i_records)}, "
-            f"bpa_c_raw={len(bpa_c_raw)}, bpa_c_agregado={len(bpa_c_aggregated)}, "
-            f"convertidos={converted_count}, removidos={removed_sem_registro}"
-        )
-
-        return {
-            'bpa_i': bpa_i_records,
-            'bpa_c': bpa_c_aggregated,
-            'stats': {
-                'total': len(records),
-                'bpa_i': len(bpa_i_records),
-                'bpa_c': len(bpa_c_aggregated),
-                'bpa_c_before_aggregation': len(bpa_c_raw),
-                'converted': converted_count,
-                'removed_sem_registro': removed_sem_registro,
-                'removed': removed_sem_registro
-            }
-        }
+        classifier = StreamingBPAClassifier(self, competencia)
+        bpa_i_records = classifier.feed(records)
+        separated = classifier.finish()
+        separated['bpa_i'] = bpa_i_records
+        return separated
     
     def _filter_records_by_sigtap(self, records: List[Dict], tipo_bpa: str, cnes: str = None) -> tuple[List[Dict], int]:
         """
@@ -629,15 +795,21 @@ class BiServerExtractionService:
         valid_records = []
         removed_tipo_errado = 0
         
-        for rec in records:
-            proc = rec.get('prd_pa', rec.get('procedimento', ''))
-            
-            # Verifica se pode ser registrado neste tipo de BPA
-            registros_permitidos = registro_map.get(proc, set())
-            if tipo_bpa in registros_permitidos:
-                valid_records.append(rec)
-            else:
-                removed_tipo_errado += 1
+        bit = {'02': bpa_columnar.SO_BPA_I, '01': bpa_columnar.SO_BPA_C}.get(tipo_bpa)
+        if bpa_columnar.NUMPY_AVAILABLE and bit is not None:
+            tipos = bpa_columnar.RegistroLookup.for_map(registro_map).classify(records)
+            valid_records = bpa_columnar.select(records, (tipos & bit) != 0)
+            removed_tipo_errado = original_count - len(valid_records)
+        else:
+            for rec in records:
+                proc = rec.get('prd_pa', rec.get('procedimento', ''))
+                
+                # Verifica se pode ser registrado neste tipo de BPA
+                registros_permitidos = registro_map.get(proc, set())
+                if tipo_bpa in registros_permitidos:
+                    valid_records.append(rec)
+                else:
+                    removed_tipo_errado += 1
         
         removed_count = original_count - len(valid_records)
         
@@ -662,7 +834,8 @@ class BiServerExtractionService:
         endpoint: str, 
         params: dict, 
         max_retries: int = 5,
-        base_delay: float = 2.0
+        base_delay: float = 2.0,
+        stop: Optional[threading.Event] = None
     ) -> Dict[str, Any]:
         """
         Busca uma página da API com retry manual e backoff exponencial.
@@ -672,14 +845,17 @@ class BiServerExtractionService:
             params: Parâmetros da requisição
             max_retries: Número máximo de tentativas
             base_delay: Delay base entre tentativas (será multiplicado exponencialmente)
+            stop: Evento que interrompe as tentativas (inclusive durante o backoff)
             
         Returns:
             Resposta da API
         """
-        import time
+        stop = stop or threading.Event()
         
         last_error = None
         for attempt in range(max_retries):
+            if stop.is_set():
+                raise Exception(f"Busca da página {params.get('page')} interrompida")
             try:
                 # Usa retry=False pois faremos retry manual com mais controle
                 result = self.client.get(endpoint, params=params, retry=False, timeout=120)
@@ -692,7 +868,8 @@ class BiServerExtractionService:
                 if '502' in error_str or '503' in error_str or '504' in error_str or 'timeout' in error_str:
                     delay = base_delay * (2 ** attempt) + random.uniform(0, 1)
                     logger.warning(f"⚠️ Tentativa {attempt + 1}/{max_retries} falhou (502/timeout). Aguardando {delay:.1f}s...")
-                    time.sleep(delay)
+                    if stop.wait(delay):
+                        raise Exception(f"Busca da página {params.get('page')} interrompida durante o backoff")
                 else:
                     # Outros erros, não faz retry
                     raise
@@ -700,20 +877,235 @@ class BiServerExtractionService:
         # Esgotou tentativas
         raise Exception(f"Máximo de tentativas ({max_retries}) excedido. Último erro: {last_error}")
     
+    def _iter_pages(
+        self,
+        endpoint: str,
+        base_params: dict,
+        executor: ThreadPoolExecutor,
+        limiter: TokenBucket,
+        max_in_flight: int,
+        max_pages: int = 500,
+        label: str = 'BPA',
+        stop: Optional[threading.Event] = None
+    ):
+        """
+        Busca páginas em paralelo (janela de até `max_in_flight`) e as entrega em ordem.
+
+        Cada página usa `_fetch_page_with_retry` (mesmo backoff por página) após
+        obter um token do `limiter`. Ao ver a primeira página vazia ou parcial
+        cancela as páginas especulativas restantes e aciona `stop`, que
+        interrompe as que já estão em execução (inclusive no backoff), antes de
+        entregar a última página. Erros são relançados na ordem em que a página
+        falha.
+
+        Yields:
+            Tupla (page, registros)
+        """
+        stop = stop or threading.Event()
+
+        def fetch(page: int) -> Dict[str, Any]:
+            limiter.acquire()
+            return self._fetch_page_with_retry(endpoint, dict(base_params, page=page), stop=stop)
+
+        def encerrar() -> None:
+            stop.set()
+            for future in pending.values():
+                future.cancel()
+            pending.clear()
+
+        pending = {}
+        next_page = 0
+        try:
+            for page in range(max_pages):
+                while next_page < max_pages and len(pending) < max_in_flight:
+                    pending[next_page] = executor.submit(fetch, next_page)
+                    next_page += 1
+
+                result = pending.pop(page).result()
+                page_records = result.get("registros", [])
+
+                if not page_records:
+                    logger.info(f"📭 Página {page} vazia. Fim da extração {label}.")
+                    return
+
+                if len(page_records) < BiServerConfig.PAGE_SIZE:
+                    logger.info(f"📭 Página {page} parcial ({len(page_records)} < {BiServerConfig.PAGE_SIZE}). Provavelmente última página {label}.")
+                    encerrar()
+                    yield page, page_records
+                    return
+
+                yield page, page_records
+        finally:
+            encerrar()
+    
+    def _produce_odonto_pages(
+        self,
+        endpoint: str,
+        base_params: dict,
+        executor: ThreadPoolExecutor,
+        limiter: TokenBucket,
+        max_in_flight: int,
+        max_pages: int,
+        out: queue.Queue,
+        stop: threading.Event,
+        fetch_stop: Optional[threading.Event] = None
+    ) -> None:
+        """
+        Extrai as páginas de odonto para a fila `out` (None ao final); em caso de erro mantém o que já veio.
+
+        `fetch_stop` é repassado a `_iter_pages` para que o consumidor possa
+        interromper as buscas em andamento ao encerrar.
+        """
+        total = 0
+        try:
+            for page, page_records in self._iter_pages(
+                endpoint, dict(base_params, tables="odonto"), executor, limiter,
+                max_in_flight, max_pages, label='ODONTO', stop=fetch_stop
+            ):
+                # Marca registros como vindos de odonto (para debug)
+                for rec in page_records:
+                    rec['_source'] = 'odonto'
+                total += len(page_records)
+                logger.info(f"🦷 Página {page}: {len(page_records)} registros odonto (total odonto: {total})")
+                if not _put_unless_stopped(out, page_records, stop):
+                    return
+        except Exception as e:
+            logger.error(f"❌ Erro na extração ODONTO: {e}")
+            # Continua mesmo se falhar odonto, já temos os dados de BPA
+            logger.warning(f"⚠️ Continuando sem mais dados de odonto")
+        finally:
+            _put_unless_stopped(out, None, stop)
+    
+    def iter_extracted_pages(
+        self,
+        cnes: str,
+        competencia: str,
+        limit: int = None,
+        offset: int = 0,
+        max_in_flight: int = None,
+        counters: Dict[str, int] = None
+    ):
+        """
+        Gera as páginas brutas da competência: primeiro BPA, depois odonto (UPAs).
+
+        As páginas de odonto são buscadas em paralelo e passam por uma fila
+        limitada, então nunca há mais que algumas páginas em memória. `offset`
+        e `limit` são aplicados sobre o fluxo; ao atingir o limite a extração
+        para. `counters` (opcional) recebe os totais extraídos em 'bpa' e 'odonto'.
+
+        Erro na primeira página BPA é relançado; em páginas seguintes a extração
+        termina com os dados já entregues.
+        """
+        counters = counters if counters is not None else {}
+        counters.update(bpa=0, odonto=0)
+
+        # Verifica se é UPA para também extrair odonto
+        is_upa = cnes in UPAS_COM_ODONTO
+        if is_upa:
+            logger.info(f"🦷 UPA detectada (CNES {cnes}) - também extrairá dados de ODONTO")
+        
+        # Formata competência
+        comp_formatada = f"{competencia[:4]}-{competencia[4:6]}" if len(competencia) == 6 else competencia
+        
+        endpoint = "/api/bpa/data"
+        max_pages = 500  # Limite alto para extrair tudo (500 páginas * 10k = 5M registros)
+        max_in_flight = max(1, max_in_flight or BiServerConfig.MAX_IN_FLIGHT)
+        base_params = {"cnes": cnes, "competencia": comp_formatada}
+        end = offset + limit if limit is not None else None
+        position = 0
+
+        def window(page_records: List[Dict]) -> List[Dict]:
+            nonlocal position
+            start = position
+            position += len(page_records)
+            lo = max(offset - start, 0)
+            hi = len(page_records) if end is None else min(end - start, len(page_records))
+            if lo == 0 and hi == len(page_records):
+                return page_records
+            return page_records[lo:hi] if lo < hi else []
+
+        def limit_reached() -> bool:
+            return end is not None and position >= end
+        
+        limiter = TokenBucket(BiServerConfig.RATE_LIMIT, capacity=max_in_flight)
+        page_executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="biserver-page")
+        stream_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="biserver-odonto")
+        odonto_pages = queue.Queue(maxsize=max_in_flight)
+        stop = threading.Event()
+        odonto_fetch_stop = threading.Event()
+        
+        try:
+            # ========== EXTRAÇÃO ODONTO (apenas para UPAs, em paralelo) ==========
+            if is_upa:
+                logger.info(f"🦷 Iniciando extração de ODONTO para UPA (em paralelo)...")
+                stream_executor.submit(
+                    self._produce_odonto_pages,
+                    endpoint, base_params, page_executor, limiter, max_in_flight, max_pages,
+                    odonto_pages, stop, odonto_fetch_stop
+                )
+            
+            # ========== EXTRAÇÃO PRINCIPAL (BPA) ==========
+            logger.info(f"📥 Iniciando extração de BPA (até {max_in_flight} páginas simultâneas)...")
+            pages = self._iter_pages(
+                endpoint, base_params, page_executor, limiter, max_in_flight, max_pages, label='BPA'
+            )
+            try:
+                while True:
+                    try:
+                        page, page_records = next(pages)
+                    except StopIteration:
+                        break
+                    except Exception as e:
+                        logger.error(f"❌ Erro na extração BPA: {e}")
+                        if counters['bpa']:
+                            logger.warning(f"⚠️ Continuando com {counters['bpa']} registros extraídos antes do erro")
+                            break
+                        raise
+                    counters['bpa'] += len(page_records)
+                    logger.info(f"✅ Página {page}: {len(page_records)} registros (total: {counters['bpa']})")
+                    chunk = window(page_records)
+                    if chunk:
+                        yield chunk
+                    if limit_reached():
+                        return
+            finally:
+                pages.close()
+            
+            logger.info(f"📊 Total BPA extraído: {counters['bpa']} registros")
+            
+            if is_upa:
+                while True:
+                    page_records = odonto_pages.get()
+                    if page_records is None:
+                        break
+                    counters['odonto'] += len(page_records)
+                    chunk = window(page_records)
+                    if chunk:
+                        yield chunk
+                    if limit_reached():
+                        return
+                logger.info(f"🦷 Total ODONTO extraído: {counters['odonto']} registros")
+        finally:
+            stop.set()
+            odonto_fetch_stop.set()
+            stream_executor.shutdown(wait=True)
+            page_executor.shutdown(wait=True, cancel_futures=True)
+    
     def extract_and_separate_bpa(
         self,
         cnes: str,
         competencia: str,
         limit: int = None,  # None = sem limite
-        offset: int = 0
+        offset: int = 0,
+        max_in_flight: int = None
     ) -> Dict[str, Any]:
         """
         NOVO MÉTODO UNIFICADO - Extrai todos os dados e separa BPA-I de BPA-C
         
         A API do BiServer retorna TODOS os registros juntos (BPA-I + BPA-C misturados).
         Este método:
-        1. Extrai dados da API com paginação incremental e delays
-        2. Se for UPA, também extrai dados de odonto (tables='odonto')
+        1. Extrai dados da API com páginas em paralelo e rate limit (token bucket)
+        2. Se for UPA, extrai dados de odonto (tables='odonto') simultaneamente
         3. Usa SIGTAP para separar por tipo_registro
         4. Retorna BPA-I e BPA-C separados
         
@@ -722,140 +1114,35 @@ class BiServerExtractionService:
             competencia: Competência no formato YYYYMM (ex: 202512)
             limit: Limite de registros (None = sem limite, extrai tudo)
             offset: Offset para paginação
+            max_in_flight: Páginas simultâneas (None = BiServerConfig.MAX_IN_FLIGHT)
             
         Returns:
             Dict com bpa_i, bpa_c e estatísticas
         """
-        import time
-        
         try:
             logger.info(f"🔄 Extraindo e separando BPA: CNES={cnes}, Competência={competencia}")
             
-            # Verifica se é UPA para também extrair odonto
-            is_upa = cnes in UPAS_COM_ODONTO
-            if is_upa:
-                logger.info(f"🦷 UPA detectada (CNES {cnes}) - também extrairá dados de ODONTO")
-            
-            # Formata competência
-            comp_formatada = f"{competencia[:4]}-{competencia[4:6]}" if len(competencia) == 6 else competencia
-            
-            endpoint = "/api/bpa/data"
-            all_records = []
-            page = 0
-            max_pages = 500  # Limite alto para extrair tudo (500 páginas * 10k = 5M registros)
-            page_delay = 1.0  # Delay entre páginas para não sobrecarregar
-            
-            # ========== EXTRAÇÃO PRINCIPAL (BPA) ==========
-            logger.info(f"📥 Iniciando extração de BPA...")
-            while page < max_pages:
-                params = {
-                    "cnes": cnes,
-                    "competencia": comp_formatada,
-                    "page": page
-                }
-                
-                logger.info(f"📥 Buscando página {page} (BPA)...")
-                
-                try:
-                    result = self._fetch_page_with_retry(endpoint, params)
-                    page_records = result.get("registros", [])
-                    
-                    if not page_records:
-                        logger.info(f"📭 Página {page} vazia. Fim da extração BPA.")
-                        break
-                    
-                    all_records.extend(page_records)
-                    logger.info(f"✅ Página {page}: {len(page_records)} registros (total: {len(all_records)})")
-                    
-                    # Se a página veio com menos registros que o esperado, provavelmente é a última
-                    if len(page_records) < 500:
-                        logger.info(f"📭 Página {page} parcial ({len(page_records)} < 500). Provavelmente última página.")
-                        break
-                    
-                    page += 1
-                    
-                    # Delay entre páginas para não sobrecarregar o servidor
-                    if page < max_pages:
-                        time.sleep(page_delay)
-                        
-                except Exception as e:
-                    logger.error(f"❌ Erro na página {page}: {e}")
-                    if all_records:
-                        logger.warning(f"⚠️ Continuando com {len(all_records)} registros extraídos antes do erro")
-                        break
-                    else:
-                        raise
-            
-            bpa_count = len(all_records)
-            logger.info(f"📊 Total BPA extraído: {bpa_count} registros")
+            counters = {}
+            classifier = StreamingBPAClassifier(self, competencia)
+            bpa_i_records = []
+            for page_records in self.iter_extracted_pages(
+                cnes, competencia, limit=limit, offset=offset,
+                max_in_flight=max_in_flight, counters=counters
+            ):
+                # Separa BPA-I de BPA-C usando SIGTAP (dual → BPA-C) e agrega para evitar repetições
+                bpa_i_records.extend(classifier.feed(page_records))
             
-            # ========== EXTRAÇÃO ODONTO (apenas para UPAs) ==========
-            odonto_count = 0
-            if is_upa:
-                logger.info(f"🦷 Iniciando extração de ODONTO para UPA...")
-                page = 0
-                
-                while page < max_pages:
-                    params = {
-                        "cnes": cnes,
-                        "competencia": comp_formatada,
-                        "page": page,
-                        "tables": "odonto"  # Parâmetro para extrair da tabela odonto
-                    }
-                    
-                    logger.info(f"🦷 Buscando página {page} (ODONTO)...")
-                    
-                    try:
-                        result = self._fetch_page_with_retry(endpoint, params)
-                        page_records = result.get("registros", [])
-                        
-                        if not page_records:
-                            logger.info(f"📭 Página {page} vazia. Fim da extração ODONTO.")
-                            break
-                        
-                        # Marca registros como vindos de odonto (para debug)
-                        for rec in page_records:
-                            rec['_source'] = 'odonto'
-                        
-                        all_records.extend(page_records)
-                        odonto_count += len(page_records)
-                        logger.info(f"🦷 Página {page}: {len(page_records)} registros odonto (total odonto: {odonto_count})")
-                        
-                        if len(page_records) < 500:
-                            logger.info(f"📭 Página {page} parcial. Provavelmente última página odonto.")
-                            break
-                        
-                        page += 1
-                        time.sleep(page_delay)
-                            
-                    except Exception as e:
-                        logger.error(f"❌ Erro na página {page} (odonto): {e}")
-                        # Continua mesmo se falhar odonto, já temos os dados de BPA
-                        logger.warning(f"⚠️ Continuando sem mais dados de odonto")
-                        break
-                
-                logger.info(f"🦷 Total ODONTO extraído: {odonto_count} registros")
-            
-            # ========== PROCESSAMENTO ==========
-            logger.info(f"📊 Total geral extraído: {len(all_records)} registros (BPA: {bpa_count}, Odonto: {odonto_count})")
-            
-            # Aplica offset e limit apenas se especificado
-            if limit is not None:
-                records = all_records[offset:offset + limit]
-            else:
-                records = all_records[offset:] if offset > 0 else all_records
+            odonto_count = counters['odonto']
+            logger.info(f"📊 Total geral extraído: {counters['bpa'] + odonto_count} registros (BPA: {counters['bpa']}, Odonto: {odonto_count})")
             
-            logger.info(f"📊 Processando: {len(records)} registros")
-            
-            # Separa BPA-I de BPA-C usando SIGTAP (dual → BPA-C) e agrega para evitar repetições
-            separated = self._classify_and_convert_bpa(records, cnes=cnes, competencia=competencia)
+            separated = classifier.finish()
             
             # Adiciona estatísticas de odonto
             separated['stats']['odonto'] = odonto_count
             
             return {
                 'success': True,
-                'bpa_i': separated['bpa_i'],
+                'bpa_i': bpa_i_records,
                 'bpa_c': separated['bpa_c'],
                 'stats': separated['stats'],
                 'message': f"Extraídos e separados: {separated['stats']['bpa_i']} BPA-I, {separated['stats']['bpa_c']} BPA-C" + (f" (incluindo {odonto_count} de odonto)" if odonto_count > 0 else "")
@@ -1254,6 +1541,8 @@ class BiServerExtractionService:
                 "message": f"Extraídos {len(all_records)} registros em {batch_number - 1} lotes"
             }
             
+        except JobCancelled:
+            raise
         except Exception as e:
             logger.error(f"Erro na extração completa: {e}")
             return {
@@ -1358,6 +1647,8 @@ class BiServerExtractionService:
                 "message": f"Extraídos {len(all_records)} registros em {batch_number - 1} lotes"
             }
             
+        except JobCancelled:
+            raise
         except Exception as e:
             logger.error(f"Erro na extração completa: {e}")
             return {
@@ -0,0 +1,207 @@
+"""
+Classificação BPA-I/BPA-C em colunas (NumPy)
+
+Converte os códigos de procedimento de uma página em ids inteiros (mapa
+construído uma vez por competência SIGTAP), obtém o tipo de registro de todas
+as linhas por indexação de um array e separa os registros por máscara. A
+agregação BPA-C (uid, cmp, cbo, pa, idade) vira uma soma agrupada (bincount).
+
+NumPy chega como dependência do pandas; sem ele, os chamadores mantêm os
+laços por registro.
+"""
+import threading
+from itertools import compress, repeat
+from operator import itemgetter
+from typing import Callable, Dict, List, Optional, Tuple
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    np = None
+    NUMPY_AVAILABLE = False
+
+# Tipo de registro por linha (bits): 1 = permite BPA-I (02), 2 = permite BPA-C (01)
+SEM_REGISTRO = 0
+SO_BPA_I = 1
+SO_BPA_C = 2
+DUAL = 3
+
+_get_pa = itemgetter('prd_pa')
+
+
+class RegistroLookup:
+    """Mapa procedimento -> tipo de registro (02/01) como array indexado por id"""
+
+    _cache_lock = threading.Lock()
+    _cached: Optional[tuple] = None  # (registro_map, lookup) da última competência usada
+
+    def __init__(self, registro_map: Dict[str, set]):
+        self.code_ids: Dict[str, int] = {}
+        tipos = [SEM_REGISTRO]  # id 0 = procedimento desconhecido
+        for codigo, registros in registro_map.items():
+            self.code_ids[codigo] = len(tipos)
+            tipos.append(
+                (SO_BPA_I if '02' in registros else 0) | (SO_BPA_C if '01' in registros else 0)
+            )
+        self.tipos = np.array(tipos, dtype=np.int8)
+
+    @classmethod
+    def for_map(cls, registro_map: Dict[str, set]) -> 'RegistroLookup':
+        """Reaproveita o lookup enquanto o mapa (índice SIGTAP) for o mesmo objeto"""
+        with cls._cache_lock:
+            cached = cls._cached
+            if cached is not None and cached[0] is registro_map:
+                return cached[1]
+            lookup = cls(registro_map)
+            cls._cached = (registro_map, lookup)
+            return lookup
+
+    def classify(self, records: List[Dict]) -> 'np.ndarray':
+        """Array int8 com o tipo de registro de cada linha (SEM_REGISTRO/SO_BPA_I/SO_BPA_C/DUAL)"""
+        try:
+            codigos = map(_get_pa, records)
+            ids = np.fromiter(map(self.code_ids.get, codigos, repeat(0)), dtype=np.int32, count=len(records))
+        except KeyError:
+            # Registros sem 'prd_pa' (formato antigo com 'procedimento')
+            codigos = (rec.get('prd_pa', rec.get('procedimento', '')) for rec in records)
+            ids = np.fromiter(map(self.code_ids.get, codigos, repeat(0)), dtype=np.int32, count=len(records))
+        return self.tipos[ids]
+
+
+def select(records: List[Dict], mask: 'np.ndarray') -> List[Dict]:
+    """Registros onde mask é verdadeiro, na ordem original"""
+    return list(compress(records, mask.tolist()))
+
+
+def count(mask: 'np.ndarray') -> int:
+    """Quantidade de posições verdadeiras da máscara"""
+    return int(np.count_nonzero(mask))
+
+
+# Campos que, preenchidos, determinam sozinhos a chave BPA-C (uid, cmp, cbo, pa, idade)
+BPAC_KEY_FIELDS = ('prd_uid', 'prd_cmp', 'prd_cbo', 'prd_pa', 'prd_idade')
+_get_bpac_key_fields = itemgetter(*BPAC_KEY_FIELDS)
+_get_qt = itemgetter('prd_qt_p')
+
+
+def _group_ids(
+    records: List[Dict],
+    key_fn: Callable[[Dict], tuple],
+    key_from_fields: Optional[Callable[..., tuple]] = None,
+    key_cache: Optional[Dict[tuple, tuple]] = None
+) -> Tuple['np.ndarray', List[tuple], List[int]]:
+    """
+    (id do grupo por linha, chave de cada grupo, primeira linha de cada grupo),
+    com os grupos numerados na ordem da primeira ocorrência.
+
+    Caminho rápido (registros do BiServer, com os 5 campos da chave preenchidos):
+    as tuplas brutas saem de um itemgetter e são agrupadas por dict em C;
+    key_from_fields (normalização de competência/idade) roda uma vez por tupla
+    distinta, e key_cache guarda o resultado entre páginas.
+    """
+    if key_cache is None:
+        key_cache = {}
+    n = len(records)
+    brutas = None
+    if key_from_fields is not None:
+        try:
+            brutas = list(map(_get_bpac_key_fields, records))
+        except KeyError:
+            brutas = None
+
+    if brutas is not None:
+        # Última escrita vence: cada tupla fica com a linha da sua primeira ocorrência
+        primeira_linha = dict(zip(reversed(brutas), range(n - 1, -1, -1)))
+        chaves: Dict[tuple, int] = {}
+        primeiras: List[int] = []
+        grupo_da_bruta: Dict[tuple, int] = {}
+        # dict.fromkeys preserva a ordem de primeira ocorrência das tuplas
+        for bruta in dict.fromkeys(brutas):
+            chave = key_cache.get(bruta)
+            if chave is None:
+                if not all(bruta):
+                    break  # campo vazio: normalização completa por registro
+                chave = key_cache[bruta] = key_from_fields(*bruta)
+            grupo = chaves.get(chave)
+            if grupo is None:
+                grupo = chaves[chave] = len(chaves)
+                primeiras.append(primeira_linha[bruta])
+            grupo_da_bruta[bruta] = grupo
+        else:
+            inverse = np.fromiter(map(grupo_da_bruta.__getitem__, brutas), dtype=np.int64, count=n)
+            return inverse, list(chaves), primeiras
+
+    chaves = {}
+    primeiras = []
+    inverse = np.empty(n, dtype=np.int64)
+    for linha, rec in enumerate(records):
+        chave = key_fn(rec)
+        grupo = chaves.get(chave)
+        if grupo is None:
+            grupo = chaves[chave] = len(chaves)
+            primeiras.append(linha)
+        inverse[linha] = grupo
+    return inverse, list(chaves), primeiras
+
+
+def _quantidades(records: List[Dict]) -> 'np.ndarray':
+    """prd_qt_p de cada linha como em `_convert_record_to_bpac` (fallback 'quantidade', depois 1)"""
+    n = len(records)
+    try:
+        brutas = list(map(_get_qt, records))
+        valores = {v: int(v) for v in set(brutas) if v}
+        if len(valores) == len(set(brutas)):
+            return np.fromiter(map(valores.__getitem__, brutas), dtype=np.int64, count=n)
+    except (KeyError, TypeError):
+        pass
+    return np.fromiter(
+        (int(rec.get('prd_qt_p') or rec.get('quantidade') or 1) for rec in records),
+        dtype=np.int64,
+        count=n
+    )
+
+
+def accumulate_bpac(
+    total: Dict[tuple, Dict],
+    records: List[Dict],
+    key_fn: Callable[[Dict], tuple],
+    convert_fn: Callable[[Dict], Dict],
+    key_from_fields: Optional[Callable[..., tuple]] = None,
+    key_cache: Optional[Dict[tuple, tuple]] = None
+) -> None:
+    """
+    Agrega uma página de registros BPA-C em `total`, somando prd_qt_p por chave.
+
+    Equivale a chamar `_accumulate_bpac` registro a registro: cada grupo é o
+    primeiro registro convertido da chave, com prd_qt_p somado e
+    `_aggregation_count`, e os grupos ficam na ordem da primeira ocorrência.
+    As somas da página saem de bincount, e só chaves novas no acumulado
+    convertem um representante para o formato BPA-C.
+
+    Args:
+        total: Grupos acumulados (chave -> registro BPA-C), alterado no lugar
+        key_fn: chave (uid, cmp, cbo, pa, idade) de um registro qualquer
+        convert_fn: registro bruto -> registro BPA-C
+        key_from_fields: mesma chave a partir dos campos BPAC_KEY_FIELDS
+            preenchidos (habilita o caminho rápido)
+        key_cache: tuplas brutas -> chave, reaproveitado entre páginas
+    """
+    if not records:
+        return
+
+    inverse, chaves, primeiras = _group_ids(records, key_fn, key_from_fields, key_cache)
+    n_grupos = len(chaves)
+    somas = np.bincount(inverse, weights=_quantidades(records), minlength=n_grupos).astype(np.int64).tolist()
+    contagens = np.bincount(inverse, minlength=n_grupos).tolist()
+
+    for chave, linha, soma, contagem in zip(chaves, primeiras, somas, contagens):
+        existing = total.get(chave)
+        if existing is None:
+            rep = convert_fn(records[linha])
+            rep['prd_qt_p'] = soma
+            rep['_aggregation_count'] = contagem
+            total[chave] = rep
+        else:
+            existing['prd_qt_p'] += soma
+            existing['_aggregation_count'] += contagem
@@ -0,0 +1,279 @@
+"""
+Layout declarativo dos registros do arquivo de remessa do BPA Magnético
+
+Cada tipo de registro (01 cabeçalho, 02 BPA-C, 03 BPA-I) é uma lista de
+campos de largura fixa. `Layout` compila a lista uma vez em:
+- um codificador: função gerada com uma expressão por campo e um único
+  ''.join (sem concatenações nem chamadas a pad_left/pad_right por campo);
+- um decodificador: fatias pré-calculadas que devolvem os campos de uma linha.
+
+Regras de preenchimento (as mesmas de BPAFileGenerator.pad_left/pad_right):
+- NUM: zeros à esquerda, corta o excesso à direita (zfill(n)[:n])
+- ALFA: espaços à direita, corta o excesso (ljust(n)[:n])
+- DATA: YYYYMMDD (data_yyyymmdd), 8 espaços se inválida
+- FIXO: conteúdo constante
+Valores None/vazios viram '' antes do preenchimento.
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+NUM = 'num'
+ALFA = 'alfa'
+DATA = 'data'
+FIXO = 'fixo'
+
+DATA_VAZIA = ' ' * 8
+
+
+def data_yyyymmdd(valor: Any) -> str:
+    """
+    Converte data (YYYYMMDD, YYYY-MM-DD, DD/MM/YYYY, date/datetime) para YYYYMMDD
+
+    Caminho rápido para o formato do banco (8 dígitos); os demais formatos
+    são fatiados direto, com strptime só para variações sem zero à esquerda.
+    """
+    if not valor:
+        return DATA_VAZIA
+    texto = str(valor)[:10]
+    if len(texto) == 8 and texto.isdigit():
+        return texto
+    if len(texto) == 10:
+        if texto[4] == '-' and texto[7] == '-':
+            ano, mes, dia = texto[:4], texto[5:7], texto[8:]
+        elif texto[2] == '/' and texto[5] == '/':
+            ano, mes, dia = texto[6:], texto[3:5], texto[:2]
+        else:
+            return DATA_VAZIA
+        if not (ano.isdigit() and mes.isdigit() and dia.isdigit()):
+            return DATA_VAZIA
+        try:
+            datetime(int(ano), int(mes), int(dia))
+        except ValueError:
+            return DATA_VAZIA
+        return ano + mes + dia
+    for formato in ('%Y-%m-%d', '%d/%m/%Y'):
+        try:
+            return datetime.strptime(texto, formato).strftime('%Y%m%d')
+        except ValueError:
+            pass
+    return DATA_VAZIA
+
+
+def calcular_idade(nascimento: Any, referencia: Any = None) -> int:
+    """Idade em anos (0 a 999) na data de referência YYYYMMDD (padrão: hoje)"""
+    nasc = data_yyyymmdd(nascimento)
+    if not nasc.isdigit():
+        return 0
+    if isinstance(referencia, str) and len(referencia) == 8:
+        try:
+            ref_ano, ref_mes, ref_dia = int(referencia[:4]), int(referencia[4:6]), int(referencia[6:])
+        except ValueError:
+            return 0
+    else:
+        hoje = datetime.now()
+        ref_ano, ref_mes, ref_dia = hoje.year, hoje.month, hoje.day
+    idade = ref_ano - int(nasc[:4])
+    if (ref_mes, ref_dia) < (int(nasc[4:6]), int(nasc[6:])):
+        idade -= 1
+    return max(0, min(999, idade))
+
+
+@dataclass(frozen=True)
+class Campo:
+    """
+    Campo de largura fixa
+
+    Origem do valor (exatamente uma):
+        chave: chave do registro (record.get(chave, padrao))
+        contexto: parâmetro nomeado do codificador (folha, seq, cnes...)
+        calculo: função do registro (idade, telefone...)
+        fixo: conteúdo constante (tipo FIXO)
+    """
+    nome: str
+    tamanho: int
+    tipo: str = ALFA
+    chave: Optional[str] = None
+    padrao: Any = ''
+    contexto: Optional[str] = None
+    calculo: Optional[Callable[[Dict], Any]] = None
+    fixo: str = ''
+
+
+def fixo(nome: str, conteudo: str) -> Campo:
+    return Campo(nome, len(conteudo), FIXO, fixo=conteudo)
+
+
+def brancos(nome: str, tamanho: int) -> Campo:
+    return Campo(nome, tamanho, FIXO, fixo=' ' * tamanho)
+
+
+class Layout:
+    """Layout de um tipo de registro compilado em codificador e decodificador"""
+
+    def __init__(self, nome: str, campos: List[Campo]):
+        self.nome = nome
+        self.campos = campos
+        self.tamanho = sum(c.tamanho for c in campos)
+        self.parametros = list(dict.fromkeys(c.contexto for c in campos if c.contexto))
+        self.codificar = self._compilar_codificador()
+        self.fatias = self._fatias()
+
+    def _compilar_codificador(self) -> Callable[..., str]:
+        namespace: Dict[str, Any] = {'_data': data_yyyymmdd}
+        partes: List[str] = []
+        for i, campo in enumerate(self.campos):
+            if campo.tipo == FIXO:
+                # Constantes vizinhas viram um único literal
+                if partes and partes[-1].startswith('_k'):
+                    namespace[partes[-1]] += campo.fixo
+                else:
+                    nome = f'_k{i}'
+                    namespace[nome] = campo.fixo
+                    partes.append(nome)
+                continue
+
+            if campo.chave is not None:
+                namespace[f'_p{i}'] = campo.padrao
+                valor = f'r.get({campo.chave!r}, _p{i})'
+            elif campo.contexto is not None:
+                valor = campo.contexto
+            else:
+                namespace[f'_f{i}'] = campo.calculo
+                valor = f'_f{i}(r)'
+
+            n = campo.tamanho
+            if campo.tipo == NUM:
+                partes.append(f"str({valor} or '').zfill({n})[:{n}]")
+            elif campo.tipo == DATA:
+                partes.append(f'_data({valor})')
+            else:
+                partes.append(f"str({valor} or '').ljust({n})[:{n}]")
+
+        parametros = ''.join(f', {p}' for p in self.parametros)
+        codigo = (
+            f"def codificar(r{parametros}):\n"
+            f"    return ''.join(({', '.join(partes)},))\n"
+        )
+        exec(compile(codigo, f'<layout {self.nome}>', 'exec'), namespace)
+        codificar = namespace['codificar']
+        codificar.__doc__ = f"Linha do registro {self.nome} ({self.tamanho} caracteres)"
+        return codificar
+
+    def _fatias(self) -> List[Tuple[Campo, slice]]:
+        fatias = []
+        inicio = 0
+        for campo in self.campos:
+            fatias.append((campo, slice(inicio, inicio + campo.tamanho)))
+            inicio += campo.tamanho
+        return fatias
+
+    def posicao(self, nome: str) -> slice:
+        """Fatia (0-based) do campo na linha"""
+        for campo, fatia in self.fatias:
+            if campo.nome == nome:
+                return fatia
+        raise KeyError(nome)
+
+    def decodificar(self, linha: str) -> Dict[str, str]:
+        """
+        Campos de uma linha (NUM/DATA como texto, ALFA sem os espaços à direita)
+
+        Raises:
+            ValueError: tamanho diferente do layout ou campo fixo divergente
+        """
+        if len(linha) != self.tamanho:
+            raise ValueError(f"Registro {self.nome}: {len(linha)} caracteres, esperado {self.tamanho}")
+        campos = {}
+        for campo, fatia in self.fatias:
+            valor = linha[fatia]
+            if campo.tipo == FIXO:
+                if valor != campo.fixo and campo.fixo.strip():
+                    raise ValueError(f"Registro {self.nome}: campo {campo.nome} = {valor!r}, esperado {campo.fixo!r}")
+                continue
+            campos[campo.nome] = valor.rstrip() if campo.tipo == ALFA else valor
+        return campos
+
+
+def _telefone(record: Dict) -> str:
+    return str(record.get('prd_ddtel_pcnte', '') or '') + str(record.get('prd_tel_pcnte', '') or '')
+
+
+def _idade_bpai(record: Dict) -> int:
+    return calcular_idade(record.get('prd_dtnasc', ''), record.get('prd_dtaten', ''))
+
+
+# Cabeçalho (01) - 142 caracteres
+HEADER = Layout('01', [
+    fixo('tipo', '01'),
+    fixo('indicador', '#BPA#'),
+    Campo('competencia', 6, ALFA, contexto='competencia'),
+    Campo('total_registros', 6, NUM, contexto='total_registros'),
+    Campo('total_bpas', 6, NUM, contexto='total_bpas'),
+    Campo('campo_controle', 4, NUM, contexto='campo_controle'),
+    brancos('reservado_1', 52),
+    fixo('zeros', '0' * 14),
+    brancos('reservado_2', 41),
+    Campo('versao', 6, ALFA, contexto='versao'),
+])
+
+# BPA-C (02) - 51 caracteres
+BPAC = Layout('02', [
+    fixo('tipo', '02'),
+    Campo('cnes', 7, NUM, contexto='cnes'),
+    Campo('competencia', 6, ALFA, contexto='competencia'),
+    Campo('cbo', 6, NUM, chave='prd_cbo'),
+    Campo('folha', 3, NUM, contexto='folha'),
+    Campo('seq', 2, NUM, contexto='seq'),
+    Campo('procedimento', 10, NUM, chave='prd_pa'),
+    Campo('idade', 3, NUM, chave='prd_idade', padrao=0),
+    Campo('quantidade', 6, NUM, chave='prd_qt_p', padrao=1),
+    Campo('seq_paciente', 3, NUM, chave='seq_paciente', padrao=1),
+    fixo('origem', 'BPA'),
+])
+
+# BPA-I (03) - 379 caracteres
+BPAI = Layout('03', [
+    fixo('tipo', '03'),
+    Campo('cnes', 7, NUM, contexto='cnes'),                                   # 3-9
+    Campo('competencia', 6, ALFA, contexto='competencia'),                    # 10-15
+    Campo('cbo', 6, NUM, chave='prd_cbo'),                                    # 16-21
+    Campo('cns_paciente', 15, ALFA, chave='prd_cnspac'),                      # 22-36
+    Campo('data_atendimento', 8, DATA, chave='prd_dtaten'),                   # 37-44
+    Campo('folha', 3, NUM, contexto='folha'),                                 # 45-47
+    Campo('seq', 2, NUM, contexto='seq'),                                     # 48-49
+    Campo('procedimento', 10, NUM, chave='prd_pa'),                           # 50-59
+    Campo('cns_profissional', 15, ALFA, chave='prd_cnsmed'),                  # 60-74
+    Campo('sexo', 1, ALFA, chave='prd_sexo'),                                 # 75
+    Campo('ibge', 6, NUM, chave='prd_ibge'),                                  # 76-81
+    Campo('cid', 4, ALFA, chave='prd_cid'),                                   # 82-85
+    Campo('idade', 3, NUM, calculo=_idade_bpai),                              # 86-88
+    Campo('quantidade', 6, NUM, chave='prd_qt_p', padrao=1),                  # 89-94
+    Campo('carater_atendimento', 2, NUM, chave='prd_caten', padrao='01'),     # 95-96
+    Campo('autorizacao', 13, ALFA, chave='prd_naut'),                         # 97-109
+    fixo('origem', 'BPA'),                                                    # 110-112
+    Campo('nome_paciente', 30, ALFA, chave='prd_nmpac'),                      # 113-142
+    Campo('data_nascimento', 8, DATA, chave='prd_dtnasc'),                    # 143-150
+    Campo('raca', 2, NUM, chave='prd_raca', padrao='99'),                     # 151-152
+    Campo('etnia', 4, ALFA, chave='prd_etnia'),                               # 153-156
+    Campo('nacionalidade', 3, NUM, chave='prd_nac', padrao='010'),            # 157-159
+    brancos('reservado_1', 34),                                               # 160-193
+    Campo('cep', 8, NUM, chave='prd_cep_pcnte'),                              # 194-201
+    Campo('logradouro_codigo', 3, NUM, chave='prd_lograd_pcnte'),             # 202-204
+    Campo('endereco', 30, ALFA, chave='prd_end_pcnte'),                       # 205-234
+    Campo('complemento', 10, ALFA, chave='prd_compl_pcnte'),                  # 235-244
+    Campo('numero', 5, ALFA, chave='prd_num_pcnte'),                          # 245-249
+    Campo('bairro', 30, ALFA, chave='prd_bairro_pcnte'),                      # 250-279
+    Campo('telefone', 11, ALFA, calculo=_telefone),                           # 280-290
+    brancos('reservado_2', 89),                                               # 291-379
+])
+
+LAYOUTS = {'01': HEADER, '02': BPAC, '03': BPAI}
+
+
+def decodificar_linha(linha: str) -> Tuple[str, Dict[str, str]]:
+    """(tipo do registro, campos) de uma linha da remessa"""
+    layout = LAYOUTS.get(linha[:2])
+    if layout is None:
+        raise ValueError(f"Tipo de registro desconhecido: {linha[:2]!r}")
+    return layout.nome, layout.decodificar(linha)
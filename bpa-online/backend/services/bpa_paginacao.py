@@ -0,0 +1,134 @@
+"""
+Paginação por keyset e streaming NDJSON das listagens BPA-I/BPA-C
+
+As páginas seguem a ordem de id: cada uma busca `id > último id da anterior`
+(índice (prd_uid, id) da partição do mês), então o custo não cresce com o
+número da página como no OFFSET. O `next_cursor` é opaco para o cliente e
+amarrado aos filtros da listagem: reaproveitá-lo com outra competência é erro.
+
+`format=ndjson` devolve um registro JSON por linha, lido em blocos de um
+cursor server-side: memória constante no servidor e no cliente, seja qual for
+o tamanho da competência.
+"""
+import base64
+import binascii
+import hashlib
+import json
+import os
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Dict, Iterator, List, Optional
+
+PAGE_DEFAULT_LIMIT = int(os.getenv('BPA_PAGE_DEFAULT_LIMIT', '500'))
+PAGE_MAX_LIMIT = int(os.getenv('BPA_PAGE_MAX_LIMIT', '5000'))
+
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+
+
+class CursorInvalido(ValueError):
+    """next_cursor malformado ou de outra listagem"""
+
+
+def _assinatura(filtros: Dict[str, Any]) -> str:
+    bruto = json.dumps(filtros, sort_keys=True, default=str)
+    return hashlib.sha1(bruto.encode('utf-8')).hexdigest()[:12]
+
+
+def encode_cursor(ultimo_id: int, filtros: Dict[str, Any]) -> str:
+    bruto = json.dumps({'id': ultimo_id, 'f': _assinatura(filtros)}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(bruto.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor: Optional[str], filtros: Dict[str, Any]) -> Optional[int]:
+    """Último id já entregue (None = início da listagem)"""
+    if not cursor:
+        return None
+    try:
+        bruto = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        dados = json.loads(bruto)
+        ultimo_id = int(dados['id'])
+        assinatura = dados['f']
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise CursorInvalido("cursor inválido")
+    if assinatura != _assinatura(filtros):
+        raise CursorInvalido("cursor pertence a outra listagem (filtros diferentes)")
+    return ultimo_id
+
+
+def _filtros(tabela: str, cnes: str, competencia: Optional[str], exportado: Optional[bool]) -> Dict[str, Any]:
+    return {'tabela': tabela, 'cnes': cnes, 'competencia': competencia, 'exportado': exportado}
+
+
+def _lister(db, tabela: str):
+    if tabela == 'bpa_individualizado':
+        return db.list_bpa_individualizado
+    if tabela == 'bpa_consolidado':
+        return db.list_bpa_consolidado
+    raise ValueError(f"Tabela inválida: {tabela}")
+
+
+def pagina_bpa(db, tabela: str, cnes: str, competencia: Optional[str] = None,
+               exportado: Optional[bool] = None, limit: Optional[int] = None,
+               cursor: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Uma página da listagem: {'data': [...], 'next_cursor': str | None, 'limit': n}
+
+    Busca limit + 1 registros para saber se há próxima página sem contar a competência.
+    """
+    filtros, after_id, limit = _preparar_pagina(tabela, cnes, competencia, exportado, limit, cursor)
+    rows = _lister(db, tabela)(cnes, competencia, exportado, limit=limit + 1, after_id=after_id)
+    return _montar_pagina(rows, limit, filtros)
+
+
+async def pagina_bpa_async(adb, tabela: str, cnes: str, competencia: Optional[str] = None,
+                           exportado: Optional[bool] = None, limit: Optional[int] = None,
+                           cursor: Optional[str] = None) -> Dict[str, Any]:
+    """pagina_bpa sobre AsyncBPADatabase"""
+    filtros, after_id, limit = _preparar_pagina(tabela, cnes, competencia, exportado, limit, cursor)
+    rows = await _lister(adb, tabela)(cnes, competencia, exportado, limit=limit + 1, after_id=after_id)
+    return _montar_pagina(rows, limit, filtros)
+
+
+def _preparar_pagina(tabela: str, cnes: str, competencia: Optional[str], exportado: Optional[bool],
+                     limit: Optional[int], cursor: Optional[str]):
+    filtros = _filtros(tabela, cnes, competencia, exportado)
+    after_id = decode_cursor(cursor, filtros)
+    limit = max(1, min(limit or PAGE_DEFAULT_LIMIT, PAGE_MAX_LIMIT))
+    return filtros, after_id, limit
+
+
+def _montar_pagina(rows: List[Dict], limit: int, filtros: Dict[str, Any]) -> Dict[str, Any]:
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1]['id'], filtros)
+    return {'data': rows, 'next_cursor': next_cursor, 'limit': limit}
+
+
+def _json_default(value: Any):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+
+def linhas_ndjson(blocos: Iterator[List[Dict]]) -> Iterator[bytes]:
+    """Um registro JSON por linha; um write por bloco do cursor"""
+    for bloco in blocos:
+        yield ''.join(
+            json.dumps(row, default=_json_default, ensure_ascii=False) + '\n' for row in bloco
+        ).encode('utf-8')
+
+
+def ndjson_bpa(db, tabela: str, cnes: str, competencia: Optional[str] = None,
+               exportado: Optional[bool] = None, cursor: Optional[str] = None) -> Iterator[bytes]:
+    """
+    Listagem completa em NDJSON a partir de um cursor server-side
+
+    O cursor é validado antes do primeiro byte (erro vira 400, não stream
+    interrompido); `cursor` permite retomar depois do último id recebido.
+    """
+    after_id = decode_cursor(cursor, _filtros(tabela, cnes, competencia, exportado))
+    blocos = db.iter_bpa_lista(tabela, cnes, competencia, exportado, after_id=after_id)
+    return linhas_ndjson(blocos)
@@ -10,12 +10,16 @@ Este módulo gera os arquivos de exportação no mesmo formato do software BPA o
 Layout baseado na análise do BPA v04.10
 """
 
+import io
 import os
 from datetime import datetime
-from typing import List, Dict, Any, Optional, Tuple
+from itertools import chain, groupby, islice
+from typing import Callable, List, Dict, Any, Iterable, Optional, Tuple
 from dataclasses import dataclass
 import logging
 
+from services.bpa_layout import BPAC, BPAI, HEADER, calcular_idade, data_yyyymmdd
+
 logger = logging.getLogger(__name__)
 
 # Mapeamento de meses
@@ -31,6 +35,20 @@ MESES_EXT = {
     '09': 'SETEMBRO', '10': 'OUTUBRO', '11': 'NOVEMBRO', '12': 'DEZEMBRO'
 }
 
+# Registros por folha na remessa (BPA-C e BPA-I)
+REGISTROS_POR_FOLHA = 20
+
+# Buffer de escrita dos arquivos gerados
+WRITE_BUFFER = 1024 * 1024
+
+
+def calcular_campo_controle(total_registros: int, total_bpas: int) -> str:
+    """
+    Campo de controle do BPA Magnético: (total_registros * 7 + total_bpas * 3) mod 10000
+    Esta é a fórmula oficial usada pelo DATASUS para validação
+    """
+    return str((total_registros * 7 + total_bpas * 3) % 10000).zfill(4)
+
 
 @dataclass
 class BPAExportConfig:
@@ -48,44 +66,27 @@ class BPAFileGenerator:
     
     VERSION = "04.10"
     
-    def __init__(self, config: BPAExportConfig, db_connection=None, sigtap_parser=None):
+    def __init__(self, config: BPAExportConfig, db_connection=None, sigtap_parser=None,
+                 valores: Optional[Dict[str, float]] = None):
+        """
+        Args:
+            valores: Tabela procedimento -> valor ambulatorial já carregada
+                (remessa em lote); dispensa o sigtap_parser
+        """
         self.config = config
         self.db = db_connection
         self.sigtap_parser = sigtap_parser
         self.config.versao_banco = f"{config.competencia}a"
-        self._valores_cache = {}  # Cache de valores de procedimentos
+        self._valores_cache = valores if valores is not None else {}  # Cache de valores de procedimentos
     
     def format_date_yyyymmdd(self, date_str: str) -> str:
         """Converte data de vários formatos para YYYYMMDD"""
-        if not date_str:
-            return "        "
-        
-        date_str = str(date_str)[:10]
-        
-        # Se já está no formato YYYYMMDD
-        if len(date_str) == 8 and date_str.isdigit():
-            return date_str
-        
-        # Tenta YYYY-MM-DD
-        try:
-            dt = datetime.strptime(date_str, '%Y-%m-%d')
-            return dt.strftime('%Y%m%d')
-        except:
-            pass
-        
-        # Tenta DD/MM/YYYY
-        try:
-            dt = datetime.strptime(date_str, '%d/%m/%Y')
-            return dt.strftime('%Y%m%d')
-        except:
-            pass
-        
-        return "        "
+        return data_yyyymmdd(date_str)
     
     def format_date_display(self, date_str: str) -> str:
         """Formata data para exibição DD/MM/YYYY"""
-        yyyymmdd = self.format_date_yyyymmdd(date_str)
-        if len(yyyymmdd) == 8:
+        yyyymmdd = data_yyyymmdd(date_str)
+        if yyyymmdd[0] != ' ':
             return f"{yyyymmdd[6:8]}/{yyyymmdd[4:6]}/{yyyymmdd[0:4]}"
         return "  /  /    "
     
@@ -147,32 +148,7 @@ class BPAFileGenerator:
     
     def calculate_age(self, birth_date: str, ref_date: str = None) -> int:
         """Calcula idade"""
-        try:
-            birth = self.format_date_yyyymmdd(birth_date)
-            if len(birth) != 8:
-                return 0
-            
-            ref = ref_date or datetime.now().strftime('%Y%m%d')
-            if isinstance(ref, str) and len(ref) == 8:
-                ref_year = int(ref[:4])
-                ref_month = int(ref[4:6])
-                ref_day = int(ref[6:8])
-            else:
-                ref_year = datetime.now().year
-                ref_month = datetime.now().month
-                ref_day = datetime.now().day
-            
-            birth_year = int(birth[:4])
-            birth_month = int(birth[4:6])
-            birth_day = int(birth[6:8])
-            
-            age = ref_year - birth_year
-            if (ref_month, ref_day) < (birth_month, birth_day):
-                age -= 1
-            
-            return max(0, min(999, age))
-        except:
-            return 0
+        return calcular_idade(birth_date, ref_date)
     
     # ==========================================================================
     # GERADOR: PACAPSAD.SET - Arquivo de Remessa
@@ -180,122 +156,87 @@ class BPAFileGenerator:
     
     def generate_set_header(self, total_registros: int, total_bpas: int, campo_controle: str) -> str:
         """
-        Gera linha de cabeçalho (tipo 01) do arquivo .SET
+        Gera linha de cabeçalho (tipo 01) do arquivo .SET (layout em bpa_layout.HEADER)
         
         Layout:
         01#BPA#2025090004520000181112                                    00000000000000                                         D04.10
         """
-        linha = ""
-        linha += "01"  # Tipo registro (pos 1-2)
-        linha += "#BPA#"  # Indicador (pos 3-7)
-        linha += self.config.competencia  # Competência YYYYMM (pos 8-13)
-        linha += self.pad_left(str(total_registros), 6)  # Total registros (pos 14-19)
-        linha += self.pad_left(str(total_bpas), 6)  # Total BPAs (pos 20-25)
-        linha += self.pad_left(campo_controle, 4)  # Campo controle (pos 26-29)
-        linha += " " * 52  # Espaços reservados (pos 30-81)
-        linha += "0" * 14  # Zeros (pos 82-95)
-        linha += " " * 41  # Espaços (pos 96-136)
-        linha += "D" + self.VERSION  # Versão (pos 137-142)
-        
-        return linha
+        return HEADER.codificar(
+            None,
+            competencia=self.config.competencia,
+            total_registros=total_registros,
+            total_bpas=total_bpas,
+            campo_controle=campo_controle,
+            versao="D" + self.VERSION
+        )
     
     def generate_set_bpac_line(self, record: Dict, folha: int, seq: int) -> str:
         """
-        Gera linha BPA-C (tipo 02) do arquivo .SET
+        Gera linha BPA-C (tipo 02) do arquivo .SET (layout em bpa_layout.BPAC)
         
-        Layout (46 caracteres):
         02 CNES(7) COMP(6) CBO(6) FOLHA(3) SEQ(2) PROC(10) IDADE(3) QTD(6) SEQPAC(3) BPA
         """
-        linha = ""
-        linha += "02"  # Tipo registro
-        linha += self.pad_left(self.config.cnes, 7)  # CNES
-        linha += self.config.competencia  # Competência
-        linha += self.pad_left(record.get('prd_cbo', ''), 6)  # CBO
-        linha += self.pad_left(str(folha), 3)  # Folha
-        linha += self.pad_left(str(seq), 2)  # Sequência
-        linha += self.pad_left(record.get('prd_pa', ''), 10)  # Procedimento
-        linha += self.pad_left(str(record.get('prd_idade', 0)), 3)  # Idade
-        linha += self.pad_left(str(record.get('prd_qt_p', 1)), 6)  # Quantidade
-        linha += self.pad_left(str(record.get('seq_paciente', 1)), 3)  # Seq paciente
-        linha += "BPA"  # Indicador
-        
-        return linha
+        return BPAC.codificar(
+            record, cnes=self.config.cnes, competencia=self.config.competencia, folha=folha, seq=seq
+        )
     
     def generate_set_bpai_line(self, record: Dict, folha: int, seq: int) -> str:
         """
-        Gera linha BPA-I (tipo 03) do arquivo .SET
+        Gera linha BPA-I (tipo 03) do arquivo .SET (layout em bpa_layout.BPAI)
         
-        Layout completo (379 caracteres):
-        Contém todos os dados do paciente
+        Layout completo (379 caracteres): contém todos os dados do paciente
         """
-        linha = ""
-        
-        # Cabeçalho (pos 1-49)
-        linha += "03"  # Tipo registro (1-2)
-        linha += self.pad_left(self.config.cnes, 7)  # CNES (3-9)
-        linha += self.config.competencia  # Competência (10-15)
-        linha += self.pad_left(record.get('prd_cbo', ''), 6)  # CBO (16-21)
-        linha += self.pad_right(record.get('prd_cnspac', ''), 15)  # CNS Paciente (22-36)
-        linha += self.format_date_yyyymmdd(record.get('prd_dtaten', ''))  # Data atendimento (37-44)
-        linha += self.pad_left(str(folha), 3)  # Folha (45-47)
-        linha += self.pad_left(str(seq), 2)  # Sequência (48-49)
-        
-        # Procedimento e profissional (pos 50-74)
-        linha += self.pad_left(record.get('prd_pa', ''), 10)  # Procedimento (50-59)
-        linha += self.pad_right(record.get('prd_cnsmed', ''), 15)  # CNS Profissional (60-74)
-        
-        # Dados demográficos (pos 75-96)
-        linha += self.pad_right(record.get('prd_sexo', ''), 1)  # Sexo (75)
-        linha += self.pad_left(record.get('prd_ibge', ''), 6)  # IBGE (76-81)
-        linha += self.pad_right(record.get('prd_cid', ''), 4)  # CID (82-85)
-        
-        # Calcula idade
-        idade = self.calculate_age(
-            record.get('prd_dtnasc', ''),
-            record.get('prd_dtaten', '')
+        return BPAI.codificar(
+            record, cnes=self.config.cnes, competencia=self.config.competencia, folha=folha, seq=seq
         )
-        linha += self.pad_left(str(idade), 3)  # Idade (86-88)
-        linha += self.pad_left(str(record.get('prd_qt_p', 1)), 6)  # Quantidade (89-94)
-        linha += self.pad_left(record.get('prd_caten', '01'), 2)  # Caráter atendimento (95-96)
-        
-        # Autorização (pos 97-109)
-        linha += self.pad_right(record.get('prd_naut', ''), 13)  # Num autorização (97-109)
-        
-        # Indicador (pos 110-112)
-        linha += "BPA"
-        
-        # Nome do paciente (pos 113-142)
-        linha += self.pad_right(record.get('prd_nmpac', ''), 30)
-        
-        # Data nascimento (pos 143-150)
-        linha += self.format_date_yyyymmdd(record.get('prd_dtnasc', ''))
-        
-        # Raça/cor e etnia (pos 151-156)
-        linha += self.pad_left(record.get('prd_raca', '99'), 2)  # Raça (151-152)
-        linha += self.pad_right(record.get('prd_etnia', ''), 4)  # Etnia (153-156)
+    
+    @staticmethod
+    def remessa_totais(bpai_count: int, bpac_count: int) -> Tuple[int, int]:
+        """(total de registros, total de BPAs/folhas) da remessa para as quantidades dadas"""
+        folhas = lambda n: -(-n // REGISTROS_POR_FOLHA)
+        return bpai_count + bpac_count, folhas(bpai_count) + folhas(bpac_count)
+    
+    def write_set_file(self, f, bpai_records: Iterable[Dict], bpac_records: Iterable[Dict]) -> Tuple[int, int]:
+        """
+        Grava o arquivo .SET em `f` (seekable) lendo os registros uma única vez
         
-        # Nacionalidade (pos 157-159)
-        linha += self.pad_left(record.get('prd_nac', '010'), 3)
+        O cabeçalho tem largura fixa: é gravado com totais zerados e reescrito
+        no início do arquivo ao final, com os totais contados na passagem.
         
-        # Reservado (pos 160-193)
-        linha += " " * 34
+        Returns:
+            Tuple[int, int]: (total registros, total BPAs)
+        """
+        inicio = f.tell()
+        f.write(self.generate_set_header(0, 0, '0000'))
         
-        # Endereço (pos 194+)
-        linha += self.pad_left(record.get('prd_cep_pcnte', ''), 8)  # CEP (194-201)
-        linha += self.pad_left(record.get('prd_lograd_pcnte', ''), 3)  # Tipo logradouro (202-204)
-        linha += self.pad_right(record.get('prd_end_pcnte', ''), 30)  # Logradouro (205-234)
-        linha += self.pad_right(record.get('prd_compl_pcnte', ''), 10)  # Complemento (235-244)
-        linha += self.pad_right(record.get('prd_num_pcnte', ''), 5)  # Número (245-249)
-        linha += self.pad_right(record.get('prd_bairro_pcnte', ''), 30)  # Bairro (250-279)
+        # Processa BPA-C e depois BPA-I (20 registros por folha)
+        totais = []
+        for records, gerar_linha in ((bpac_records, self.generate_set_bpac_line),
+                                     (bpai_records, self.generate_set_bpai_line)):
+            folha = 1
+            seq = 1
+            count = 0
+            for rec in records:
+                if seq > REGISTROS_POR_FOLHA:
+                    folha += 1
+                    seq = 1
+                f.write("\n")
+                f.write(gerar_linha(rec, folha, seq))
+                seq += 1
+                count += 1
+            totais.append((count, folha if count else 0))
         
-        # Telefone (pos 280-290)
-        telefone = str(record.get('prd_ddtel_pcnte', '') or '') + str(record.get('prd_tel_pcnte', '') or '')
-        linha += self.pad_right(telefone, 11)
+        total_registros = sum(count for count, _ in totais)
+        total_bpas = sum(folhas for _, folhas in totais)
         
-        # Reservado final (pos 291-379)
-        linha += " " * 89
+        fim = f.tell()
+        f.seek(inicio)
+        f.write(self.generate_set_header(
+            total_registros, total_bpas, calcular_campo_controle(total_registros, total_bpas)
+        ))
+        f.seek(fim)
         
-        return linha
+        return total_registros, total_bpas
     
     def generate_set_file(self, bpai_records: List[Dict], bpac_records: List[Dict]) -> Tuple[str, int, int]:
         """
@@ -304,45 +245,9 @@ class BPAFileGenerator:
         Returns:
             Tuple[str, int, int]: (conteúdo do arquivo, total registros, total BPAs)
         """
-        lines = []
-        total_registros = len(bpai_records) + len(bpac_records)
-        
-        # Conta folhas únicas para determinar total de BPAs
-        folhas_bpai = set()
-        folhas_bpac = set()
-        
-        # Processa BPA-C
-        folha = 1
-        seq = 1
-        for i, rec in enumerate(bpac_records):
-            if seq > 20:  # 20 registros por folha no BPA-C
-                folha += 1
-                seq = 1
-            folhas_bpac.add(folha)
-            lines.append(self.generate_set_bpac_line(rec, folha, seq))
-            seq += 1
-        
-        # Processa BPA-I
-        folha = 1
-        seq = 1
-        for i, rec in enumerate(bpai_records):
-            if seq > 20:  # 20 registros por folha no BPA-I
-                folha += 1
-                seq = 1
-            folhas_bpai.add(folha)
-            lines.append(self.generate_set_bpai_line(rec, folha, seq))
-            seq += 1
-        
-        total_bpas = len(folhas_bpai) + len(folhas_bpac)
-        
-        # Calcula campo de controle (soma de verificação simples)
-        campo_controle = str((total_registros * 7 + total_bpas * 3) % 10000).zfill(4)
-        
-        # Adiciona cabeçalho no início
-        header = self.generate_set_header(total_registros, total_bpas, campo_controle)
-        lines.insert(0, header)
-        
-        return "\n".join(lines), total_registros, total_bpas
+        buffer = io.StringIO()
+        total_registros, total_bpas = self.write_set_file(buffer, bpai_records, bpac_records)
+        return buffer.getvalue(), total_registros, total_bpas
     
     # ==========================================================================
     # GERADOR: RELEXP.PRN - Relatório de Controle de Remessa
@@ -480,15 +385,16 @@ MS/SAS/DATASUS/     SISTEMA DE INFORMACOES AMBULATORIAIS            DATA COMP.
         Pos 104+:  SITUACAO
         """
         # Formata campos
-        cns = self.pad_right(record.get('prd_cnspac', ''), 15)
+        # Preenchimentos inline (mesmo resultado de pad_left/pad_right, sem chamada por campo)
+        cns = str(record.get('prd_cnspac', '') or '').ljust(15)[:15]
         dtnasc = self.format_date_display(record.get('prd_dtnasc', ''))
         sexo = record.get('prd_sexo', '') or ' '
-        raca = self.pad_left(record.get('prd_raca', ''), 2)
+        raca = str(record.get('prd_raca', '') or '').zfill(2)[:2]
         # Usa código IBGE do registro, ou fallback para o município do estabelecimento
         ibge_raw = record.get('prd_ibge', '') or ''
         if not ibge_raw.strip():
             ibge_raw = self.config.ibge_municipio or ''
-        ibge = self.pad_right(ibge_raw, 6)
+        ibge = ibge_raw.ljust(6)[:6]
         dtaten = self.format_date_display(record.get('prd_dtaten', ''))
         
         # Formata procedimento (GG.SS.TT.PPP-D)
@@ -496,12 +402,12 @@ MS/SAS/DATASUS/     SISTEMA DE INFORMACOES AMBULATORIAIS            DATA COMP.
         if len(pa) >= 10:
             proc = f"{pa[0:2]}.{pa[2:4]}.{pa[4:6]}.{pa[6:9]}-{pa[9]}"
         else:
-            proc = self.pad_right(pa, 14)
+            proc = pa.ljust(14)[:14]
         
         qtd = int(record.get('prd_qt_p', 0) or 0)
-        cid = self.pad_right(record.get('prd_cid', ''), 4)
-        caten = self.pad_left(record.get('prd_caten', '01'), 2)
-        nome = self.pad_right(record.get('prd_nmpac', ''), 30)
+        cid = str(record.get('prd_cid', '') or '').ljust(4)[:4]
+        caten = str(record.get('prd_caten', '01') or '').zfill(2)[:2]
+        nome = str(record.get('prd_nmpac', '') or '').ljust(30)[:30]
         situacao = "Sem Erros"
         
         # Obtém valor real do procedimento via SIGTAP
@@ -557,55 +463,62 @@ MS/SAS/DATASUS/     SISTEMA DE INFORMACOES AMBULATORIAIS            DATA COMP.
     Data:___/___/___         Data:___/___/___             Data:___/___/___      
 """
     
-    def generate_bpai_report(self, records: List[Dict]) -> str:
-        """Gera relatório BPA-I completo"""
-        output = []
+    @staticmethod
+    def _chave_profissional(rec: Dict) -> tuple:
+        return (rec.get('prd_cnsmed', ''), rec.get('prd_cbo', ''))
+    
+    def write_bpai_report(self, f, records: Iterable[Dict]):
+        """
+        Grava o relatório BPA-I em `f` a partir de registros já ordenados por
+        profissional (CNS, CBO) e data de atendimento, sem guardá-los em memória
+        """
         comp_display = self.format_competencia_display(self.config.competencia)
         
-        # Agrupa por profissional
-        by_professional = {}
-        for rec in records:
-            key = (rec.get('prd_cnsmed', ''), rec.get('prd_cbo', ''))
-            if key not in by_professional:
-                by_professional[key] = []
-            by_professional[key].append(rec)
-        
-        # Ordena profissionais por CNS (ordem crescente)
-        sorted_professionals = sorted(by_professional.keys(), key=lambda x: x[0] or '')
-        
         page_num = 1
-        for (cns_prof, cbo) in sorted_professionals:
-            prof_records = by_professional[(cns_prof, cbo)]
-            
-            # Ordena registros por data de atendimento
-            prof_records.sort(key=lambda r: self.format_date_yyyymmdd(r.get('prd_dtaten', '')) or '00000000')
-            
+        for (cns_prof, cbo), prof_records in groupby(records, key=self._chave_profissional):
             folha = 1
             records_on_page = 0
             
-            output.append(self.generate_bpai_header(page_num, comp_display))
-            output.append(self.generate_bpai_profissional_header(
+            f.write(self.generate_bpai_header(page_num, comp_display))
+            f.write(self.generate_bpai_profissional_header(
                 self.config.cnes, cns_prof, cbo, self.config.competencia, folha
             ))
             
             for i, rec in enumerate(prof_records):
                 if records_on_page >= 19:
-                    output.append(self.generate_bpai_footer())
+                    f.write(self.generate_bpai_footer())
                     page_num += 1
                     folha += 1
-                    output.append(self.generate_bpai_header(page_num, comp_display))
-                    output.append(self.generate_bpai_profissional_header(
+                    f.write(self.generate_bpai_header(page_num, comp_display))
+                    f.write(self.generate_bpai_profissional_header(
                         self.config.cnes, cns_prof, cbo, self.config.competencia, folha
                     ))
                     records_on_page = 0
                 
-                output.append(self.generate_bpai_record_line(i + 1, rec))
+                f.write(self.generate_bpai_record_line(i + 1, rec))
                 records_on_page += 1
             
-            output.append(self.generate_bpai_footer())
+            f.write(self.generate_bpai_footer())
             page_num += 1
+    
+    def generate_bpai_report(self, records: List[Dict]) -> str:
+        """Gera relatório BPA-I completo"""
+        # Agrupa por profissional
+        by_professional = {}
+        for rec in records:
+            by_professional.setdefault(self._chave_profissional(rec), []).append(rec)
+        
+        # Profissionais por CNS (ordem crescente); registros por data de atendimento
+        ordered = []
+        for key in sorted(by_professional.keys(), key=lambda x: x[0] or ''):
+            ordered.extend(sorted(
+                by_professional[key],
+                key=lambda r: self.format_date_yyyymmdd(r.get('prd_dtaten', '')) or '00000000'
+            ))
         
-        return ''.join(output)
+        buffer = io.StringIO()
+        self.write_bpai_report(buffer, ordered)
+        return buffer.getvalue()
     
     # ==========================================================================
     # GERADOR: BPAC_REL.TXT - Relatório BPA Consolidado
@@ -668,49 +581,153 @@ MS/SAS/DATASUS/     SISTEMA DE INFORMACOES AMBULATORIAIS            DATA COMP.
     Data:___/___/___         Data:___/___/___             Data:___/___/___      
 """
     
-    def generate_bpac_report(self, records: List[Dict]) -> str:
-        """Gera relatório BPA-C completo"""
-        output = []
+    def write_bpac_report(self, f, records: Iterable[Dict]):
+        """
+        Grava o relatório BPA-C em `f` a partir de registros já agrupados por
+        CBO, lendo-os uma única vez
+        """
         comp_display = self.format_competencia_display(self.config.competencia)
         
-        # Agrupa por CBO
-        by_cbo = {}
-        for rec in records:
-            cbo = rec.get('prd_cbo', '')
-            if cbo not in by_cbo:
-                by_cbo[cbo] = []
-            by_cbo[cbo].append(rec)
-        
         page_num = 1
-        for cbo, cbo_records in by_cbo.items():
+        for cbo, cbo_records in groupby(records, key=lambda rec: rec.get('prd_cbo', '')):
             folha = 1
             records_on_page = 0
             
-            output.append(self.generate_bpac_header(page_num, comp_display))
-            output.append(self.generate_bpac_table_header(
+            f.write(self.generate_bpac_header(page_num, comp_display))
+            f.write(self.generate_bpac_table_header(
                 self.config.cnes, cbo, self.config.competencia, folha
             ))
             
             # Processa em grupos de 3 (3 colunas por linha)
-            for i in range(0, len(cbo_records), 3):
+            start_seq = 1
+            while True:
+                batch = list(islice(cbo_records, 3))
+                if not batch:
+                    break
                 if records_on_page >= 20:
-                    output.append(self.generate_bpac_footer())
+                    f.write(self.generate_bpac_footer())
                     page_num += 1
                     folha += 1
-                    output.append(self.generate_bpac_header(page_num, comp_display))
-                    output.append(self.generate_bpac_table_header(
+                    f.write(self.generate_bpac_header(page_num, comp_display))
+                    f.write(self.generate_bpac_table_header(
                         self.config.cnes, cbo, self.config.competencia, folha
                     ))
                     records_on_page = 0
                 
-                batch = cbo_records[i:i+3]
-                output.append(self.generate_bpac_record_line(batch, i + 1))
+                f.write(self.generate_bpac_record_line(batch, start_seq))
                 records_on_page += 1
+                start_seq += 3
             
-            output.append(self.generate_bpac_footer())
+            f.write(self.generate_bpac_footer())
             page_num += 1
+    
+    def generate_bpac_report(self, records: List[Dict]) -> str:
+        """Gera relatório BPA-C completo"""
+        # Agrupa por CBO (ordem da primeira ocorrência)
+        by_cbo = {}
+        for rec in records:
+            by_cbo.setdefault(rec.get('prd_cbo', ''), []).append(rec)
+        
+        buffer = io.StringIO()
+        self.write_bpac_report(buffer, chain.from_iterable(by_cbo.values()))
+        return buffer.getvalue()
+    
+    # ==========================================================================
+    # GERAÇÃO EM STREAMING: os 4 arquivos direto do banco
+    # ==========================================================================
+    
+    def write_reports(
+        self,
+        db,
+        export_dir: str,
+        extensao: str,
+        tipo: str = 'all',
+        on_file: Optional[Callable[[str], None]] = None
+    ) -> Dict[str, Any]:
+        """
+        Grava os arquivos do BPA Magnético em export_dir lendo o banco em blocos
+        (BPADatabase.iter_bpa_for_report), sem limite de volume
+        
+        Cada arquivo lê os registros na ordem em que os imprime. Os totais da
+        remessa saem da própria gravação; sem remessa, das contagens do banco.
+        
+        Args:
+            db: BPADatabase
+            extensao: Extensão da remessa (JAN, FEV, ...)
+            tipo: 'remessa' (com RELEXP), 'relexp', 'bpai', 'bpac' ou 'all'
+            on_file: Chamado com o nome de cada arquivo gravado
+        
+        Returns:
+            Dict com files (nomes gravados), total_registros, total_bpas,
+            campo_controle, bpai_count e bpac_count
+        """
+        cnes = self.config.cnes
+        competencia = self.config.competencia
+        
+        def registros(tabela: str, ordem: str) -> Iterable[Dict]:
+            return chain.from_iterable(db.iter_bpa_for_report(tabela, cnes, competencia, ordem))
         
-        return ''.join(output)
+        def gravar(nome: str, escrever: Callable) -> Any:
+            path = os.path.join(export_dir, nome)
+            try:
+                with open(path, 'w', encoding='latin-1', buffering=WRITE_BUFFER) as f:
+                    resultado = escrever(f)
+            except Exception:
+                if os.path.exists(path):
+                    os.remove(path)
+                raise
+            files.append(nome)
+            if on_file:
+                on_file(nome)
+            return resultado
+        
+        # IMPORTANTE: remessa sempre gera junto com relexp (controle), pois são inseparáveis
+        gerar_remessa = tipo in ('remessa', 'all')
+        gerar_relexp = tipo in ('remessa', 'relexp', 'all')
+        gerar_bpai = tipo in ('bpai', 'all')
+        gerar_bpac = tipo in ('bpac', 'all')
+        
+        counts = db.get_bpa_stats(cnes, competencia)
+        bpai_count = counts['bpai_total']
+        bpac_count = counts['bpac_total']
+        files: List[str] = []
+        
+        if gerar_remessa:
+            total_registros, total_bpas = gravar(
+                f"PA{self.config.sigla}.{extensao}",
+                lambda f: self.write_set_file(
+                    f,
+                    registros('bpa_individualizado', 'id'),
+                    registros('bpa_consolidado', 'id')
+                )
+            )
+        else:
+            total_registros, total_bpas = self.remessa_totais(bpai_count, bpac_count)
+        campo_controle = calcular_campo_controle(total_registros, total_bpas)
+        
+        if gerar_relexp:
+            gravar("RELEXP.PRN", lambda f: f.write(
+                self.generate_relexp(total_registros, total_bpas, campo_controle, extensao)
+            ))
+        
+        if gerar_bpai:
+            gravar("BPAI_REL.TXT", lambda f: self.write_bpai_report(
+                f, registros('bpa_individualizado', 'profissional')
+            ))
+        
+        if gerar_bpac:
+            gravar("BPAC_REL.TXT", lambda f: self.write_bpac_report(
+                f, registros('bpa_consolidado', 'cbo')
+            ))
+        
+        return {
+            'files': files,
+            'total_registros': total_registros,
+            'total_bpas': total_bpas,
+            'campo_controle': campo_controle,
+            'bpai_count': bpai_count,
+            'bpac_count': bpac_count,
+        }
 
 
 class BPAReportService:
@@ -765,7 +782,7 @@ class BPAReportService:
         set_content, total_registros, total_bpas = generator.generate_set_file(
             bpai_records, bpac_records
         )
-        campo_controle = str((total_registros * 7 + total_bpas * 3) % 10000).zfill(4)
+        campo_controle = calcular_campo_controle(total_registros, total_bpas)
         
         # Gera outros relatórios
         relexp_content = generator.generate_relexp(total_registros, total_bpas, campo_controle)
@@ -257,6 +257,48 @@ class BPAConsolidationService:
                 'descricao': 'Mantém como BPA Individualizado'
             }
 
+    def estatisticas(self, cnes: str, competencia: str) -> Dict:
+        """
+        Estatísticas antes de consolidar: quantos BPA-I pendentes podem virar
+        BPA-C (geral ou por idade) e quais procedimentos ficam como BPA-I
+        """
+        bpai_records = self.db.list_bpa_individualizado(cnes, competencia, exportado=False)
+        
+        stats = {
+            'total_bpai': len(bpai_records),
+            'pode_consolidar_geral': 0,
+            'pode_consolidar_idade': 0,
+            'manter_bpai': 0,
+            'procedimentos_geral': [],
+            'procedimentos_idade': [],
+            'procedimentos_manter': []
+        }
+        
+        proc_geral = set()
+        proc_idade = set()
+        proc_manter = set()
+        
+        for record in bpai_records:
+            procedimento = record.get('prd_pa', '')
+            info = self.verificar_procedimento(procedimento)
+            
+            if info['tipo'] == 'BPA-C':
+                if info['subtipo'] == 'geral':
+                    stats['pode_consolidar_geral'] += 1
+                    proc_geral.add(procedimento)
+                else:
+                    stats['pode_consolidar_idade'] += 1
+                    proc_idade.add(procedimento)
+            else:
+                stats['manter_bpai'] += 1
+                proc_manter.add(procedimento)
+        
+        stats['procedimentos_geral'] = sorted(proc_geral)
+        stats['procedimentos_idade'] = sorted(proc_idade)
+        stats['procedimentos_manter'] = sorted(proc_manter)
+        
+        return stats
+
 
 # Singleton
 _consolidation_service = None
@@ -0,0 +1,585 @@
+"""
+Regras de correção BPA em forma declarativa, compiladas por (CNES, tipo)
+
+Fonte única das regras de correção BPA (BPACorrections.apply_corrections
+delega para cá), descritas como dados (REGRAS) sobre um nome canônico de
+campo (CAMPOS). A compilação descarta o que
+não se aplica ao tipo/unidade, resolve as tabelas e os rótulos de estatística
+uma vez e devolve um pipeline de funções por registro.
+
+Dois modos de saída:
+- detalhado: mensagens legíveis em CorrectionResult (apply_corrections)
+- estatísticas: só o tipo de cada correção (prefixo da mensagem), sem formatar
+  texto; é o que process_batch usa
+
+Lotes grandes são divididos em blocos processados em paralelo, em processos
+iniciados com spawn: a API roda em threads (uvicorn, jobs) e um fork copiaria
+locks presos por outras threads para o filho.
+"""
+import os
+import json
+import hashlib
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Callable, Dict, FrozenSet, List, Mapping, Optional, Tuple
+
+from services.corrections import BPACorrections, CorrectionResult
+
+logger = logging.getLogger(__name__)
+
+# Lotes acima deste tamanho são corrigidos em paralelo (0 desativa)
+PARALLEL_THRESHOLD = int(os.getenv('CORRECTIONS_PARALLEL_THRESHOLD', '50000'))
+PARALLEL_CHUNK_SIZE = int(os.getenv('CORRECTIONS_CHUNK_SIZE', '20000'))
+PARALLEL_WORKERS = int(os.getenv('CORRECTIONS_WORKERS', '0')) or (os.cpu_count() or 1)
+
+# Nome canônico (formato amigável) -> coluna prd_* equivalente
+CAMPOS: Dict[str, str] = {
+    'procedimento': 'prd_pa',
+    'cns_paciente': 'prd_cnspac',
+    'raca_cor': 'prd_raca',
+    'carater_atendimento': 'prd_caten',
+    'cid': 'prd_cid',
+    'quantidade': 'prd_qt_p',
+    'cep': 'prd_cep_pcnte',
+    'municipio_ibge': 'prd_ibge',
+    'logradouro_codigo': 'prd_lograd_pcnte',
+    'endereco': 'prd_end_pcnte',
+    'bairro': 'prd_bairro_pcnte',
+    'numero': 'prd_num_pcnte',
+    'servico': 'prd_servico',
+    'classificacao': 'prd_classificacao',
+    'sexo': 'prd_sexo',
+}
+
+NUMEROS_INVALIDOS = frozenset({'', '00', '000', '0000', '00000', 'S/N', 'cs02', 'SN'})
+
+
+# ========== ESPECIFICAÇÃO DAS REGRAS ==========
+
+@dataclass(frozen=True)
+class ExcluirProcedimento:
+    """Exclui o registro se o procedimento estiver na tabela"""
+    tabela: FrozenSet[str]
+
+
+@dataclass(frozen=True)
+class ExcluirProcedimentoVazio:
+    """Exclui registros sem procedimento"""
+
+
+@dataclass(frozen=True)
+class IdentificacaoPaciente:
+    """CNS/CPF obrigatório (recupera do cadastro por nome + nascimento)"""
+
+
+@dataclass(frozen=True)
+class SubstituirProcedimento:
+    """Troca o procedimento pelo da tabela (revogados)"""
+    tabela: Mapping[str, str]
+    mensagem: str
+
+
+@dataclass(frozen=True)
+class Normalizar:
+    """
+    Troca o valor do campo pelo do mapa; valores fora do mapa viram `outros`
+    (None = mantém). `vazio` é o valor lido quando o campo não vem preenchido.
+    """
+    campo: str
+    mapa: Mapping[str, str]
+    mensagem: str
+    outros: Optional[str] = None
+    vazio: str = ''
+    texto: bool = True
+    apenas_upa: bool = False
+
+
+@dataclass(frozen=True)
+class ValorPorProcedimento:
+    """Valor obrigatório do campo conforme o procedimento (ex.: CID)"""
+    campo: str
+    tabela: Mapping[str, str]
+    mensagem: str
+
+
+@dataclass(frozen=True)
+class LimitePorProcedimento:
+    """Valor máximo (inteiro) do campo conforme o procedimento"""
+    campo: str
+    tabela: Mapping[str, int]
+    mensagem: str
+
+
+@dataclass(frozen=True)
+class Preencher:
+    """
+    Substitui valor vazio (se `vazio`) ou presente em `invalidos` pelo padrão.
+    `mensagem_invalido` é usada quando havia algum valor (padrão: `mensagem`).
+    """
+    campo: str
+    padrao: str
+    mensagem: str
+    mensagem_invalido: Optional[str] = None
+    invalidos: FrozenSet[str] = frozenset()
+    vazio: bool = True
+    texto: bool = False
+    maiusculas: bool = False
+
+
+@dataclass(frozen=True)
+class DefinirPorProcedimento:
+    """Define campos fixos (ex.: serviço/classificação) conforme o procedimento"""
+    tabela: Mapping[str, Tuple[Optional[str], ...]]
+    campos: Tuple[str, ...]
+    mensagens: Tuple[str, ...]
+
+
+# Tipos em que a regra vale (qualquer tipo diferente de 'BPI' segue as regras gerais)
+TODOS = None
+SO_BPI = ('BPI',)
+
+# (tipos, regra), na ordem em que são aplicadas
+REGRAS = [
+    (TODOS, ExcluirProcedimento(frozenset(BPACorrections.PROCEDIMENTOS_EXCLUIR))),
+    (TODOS, ExcluirProcedimentoVazio()),
+    (SO_BPI, IdentificacaoPaciente()),
+    (TODOS, SubstituirProcedimento(
+        BPACorrections.PROCEDIMENTOS_REVOGADOS, "Procedimento revogado: {valor} → {novo}"
+    )),
+    (TODOS, Normalizar(
+        'raca_cor', {'05': '03', '06': '03'}, "Raça/Cor corrigida: {valor} → {novo}", vazio='01'
+    )),
+    (SO_BPI, Normalizar(
+        'carater_atendimento', {'01': '02'}, "Caráter de atendimento UPA: {valor} → {novo}",
+        vazio='01', texto=False, apenas_upa=True
+    )),
+    (TODOS, ValorPorProcedimento(
+        'cid', BPACorrections.CORRECOES_CID, "CID corrigido para PA {procedimento}: {valor} → {novo}"
+    )),
+    (TODOS, LimitePorProcedimento(
+        'quantidade', BPACorrections.LIMITES_QUANTIDADE,
+        "Quantidade limitada: {valor} → {novo} (PA {procedimento})"
+    )),
+    (SO_BPI, Preencher(
+        'cep', BPACorrections.CEP_PADRAO, "CEP vazio preenchido: {novo}",
+        mensagem_invalido="CEP inválido corrigido: {valor} → {novo}",
+        invalidos=frozenset(BPACorrections.CEPS_INVALIDOS), texto=True
+    )),
+    (TODOS, Preencher('municipio_ibge', BPACorrections.IBGE_PADRAO, "IBGE vazio preenchido: {novo}")),
+    (SO_BPI, Preencher(
+        'logradouro_codigo', BPACorrections.LOGRADOURO_PADRAO, "Logradouro vazio preenchido: {novo}"
+    )),
+    (SO_BPI, Preencher('endereco', 'NAO LOCALIZADO', "Endereço vazio preenchido: {novo}")),
+    (SO_BPI, Preencher('bairro', 'NAO LOCALIZADO', "Bairro vazio preenchido: {novo}")),
+    (SO_BPI, Preencher(
+        'numero', '01', "Número inválido corrigido: '{valor}' → {novo}",
+        invalidos=NUMEROS_INVALIDOS, vazio=False, texto=True, maiusculas=True
+    )),
+    (TODOS, DefinirPorProcedimento(
+        BPACorrections.SERVICO_CLASSIFICACAO, ('servico', 'classificacao'),
+        ("Serviço definido: {novo}", "Classificação definida: {novo}")
+    )),
+    (SO_BPI, Normalizar(
+        'sexo', {'0': 'M', '1': 'F', 'M': 'M', 'F': 'F'}, "Sexo corrigido: {valor} → {novo}", outros='M'
+    )),
+]
+
+
+def _versao_regras() -> str:
+    """Hash estável de REGRAS (tabelas incluídas): muda sempre que uma regra muda"""
+    def canonico(valor):
+        if isinstance(valor, (set, frozenset)):
+            return sorted(valor)
+        raise TypeError(repr(valor))
+
+    spec = [(tipos, type(regra).__name__, asdict(regra)) for tipos, regra in REGRAS]
+    dump = json.dumps(spec, sort_keys=True, default=canonico, ensure_ascii=False)
+    return hashlib.sha1(dump.encode('utf-8')).hexdigest()[:16]
+
+
+# Versão do conjunto de regras (resultados materializados de inconsistências)
+RULESET_VERSION = _versao_regras()
+
+
+# ========== COMPILAÇÃO ==========
+
+# Regra compilada: (registro, corrigido, saída, pacientes) -> motivo de exclusão ou None
+Regra = Callable[[Dict, Dict, List[str], Optional[Dict]], Optional[str]]
+
+
+def _rotulo(mensagem: str) -> str:
+    """Tipo da correção nas estatísticas (mesmo corte de process_batch)"""
+    return mensagem.split(':')[0] if ':' in mensagem else mensagem
+
+
+def _leitor(campo: str, vazio='') -> Callable[[Dict], object]:
+    prd = CAMPOS[campo]
+
+    def ler(record: Dict):
+        return record.get(campo) or record.get(prd) or vazio
+    return ler
+
+
+def _escritor(campo: str) -> Callable[[Dict, object], None]:
+    prd = CAMPOS[campo]
+
+    def escrever(corrected: Dict, valor):
+        corrected[campo] = valor
+        if prd in corrected:
+            corrected[prd] = valor
+    return escrever
+
+
+_ler_procedimento_atual = _leitor('procedimento')
+
+
+def _compilar_regra(regra, detalhado: bool, is_upa: bool, corrections: BPACorrections) -> Optional[Regra]:
+    if isinstance(regra, ExcluirProcedimento):
+        tabela = regra.tabela
+        ler = _leitor('procedimento')
+
+        def excluir(record, corrected, saida, pacientes):
+            procedimento = ler(record)
+            if procedimento in tabela:
+                return f"Procedimento {procedimento} não pertence ao BPA"
+        return excluir
+
+    if isinstance(regra, ExcluirProcedimentoVazio):
+        ler = _leitor('procedimento')
+
+        def excluir_vazio(record, corrected, saida, pacientes):
+            procedimento = ler(record)
+            if not procedimento or procedimento.strip() == '':
+                return "Procedimento vazio ou nulo"
+        return excluir_vazio
+
+    if isinstance(regra, IdentificacaoPaciente):
+        return _compilar_identificacao(detalhado, corrections)
+
+    if isinstance(regra, SubstituirProcedimento):
+        tabela = regra.tabela
+        ler = _leitor('procedimento')
+        escrever = _escritor('procedimento')
+        mensagem = regra.mensagem
+        rotulo = _rotulo(mensagem)
+
+        def substituir(record, corrected, saida, pacientes):
+            procedimento = ler(record)
+            novo = tabela.get(procedimento)
+            if novo is not None:
+                escrever(corrected, novo)
+                saida.append(mensagem.format(valor=procedimento, novo=novo) if detalhado else rotulo)
+        return substituir
+
+    if isinstance(regra, Normalizar):
+        if regra.apenas_upa and not is_upa:
+            return None
+        campo, prd, mapa, outros, vazio, texto = (
+            regra.campo, CAMPOS[regra.campo], regra.mapa, regra.outros, regra.vazio, regra.texto
+        )
+        mensagem = regra.mensagem
+        rotulo = _rotulo(mensagem)
+
+        def normalizar(record, corrected, saida, pacientes):
+            valor = record.get(campo) or record.get(prd) or vazio
+            if texto:
+                valor = str(valor)
+            novo = mapa.get(valor)
+            if novo is None:
+                if outros is None:
+                    return None
+                novo = outros
+            if novo != valor:
+                corrected[campo] = novo
+                if prd in corrected:
+                    corrected[prd] = novo
+                saida.append(mensagem.format(valor=valor, novo=novo) if detalhado else rotulo)
+        return normalizar
+
+    if isinstance(regra, ValorPorProcedimento):
+        campo, prd, tabela, mensagem = regra.campo, CAMPOS[regra.campo], regra.tabela, regra.mensagem
+        # Rótulo depende do procedimento: pré-calculado por código da tabela
+        rotulos = {codigo: _rotulo(mensagem.format(procedimento=codigo, valor='', novo=''))
+                   for codigo in tabela}
+
+        def valor_por_procedimento(record, corrected, saida, pacientes):
+            procedimento = _ler_procedimento_atual(corrected)
+            correto = tabela.get(procedimento)
+            if correto is None:
+                return None
+            atual = record.get(campo) or record.get(prd) or ''
+            if atual != correto:
+                corrected[campo] = correto
+                if prd in corrected:
+                    corrected[prd] = correto
+                saida.append(
+                    mensagem.format(procedimento=procedimento, valor=atual, novo=correto)
+                    if detalhado else rotulos[procedimento]
+                )
+        return valor_por_procedimento
+
+    if isinstance(regra, LimitePorProcedimento):
+        campo, prd, tabela, mensagem = regra.campo, CAMPOS[regra.campo], regra.tabela, regra.mensagem
+        rotulo = _rotulo(mensagem)
+
+        def limitar(record, corrected, saida, pacientes):
+            procedimento = _ler_procedimento_atual(corrected)
+            limite = tabela.get(procedimento)
+            if limite is None:
+                return None
+            qtd = int(record.get(campo) or record.get(prd) or 1)
+            if qtd > limite:
+                corrected[campo] = limite
+                if prd in corrected:
+                    corrected[prd] = limite
+                saida.append(
+                    mensagem.format(valor=qtd, novo=limite, procedimento=procedimento) if detalhado else rotulo
+                )
+        return limitar
+
+    if isinstance(regra, Preencher):
+        campo, prd, padrao = regra.campo, CAMPOS[regra.campo], regra.padrao
+        invalidos, checa_vazio, texto, maiusculas = regra.invalidos, regra.vazio, regra.texto, regra.maiusculas
+        mensagem = regra.mensagem
+        mensagem_invalido = regra.mensagem_invalido or mensagem
+        rotulo, rotulo_invalido = _rotulo(mensagem), _rotulo(mensagem_invalido)
+
+        def preencher(record, corrected, saida, pacientes):
+            valor = record.get(campo) or record.get(prd) or ''
+            if texto:
+                valor = str(valor)
+            if checa_vazio and (not valor or valor.strip() == ''):
+                pass
+            elif not invalidos or (valor.upper() if maiusculas else valor) not in invalidos:
+                return None
+            corrected[campo] = padrao
+            if prd in corrected:
+                corrected[prd] = padrao
+            if valor:
+                saida.append(mensagem_invalido.format(valor=valor, novo=padrao) if detalhado else rotulo_invalido)
+            else:
+                saida.append(mensagem.format(valor=valor, novo=padrao) if detalhado else rotulo)
+        return preencher
+
+    if isinstance(regra, DefinirPorProcedimento):
+        tabela = regra.tabela
+        destinos = [(campo, CAMPOS[campo], mensagem, _rotulo(mensagem))
+                    for campo, mensagem in zip(regra.campos, regra.mensagens)]
+
+        def definir(record, corrected, saida, pacientes):
+            valores = tabela.get(_ler_procedimento_atual(corrected))
+            if valores is None:
+                return None
+            for (campo, prd, mensagem, rotulo), valor in zip(destinos, valores):
+                if valor:
+                    corrected[campo] = valor
+                    if prd in corrected:
+                        corrected[prd] = valor
+                    saida.append(mensagem.format(novo=valor) if detalhado else rotulo)
+        return definir
+
+    raise TypeError(f"Regra de correção desconhecida: {regra!r}")
+
+
+def _compilar_identificacao(detalhado: bool, corrections: BPACorrections) -> Regra:
+    """CNS/CPF do paciente; recupera do cadastro pelo nome + nascimento quando faltam"""
+    identificacao = corrections._identificacao_paciente
+    nome_nascimento = corrections._nome_nascimento
+
+    def identificar(record, corrected, saida, pacientes):
+        cns_paciente, cpf_paciente, cns_valido, cpf_valido = identificacao(record)
+        if cns_valido:
+            return None
+
+        if not cpf_valido:
+            nome, data_nasc = nome_nascimento(record)
+            if nome and data_nasc:
+                try:
+                    if pacientes is not None:
+                        paciente = pacientes.get((nome, data_nasc))
+                    else:
+                        from database import BPADatabase
+                        paciente = BPADatabase().get_paciente_by_nome_nascimento(nome, data_nasc)
+                    if paciente:
+                        if paciente.get('cns'):
+                            cns_paciente = paciente['cns']
+                            corrected['cns_paciente'] = cns_paciente
+                            if 'prd_cnspac' in corrected:
+                                corrected['prd_cnspac'] = cns_paciente
+                            saida.append(
+                                f"CNS recuperado do cadastro: {cns_paciente}" if detalhado
+                                else "CNS recuperado do cadastro"
+                            )
+                            return None
+                        elif paciente.get('cpf'):
+                            cpf_paciente = paciente['cpf']
+                            cpf_valido = True
+                            saida.append(
+                                f"CPF recuperado do cadastro: {cpf_paciente}" if detalhado
+                                else "CPF recuperado do cadastro"
+                            )
+                except Exception:
+                    pass  # Ignora erro de busca, vai usar validação padrão
+
+            if not cpf_valido:
+                return "CNS/CPF do paciente vazio (obrigatório para BPI)"
+
+        # Tem CPF mas não CNS: usa o CPF no campo CNS para exportação
+        cpf = cpf_paciente.strip()
+        corrected['cns_paciente'] = cpf
+        if 'prd_cnspac' in corrected:
+            corrected['prd_cnspac'] = cpf
+        saida.append(f"Usando CPF como identificador: {cpf}" if detalhado else "Usando CPF como identificador")
+        return None
+
+    return identificar
+
+
+class CompiledCorrections:
+    """Pipeline de correções de um (CNES, tipo), nos modos detalhado e estatísticas"""
+
+    def __init__(self, cnes: Optional[str], tipo: str):
+        self.cnes = cnes
+        self.tipo = tipo
+        corrections = BPACorrections(cnes)
+        self._detalhado = self._compilar(True, corrections)
+        self._estatisticas = self._compilar(False, corrections)
+
+    def _compilar(self, detalhado: bool, corrections: BPACorrections) -> Tuple[Regra, ...]:
+        compiladas = []
+        for tipos, regra in REGRAS:
+            if tipos is not None and self.tipo not in tipos:
+                continue
+            compilada = _compilar_regra(regra, detalhado, corrections.is_upa, corrections)
+            if compilada is not None:
+                compiladas.append(compilada)
+        return tuple(compiladas)
+
+    def apply(self, record: Dict, pacientes: Optional[Dict[tuple, Dict]] = None) -> CorrectionResult:
+        """Corrige um registro com mensagens (é o que BPACorrections.apply_corrections retorna)"""
+        corrected = record.copy()
+        saida: List[str] = []
+        for regra in self._detalhado:
+            motivo = regra(record, corrected, saida, pacientes)
+            if motivo is not None:
+                return CorrectionResult(
+                    original=record,
+                    corrected=corrected,
+                    corrections_applied=saida,
+                    should_delete=True,
+                    delete_reason=motivo
+                )
+        return CorrectionResult(
+            original=record,
+            corrected=corrected,
+            corrections_applied=saida,
+            should_delete=False,
+            delete_reason=None
+        )
+
+    def process(
+        self,
+        records: List[Dict],
+        pacientes: Optional[Dict[tuple, Dict]] = None
+    ) -> Tuple[List[Dict], Dict]:
+        """
+        Corrige o lote no modo estatísticas (sem mensagens nem CorrectionResult)
+
+        Returns:
+            (registros_corrigidos, estatísticas) no formato de process_batch
+        """
+        regras = self._estatisticas
+        corrected_records = []
+        stats = BPACorrections.empty_stats()
+        stats['total_input'] = len(records)
+        delete_reasons = stats['delete_reasons']
+        correction_types = stats['correction_types']
+        deleted = corrected_count = 0
+
+        for record in records:
+            corrected = record.copy()
+            saida: List[str] = []
+            for regra in regras:
+                motivo = regra(record, corrected, saida, pacientes)
+                if motivo is not None:
+                    deleted += 1
+                    delete_reasons[motivo] = delete_reasons.get(motivo, 0) + 1
+                    break
+            else:
+                corrected_records.append(corrected)
+                if saida:
+                    corrected_count += 1
+                    for rotulo in saida:
+                        correction_types[rotulo] = correction_types.get(rotulo, 0) + 1
+
+        stats['deleted'] = deleted
+        stats['corrected'] = corrected_count
+        stats['unchanged'] = len(corrected_records) - corrected_count
+        stats['total_output'] = len(corrected_records)
+        return corrected_records, stats
+
+
+_compiled: Dict[Tuple[bool, str], CompiledCorrections] = {}
+_compiled_lock = threading.Lock()
+
+
+def get_compiled_corrections(cnes: Optional[str], tipo: str) -> CompiledCorrections:
+    """Pipeline compilado, reaproveitado por (unidade é UPA, tipo)"""
+    key = (bool(cnes) and cnes in BPACorrections.CNES_UPAS, tipo)
+    with _compiled_lock:
+        compiled = _compiled.get(key)
+        if compiled is None:
+            compiled = _compiled[key] = CompiledCorrections(cnes, tipo)
+        return compiled
+
+
+def _process_chunk(cnes: Optional[str], tipo: str, records: List[Dict],
+                   pacientes: Optional[Dict[tuple, Dict]]) -> Tuple[List[Dict], Dict]:
+    """Executado nos processos filhos: compila (uma vez por processo) e corrige o bloco"""
+    return get_compiled_corrections(cnes, tipo).process(records, pacientes)
+
+
+def process_records(
+    cnes: Optional[str],
+    tipo: str,
+    records: List[Dict],
+    pacientes: Optional[Dict[tuple, Dict]] = None,
+    parallel_threshold: int = None,
+    chunk_size: int = None,
+    workers: int = None
+) -> Tuple[List[Dict], Dict]:
+    """
+    Corrige um lote; acima de `parallel_threshold` registros divide em blocos
+    processados em paralelo e soma as estatísticas (ordem dos registros mantida)
+
+    Abaixo do limite roda em série: subir processos com spawn (reimportam o
+    módulo) custa mais que corrigir poucos milhares de registros.
+    """
+    threshold = PARALLEL_THRESHOLD if parallel_threshold is None else parallel_threshold
+    chunk_size = chunk_size or PARALLEL_CHUNK_SIZE
+    workers = workers or PARALLEL_WORKERS
+
+    if not threshold or len(records) <= threshold or workers < 2:
+        return get_compiled_corrections(cnes, tipo).process(records, pacientes)
+
+    chunks = [records[i:i + chunk_size] for i in range(0, len(records), chunk_size)]
+    try:
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks)),
+                                 mp_context=multiprocessing.get_context('spawn')) as executor:
+            results = list(executor.map(
+                _process_chunk,
+                [cnes] * len(chunks), [tipo] * len(chunks), chunks, [pacientes] * len(chunks)
+            ))
+    except Exception as e:
+        logger.warning(f"[CORRECOES] Processamento paralelo indisponível, seguindo em série: {e}")
+        return get_compiled_corrections(cnes, tipo).process(records, pacientes)
+
+    corrected_records: List[Dict] = []
+    stats = BPACorrections.empty_stats()
+    for chunk_records, chunk_stats in results:
+        corrected_records.extend(chunk_records)
+        BPACorrections.merge_stats(stats, chunk_stats)
+    return corrected_records, stats
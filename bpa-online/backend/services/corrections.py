@@ -214,250 +214,92 @@ class BPACorrections:
         self.cnes = cnes
         self.is_upa = cnes in self.CNES_UPAS if cnes else False
     
-    def apply_corrections(self, record: Dict, tipo: str = 'BPI') -> CorrectionResult:
+    @staticmethod
+    def _identificacao_paciente(record: Dict) -> Tuple[str, str, bool, bool]:
+        """(cns, cpf, cns_valido, cpf_valido) do paciente de um registro BPI"""
+        cns_paciente = record.get('cns_paciente') or record.get('prd_cnspac') or ''
+        cpf_paciente = record.get('cpf_paciente') or record.get('prd_cpf_pcnte') or ''
+
+        cns_paciente = str(cns_paciente) if cns_paciente is not None else ''
+        cpf_paciente = str(cpf_paciente) if cpf_paciente is not None else ''
+
+        cns_valido = bool(cns_paciente and cns_paciente.strip() != '')
+        cpf_valido = bool(cpf_paciente and cpf_paciente.strip() != '' and len(cpf_paciente.strip()) >= 11)
+        return cns_paciente, cpf_paciente, cns_valido, cpf_valido
+
+    @staticmethod
+    def _nome_nascimento(record: Dict) -> Tuple[str, str]:
+        """Par (nome, data_nascimento) usado para recuperar o paciente no cadastro"""
+        nome = record.get('nome_paciente') or record.get('prd_nmpac') or ''
+        data_nasc = record.get('data_nascimento') or record.get('prd_dtnasc') or ''
+        return nome, data_nasc
+
+    def depende_do_cadastro(self, record: Dict) -> bool:
+        """
+        True se a correção do registro BPI consulta o cadastro de pacientes
+        (sem CNS/CPF, com nome e data de nascimento); o resultado dos demais
+        não muda quando pacientes muda
+        """
+        procedimento = record.get('procedimento') or record.get('prd_pa') or ''
+        if not procedimento or not procedimento.strip() or procedimento in self.PROCEDIMENTOS_EXCLUIR:
+            return False
+        _, _, cns_valido, cpf_valido = self._identificacao_paciente(record)
+        if cns_valido or cpf_valido:
+            return False
+        nome, data_nasc = self._nome_nascimento(record)
+        return bool(nome and data_nasc)
+
+    def buscar_pacientes_sem_identificacao(self, records: List[Dict]) -> Dict[tuple, Dict]:
+        """
+        Pré-passo de process_batch: resolve numa única consulta todos os pacientes
+        sem CNS/CPF do lote que têm nome e data de nascimento
+
+        Returns:
+            {(nome, data_nascimento): paciente} para os pares encontrados no cadastro
+        """
+        pares = {self._nome_nascimento(record) for record in records if self.depende_do_cadastro(record)}
+
+        if not pares:
+            return {}
+        try:
+            from database import BPADatabase
+            return BPADatabase().get_pacientes_by_nome_nascimento(pares)
+        except Exception:
+            return {}  # Sem cadastro disponível: segue com a validação padrão
+
+    def apply_corrections(
+        self,
+        record: Dict,
+        tipo: str = 'BPI',
+        pacientes: Optional[Dict[tuple, Dict]] = None
+    ) -> CorrectionResult:
         """
         Aplica todas as correções necessárias a um registro
         
+        As regras ficam em services.correction_rules (REGRAS); aqui só se usa
+        o pipeline compilado do (CNES, tipo) no modo detalhado, com mensagens.
+        
         Args:
             record: Dicionário com os dados do registro
             tipo: Tipo do BPA ('BPI' ou 'BPA')
+            pacientes: Cadastro pré-carregado do lote (buscar_pacientes_sem_identificacao);
+                se None, busca o paciente no banco individualmente
         
         Returns:
             CorrectionResult com os dados corrigidos e lista de correções
         """
-        corrections = []
-        corrected = record.copy()
-        should_delete = False
-        delete_reason = None
+        from services.correction_rules import get_compiled_corrections
         
-        # 1. Verifica se o procedimento deve ser excluído
-        procedimento = record.get('procedimento') or record.get('prd_pa') or ''
-        
-        if procedimento in self.PROCEDIMENTOS_EXCLUIR:
-            should_delete = True
-            delete_reason = f"Procedimento {procedimento} não pertence ao BPA"
-            return CorrectionResult(
-                original=record,
-                corrected=corrected,
-                corrections_applied=corrections,
-                should_delete=should_delete,
-                delete_reason=delete_reason
-            )
-        
-        # 2. Verifica procedimento vazio ou nulo
-        if not procedimento or procedimento.strip() == '':
-            should_delete = True
-            delete_reason = "Procedimento vazio ou nulo"
-            return CorrectionResult(
-                original=record,
-                corrected=corrected,
-                corrections_applied=corrections,
-                should_delete=should_delete,
-                delete_reason=delete_reason
-            )
-        
-        # 3. Para BPI, verifica CNS ou CPF do paciente (pelo menos um deve estar preenchido)
-        if tipo == 'BPI':
-            cns_paciente = record.get('cns_paciente') or record.get('prd_cnspac') or ''
-            cpf_paciente = record.get('cpf_paciente') or record.get('prd_cpf_pcnte') or ''
-
-            cns_paciente = str(cns_paciente) if cns_paciente is not None else ''
-            cpf_paciente = str(cpf_paciente) if cpf_paciente is not None else ''
-
-            cns_valido = cns_paciente and cns_paciente.strip() != ''
-            cpf_valido = cpf_paciente and cpf_paciente.strip() != '' and len(cpf_paciente.strip()) >= 11
-            
-            # Se CNS/CPF vazios, tenta buscar no cadastro de pacientes pelo nome+nascimento
-            if not cns_valido and not cpf_valido:
-                nome = record.get('nome_paciente') or record.get('prd_nmpac') or ''
-                data_nasc = record.get('data_nascimento') or record.get('prd_dtnasc') or ''
-                
-                if nome and data_nasc:
-                    try:
-                        from database import BPADatabase
-                        db = BPADatabase()
-                        paciente = db.get_paciente_by_nome_nascimento(nome, data_nasc)
-                        if paciente:
-                            # Encontrou paciente no cadastro!
-                            if paciente.get('cns'):
-                                cns_paciente = paciente['cns']
-                                cns_valido = True
-                                corrected['cns_paciente'] = cns_paciente
-                                if 'prd_cnspac' in corrected:
-                                    corrected['prd_cnspac'] = cns_paciente
-                                corrections.append(f"CNS recuperado do cadastro: {cns_paciente}")
-                            elif paciente.get('cpf'):
-                                cpf_paciente = paciente['cpf']
-                                cpf_valido = True
-                                corrections.append(f"CPF recuperado do cadastro: {cpf_paciente}")
-                    except Exception as e:
-                        pass  # Ignora erro de busca, vai usar validação padrão
-            
-            if not cns_valido and not cpf_valido:
-                should_delete = True
-                delete_reason = "CNS/CPF do paciente vazio (obrigatório para BPI)"
-                return CorrectionResult(
-                    original=record,
-                    corrected=corrected,
-                    corrections_applied=corrections,
-                    should_delete=should_delete,
-                    delete_reason=delete_reason
-                )
-            
-            # Se tem CPF mas não CNS, usa o CPF no campo CNS para exportação
-            if not cns_valido and cpf_valido:
-                corrected['cns_paciente'] = cpf_paciente.strip()
-                if 'prd_cnspac' in corrected:
-                    corrected['prd_cnspac'] = cpf_paciente.strip()
-                corrections.append(f"Usando CPF como identificador: {cpf_paciente.strip()}")
-        
-        # 4. Corrige procedimentos revogados
-        if procedimento in self.PROCEDIMENTOS_REVOGADOS:
-            novo_pa = self.PROCEDIMENTOS_REVOGADOS[procedimento]
-            corrected['procedimento'] = novo_pa
-            if 'prd_pa' in corrected:
-                corrected['prd_pa'] = novo_pa
-            corrections.append(f"Procedimento revogado: {procedimento} → {novo_pa}")
-        
-        # 5. Corrige raça/cor (05 e 06 → 03)
-        raca = str(record.get('raca_cor') or record.get('prd_raca') or '01')
-        if raca in ('05', '06'):
-            corrected['raca_cor'] = '03'
-            if 'prd_raca' in corrected:
-                corrected['prd_raca'] = '03'
-            corrections.append(f"Raça/Cor corrigida: {raca} → 03")
-        
-        # 6. Corrige caráter de atendimento para UPAs
-        if tipo == 'BPI' and self.is_upa:
-            caten = record.get('carater_atendimento') or record.get('prd_caten') or '01'
-            if caten == '01':
-                corrected['carater_atendimento'] = '02'
-                if 'prd_caten' in corrected:
-                    corrected['prd_caten'] = '02'
-                corrections.append("Caráter de atendimento UPA: 01 → 02")
-        
-        # 7. Corrige CID para procedimentos específicos
-        procedimento_atual = corrected.get('procedimento') or corrected.get('prd_pa') or ''
-        if procedimento_atual in self.CORRECOES_CID:
-            cid_correto = self.CORRECOES_CID[procedimento_atual]
-            cid_atual = record.get('cid') or record.get('prd_cid') or ''
-            if cid_atual != cid_correto:
-                corrected['cid'] = cid_correto
-                if 'prd_cid' in corrected:
-                    corrected['prd_cid'] = cid_correto
-                corrections.append(f"CID corrigido para PA {procedimento_atual}: {cid_atual} → {cid_correto}")
-        
-        # 8. Aplica limites de quantidade
-        if procedimento_atual in self.LIMITES_QUANTIDADE:
-            limite = self.LIMITES_QUANTIDADE[procedimento_atual]
-            qtd = int(record.get('quantidade') or record.get('prd_qt_p') or 1)
-            if qtd > limite:
-                corrected['quantidade'] = limite
-                if 'prd_qt_p' in corrected:
-                    corrected['prd_qt_p'] = limite
-                corrections.append(f"Quantidade limitada: {qtd} → {limite} (PA {procedimento_atual})")
-        
-        # 9. Corrige CEP (para BPI)
-        if tipo == 'BPI':
-            cep = str(record.get('cep') or record.get('prd_cep_pcnte') or '')
-            if not cep or cep.strip() == '' or cep in self.CEPS_INVALIDOS:
-                corrected['cep'] = self.CEP_PADRAO
-                if 'prd_cep_pcnte' in corrected:
-                    corrected['prd_cep_pcnte'] = self.CEP_PADRAO
-                if cep:
-                    corrections.append(f"CEP inválido corrigido: {cep} → {self.CEP_PADRAO}")
-                else:
-                    corrections.append(f"CEP vazio preenchido: {self.CEP_PADRAO}")
-        
-        # 10. Corrige código IBGE
-        ibge = record.get('municipio_ibge') or record.get('prd_ibge') or ''
-        if not ibge or ibge.strip() == '':
-            corrected['municipio_ibge'] = self.IBGE_PADRAO
-            if 'prd_ibge' in corrected:
-                corrected['prd_ibge'] = self.IBGE_PADRAO
-            corrections.append(f"IBGE vazio preenchido: {self.IBGE_PADRAO}")
-        
-        # 11. Corrige logradouro (para BPI)
-        if tipo == 'BPI':
-            logradouro = record.get('logradouro_codigo') or record.get('prd_lograd_pcnte') or ''
-            if not logradouro or logradouro.strip() == '':
-                corrected['logradouro_codigo'] = self.LOGRADOURO_PADRAO
-                if 'prd_lograd_pcnte' in corrected:
-                    corrected['prd_lograd_pcnte'] = self.LOGRADOURO_PADRAO
-                corrections.append(f"Logradouro vazio preenchido: {self.LOGRADOURO_PADRAO}")
-        
-        # 12. Corrige endereço vazio
-        if tipo == 'BPI':
-            endereco = record.get('endereco') or record.get('prd_end_pcnte') or ''
-            if not endereco or endereco.strip() == '':
-                corrected['endereco'] = 'NAO LOCALIZADO'
-                if 'prd_end_pcnte' in corrected:
-                    corrected['prd_end_pcnte'] = 'NAO LOCALIZADO'
-                corrections.append("Endereço vazio preenchido: NAO LOCALIZADO")
-        
-        # 13. Corrige bairro vazio
-        if tipo == 'BPI':
-            bairro = record.get('bairro') or record.get('prd_bairro_pcnte') or ''
-            if not bairro or bairro.strip() == '':
-                corrected['bairro'] = 'NAO LOCALIZADO'
-                if 'prd_bairro_pcnte' in corrected:
-                    corrected['prd_bairro_pcnte'] = 'NAO LOCALIZADO'
-                corrections.append("Bairro vazio preenchido: NAO LOCALIZADO")
-        
-        # 14. Corrige número vazio ou inválido
-        if tipo == 'BPI':
-            numero = str(record.get('numero') or record.get('prd_num_pcnte') or '')
-            numeros_invalidos = {'', '00', '000', '0000', '00000', 'S/N', 'cs02', 'SN'}
-            if numero.upper() in numeros_invalidos:
-                corrected['numero'] = '01'
-                if 'prd_num_pcnte' in corrected:
-                    corrected['prd_num_pcnte'] = '01'
-                corrections.append(f"Número inválido corrigido: '{numero}' → 01")
-        
-        # 15. Aplica serviço/classificação para procedimentos específicos
-        if procedimento_atual in self.SERVICO_CLASSIFICACAO:
-            servico, classificacao = self.SERVICO_CLASSIFICACAO[procedimento_atual]
-            if servico:
-                corrected['servico'] = servico
-                if 'prd_servico' in corrected:
-                    corrected['prd_servico'] = servico
-                corrections.append(f"Serviço definido: {servico}")
-            if classificacao:
-                corrected['classificacao'] = classificacao
-                if 'prd_classificacao' in corrected:
-                    corrected['prd_classificacao'] = classificacao
-                corrections.append(f"Classificação definida: {classificacao}")
-        
-        # 16. Corrige SEXO (0 -> M, 1 -> F)
-        if tipo == 'BPI':
-            sexo = str(record.get('sexo') or record.get('prd_sexo') or '')
-            novo_sexo = sexo
-            
-            if sexo == '0':
-                novo_sexo = 'M'
-            elif sexo == '1':
-                novo_sexo = 'F'
-            elif sexo not in ('M', 'F'):
-                novo_sexo = 'M'  # Default para valores inválidos
-            
-            if novo_sexo != sexo:
-                corrected['sexo'] = novo_sexo
-                if 'prd_sexo' in corrected:
-                    corrected['prd_sexo'] = novo_sexo
-                corrections.append(f"Sexo corrigido: {sexo} → {novo_sexo}")
-        
-        return CorrectionResult(
-            original=record,
-            corrected=corrected,
-            corrections_applied=corrections,
-            should_delete=should_delete,
-            delete_reason=delete_reason
-        )
+        return get_compiled_corrections(self.cnes, tipo).apply(record, pacientes)
     
     def process_batch(self, records: List[Dict], tipo: str = 'BPI') -> Tuple[List[Dict], Dict]:
         """
         Processa um lote de registros aplicando correções
         
+        Usa as regras compiladas por (CNES, tipo) em modo estatísticas (mesmo
+        resultado de apply_corrections, sem montar as mensagens); lotes grandes
+        são divididos entre processos (ver services.correction_rules).
+        
         Args:
             records: Lista de registros
             tipo: Tipo do BPA ('BPI' ou 'BPA')
@@ -465,9 +307,18 @@ class BPACorrections:
         Returns:
             Tupla com (registros_corrigidos, estatísticas)
         """
-        corrected_records = []
-        stats = {
-            'total_input': len(records),
+        from services.correction_rules import process_records
+        
+        # Uma consulta ao cadastro para o lote todo, em vez de uma por registro sem CNS/CPF
+        pacientes = self.buscar_pacientes_sem_identificacao(records) if tipo == 'BPI' else None
+        
+        return process_records(self.cnes, tipo, records, pacientes)
+    
+    @staticmethod
+    def empty_stats() -> Dict:
+        """Estatísticas zeradas no formato retornado por process_batch"""
+        return {
+            'total_input': 0,
             'total_output': 0,
             'deleted': 0,
             'corrected': 0,
@@ -475,29 +326,25 @@ class BPACorrections:
             'delete_reasons': {},
             'correction_types': {},
         }
+    
+    @staticmethod
+    def merge_stats(total: Dict, stats: Dict) -> Dict:
+        """
+        Soma as estatísticas de um lote em `total` (processamento por páginas)
         
-        for record in records:
-            result = self.apply_corrections(record, tipo)
-            
-            if result.should_delete:
-                stats['deleted'] += 1
-                reason = result.delete_reason or 'Desconhecido'
-                stats['delete_reasons'][reason] = stats['delete_reasons'].get(reason, 0) + 1
-            else:
-                corrected_records.append(result.corrected)
-                
-                if result.corrections_applied:
-                    stats['corrected'] += 1
-                    for correction in result.corrections_applied:
-                        # Extrai tipo de correção
-                        correction_type = correction.split(':')[0] if ':' in correction else correction
-                        stats['correction_types'][correction_type] = stats['correction_types'].get(correction_type, 0) + 1
-                else:
-                    stats['unchanged'] += 1
-        
-        stats['total_output'] = len(corrected_records)
-        
-        return corrected_records, stats
+        Args:
+            total: Estatísticas acumuladas (alteradas no lugar)
+            stats: Estatísticas de um lote retornadas por process_batch
+        
+        Returns:
+            O próprio `total`
+        """
+        for key in ('total_input', 'total_output', 'deleted', 'corrected', 'unchanged'):
+            total[key] += stats[key]
+        for key in ('delete_reasons', 'correction_types'):
+            for name, count in stats[key].items():
+                total[key][name] = total[key].get(name, 0) + count
+        return total
     
     def get_correction_summary(self, stats: Dict) -> str:
         """
@@ -556,20 +403,40 @@ class BPACorrections:
             return records
         
         # Ordena os registros
-        sorted_records = sorted(records, key=lambda r: (
-            r.get('competencia') or r.get('prd_cmp') or '',
-            r.get('cns_profissional') or r.get('prd_cnsmed') or '',
-            r.get('procedimento') or r.get('prd_pa') or '',
-            r.get('data_atendimento') or r.get('prd_dtaten') or '',
-            r.get('cnes') or r.get('prd_uid') or ''
-        ))
+        sorted_records = sorted(records, key=self.sort_key_bpi)
+        self.sequence_bpi(sorted_records)
+        return sorted_records
+    
+    @staticmethod
+    def sort_key_bpi(record: Dict) -> tuple:
+        """Ordem de assign_sequence_bpi: competência, CNS profissional, PA, data atendimento, CNES"""
+        return (
+            record.get('competencia') or record.get('prd_cmp') or '',
+            record.get('cns_profissional') or record.get('prd_cnsmed') or '',
+            record.get('procedimento') or record.get('prd_pa') or '',
+            record.get('data_atendimento') or record.get('prd_dtaten') or '',
+            record.get('cnes') or record.get('prd_uid') or ''
+        )
+    
+    def sequence_bpi(self, records: List[Dict], state: Optional[Dict] = None) -> Dict:
+        """
+        Numera folha/sequência de registros BPI já ordenados (sort_key_bpi)
         
-        prev_cnsmed = ''
-        prev_cmp = ''
-        fol_novo = 0
-        seq_novo = 0
+        Args:
+            records: Registros na ordem final (alterados no lugar)
+            state: Estado retornado pela chamada anterior, para continuar a
+                numeração entre lotes de um mesmo fluxo (exportação em streaming)
+        
+        Returns:
+            Estado da numeração após o último registro
+        """
+        state = dict(state) if state else {'prev_cnsmed': '', 'prev_cmp': '', 'folha': 0, 'seq': 0}
+        prev_cnsmed = state['prev_cnsmed']
+        prev_cmp = state['prev_cmp']
+        fol_novo = state['folha']
+        seq_novo = state['seq']
         
-        for record in sorted_records:
+        for record in records:
             cnsmed = record.get('cns_profissional') or record.get('prd_cnsmed') or ''
             cmp = record.get('competencia') or record.get('prd_cmp') or ''
             
@@ -602,7 +469,7 @@ class BPACorrections:
             if 'prd_seq' in record:
                 record['prd_seq'] = pad_left(str(seq_novo), '0', 2)
         
-        return sorted_records
+        return {'prev_cnsmed': prev_cnsmed, 'prev_cmp': prev_cmp, 'folha': fol_novo, 'seq': seq_novo}
     
     def assign_sequence_bpa(self, records: List[Dict]) -> List[Dict]:
         """
@@ -627,12 +494,26 @@ class BPACorrections:
         sorted_records = sorted(records, key=lambda r: (
             r.get('cnes') or r.get('prd_uid') or ''
         ))
+        self.sequence_bpa(sorted_records)
+        return sorted_records
+    
+    def sequence_bpa(self, records: List[Dict], state: Optional[Dict] = None) -> Dict:
+        """
+        Numera folha/sequência de registros BPA consolidado já ordenados por CNES
         
-        prev_cnes = ''
-        fol_novo = 0
-        seq_novo = 0
+        Args:
+            records: Registros na ordem final (alterados no lugar)
+            state: Estado retornado pela chamada anterior (numeração entre lotes)
         
-        for record in sorted_records:
+        Returns:
+            Estado da numeração após o último registro
+        """
+        state = dict(state) if state else {'prev_cnes': '', 'folha': 0, 'seq': 0}
+        prev_cnes = state['prev_cnes']
+        fol_novo = state['folha']
+        seq_novo = state['seq']
+        
+        for record in records:
             cnes = record.get('cnes') or record.get('prd_uid') or ''
             
             seq_novo += 1
@@ -658,7 +539,7 @@ class BPACorrections:
             if 'prd_seq' in record:
                 record['prd_seq'] = pad_left(str(seq_novo), '0', 2)
         
-        return sorted_records
+        return {'prev_cnes': prev_cnes, 'folha': fol_novo, 'seq': seq_novo}
     
     def generate_id(self, start_id: int = 1) -> callable:
         """
@@ -0,0 +1,39 @@
+"""
+Índices das consultas do BPADatabase
+
+Módulo sem efeitos na importação (database.py abre o pool e roda
+init_database() ao ser importado): migrations/indices_consultas.py lê daqui a
+lista para criar os índices com CONCURRENTLY antes de a API subir.
+"""
+
+# (nome, tabela, definição). Cada um atende consultas de
+# tests/test_explain_indices.py, que confere no EXPLAIN que elas usam o índice
+# esperado. Nas tabelas particionadas o índice é criado na tabela-mãe e o
+# Postgres o replica em cada partição (inclusive nas criadas depois por
+# bpa_garantir_particao).
+INDICES_CONSULTAS = (
+    # Exportação, relatórios e reset da exportação: prd_uid + competência (+ exportado)
+    ('idx_bpai_uid_cmp_exportado', 'bpa_individualizado', '(prd_uid, prd_cmp, prd_exportado)'),
+    ('idx_bpac_uid_cmp_exportado', 'bpa_consolidado', '(prd_uid, prd_cmp, prd_exportado)'),
+    # Listagens paginadas por keyset (prd_uid, id > último) dentro da partição do mês
+    ('idx_bpai_uid_id', 'bpa_individualizado', '(prd_uid, id)'),
+    ('idx_bpac_uid_id', 'bpa_consolidado', '(prd_uid, id)'),
+    # Limpeza de pacientes sem produção (remover_pacientes_sem_producao)
+    ('idx_bpai_cnspac', 'bpa_individualizado', '(prd_cnspac)'),
+    # Recuperação do paciente por nome + nascimento nas correções (mesma expressão da consulta)
+    ('idx_pacientes_nome_nascimento', 'pacientes', '((UPPER(TRIM(nome))), data_nascimento)'),
+)
+
+# Substituídos pelos compostos acima (prefixos deles, ou só o booleano prd_exportado)
+INDICES_OBSOLETOS = (
+    'idx_bpai_uid', 'idx_bpai_uid_cmp', 'idx_bpai_exportado',
+    'idx_bpac_uid', 'idx_bpac_exportado',
+)
+
+
+def garantir_indices(cursor) -> None:
+    """Cria os índices de INDICES_CONSULTAS que faltam e remove os obsoletos"""
+    for nome, tabela, definicao in INDICES_CONSULTAS:
+        cursor.execute(f'CREATE INDEX IF NOT EXISTS {nome} ON {tabela} {definicao}')
+    for nome in INDICES_OBSOLETOS:
+        cursor.execute(f'DROP INDEX IF EXISTS {nome}')
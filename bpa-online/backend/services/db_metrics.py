@@ -0,0 +1,381 @@
+"""
+Instrumentação do acesso ao PostgreSQL: latência, espera no pool e consultas lentas
+
+Medido em três pontos:
+    - get_connection(): espera para obter conexão do pool (bpa_db_pool_wait_seconds)
+    - cada execute/copy de um cursor: tempo e linhas por método de BPADatabase
+      (bpa_db_query_seconds, bpa_db_query_rows; ver instrumentar_metodos)
+    - a chamada inteira de cada método público (bpa_db_method_seconds)
+
+Histogramas em memória do processo, expostos em /metrics no formato texto do
+Prometheus. O custo por consulta é o de dois perf_counter e um lock.
+
+Consultas acima de DB_SLOW_QUERY_MS entram no log (`[DB] Consulta lenta`) e
+numa lista das mais recentes, com o SQL, a forma dos parâmetros (tipos e
+tamanhos, nunca os valores: CNS e nomes de pacientes não vão para o log) e,
+para SELECTs, uma amostra de EXPLAIN (ANALYZE, BUFFERS). O EXPLAIN roda numa
+thread, em conexão própria, numa transação READ ONLY desfeita no fim, e no
+máximo uma vez por método a cada DB_SLOW_QUERY_EXPLAIN_INTERVAL segundos.
+ANALYZE executa o comando de novo: só entram SELECTs que leem tabelas (com
+FROM) e chamam apenas funções de _FUNCOES_LEITURA. Chamadas como
+bpa_remover_particao, dados_versao_incrementar ou pg_advisory_xact_lock não
+são repetidas (o READ ONLY não barra advisory locks).
+"""
+import contextvars
+import hmac
+import logging
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from datetime import datetime
+from functools import wraps
+from inspect import iscoroutinefunction, isgenerator
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DB_METRICS_ENABLED = os.getenv('DB_METRICS_ENABLED', '1') != '0'
+DB_SLOW_QUERY_MS = int(os.getenv('DB_SLOW_QUERY_MS', '500'))
+DB_SLOW_QUERY_EXPLAIN = os.getenv('DB_SLOW_QUERY_EXPLAIN', '1') != '0'
+DB_SLOW_QUERY_EXPLAIN_INTERVAL = int(os.getenv('DB_SLOW_QUERY_EXPLAIN_INTERVAL', '300'))
+DB_SLOW_QUERY_EXPLAIN_TIMEOUT_MS = int(os.getenv('DB_SLOW_QUERY_EXPLAIN_TIMEOUT_MS', '30000'))
+DB_SLOW_QUERY_KEEP = int(os.getenv('DB_SLOW_QUERY_KEEP', '100'))
+# Vazio: /metrics aberto (scrape interno); definido: exige 'Authorization: Bearer <token>'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+BUCKETS_SEGUNDOS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+BUCKETS_LINHAS = (0, 1, 10, 100, 1000, 10000, 100000, 1000000)
+
+# Método de BPADatabase em execução (rótulo das consultas feitas dentro dele)
+_metodo_atual: contextvars.ContextVar[str] = contextvars.ContextVar('bpa_db_metodo', default='outros')
+# Desliga a medição (ex.: o próprio EXPLAIN das consultas lentas)
+_sem_medicao: contextvars.ContextVar[bool] = contextvars.ContextVar('bpa_db_sem_medicao', default=False)
+
+
+class Histogram:
+    """Histograma com rótulos, no modelo do Prometheus (buckets cumulativos na exposição)"""
+
+    def __init__(self, nome: str, ajuda: str, rotulos: Tuple[str, ...] = (), buckets: Tuple = BUCKETS_SEGUNDOS):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = rotulos
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, valor: float, *rotulos: str) -> None:
+        indice = bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(rotulos)
+            if serie is None:
+                # [contagem por bucket (+Inf no fim), soma, total]
+                serie = self._series[rotulos] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            serie[0][indice] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    def series(self) -> Dict[Tuple[str, ...], Dict[str, Any]]:
+        with self._lock:
+            return {r: {'buckets': list(s[0]), 'soma': s[1], 'total': s[2]} for r, s in self._series.items()}
+
+    def exposicao(self) -> Iterable[str]:
+        yield f'# HELP {self.nome} {self.ajuda}'
+        yield f'# TYPE {self.nome} histogram'
+        for rotulos, serie in sorted(self.series().items()):
+            base = list(zip(self.rotulos, rotulos))
+            acumulado = 0
+            for limite, contagem in zip(self.buckets + (float('inf'),), serie['buckets']):
+                acumulado += contagem
+                le = '+Inf' if limite == float('inf') else _numero(limite)
+                yield f'{self.nome}_bucket{_rotulos(base + [("le", le)])} {acumulado}'
+            yield f'{self.nome}_sum{_rotulos(base)} {_numero(serie["soma"])}'
+            yield f'{self.nome}_count{_rotulos(base)} {serie["total"]}'
+
+
+class Counter:
+    """Contador com rótulos"""
+
+    def __init__(self, nome: str, ajuda: str, rotulos: Tuple[str, ...] = ()):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.rotulos = rotulos
+        self._valores: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *rotulos: str, valor: float = 1) -> None:
+        with self._lock:
+            self._valores[rotulos] = self._valores.get(rotulos, 0) + valor
+
+    def valor(self, *rotulos: str) -> float:
+        with self._lock:
+            return self._valores.get(rotulos, 0)
+
+    def exposicao(self) -> Iterable[str]:
+        yield f'# HELP {self.nome} {self.ajuda}'
+        yield f'# TYPE {self.nome} counter'
+        with self._lock:
+            valores = sorted(self._valores.items())
+        for rotulos, valor in valores:
+            yield f'{self.nome}{_rotulos(list(zip(self.rotulos, rotulos)))} {_numero(valor)}'
+
+
+def _numero(valor: float) -> str:
+    return repr(float(valor)) if not float(valor).is_integer() else str(int(valor))
+
+
+def _escapar(valor: str) -> str:
+    return str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _rotulos(pares: List[Tuple[str, str]]) -> str:
+    if not pares:
+        return ''
+    return '{' + ','.join(f'{nome}="{_escapar(valor)}"' for nome, valor in pares) + '}'
+
+
+POOL_WAIT = Histogram('bpa_db_pool_wait_seconds', 'Espera para obter conexao do pool', ('pool',))
+POOL_ESGOTADO = Counter('bpa_db_pool_exhausted_total', 'Pedidos de conexao recusados com o pool cheio', ('pool',))
+METHOD_SECONDS = Histogram('bpa_db_method_seconds', 'Duracao das chamadas a BPADatabase', ('metodo',))
+QUERY_SECONDS = Histogram('bpa_db_query_seconds', 'Duracao de cada comando SQL', ('metodo',))
+QUERY_ROWS = Histogram('bpa_db_query_rows', 'Linhas retornadas/afetadas por comando SQL', ('metodo',), BUCKETS_LINHAS)
+QUERY_ERRORS = Counter('bpa_db_query_errors_total', 'Comandos SQL que falharam', ('metodo',))
+SLOW_QUERIES = Counter('bpa_db_slow_queries_total', 'Comandos acima de DB_SLOW_QUERY_MS', ('metodo',))
+
+METRICAS = (POOL_WAIT, POOL_ESGOTADO, METHOD_SECONDS, QUERY_SECONDS, QUERY_ROWS, QUERY_ERRORS, SLOW_QUERIES)
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def prometheus_text() -> str:
+    """Todas as métricas no formato texto do Prometheus"""
+    return '\n'.join(linha for metrica in METRICAS for linha in metrica.exposicao()) + '\n'
+
+
+def metrics_autorizado(authorization: Optional[str]) -> bool:
+    if not METRICS_TOKEN:
+        return True
+    return hmac.compare_digest((authorization or '').encode('utf-8'), f'Bearer {METRICS_TOKEN}'.encode('utf-8'))
+
+
+# ========== CONSULTAS ==========
+
+def medicao_ativa() -> bool:
+    return DB_METRICS_ENABLED and not _sem_medicao.get()
+
+
+def registrar_consulta(sql: Any, params: Any, duracao: float, linhas: int = -1,
+                       erro: bool = False, metodo: Optional[str] = None) -> None:
+    """Registra um comando executado (chamado pelos cursores instrumentados)"""
+    metodo = metodo or _metodo_atual.get()
+    QUERY_SECONDS.observe(duracao, metodo)
+    if erro:
+        QUERY_ERRORS.inc(metodo)
+    elif linhas is not None and linhas >= 0:
+        QUERY_ROWS.observe(linhas, metodo)
+    if duracao * 1000 >= DB_SLOW_QUERY_MS:
+        _consulta_lenta(metodo, sql, params, duracao, linhas)
+
+
+def forma_parametros(params: Any) -> Any:
+    """Tipos (e tamanhos de listas/textos) dos parâmetros, sem os valores"""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {chave: _forma(valor) for chave, valor in params.items()}
+    if isinstance(params, (list, tuple)):
+        return [_forma(valor) for valor in params]
+    return _forma(params)
+
+
+def _forma(valor: Any) -> str:
+    if valor is None:
+        return 'null'
+    if isinstance(valor, (list, tuple)):
+        return f'{type(valor).__name__}[{len(valor)}]'
+    if isinstance(valor, (str, bytes)):
+        return f'{type(valor).__name__}({len(valor)})'
+    return type(valor).__name__
+
+
+def _texto_sql(sql: Any) -> str:
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    return ' '.join(str(sql).split())
+
+
+_SOMENTE_LEITURA = re.compile(r'^\s*(SELECT|WITH)\b', re.IGNORECASE)
+_ESCRITA = re.compile(r'\b(INSERT|UPDATE|DELETE|MERGE|TRUNCATE)\b', re.IGNORECASE)
+_FROM = re.compile(r'\bFROM\b', re.IGNORECASE)
+# nome( ... ): chamadas de função, e também palavras-chave seguidas de parêntese
+_CHAMADA = re.compile(r'([A-Za-z_][A-Za-z0-9_.]*)\s*\(')
+_LITERAL = re.compile(r"'(?:[^']|'')*'")
+
+# Funções (e palavras-chave antes de parêntese) que podem ir para o EXPLAIN ANALYZE
+_FUNCOES_LEITURA = frozenset({
+    # palavras-chave
+    'select', 'from', 'where', 'and', 'or', 'not', 'in', 'exists', 'any', 'all', 'as', 'on', 'using',
+    'join', 'values', 'over', 'filter', 'within', 'array', 'row', 'cast', 'case', 'when', 'then',
+    'else', 'partition', 'by', 'union', 'intersect', 'except', 'lateral', 'is', 'distinct', 'between',
+    'like', 'ilike', 'limit', 'offset', 'order', 'group', 'having',
+    # agregações e janelas
+    'count', 'sum', 'min', 'max', 'avg', 'bool_and', 'bool_or', 'string_agg', 'array_agg',
+    'json_agg', 'jsonb_agg', 'jsonb_object_agg', 'row_number', 'rank', 'dense_rank', 'lag', 'lead',
+    # escalares sem efeito colateral
+    'coalesce', 'nullif', 'greatest', 'least', 'upper', 'lower', 'trim', 'ltrim', 'rtrim', 'btrim',
+    'substr', 'substring', 'length', 'char_length', 'lpad', 'rpad', 'concat', 'replace', 'left',
+    'right', 'position', 'split_part', 'md5', 'round', 'abs', 'floor', 'ceil', 'extract',
+    'date_trunc', 'to_char', 'to_date', 'to_timestamp', 'now', 'unnest', 'generate_series',
+    'json_build_object', 'jsonb_build_object', 'to_regclass', 'current_schema',
+})
+
+_lentas: deque = deque(maxlen=DB_SLOW_QUERY_KEEP)
+_lentas_lock = threading.Lock()
+_ultimo_explain: Dict[str, float] = {}
+
+
+def _consulta_lenta(metodo: str, sql: Any, params: Any, duracao: float, linhas: int) -> None:
+    SLOW_QUERIES.inc(metodo)
+    texto = _texto_sql(sql)
+    registro = {
+        'quando': datetime.now().isoformat(timespec='seconds'),
+        'metodo': metodo,
+        'duracao_ms': round(duracao * 1000, 1),
+        'linhas': linhas,
+        'sql': texto[:4000],
+        'parametros': forma_parametros(params),
+        'plano': None,
+    }
+    with _lentas_lock:
+        _lentas.append(registro)
+    logger.warning(f"[DB] Consulta lenta em {metodo}: {registro['duracao_ms']}ms, "
+                   f"{linhas} linhas, parâmetros {registro['parametros']}: {texto[:500]}")
+
+    if DB_SLOW_QUERY_EXPLAIN and _amostrar_explain(metodo, texto):
+        threading.Thread(
+            target=_explain, args=(registro, sql, params), name='bpa-explain', daemon=True
+        ).start()
+
+
+def _amostrar_explain(metodo: str, texto: str) -> bool:
+    """SELECT sem escrita, e no máximo um EXPLAIN por método no intervalo"""
+    if not _leitura_repetivel(texto):
+        return False
+    agora = time.monotonic()
+    with _lentas_lock:
+        ultimo = _ultimo_explain.get(metodo)
+        if ultimo is not None and agora - ultimo < DB_SLOW_QUERY_EXPLAIN_INTERVAL:
+            return False
+        _ultimo_explain[metodo] = agora
+    return True
+
+
+def _leitura_repetivel(texto: str) -> bool:
+    """SELECT/WITH que lê tabelas e só chama funções sem efeito colateral"""
+    if not _SOMENTE_LEITURA.match(texto) or _ESCRITA.search(texto):
+        return False
+    sem_literais = _LITERAL.sub("''", texto)
+    if not _FROM.search(sem_literais):
+        return False
+    return all(nome.lower() in _FUNCOES_LEITURA for nome in _CHAMADA.findall(sem_literais))
+
+
+def _explain(registro: Dict, sql: Any, params: Any) -> None:
+    """EXPLAIN (ANALYZE, BUFFERS) numa conexão própria, em transação READ ONLY sempre desfeita"""
+    import psycopg2
+    from database import DB_CONFIG
+
+    _sem_medicao.set(True)
+    conn = None
+    try:
+        conn = psycopg2.connect(
+            host=DB_CONFIG["host"], port=DB_CONFIG["port"], database=DB_CONFIG["database"],
+            user=DB_CONFIG["user"], password=DB_CONFIG["password"], connect_timeout=5
+        )
+        with conn.cursor() as cursor:
+            cursor.execute('SET TRANSACTION READ ONLY')
+            cursor.execute("SELECT set_config('statement_timeout', %s, true)",
+                           (str(DB_SLOW_QUERY_EXPLAIN_TIMEOUT_MS),))
+            cursor.execute('EXPLAIN (ANALYZE, BUFFERS) ' + _texto_sql(sql), params)
+            plano = '\n'.join(row[0] for row in cursor.fetchall())
+        registro['plano'] = plano
+        logger.warning(f"[DB] Plano da consulta lenta em {registro['metodo']}:\n{plano}")
+    except Exception as e:
+        registro['plano'] = f'indisponível: {e}'
+    finally:
+        if conn is not None:
+            conn.rollback()
+            conn.close()
+
+
+def consultas_lentas() -> List[Dict]:
+    """Consultas lentas mais recentes primeiro"""
+    with _lentas_lock:
+        return [dict(registro) for registro in reversed(_lentas)]
+
+
+# ========== MÉTODOS ==========
+
+def _medir_metodo(nome: str, func):
+    if iscoroutinefunction(func):
+        @wraps(func)
+        async def medido_async(*args, **kwargs):
+            if not DB_METRICS_ENABLED:
+                return await func(*args, **kwargs)
+            token = _metodo_atual.set(nome)
+            inicio = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                METHOD_SECONDS.observe(time.perf_counter() - inicio, nome)
+                _metodo_atual.reset(token)
+        return medido_async
+
+    @wraps(func)
+    def medido(*args, **kwargs):
+        if not DB_METRICS_ENABLED:
+            return func(*args, **kwargs)
+        token = _metodo_atual.set(nome)
+        inicio = time.perf_counter()
+        try:
+            resultado = func(*args, **kwargs)
+        finally:
+            _metodo_atual.reset(token)
+        if isgenerator(resultado):
+            # iter_*: as consultas rodam durante o consumo, bloco a bloco
+            return _gerador_medido(nome, resultado, inicio)
+        METHOD_SECONDS.observe(time.perf_counter() - inicio, nome)
+        return resultado
+    return medido
+
+
+def _gerador_medido(nome: str, gerador, inicio: float):
+    """Consome o gerador com o rótulo do método (o consumidor pode fazer outras consultas entre blocos)"""
+    contexto = contextvars.copy_context()
+    contexto.run(_metodo_atual.set, nome)
+    try:
+        while True:
+            try:
+                bloco = contexto.run(next, gerador)
+            except StopIteration:
+                return
+            yield bloco
+    finally:
+        contexto.run(gerador.close)
+        METHOD_SECONDS.observe(time.perf_counter() - inicio, nome)
+
+
+def instrumentar_metodos(cls, ignorar: Iterable[str] = ()):
+    """
+    Mede os métodos públicos da classe e rotula com o nome deles as consultas
+    feitas dentro (ex.: BPADatabase, AsyncBPADatabase). Métodos estáticos e de
+    classe, e os de `ignorar`, ficam como estão.
+    """
+    for nome, valor in list(vars(cls).items()):
+        if nome.startswith('_') or nome in ignorar or not callable(valor) \
+                or isinstance(valor, (staticmethod, classmethod, type)):
+            continue
+        setattr(cls, nome, _medir_metodo(nome, valor))
+    return cls
@@ -5,6 +5,8 @@ from datetime import datetime
 from dbfread import DBF
 import json
 
+from services.search_index import SearchIndex
+
 logger = logging.getLogger(__name__)
 
 class DBFManagerService:
@@ -26,6 +28,10 @@ class DBFManagerService:
         self._procedimentos_cache = None
         self._cache_timestamp = None
         
+        # Índices de busca (montados no primeiro uso)
+        self._procedimentos_busca = None
+        self._cbos_busca = None
+        
     def _get_cache_file(self, table_name: str) -> str:
         """Retorna caminho do arquivo de cache para uma tabela"""
         return os.path.join(self.cache_dir, f"{table_name}_cache.json")
@@ -59,7 +65,10 @@ class DBFManagerService:
             return []
     
     def _save_cache(self, cache_key: str, data: Dict):
-        """Salva dados no cache"""
+        """Salva dados no cache (resultado vazio não sobrescreve o cache existente)"""
+        if not data:
+            logger.warning(f"Cache {cache_key} não salvo: tabelas DBF sem dados")
+            return
         cache_file = self._get_cache_file(cache_key)
         cache_data = {
             'timestamp': datetime.now().isoformat(),
@@ -73,8 +82,8 @@ class DBFManagerService:
         except Exception as e:
             logger.error(f"Erro ao salvar cache {cache_key}: {e}")
     
-    def _load_cache(self, cache_key: str) -> Optional[Dict]:
-        """Carrega dados do cache"""
+    def _load_cache(self, cache_key: str, ignorar_validade: bool = False) -> Optional[Dict]:
+        """Carrega dados do cache (ignorar_validade: aceita cache expirado)"""
         cache_file = self._get_cache_file(cache_key)
         
         if not os.path.exists(cache_file):
@@ -86,7 +95,7 @@ class DBFManagerService:
             
             # Verifica se o cache não está muito antigo (1 hora)
             cache_time = datetime.fromisoformat(cache_data['timestamp'])
-            if (datetime.now() - cache_time).total_seconds() > 3600:
+            if not ignorar_validade and (datetime.now() - cache_time).total_seconds() > 3600:
                 logger.info(f"Cache {cache_key} expirado")
                 return None
             
@@ -212,6 +221,14 @@ class DBFManagerService:
         
         logger.info(f"Informações dos procedimentos carregadas: {len(procedimentos_info)} procedimentos")
         
+        # Sem as tabelas DBF, mantém o cache anterior (mesmo expirado)
+        if not procedimentos_info:
+            cached_data = self._load_cache('procedimentos_info', ignorar_validade=True)
+            if cached_data:
+                logger.warning("Tabelas DBF indisponíveis: usando cache anterior dos procedimentos")
+                self._procedimentos_cache = cached_data
+                return cached_data
+        
         # Salva no cache
         self._save_cache('procedimentos_info', procedimentos_info)
         self._procedimentos_cache = procedimentos_info
@@ -269,6 +286,8 @@ class DBFManagerService:
         self._cbo_procedimentos_cache = None
         self._procedimentos_cache = None
         self._cache_timestamp = None
+        self._procedimentos_busca = None
+        self._cbos_busca = None
         
         # Remove arquivos de cache
         try:
@@ -407,6 +426,31 @@ class DBFManagerService:
             '223710': 'FARMACEUTICO',
         }
     
+    def search_procedimentos(
+        self,
+        query: str,
+        limit: int = 50,
+        allowed: Optional[Set[str]] = None
+    ) -> List[Dict[str, str]]:
+        """
+        Busca procedimentos por código ou descrição (sem acento, ranqueada)
+        
+        Args:
+            query: Texto para buscar (código ou descrição)
+            limit: Número máximo de resultados
+            allowed: Restringe a estes códigos (ex.: procedimentos do CBO)
+            
+        Returns:
+            Lista com as informações dos procedimentos encontrados
+        """
+        procedimentos = self.get_procedimentos_info()
+        if self._procedimentos_busca is None:
+            self._procedimentos_busca = SearchIndex(
+                (codigo, info.get('descricao', '')) for codigo, info in procedimentos.items()
+            )
+        codigos = self._procedimentos_busca.search(query, limit=limit, allowed=allowed)
+        return [procedimentos[codigo] for codigo in codigos]
+    
     def search_cbos(self, query: str, limit: int = 50) -> List[Dict[str, str]]:
         """
         Busca CBOs por código ou descrição
@@ -418,22 +462,17 @@ class DBFManagerService:
         Returns:
             Lista de CBOs correspondentes à busca
         """
-        all_cbos = self.get_all_cbos()
-        query_lower = query.lower().strip()
-        
-        if not query_lower:
-            return all_cbos[:limit]
-        
-        # Filtra por código ou descrição
-        matches = []
-        for cbo in all_cbos:
-            if (query_lower in cbo['codigo'].lower() or 
-                query_lower in cbo['descricao'].lower()):
-                matches.append(cbo)
-                if len(matches) >= limit:
-                    break
-        
-        return matches
+        if not query.strip():
+            return self.get_all_cbos()[:limit]
+        
+        if self._cbos_busca is None:
+            all_cbos = self.get_all_cbos()
+            self._cbos_busca = (
+                {cbo['codigo']: cbo for cbo in all_cbos},
+                SearchIndex((cbo['codigo'], cbo['descricao']) for cbo in all_cbos)
+            )
+        cbos, busca = self._cbos_busca
+        return [cbos[codigo] for codigo in busca.search(query, limit=limit)]
 
 
 # Singleton instance
@@ -2,16 +2,26 @@
 from typing import List, Dict, Optional
 import logging
 from database import db
-from services.sigtap_parser import SigtapParser
-from services.sigtap_filter_service import get_sigtap_filter_service
-from datetime import datetime
+from services.sigtap_manager_service import get_sigtap_manager
+from services.sigtap_precos import COMPETENCIA_LEGADA, garantir_precos
 
 logger = logging.getLogger(__name__)
 
 class FinancialService:
     def __init__(self):
-        # Reutiliza o parser do serviço de filtro que já é singleton/cacheado
-        self.sigtap_service = get_sigtap_filter_service()
+        self.sigtap_manager = get_sigtap_manager()
+
+    def _competencia_precos(self, competencia: Optional[str]) -> str:
+        """
+        Competência SIGTAP usada na valoração: a informada, se instalada, senão a ativa
+        """
+        if competencia:
+            try:
+                self.sigtap_manager.get_sigtap_dir(competencia)
+                return competencia
+            except Exception as e:
+                logger.warning(f"SIGTAP da competência {competencia} indisponível, usando a ativa: {e}")
+        return self.sigtap_manager.get_active_competencia() or COMPETENCIA_LEGADA
 
     def get_dashboard_stats(
         self,
@@ -24,22 +34,16 @@ class FinancialService:
     ) -> Dict:
         """
         Gera estatísticas financeiras completas para o dashboard
+
+        A valoração (quantidade x VL_SA), a evolução mensal e os rankings são
+        calculados no Postgres contra a versão de preços SIGTAP da competência
+        (carregada na ativação; ver services/sigtap_precos.py).
         """
-        # Usa parser da competência informada (ou ativa). Faz fallback se a competência não existir.
-        parser = None
-        parser_competencia = competencia_inicio or competencia_fim
-        try:
-            parser = self.sigtap_service.get_parser(parser_competencia)
-        except Exception as e:
-            logger.warning(f"Falha ao carregar SIGTAP da competência {parser_competencia}: {e}")
-            try:
-                parser = self.sigtap_service.get_parser()
-            except Exception as e2:
-                logger.error(f"Falha ao carregar SIGTAP ativo: {e2}")
-                parser = None
+        competencia_precos = self._competencia_precos(competencia_inicio or competencia_fim)
+        garantir_precos(competencia_precos)
 
-        # 1. Buscar dados agregados do banco de dados
-        raw_data = db.get_production_for_dashboard(
+        linhas = db.get_financial_dashboard(
+            competencia_precos,
             competencia_inicio=competencia_inicio,
             competencia_fim=competencia_fim,
             cnes_list=cnes_list,
@@ -47,112 +51,47 @@ class FinancialService:
             cbo=cbo,
             procedimento=procedimento
         )
-        
-        # 2. Processar e enriquecer com valores do SIGTAP
-        stats = {
-            'total_valor': 0.0,
-            'total_procedimentos': 0,
-            'total_profissionais': 0,  # Estimativa baseada em CBOs únicos por CNES (não exata na agregação atual)
-            'evolution_data': {}, # {competencia: {valor: X, quantidade: Y}}
-            'top_procedimentos': [],
-            'top_cbos': []
-        }
-        
-        proc_stats = {} # Mapa temporário para agregar totais por procedimento
-        cbo_stats = {}  # Mapa temporário para agregar totais por CBO
-        procedimentos_map = None
-        if parser:
-            try:
-                procedimentos_map = {p['CO_PROCEDIMENTO']: p for p in parser.parse_procedimentos()}
-            except Exception as e:
-                logger.warning(f"Falha ao carregar procedimentos SIGTAP: {e}")
-                procedimentos_map = None
-        
-        for row in raw_data:
-            proc_code = row['procedimento']
-            qtde_raw = row['quantidade_total'] or 0
-            try:
-                qtde = int(qtde_raw)
-            except Exception:
-                qtde = int(float(qtde_raw) if qtde_raw is not None else 0)
-            competencia = row['competencia']
-            cbo_code = row['cbo']
-            
-            # Buscar valor unitário
-            valor_unit = 0.0
-            if parser:
-                try:
-                    valores = parser.get_procedimento_valor(proc_code)
-                    valor_unit = float(valores.get('valor_sa', 0.0) or 0.0)
-                except Exception:
-                    valor_unit = 0.0
-            valor_total = float(valor_unit) * float(qtde)
-            
-            # Atualizar totais globais
-            stats['total_valor'] += valor_total
-            stats['total_procedimentos'] += qtde
-            
-            # Atualizar evolução temporal
-            if competencia not in stats['evolution_data']:
-                stats['evolution_data'][competencia] = {'valor': 0.0, 'quantidade': 0}
-            stats['evolution_data'][competencia]['valor'] += valor_total
-            stats['evolution_data'][competencia]['quantidade'] += qtde
-            
-            # Atualizar ranking procedimentos
-            if proc_code not in proc_stats:
-                # Buscar nome apenas uma vez
-                dados_proc = procedimentos_map.get(proc_code) if procedimentos_map else None
-                nome_proc = dados_proc['NO_PROCEDIMENTO'] if dados_proc else f"PROC {proc_code}"
-                
-                proc_stats[proc_code] = {
-                    'codigo': proc_code,
-                    'nome': nome_proc,
-                    'quantidade': 0,
-                    'valor': 0.0
-                }
-            proc_stats[proc_code]['quantidade'] += qtde
-            proc_stats[proc_code]['valor'] += valor_total
 
-            # Atualizar ranking CBOs
-            if cbo_code:
-                if cbo_code not in cbo_stats:
-                    cbo_stats[cbo_code] = {
-                        'cbo': cbo_code,
-                        'quantidade': 0,
-                        'valor': 0.0
-                    }
-                cbo_stats[cbo_code]['quantidade'] += qtde
-                cbo_stats[cbo_code]['valor'] += valor_total
-                
-        # 3. Formatar resultados para o frontend
-        
-        # Evolução (ordenada por competência)
-        evolution_list = [
-            {'competencia': k, **v} 
-            for k, v in sorted(stats['evolution_data'].items())
-        ]
-        
-        # Top Procedimentos (por valor)
-        top_procs = sorted(proc_stats.values(), key=lambda x: x['valor'], reverse=True)[:10]
-        
-        # Top CBOs (por valor)
-        # Buscar nomes dos CBOs para exibição bonita
-        # Mapa CBO -> Nome
-        if parser:
-            try:
-                cbos_map = {c['CO_OCUPACAO']: c['NO_OCUPACAO'] for c in parser.parse_ocupacoes()}
-                for item in cbo_stats.values():
-                    item['nome'] = cbos_map.get(item['cbo'], f"CBO {item['cbo']}")
-            except Exception:
-                pass # Fallback se falhar parser de CBO
-            
-        top_cbos = sorted(cbo_stats.values(), key=lambda x: x['valor'], reverse=True)[:10]
-        
+        total = {'quantidade': 0, 'valor': 0}
+        evolution_list = []
+        top_procs = []
+        top_cbos = []
+        total_cbos = 0
+
+        for row in linhas:
+            quantidade = int(row['quantidade'] or 0)
+            valor = float(row['valor'] or 0)
+            grupo = row['grupo']
+
+            if grupo == 'total':
+                total = {'quantidade': quantidade, 'valor': valor}
+            elif grupo == 'evolucao':
+                evolution_list.append({
+                    'competencia': row['competencia'],
+                    'valor': valor,
+                    'quantidade': quantidade
+                })
+            elif grupo == 'procedimento':
+                top_procs.append({
+                    'codigo': row['procedimento'],
+                    'nome': row['no_procedimento'] or f"PROC {row['procedimento']}",
+                    'quantidade': quantidade,
+                    'valor': valor
+                })
+            elif grupo == 'cbo':
+                total_cbos = int(row['itens'])
+                top_cbos.append({
+                    'cbo': row['cbo'],
+                    'quantidade': quantidade,
+                    'valor': valor,
+                    'nome': row['no_ocupacao'] or f"CBO {row['cbo']}"
+                })
+
         return {
             'kpis': {
-                'total_faturado': round(stats['total_valor'], 2),
-                'total_procedimentos': stats['total_procedimentos'],
-                'total_cbos_atuantes': len(cbo_stats) 
+                'total_faturado': round(total['valor'], 2),
+                'total_procedimentos': total['quantidade'],
+                'total_cbos_atuantes': total_cbos
             },
             'graficos': {
                 'evolucao_faturamento': evolution_list,
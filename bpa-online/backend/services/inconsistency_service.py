@@ -1,86 +1,251 @@
-from typing import List, Dict, Any
+import json
+import logging
+from typing import List, Dict, Any, Optional
+
+from psycopg2.extras import RealDictCursor, execute_values
+
 from services.corrections import BPACorrections
+from services.correction_rules import RULESET_VERSION, get_compiled_corrections
 from database import get_connection
 
+logger = logging.getLogger(__name__)
+
+# Registros lidos/gravados por vez ao recalcular
+REFRESH_CHUNK_SIZE = 2000
+
+# Colunas analisadas pelas regras (CPF e nascimento entram na identificação do paciente)
+ANALYZED_COLUMNS = (
+    'id', 'prd_nmpac', 'prd_pa', 'prd_dtaten', 'prd_cnspac', 'prd_cpf_pcnte', 'prd_dtnasc', 'prd_cbo', 'prd_cid',
+    'prd_raca', 'prd_sexo', 'prd_cep_pcnte', 'prd_ibge', 'prd_lograd_pcnte',
+    'prd_end_pcnte', 'prd_bairro_pcnte', 'prd_num_pcnte', 'prd_qt_p', 'prd_caten',
+)
+
+
+def _rotulo(correction: str) -> str:
+    """Tipo da regra (mesmo corte das estatísticas de process_batch)"""
+    return correction.split(':')[0] if ':' in correction else correction
+
+
+def _format_date(raw_date: Optional[str]) -> Optional[str]:
+    """YYYYMMDD -> YYYY-MM-DD para o frontend"""
+    if raw_date and len(raw_date) == 8:
+        return f"{raw_date[:4]}-{raw_date[4:6]}-{raw_date[6:]}"
+    return raw_date or None
+
+
 class InconsistencyService:
+    """
+    Relatório de inconsistências materializado em bpa_inconsistencias.
+
+    Cada registro BPA-I guarda o resultado das regras com a versão do conjunto
+    de regras e o updated_at do registro. Uma consulta só recalcula os registros
+    novos, alterados ou avaliados por outra versão das regras; o relatório é
+    servido paginado a partir da tabela.
+
+    Registros sem CNS/CPF dependem do cadastro de pacientes (o CNS pode ser
+    recuperado por nome + nascimento): para eles guarda-se também a versão do
+    escopo 'cadastro' de dados_versao, e qualquer escrita em pacientes ou
+    profissionais os recalcula.
+    """
+
     def __init__(self):
         self.corrector = BPACorrections()
+        self.engine = get_compiled_corrections(None, 'BPI')
 
-    def get_inconsistency_report(self, cnes: str, competencia: str) -> Dict[str, Any]:
+    def _analyze(self, records: List[Dict], cadastro_versao: Optional[int] = None) -> List[tuple]:
+        """Linhas de bpa_inconsistencias para um bloco de registros"""
+        pacientes = self.corrector.buscar_pacientes_sem_identificacao(records)
+        rows = []
+        for record in records:
+            result = self.engine.apply(record, pacientes)
+            if result.should_delete:
+                tipo = "critical"
+                regras = [result.delete_reason]
+            elif result.corrections_applied:
+                tipo = "warning"
+                regras = sorted({_rotulo(c) for c in result.corrections_applied})
+            else:
+                tipo = None
+                regras = []
+            rows.append((
+                record['id'], record['prd_uid'], record['prd_cmp'], RULESET_VERSION,
+                record['updated_at'], tipo, regras,
+                json.dumps(result.corrections_applied, ensure_ascii=False), result.delete_reason,
+                cadastro_versao if self.corrector.depende_do_cadastro(record) else None
+            ))
+        return rows
+
+    def refresh(self, cnes: str, competencia: str) -> int:
+        """
+        Recalcula os registros sem resultado, alterados depois do cálculo
+        (updated_at), avaliados por outra versão das regras ou que consultaram
+        o cadastro de pacientes numa versão anterior
+
+        Returns:
+            Quantidade de registros recalculados
+        """
+        columns = ', '.join(f'b.{c}' for c in ANALYZED_COLUMNS)
+        recalculados = 0
+        with get_connection() as conn:
+            try:
+                with conn.cursor(name='inconsistencias_pendentes', cursor_factory=RealDictCursor) as pendentes, \
+                        conn.cursor() as cursor:
+                    # Lida antes de calcular: escrita no cadastro durante o cálculo
+                    # deixa a versão gravada para trás e o registro é refeito depois
+                    cursor.execute(
+                        "SELECT COALESCE(MAX(versao), 0) FROM dados_versao WHERE escopo = 'cadastro'"
+                    )
+                    cadastro_versao = cursor.fetchone()[0]
+
+                    pendentes.itersize = REFRESH_CHUNK_SIZE
+                    pendentes.execute(f"""
+                        SELECT {columns}, b.prd_uid, b.prd_cmp, b.updated_at
+                        FROM bpa_individualizado b
+                        LEFT JOIN bpa_inconsistencias i ON i.bpa_id = b.id
+                        WHERE b.prd_uid = %s AND b.prd_cmp = %s
+                          AND (i.bpa_id IS NULL
+                               OR i.regras_versao <> %s
+                               OR i.registro_atualizado_em IS DISTINCT FROM b.updated_at
+                               OR i.cadastro_versao <> %s)
+                    """, (cnes, competencia, RULESET_VERSION, cadastro_versao))
+
+                    while True:
+                        chunk = pendentes.fetchmany(REFRESH_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        execute_values(cursor, """
+                            INSERT INTO bpa_inconsistencias (
+                                bpa_id, prd_uid, prd_cmp, regras_versao, registro_atualizado_em,
+                                tipo, regras, corrections, delete_reason, cadastro_versao
+                            ) VALUES %s
+                            ON CONFLICT (bpa_id) DO UPDATE SET
+                                prd_uid = EXCLUDED.prd_uid,
+                                prd_cmp = EXCLUDED.prd_cmp,
+                                regras_versao = EXCLUDED.regras_versao,
+                                registro_atualizado_em = EXCLUDED.registro_atualizado_em,
+                                tipo = EXCLUDED.tipo,
+                                regras = EXCLUDED.regras,
+                                corrections = EXCLUDED.corrections,
+                                delete_reason = EXCLUDED.delete_reason,
+                                cadastro_versao = EXCLUDED.cadastro_versao,
+                                calculado_em = CURRENT_TIMESTAMP
+                        """, self._analyze([dict(r) for r in chunk], cadastro_versao),
+                            page_size=REFRESH_CHUNK_SIZE)
+                        recalculados += len(chunk)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+
+        if recalculados:
+            logger.info(f"[INCONSISTENCIAS] {cnes}/{competencia}: {recalculados} registros recalculados")
+        return recalculados
+
+    def get_inconsistency_report(
+        self,
+        cnes: str,
+        competencia: str,
+        page: int = 1,
+        page_size: int = 100,
+        tipo: Optional[str] = None,
+        regra: Optional[str] = None
+    ) -> Dict[str, Any]:
         """
         Gera um relatório de inconsistências para um CNES e competência específicos.
         Analisa apenas BPA Individualizado (BPI) por enquanto, pois é onde a maioria das regras se aplica.
+
+        Args:
+            page, page_size: Página dos detalhes (a partir de 1)
+            tipo: 'critical' ou 'warning'
+            regra: Tipo de regra (ex.: 'CEP vazio preenchido'; para críticos, o motivo da exclusão)
         """
-        inconsistencies = []
-        summary = {
-            "total": 0,
-            "critical": 0,
-            "warnings": 0
-        }
+        page = max(1, int(page))
+        page_size = max(1, min(int(page_size), 1000))
 
         try:
+            self.refresh(cnes, competencia)
+
             with get_connection() as conn:
-                cursor = conn.cursor()
-                
-                # Busca registros BPI
-                cursor.execute("""
-                    SELECT 
-                        id, prd_nmpac, prd_pa, prd_dtaten, prd_cnspac, prd_cbo, prd_cid,
-                        prd_raca, prd_sexo, prd_cep_pcnte, prd_ibge, prd_lograd_pcnte,
-                        prd_end_pcnte, prd_bairro_pcnte, prd_num_pcnte, prd_qt_p, prd_caten
-                    FROM bpa_individualizado
-                    WHERE prd_uid = %s AND prd_cmp = %s
-                """, (cnes, competencia))
-                
-                columns = [desc[0] for desc in cursor.description]
-                rows = cursor.fetchall()
-                
-                for row in rows:
-                    record = dict(zip(columns, row))
-                    
-                    # Adapta nomes para o BPACorrections (que espera nomes amigáveis em alguns casos ou prd_*)
-                    # O apply_corrections já lida com prd_*
-                    result = self.corrector.apply_corrections(record, tipo='BPI')
-                    
-                    if result.corrections_applied or result.should_delete:
-                        summary["total"] += 1
-                        
-                        error_type = "critical" if result.should_delete else "warning"
-                        if error_type == "critical":
-                            summary["critical"] += 1
-                        else:
-                            summary["warnings"] += 1
-                            
-                        # Formata a data de YYYYMMDD para YYYY-MM-DD para o frontend
-                        raw_date = record.get("prd_dtaten")
-                        formatted_date = None
-                        if raw_date and len(raw_date) == 8:
-                            formatted_date = f"{raw_date[:4]}-{raw_date[4:6]}-{raw_date[6:]}"
-                        elif raw_date:
-                            formatted_date = raw_date
-
-                        inconsistencies.append({
-                            "id": record["id"],
-                            "paciente": record["prd_nmpac"],
-                            "procedimento": record["prd_pa"],
-                            "data": formatted_date,
-                            "tipo": error_type,
-                            "mensagem": result.delete_reason if result.should_delete else "; ".join(result.corrections_applied),
-                            "corrections": result.corrections_applied,
-                            "should_delete": result.should_delete,
-                            "delete_reason": result.delete_reason
-                        })
-                
-                cursor.close()
-                
+                with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                    cursor.execute("""
+                        SELECT tipo, COUNT(*) AS total
+                        FROM bpa_inconsistencias
+                        WHERE prd_uid = %s AND prd_cmp = %s AND tipo IS NOT NULL
+                        GROUP BY tipo
+                    """, (cnes, competencia))
+                    por_tipo = {row['tipo']: row['total'] for row in cursor.fetchall()}
+
+                    cursor.execute("""
+                        SELECT regra, COUNT(*) AS total
+                        FROM bpa_inconsistencias, unnest(regras) AS regra
+                        WHERE prd_uid = %s AND prd_cmp = %s AND tipo IS NOT NULL
+                        GROUP BY regra
+                        ORDER BY total DESC, regra
+                    """, (cnes, competencia))
+                    por_regra = {row['regra']: row['total'] for row in cursor.fetchall()}
+
+                    filtros = ["i.prd_uid = %s", "i.prd_cmp = %s", "i.tipo IS NOT NULL"]
+                    params: List[Any] = [cnes, competencia]
+                    if tipo:
+                        filtros.append("i.tipo = %s")
+                        params.append(tipo)
+                    if regra:
+                        filtros.append("i.regras @> ARRAY[%s]::text[]")
+                        params.append(regra)
+                    where = ' AND '.join(filtros)
+
+                    cursor.execute(f"SELECT COUNT(*) AS total FROM bpa_inconsistencias i WHERE {where}", params)
+                    filtrados = cursor.fetchone()['total']
+
+                    cursor.execute(f"""
+                        SELECT i.bpa_id, i.tipo, i.corrections, i.delete_reason,
+                               b.prd_nmpac, b.prd_pa, b.prd_dtaten
+                        FROM bpa_inconsistencias i
+                        JOIN bpa_individualizado b ON b.id = i.bpa_id
+                        WHERE {where}
+                        ORDER BY i.bpa_id
+                        LIMIT %s OFFSET %s
+                    """, params + [page_size, (page - 1) * page_size])
+                    rows = cursor.fetchall()
+
         except Exception as e:
             print(f"Erro ao gerar relatório de inconsistências: {e}")
             raise e
 
+        inconsistencies = []
+        for row in rows:
+            should_delete = row['tipo'] == 'critical'
+            corrections = row['corrections'] or []
+            inconsistencies.append({
+                "id": row["bpa_id"],
+                "paciente": row["prd_nmpac"],
+                "procedimento": row["prd_pa"],
+                "data": _format_date(row["prd_dtaten"]),
+                "tipo": row["tipo"],
+                "mensagem": row["delete_reason"] if should_delete else "; ".join(corrections),
+                "corrections": corrections,
+                "should_delete": should_delete,
+                "delete_reason": row["delete_reason"]
+            })
+
+        critical = por_tipo.get('critical', 0)
+        warnings = por_tipo.get('warning', 0)
         return {
-            "summary": summary,
-            "details": inconsistencies
+            "summary": {
+                "total": critical + warnings,
+                "critical": critical,
+                "warnings": warnings,
+                "por_regra": por_regra
+            },
+            "details": inconsistencies,
+            "pagination": {
+                "page": page,
+                "page_size": page_size,
+                "total": filtrados,
+                "pages": (filtrados + page_size - 1) // page_size
+            }
         }
 
+
 def get_inconsistency_service():
     return InconsistencyService()
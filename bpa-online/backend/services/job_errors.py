@@ -0,0 +1,11 @@
+"""
+Exceções dos jobs em background
+
+Módulo sem efeitos na importação (services/job_service.py importa database,
+que abre o pool): serviços de extração e geração importam daqui para relançar
+JobCancelled antes dos seus `except Exception` genéricos.
+"""
+
+
+class JobCancelled(Exception):
+    """Lançada em `JobContext.progress` quando o cancelamento foi solicitado"""
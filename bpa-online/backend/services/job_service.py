@@ -0,0 +1,189 @@
+"""
+Serviço de Jobs em Background
+Executa extrações e geração de relatórios fora do event loop, com estado
+persistido na tabela `jobs` (progresso por página/lote, cancelamento e resultado)
+
+Cada processo tem um `worker_id` próprio: o job em execução guarda o dono e
+um batimento (`heartbeat_at`) renovado a cada JOB_HEARTBEAT_SECONDS. Um job
+só é dado como interrompido quando o batimento passa de JOB_STALE_SECONDS,
+então reiniciar um worker não derruba os jobs dos outros.
+"""
+import os
+import socket
+import uuid
+import threading
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+from database import db
+from services.job_errors import JobCancelled  # noqa: F401
+
+logger = logging.getLogger(__name__)
+
+JOB_HEARTBEAT_SECONDS = int(os.getenv('JOB_HEARTBEAT_SECONDS', '30'))
+JOB_STALE_SECONDS = int(os.getenv('JOB_STALE_SECONDS', str(JOB_HEARTBEAT_SECONDS * 4)))
+
+
+class JobContext:
+    """
+    Contexto entregue ao handler do job.
+
+    `progress(current, total, message)` tem a mesma forma do callback
+    `on_batch_complete` das extrações: chamado a cada página/lote, grava o
+    progresso e lança JobCancelled se o job foi cancelado.
+    """
+
+    def __init__(self, job_id: str, cancel_event: threading.Event):
+        self.job_id = job_id
+        self._cancel_event = cancel_event
+
+    @property
+    def cancel_requested(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def progress(self, current: int, total: int = None, message: str = None):
+        """Registra progresso; lança JobCancelled se o cancelamento foi solicitado"""
+        try:
+            if db.update_job_progress(self.job_id, current, total, message):
+                self._cancel_event.set()
+        except Exception as e:
+            logger.warning(f"[JOB {self.job_id}] Falha ao gravar progresso: {e}")
+        if self._cancel_event.is_set():
+            raise JobCancelled(f"Job {self.job_id} cancelado")
+
+
+class JobService:
+    """Fila de jobs com pool de workers (threads)"""
+
+    def __init__(self, max_workers: int = None):
+        self.max_workers = max_workers or int(os.getenv('JOB_WORKERS', '2'))
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="bpa-job")
+        self.handlers: Dict[str, Callable[..., Any]] = {}
+        self._cancel_events: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._heartbeat: Optional[threading.Thread] = None
+
+    def register(self, tipo: str, handler: Callable[..., Any]):
+        """
+        Registra o handler de um tipo de job.
+
+        O handler é chamado como handler(job: JobContext, **params) e seu
+        retorno (JSON-serializável) é gravado como resultado do job.
+        """
+        self.handlers[tipo] = handler
+
+    def submit(self, tipo: str, params: Dict[str, Any], usuario_id: int = None) -> Dict:
+        """Persiste o job e o coloca na fila; retorna o registro criado"""
+        if tipo not in self.handlers:
+            raise ValueError(f"Tipo de job desconhecido: {tipo}")
+
+        job_id = str(uuid.uuid4())
+        job = db.create_job(job_id, tipo, params, usuario_id)
+        self._enqueue(job_id, tipo, params)
+        logger.info(f"[JOB {job_id}] Enfileirado: {tipo} {params}")
+        return job
+
+    def _enqueue(self, job_id: str, tipo: str, params: Dict[str, Any]):
+        with self._lock:
+            self._cancel_events[job_id] = threading.Event()
+        self._ensure_heartbeat()
+        self.executor.submit(self._run, job_id, tipo, params)
+
+    def _ensure_heartbeat(self):
+        with self._lock:
+            if self._heartbeat is None:
+                self._heartbeat = threading.Thread(
+                    target=self._heartbeat_loop, name="bpa-job-heartbeat", daemon=True
+                )
+                self._heartbeat.start()
+
+    def _heartbeat_loop(self):
+        """Renova o batimento dos jobs deste worker e encerra os de workers mortos"""
+        while True:
+            time.sleep(JOB_HEARTBEAT_SECONDS)
+            try:
+                db.heartbeat_jobs(self.worker_id)
+                for job_id in db.fail_stale_jobs(JOB_STALE_SECONDS):
+                    logger.warning(f"[JOB {job_id}] Sem batimento há {JOB_STALE_SECONDS}s: marcado como erro")
+            except Exception as e:
+                logger.warning(f"[JOBS] Falha ao renovar batimento: {e}")
+
+    def _run(self, job_id: str, tipo: str, params: Dict[str, Any]):
+        cancel_event = self._cancel_events[job_id]
+        try:
+            if not db.start_job(job_id, self.worker_id):
+                logger.info(f"[JOB {job_id}] Cancelado ou assumido por outro worker antes de iniciar")
+                return
+
+            job = JobContext(job_id, cancel_event)
+            try:
+                result = self.handlers[tipo](job, **params)
+            except JobCancelled:
+                db.finish_job(job_id, 'cancelled', message='Cancelado pelo usuário')
+                logger.info(f"[JOB {job_id}] Cancelado")
+                return
+            except Exception as e:
+                # HTTPException dos endpoints carrega a mensagem em `detail`
+                error = str(getattr(e, 'detail', None) or e)
+                db.finish_job(job_id, 'error', error=error, message=f"Erro: {error}")
+                logger.error(f"[JOB {job_id}] Erro: {error}")
+                return
+
+            if cancel_event.is_set():
+                # Handler engoliu o JobCancelled (ex.: try/except genérico): guarda o parcial
+                db.finish_job(job_id, 'cancelled', result=result, message='Cancelado pelo usuário')
+            else:
+                db.finish_job(job_id, 'completed', result=result, message='Concluído')
+            logger.info(f"[JOB {job_id}] Finalizado")
+        except Exception as e:
+            logger.error(f"[JOB {job_id}] Falha ao atualizar estado do job: {e}")
+        finally:
+            with self._lock:
+                self._cancel_events.pop(job_id, None)
+
+    def cancel(self, job_id: str) -> Optional[str]:
+        """Solicita cancelamento; retorna o status atual (None se não existe)"""
+        status = db.request_job_cancel(job_id)
+        with self._lock:
+            event = self._cancel_events.get(job_id)
+        if event:
+            event.set()
+        return status
+
+    def get(self, job_id: str, include_result: bool = False) -> Optional[Dict]:
+        return db.get_job(job_id, include_result=include_result)
+
+    def list(self, usuario_id: int = None, status: str = None, limit: int = 50) -> List[Dict]:
+        return db.list_jobs(usuario_id=usuario_id, status=status, limit=limit)
+
+    def recover(self):
+        """
+        Na inicialização: marca como erro os jobs sem batimento recente e
+        reenfileira os pendentes (start_job garante que só um worker os executa)
+        """
+        self._ensure_heartbeat()
+        try:
+            state = db.reset_interrupted_jobs(JOB_STALE_SECONDS)
+        except Exception as e:
+            logger.warning(f"[JOBS] Não foi possível recuperar jobs pendentes: {e}")
+            return
+        for job_id in state['pending']:
+            job = db.get_job(job_id, include_result=False)
+            if job and job['tipo'] in self.handlers:
+                self._enqueue(job_id, job['tipo'], job.get('params') or {})
+        if state['interrupted'] or state['pending']:
+            logger.info(
+                f"[JOBS] {len(state['interrupted'])} interrompidos, "
+                f"{len(state['pending'])} reenfileirados"
+            )
+
+
+_job_service = None
+def get_job_service():
+    global _job_service
+    if _job_service is None:
+        _job_service = JobService()
+    return _job_service
@@ -0,0 +1,273 @@
+"""
+Remessa em lote: arquivos do BPA Magnético de todas as unidades de uma competência
+
+Cada CNES vira uma tarefa num pool de processos (iniciados com spawn: o lote
+roda numa thread de job da API, e um fork copiaria locks e conexões presos por
+outras threads). A tabela de valores SIGTAP (procedimento -> valor
+ambulatorial) da competência é montada uma vez no processo principal e
+entregue a cada worker no initializer, em vez de cada unidade carregar o seu
+SigtapParser. Ao final grava um manifesto com os totais e o campo de controle
+de cada unidade.
+
+Uso pela linha de comando (a partir de backend/):
+    python -m services.remessa_batch 202512 [--cnes 6061478 2467968] [--workers 4]
+"""
+import json
+import logging
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from constants.estabelecimentos import CNES_VALIDOS, get_estabelecimento, get_ibge_municipio
+from services.bpa_report_generator import MESES, BPAExportConfig, BPAFileGenerator
+from services.job_errors import JobCancelled
+
+logger = logging.getLogger(__name__)
+
+# Processos do pool (um CNES por tarefa)
+REMESSA_BATCH_WORKERS = int(os.getenv('REMESSA_BATCH_WORKERS', str(min(8, os.cpu_count() or 1))))
+
+REPORTS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'reports')
+
+# Tabela de valores e fábrica do banco do worker (preenchidas pelo initializer)
+_valores_worker: Dict[str, float] = {}
+_db_factory_worker: Optional[Callable] = None
+
+
+def sigla_arquivo(cnes: str) -> str:
+    """Sigla do estabelecimento para o nome da remessa (PA<SIGLA>.<MES>), só letras e números"""
+    estabelecimento = get_estabelecimento(cnes) or {}
+    sigla = re.sub(r'[^A-Za-z0-9]', '', estabelecimento.get('sigla') or '').upper()
+    return sigla or cnes
+
+
+def sigtap_dir_competencia(competencia: str) -> Optional[str]:
+    """
+    Diretório SIGTAP da competência; sem ela importada, o da ativa (ou o
+    legado). None se não há SIGTAP nenhuma.
+    """
+    from services.sigtap_manager_service import get_sigtap_manager
+
+    manager = get_sigtap_manager()
+    try:
+        return manager.get_sigtap_dir(competencia)
+    except Exception as e:
+        logger.warning(f"[REMESSA LOTE] SIGTAP {competencia} indisponível, usando a ativa: {e}")
+    try:
+        return manager.get_sigtap_dir(None)
+    except Exception as e:
+        logger.warning(f"[REMESSA LOTE] Nenhuma SIGTAP disponível: {e}")
+        return None
+
+
+def carregar_valores(sigtap_dir: Optional[str]) -> Dict[str, float]:
+    """
+    Valor ambulatorial (R$) de cada procedimento, como usado nos relatórios
+    (BPAFileGenerator._get_valor_procedimento_num). Vazio sem SIGTAP.
+    """
+    if not sigtap_dir or not os.path.exists(sigtap_dir):
+        logger.warning(f"[REMESSA LOTE] SIGTAP não encontrado em {sigtap_dir}; valores zerados")
+        return {}
+    from services.sigtap_index import get_sigtap_parser
+
+    parser = get_sigtap_parser(sigtap_dir)
+    tabela = {}
+    for proc in parser.parse_procedimentos():
+        valores = parser.get_procedimento_valor(proc['CO_PROCEDIMENTO'])
+        tabela[proc['CO_PROCEDIMENTO']] = valores.get('valor_ambulatorio', 0.0) or valores.get('valor_sa', 0.0) or 0.0
+    return tabela
+
+
+def _init_worker(valores: Dict[str, float], db_factory: Optional[Callable] = None):
+    """Initializer do pool: recebe a tabela de valores (e, opcionalmente, a classe do banco)"""
+    global _valores_worker, _db_factory_worker
+    _valores_worker = valores
+    _db_factory_worker = db_factory
+
+
+def gerar_unidade(
+    cnes: str,
+    competencia: str,
+    tipo: str = 'all',
+    valores: Optional[Dict[str, float]] = None,
+    reports_dir: str = REPORTS_DIR,
+    db=None
+) -> Dict:
+    """
+    Gera os arquivos de um CNES em reports/<cnes>_<competencia>/ (mesma pasta
+    de /api/reports/generate) e devolve a entrada do manifesto
+    """
+    inicio = time.perf_counter()
+    estabelecimento = get_estabelecimento(cnes) or {}
+    entrada = {
+        'cnes': cnes,
+        'nome': estabelecimento.get('nome', ''),
+        'sigla': sigla_arquivo(cnes),
+    }
+    try:
+        if db is None:
+            if _db_factory_worker is not None:
+                db = _db_factory_worker()
+            else:
+                from database import BPADatabase
+                db = BPADatabase()
+
+        counts = db.get_bpa_stats(cnes, competencia)
+        if not counts['bpai_total'] and not counts['bpac_total']:
+            entrada.update({'status': 'vazio', 'bpai_count': 0, 'bpac_count': 0, 'files': []})
+            return entrada
+
+        config = BPAExportConfig(
+            cnes=cnes,
+            competencia=competencia,
+            sigla=entrada['sigla'],
+            ibge_municipio=get_ibge_municipio(cnes)
+        )
+        generator = BPAFileGenerator(config, valores=_valores_worker if valores is None else valores)
+
+        pasta = f"{cnes}_{competencia}"
+        export_dir = os.path.join(reports_dir, pasta)
+        os.makedirs(export_dir, exist_ok=True)
+
+        extensao = MESES.get(competencia[4:6], 'TXT')
+        resultado = generator.write_reports(db, export_dir, extensao, tipo)
+        entrada.update({
+            'status': 'ok',
+            'total_registros': resultado['total_registros'],
+            'total_bpas': resultado['total_bpas'],
+            'campo_controle': resultado['campo_controle'],
+            'bpai_count': resultado['bpai_count'],
+            'bpac_count': resultado['bpac_count'],
+            'files': [f"/api/reports/download/{pasta}/{nome}" for nome in resultado['files']],
+        })
+    except Exception as e:
+        logger.error(f"[REMESSA LOTE] Erro ao gerar {cnes}/{competencia}: {e}")
+        entrada.update({'status': 'erro', 'error': str(e)})
+    finally:
+        entrada['tempo_s'] = round(time.perf_counter() - inicio, 2)
+    return entrada
+
+
+def _gerar_unidade_worker(cnes: str, competencia: str, tipo: str, reports_dir: str) -> Dict:
+    return gerar_unidade(cnes, competencia, tipo, reports_dir=reports_dir)
+
+
+def gerar_remessas_competencia(
+    competencia: str,
+    cnes_list: Optional[List[str]] = None,
+    tipo: str = 'all',
+    workers: Optional[int] = None,
+    reports_dir: str = REPORTS_DIR,
+    sigtap_dir: Optional[str] = None,
+    on_progress: Optional[Callable] = None,
+    db_factory: Optional[Callable] = None
+) -> Dict:
+    """
+    Gera os arquivos de todas as unidades (ou das informadas) de uma competência
+
+    Args:
+        cnes_list: CNES a gerar; padrão: todos de constants/estabelecimentos.py
+        tipo: Arquivos a gerar ('remessa', 'relexp', 'bpai', 'bpac', 'all')
+        workers: Processos do pool (REMESSA_BATCH_WORKERS); 1 gera em série
+        sigtap_dir: Tabela SIGTAP dos valores; padrão: a da competência (ou a ativa)
+        on_progress: on_progress(current, total, message) a cada unidade concluída
+        db_factory: Classe/função do banco nos workers (importável; padrão BPADatabase)
+
+    Returns:
+        Manifesto (também gravado em reports/LOTE_<competencia>/MANIFESTO.json)
+    """
+    cnes_list = list(dict.fromkeys(cnes_list or CNES_VALIDOS))
+    workers = min(workers or REMESSA_BATCH_WORKERS, len(cnes_list)) or 1
+    inicio = time.perf_counter()
+
+    valores = carregar_valores(sigtap_dir or sigtap_dir_competencia(competencia))
+    logger.info(f"[REMESSA LOTE] {competencia}: {len(cnes_list)} unidades, {workers} processos, "
+                f"{len(valores)} valores SIGTAP")
+
+    unidades: Dict[str, Dict] = {}
+
+    def concluir(entrada: Dict):
+        unidades[entrada['cnes']] = entrada
+        if on_progress:
+            on_progress(len(unidades), len(cnes_list), f"{entrada['cnes']}: {entrada['status']}")
+
+    if workers > 1:
+        executor = None
+        try:
+            executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                           initializer=_init_worker, initargs=(valores, db_factory))
+            futures = [
+                executor.submit(_gerar_unidade_worker, cnes, competencia, tipo, reports_dir)
+                for cnes in cnes_list
+            ]
+            for future in as_completed(futures):
+                concluir(future.result())
+        except JobCancelled:
+            # Não espera as unidades que faltam: as da fila são descartadas e
+            # as que já estão em execução terminam nos processos
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        except Exception as e:
+            # Espera as unidades em execução antes de refazer em série as que faltam
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
+            logger.warning(f"[REMESSA LOTE] Pool de processos indisponível, seguindo em série: {e}")
+        else:
+            executor.shutdown(wait=True)
+
+    for cnes in cnes_list:
+        if cnes not in unidades:
+            db = db_factory() if db_factory else None
+            concluir(gerar_unidade(cnes, competencia, tipo, valores, reports_dir, db=db))
+
+    # Manifesto na ordem pedida
+    entradas = [unidades[cnes] for cnes in cnes_list]
+    geradas = [e for e in entradas if e['status'] == 'ok']
+    manifesto = {
+        'competencia': competencia,
+        'tipo': tipo,
+        'gerado_em': datetime.now().isoformat(timespec='seconds'),
+        'tempo_s': round(time.perf_counter() - inicio, 2),
+        'totais': {
+            'unidades': len(entradas),
+            'geradas': len(geradas),
+            'vazias': sum(1 for e in entradas if e['status'] == 'vazio'),
+            'erros': sum(1 for e in entradas if e['status'] == 'erro'),
+            'total_registros': sum(e['total_registros'] for e in geradas),
+            'total_bpas': sum(e['total_bpas'] for e in geradas),
+            'bpai_count': sum(e['bpai_count'] for e in geradas),
+            'bpac_count': sum(e['bpac_count'] for e in geradas),
+        },
+        'unidades': entradas,
+    }
+
+    pasta = f"LOTE_{competencia}"
+    os.makedirs(os.path.join(reports_dir, pasta), exist_ok=True)
+    with open(os.path.join(reports_dir, pasta, 'MANIFESTO.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifesto, f, ensure_ascii=False, indent=2)
+    manifesto['manifesto_url'] = f"/api/reports/download/{pasta}/MANIFESTO.json"
+
+    logger.info(f"[REMESSA LOTE] {competencia}: {len(geradas)}/{len(entradas)} unidades em {manifesto['tempo_s']}s")
+    return manifesto
+
+
+if __name__ == '__main__':
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Gera a remessa BPA de todas as unidades de uma competência')
+    parser.add_argument('competencia', help='Competência YYYYMM')
+    parser.add_argument('--cnes', nargs='*', help='CNES a gerar (padrão: todos os estabelecimentos)')
+    parser.add_argument('--tipo', default='all', choices=['remessa', 'relexp', 'bpai', 'bpac', 'all'])
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    resultado = gerar_remessas_competencia(args.competencia, args.cnes, args.tipo, args.workers)
+    print(json.dumps(resultado['totais'], ensure_ascii=False, indent=2))
+    for unidade in resultado['unidades']:
+        print(f"{unidade['cnes']} {unidade['sigla']:<12} {unidade['status']:<6} "
+              f"registros={unidade.get('total_registros', 0)} controle={unidade.get('campo_controle', '-')}")
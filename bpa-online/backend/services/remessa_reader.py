@@ -0,0 +1,443 @@
+"""
+Leitura e conciliação dos arquivos gerados do BPA Magnético
+
+Lê com mmap a remessa (PA<SIGLA>.<MES>) e os relatórios BPAI_REL.TXT /
+BPAC_REL.TXT de backend/reports/, sem carregar o arquivo inteiro: as linhas
+são percorridas direto do mapa e os registros 01/02/03 só são decodificados
+(bpa_layout) quando pedidos. A remessa tem o cabeçalho validado (contagens e
+campo de controle).
+
+A conciliação compara o arquivo com o banco por chave (folha, seq, pa, cns):
+o lado do banco é numerado exatamente como os geradores numeram
+(BPAFileGenerator.write_set_file / write_bpai_report / write_bpac_report), e
+as chaves dos dois lados viram contadores de hashes. Só as chaves divergentes
+são materializadas, numa segunda passagem, como exemplos.
+
+Uso pela linha de comando (a partir de backend/):
+    python -m services.remessa_reader reports/2755289_202512/PAUPANORTE.DEZ
+"""
+import logging
+import mmap
+import os
+import re
+from array import array
+from collections import Counter
+from itertools import chain
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from services.bpa_layout import BPAC, BPAI, LAYOUTS
+from services.bpa_report_generator import REGISTROS_POR_FOLHA, calcular_campo_controle
+
+logger = logging.getLogger(__name__)
+
+ENCODING = 'latin-1'
+
+# Divergências listadas por lado no resultado da conciliação
+EXEMPLOS_LIMITE = 50
+
+# Linhas por folha nos relatórios (mesmos cortes de write_bpai_report / write_bpac_report)
+BPAI_REL_LINHAS_POR_FOLHA = 19
+BPAC_REL_LINHAS_POR_FOLHA = 20
+BPAC_REL_COLUNAS = 3
+
+Chave = Tuple
+
+
+class ArquivoMapeado:
+    """Arquivo de texto aberto com mmap, percorrido linha a linha"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Arquivo vazio não pode ser mapeado
+            self._mm = None
+
+    def close(self):
+        if self._mm is not None:
+            self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def tamanho(self) -> int:
+        return len(self._mm) if self._mm is not None else 0
+
+    def linhas(self) -> Iterator[Tuple[int, bytes]]:
+        """(offset, linha sem quebra) de cada linha do arquivo"""
+        if self._mm is None:
+            return
+        # find em vez de readline: a posição do mmap é compartilhada entre iterações
+        mm = self._mm
+        fim_arquivo = len(mm)
+        offset = 0
+        while offset < fim_arquivo:
+            fim = mm.find(b'\n', offset)
+            if fim < 0:
+                fim = fim_arquivo
+            yield offset, mm[offset:fim].rstrip(b'\r')
+            offset = fim + 1
+
+    def linha_em(self, offset: int) -> bytes:
+        """Linha que começa em offset"""
+        fim = self._mm.find(b'\n', offset)
+        return self._mm[offset:fim if fim >= 0 else len(self._mm)].rstrip(b'\r')
+
+
+class RemessaReader(ArquivoMapeado):
+    """
+    Arquivo de remessa (registros 01/02/03 de largura fixa)
+
+    `registro(i)` decodifica só a linha i; o índice de offsets (8 bytes por
+    linha) é montado na primeira consulta por posição.
+    """
+
+    _FOLHA = {'02': BPAC.posicao('folha'), '03': BPAI.posicao('folha')}
+    _SEQ = {'02': BPAC.posicao('seq'), '03': BPAI.posicao('seq')}
+    _PA = {'02': BPAC.posicao('procedimento'), '03': BPAI.posicao('procedimento')}
+    _CNS = BPAI.posicao('cns_paciente')
+
+    def __init__(self, path: str):
+        super().__init__(path)
+        self._offsets: Optional[array] = None
+
+    @property
+    def offsets(self) -> array:
+        if self._offsets is None:
+            self._offsets = array('q', (offset for offset, linha in self.linhas() if linha))
+        return self._offsets
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def registro(self, i: int) -> Tuple[str, Dict[str, str]]:
+        """(tipo, campos) do i-ésimo registro (0 = cabeçalho)"""
+        linha = self.linha_em(self.offsets[i]).decode(ENCODING)
+        layout = LAYOUTS.get(linha[:2])
+        if layout is None:
+            raise ValueError(f"Tipo de registro desconhecido: {linha[:2]!r}")
+        return layout.nome, layout.decodificar(linha)
+
+    def cabecalho(self) -> Dict[str, str]:
+        tipo, campos = self.registro(0)
+        if tipo != '01':
+            raise ValueError("Primeira linha não é o cabeçalho (01)")
+        return campos
+
+    def chaves(self, erros: Optional[List[Dict]] = None) -> Iterator[Chave]:
+        """
+        (tipo, folha, seq, pa, cns) de cada registro 02/03, sem decodificar os
+        demais campos; linhas inválidas vão para `erros` (linha, motivo)
+        """
+        for numero, (_, bruta) in enumerate(self.linhas(), start=1):
+            if not bruta:
+                continue
+            linha = bruta.decode(ENCODING)
+            tipo = linha[:2]
+            if tipo == '01':
+                continue
+            layout = LAYOUTS.get(tipo)
+            if layout is None or len(linha) != layout.tamanho:
+                if erros is not None:
+                    erros.append({'linha': numero, 'motivo': f"tipo {tipo!r} com {len(linha)} caracteres"})
+                continue
+            try:
+                folha = int(linha[self._FOLHA[tipo]])
+                seq = int(linha[self._SEQ[tipo]])
+            except ValueError:
+                if erros is not None:
+                    erros.append({'linha': numero, 'motivo': 'folha/sequência não numérica'})
+                continue
+            cns = linha[self._CNS].rstrip() if tipo == '03' else ''
+            yield (tipo, folha, seq, linha[self._PA[tipo]], cns)
+
+    def validar(self) -> Dict[str, Any]:
+        """
+        Confere o cabeçalho com o conteúdo: total de registros, total de BPAs
+        (folhas distintas por tipo) e campo de controle
+        """
+        erros_linhas: List[Dict] = []
+        registros = 0
+        folhas = set()
+        for tipo, folha, _, _, _ in self.chaves(erros_linhas):
+            registros += 1
+            folhas.add((tipo, folha))
+
+        resultado: Dict[str, Any] = {
+            'registros': registros,
+            'bpas': len(folhas),
+            'linhas_invalidas': len(erros_linhas),
+            'exemplos_linhas_invalidas': erros_linhas[:EXEMPLOS_LIMITE],
+            'erros': [],
+        }
+        try:
+            cabecalho = self.cabecalho()
+        except (IndexError, ValueError) as e:
+            resultado['erros'].append(f"Cabeçalho inválido: {e}")
+            resultado['valido'] = False
+            return resultado
+
+        total_registros = int(cabecalho['total_registros'])
+        total_bpas = int(cabecalho['total_bpas'])
+        resultado['cabecalho'] = {
+            'competencia': cabecalho['competencia'],
+            'total_registros': total_registros,
+            'total_bpas': total_bpas,
+            'campo_controle': cabecalho['campo_controle'],
+        }
+        if total_registros != registros:
+            resultado['erros'].append(f"Cabeçalho informa {total_registros} registros, arquivo tem {registros}")
+        if total_bpas != len(folhas):
+            resultado['erros'].append(f"Cabeçalho informa {total_bpas} BPAs, arquivo tem {len(folhas)}")
+        esperado = calcular_campo_controle(total_registros, total_bpas)
+        if cabecalho['campo_controle'] != esperado:
+            resultado['erros'].append(
+                f"Campo de controle {cabecalho['campo_controle']} não confere (esperado {esperado})"
+            )
+        if erros_linhas:
+            resultado['erros'].append(f"{len(erros_linhas)} linhas fora do layout")
+        resultado['valido'] = not resultado['erros']
+        return resultado
+
+
+# Relatórios: linhas de cabeçalho de página e de registros
+_RE_PROFISSIONAL = re.compile(r'^\s+CNS PROFISSIONAL (.*?)\s+CBO : (.*)$')
+_RE_CBO = re.compile(r'^\s+CBO : (.*)$')
+_RE_FOLHA = re.compile(r'^\s+COMPETENCIA : \S* FOLHA : (\d+)')
+_RE_BPAI = re.compile(r'^    (\d+) (.{15}) .{10} .    .{2}  .{6} .{10} (.{14})     \d')
+_RE_BPAC = re.compile(r'(\d{2,})  (.{14}) (\d{3})  ')
+
+
+def _digitos_procedimento(proc: str) -> str:
+    """GG.SS.TT.PPP-D (ou código cru) -> 10 dígitos como na remessa"""
+    return proc.replace('.', '').replace('-', '').strip().zfill(10)[:10]
+
+
+class BPAIRelReader(ArquivoMapeado):
+    """BPAI_REL.TXT: chaves (cns_prof, cbo, folha, seq, pa, cns) dos registros"""
+
+    def chaves(self) -> Iterator[Chave]:
+        profissional = ('', '')
+        folha = 0
+        for _, bruta in self.linhas():
+            linha = bruta.decode(ENCODING)
+            m = _RE_BPAI.match(linha)
+            if m:
+                yield (*profissional, folha, int(m.group(1)), _digitos_procedimento(m.group(3)),
+                       m.group(2).rstrip())
+                continue
+            m = _RE_PROFISSIONAL.match(linha)
+            if m:
+                profissional = (m.group(1).strip(), m.group(2).strip())
+                continue
+            m = _RE_FOLHA.match(linha)
+            if m:
+                folha = int(m.group(1))
+
+
+class BPACRelReader(ArquivoMapeado):
+    """BPAC_REL.TXT: chaves (cbo, folha, seq, pa) dos registros (3 por linha)"""
+
+    def chaves(self) -> Iterator[Chave]:
+        cbo = ''
+        folha = 0
+        for _, bruta in self.linhas():
+            linha = bruta.decode(ENCODING)
+            m = _RE_CBO.match(linha)
+            if m:
+                cbo = m.group(1).strip()
+                continue
+            m = _RE_FOLHA.match(linha)
+            if m:
+                folha = int(m.group(1))
+                continue
+            if linha.startswith('    ') and linha[4:6].isdigit():
+                for r in _RE_BPAC.finditer(linha):
+                    yield (cbo, folha, int(r.group(1)), _digitos_procedimento(r.group(2)))
+
+
+# Chaves do banco, numeradas como os geradores numeram
+
+def _pa(record: Dict) -> str:
+    return str(record.get('prd_pa', '') or '').zfill(10)[:10]
+
+
+def _cns(record: Dict) -> str:
+    return str(record.get('prd_cnspac', '') or '').ljust(15)[:15].rstrip()
+
+
+def _registros(db, tabela: str, cnes: str, competencia: str, ordem: str) -> Iterator[Dict]:
+    return chain.from_iterable(db.iter_bpa_for_report(tabela, cnes, competencia, ordem))
+
+
+def chaves_banco_remessa(db, cnes: str, competencia: str) -> Iterator[Chave]:
+    """Chaves da remessa esperada: BPA-C e depois BPA-I, na ordem do id, 20 por folha"""
+    for tipo, tabela in (('02', 'bpa_consolidado'), ('03', 'bpa_individualizado')):
+        for i, rec in enumerate(_registros(db, tabela, cnes, competencia, 'id')):
+            cns = _cns(rec) if tipo == '03' else ''
+            yield (tipo, i // REGISTROS_POR_FOLHA + 1, i % REGISTROS_POR_FOLHA + 1, _pa(rec), cns)
+
+
+def chaves_banco_bpai_rel(db, cnes: str, competencia: str) -> Iterator[Chave]:
+    """Chaves do BPAI_REL esperado: por profissional, 19 registros por folha"""
+    anterior = None
+    i = 0
+    for rec in _registros(db, 'bpa_individualizado', cnes, competencia, 'profissional'):
+        # Mesma quebra de grupo do gerador (valores crus); no relatório saem sem espaços
+        grupo = (rec.get('prd_cnsmed', ''), rec.get('prd_cbo', ''))
+        if grupo != anterior:
+            anterior = grupo
+            profissional = tuple(str(valor or '').strip() for valor in grupo)
+            i = 0
+        yield (*profissional, i // BPAI_REL_LINHAS_POR_FOLHA + 1, i + 1, _pa(rec), _cns(rec))
+        i += 1
+
+
+def chaves_banco_bpac_rel(db, cnes: str, competencia: str) -> Iterator[Chave]:
+    """Chaves do BPAC_REL esperado: por CBO, 3 por linha e 20 linhas por folha"""
+    anterior = None
+    i = 0
+    for rec in _registros(db, 'bpa_consolidado', cnes, competencia, 'cbo'):
+        grupo = rec.get('prd_cbo', '')
+        if grupo != anterior:
+            anterior = grupo
+            cbo = str(grupo or '').strip()
+            i = 0
+        yield (cbo, (i // BPAC_REL_COLUNAS) // BPAC_REL_LINHAS_POR_FOLHA + 1, i + 1, _pa(rec))
+        i += 1
+
+
+def _tipo_arquivo(nome: str) -> str:
+    nome = os.path.basename(nome).upper()
+    if nome == 'BPAI_REL.TXT':
+        return 'bpai_rel'
+    if nome == 'BPAC_REL.TXT':
+        return 'bpac_rel'
+    if nome.startswith('PA') and '.' in nome:
+        return 'remessa'
+    raise ValueError(f"Arquivo não reconhecido para conciliação: {nome}")
+
+
+def _diferenca(
+    chaves_arquivo: Callable[[], Iterator[Chave]],
+    chaves_banco: Callable[[], Iterator[Chave]],
+    limite: int
+) -> Dict[str, Any]:
+    """Compara os dois lados por hash das chaves; exemplos numa segunda passagem"""
+    arquivo = Counter(map(hash, chaves_arquivo()))
+    banco = Counter(map(hash, chaves_banco()))
+    so_arquivo = arquivo - banco
+    so_banco = banco - arquivo
+
+    def exemplos(chaves: Iterator[Chave], pendentes: Counter) -> List[List]:
+        encontrados = []
+        restantes = dict(pendentes)
+        if not restantes:
+            return encontrados
+        for chave in chaves:
+            h = hash(chave)
+            if restantes.get(h):
+                restantes[h] -= 1
+                encontrados.append(list(chave))
+                if len(encontrados) >= limite:
+                    break
+        return encontrados
+
+    return {
+        'registros_arquivo': sum(arquivo.values()),
+        'registros_banco': sum(banco.values()),
+        'so_no_arquivo': sum(so_arquivo.values()),
+        'so_no_banco': sum(so_banco.values()),
+        'exemplos_so_no_arquivo': exemplos(chaves_arquivo(), so_arquivo),
+        'exemplos_so_no_banco': exemplos(chaves_banco(), so_banco),
+    }
+
+
+def reconciliar(path: str, db, cnes: str, competencia: str, limite: int = EXEMPLOS_LIMITE) -> Dict[str, Any]:
+    """
+    Confere um arquivo gerado (remessa, BPAI_REL.TXT ou BPAC_REL.TXT) com o banco
+
+    Returns:
+        Dict com tipo, contagens, divergências (com exemplos de chaves) e,
+        para a remessa, a validação do cabeçalho; `ok` quando tudo confere
+    """
+    tipo = _tipo_arquivo(path)
+    leitor_cls, chaves_banco, campos_chave = {
+        'remessa': (RemessaReader, chaves_banco_remessa, ['tipo', 'folha', 'seq', 'pa', 'cns']),
+        'bpai_rel': (BPAIRelReader, chaves_banco_bpai_rel, ['cns_profissional', 'cbo', 'folha', 'seq', 'pa', 'cns']),
+        'bpac_rel': (BPACRelReader, chaves_banco_bpac_rel, ['cbo', 'folha', 'seq', 'pa']),
+    }[tipo]
+
+    with leitor_cls(path) as leitor:
+        resultado: Dict[str, Any] = {
+            'arquivo': os.path.basename(path),
+            'tipo': tipo,
+            'cnes': cnes,
+            'competencia': competencia,
+            'tamanho_bytes': leitor.tamanho,
+            'campos_chave': campos_chave,
+        }
+        if tipo == 'remessa':
+            resultado['cabecalho'] = leitor.validar()
+            competencia_arquivo = resultado['cabecalho'].get('cabecalho', {}).get('competencia')
+            if competencia_arquivo and competencia_arquivo != competencia:
+                resultado['cabecalho']['erros'].append(
+                    f"Competência do arquivo {competencia_arquivo} difere de {competencia}"
+                )
+                resultado['cabecalho']['valido'] = False
+
+        resultado.update(_diferenca(
+            leitor.chaves, lambda: chaves_banco(db, cnes, competencia), limite
+        ))
+
+    resultado['ok'] = (
+        resultado['so_no_arquivo'] == 0 and resultado['so_no_banco'] == 0
+        and resultado.get('cabecalho', {}).get('valido', True)
+    )
+    logger.info(f"[CONCILIACAO] {resultado['arquivo']} {cnes}/{competencia}: "
+                f"{resultado['registros_arquivo']} no arquivo, {resultado['registros_banco']} no banco, "
+                f"ok={resultado['ok']}")
+    return resultado
+
+
+def cnes_competencia_da_pasta(path: str) -> Tuple[Optional[str], Optional[str]]:
+    """reports/<cnes>_<competencia>/arquivo -> (cnes, competencia)"""
+    m = re.match(r'^(\d{7})_(\d{6})$', os.path.basename(os.path.dirname(os.path.abspath(path))))
+    return (m.group(1), m.group(2)) if m else (None, None)
+
+
+if __name__ == '__main__':
+    import argparse
+    import json
+
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description='Confere remessa/BPAI_REL/BPAC_REL gerados com o banco')
+    parser.add_argument('arquivo')
+    parser.add_argument('--cnes', help='Padrão: da pasta <cnes>_<competencia>')
+    parser.add_argument('--competencia', help='Padrão: da pasta <cnes>_<competencia>')
+    parser.add_argument('--so-cabecalho', action='store_true', help='Só valida o cabeçalho da remessa (sem banco)')
+    parser.add_argument('--limite', type=int, default=EXEMPLOS_LIMITE)
+    args = parser.parse_args()
+
+    if args.so_cabecalho:
+        with RemessaReader(args.arquivo) as remessa:
+            resultado = remessa.validar()
+    else:
+        from database import BPADatabase
+
+        cnes_pasta, competencia_pasta = cnes_competencia_da_pasta(args.arquivo)
+        cnes = args.cnes or cnes_pasta
+        competencia = args.competencia or competencia_pasta
+        if not cnes or not competencia:
+            parser.error('Informe --cnes e --competencia (pasta fora do padrão <cnes>_<competencia>)')
+        resultado = reconciliar(args.arquivo, BPADatabase(), cnes, competencia, args.limite)
+
+    print(json.dumps(resultado, ensure_ascii=False, indent=2))
+    raise SystemExit(0 if resultado.get('ok', resultado.get('valido')) else 1)
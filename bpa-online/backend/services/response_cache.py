@@ -0,0 +1,318 @@
+"""
+Cache de respostas versionado para endpoints de leitura
+
+A chave de cada resposta é (endpoint, parâmetros, versões dos dados). As
+versões ficam em dados_versao no Postgres e são incrementadas pelas próprias
+escritas: triggers da produção (por CNES/competência) e dos cadastros, e
+`incrementar_versao('sigtap', ...)` na importação/ativação da SIGTAP. Uma
+escrita muda a chave; não há TTL para acertar, e entradas antigas saem pelo LRU.
+
+Camadas:
+    - LRU em memória do processo (RESPONSE_CACHE_MAX_ENTRIES)
+    - compartilhada opcional em Redis (RESPONSE_CACHE_REDIS_URL), entre os
+      workers do FastAPI e o backend Django
+
+Uso (FastAPI ou Django):
+    stats = cached('bpa/stats', {'cnes': cnes, 'competencia': competencia},
+                   lambda: versoes_dados(bpa=(cnes, competencia)),
+                   lambda: db.get_bpa_stats(cnes, competencia))
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    redis = None
+    REDIS_AVAILABLE = False
+
+RESPONSE_CACHE_ENABLED = os.getenv('RESPONSE_CACHE_ENABLED', '1') != '0'
+RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '2048'))
+RESPONSE_CACHE_REDIS_URL = os.getenv('RESPONSE_CACHE_REDIS_URL', '')
+# Só limpeza do Redis: a validade vem das versões
+RESPONSE_CACHE_SHARED_TTL = int(os.getenv('RESPONSE_CACHE_SHARED_TTL', '86400'))
+
+_PREFIXO = 'bpa:resp:'
+
+
+class LRUTier:
+    """Camada em memória (thread-safe) com descarte do menos usado"""
+
+    def __init__(self, max_entries: int = RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._dados: 'OrderedDict[str, Any]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, chave: str) -> Tuple[bool, Any]:
+        with self._lock:
+            if chave not in self._dados:
+                return False, None
+            self._dados.move_to_end(chave)
+            return True, self._dados[chave]
+
+    def set(self, chave: str, valor: Any):
+        with self._lock:
+            self._dados[chave] = valor
+            self._dados.move_to_end(chave)
+            while len(self._dados) > self.max_entries:
+                self._dados.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._dados.clear()
+
+    def __len__(self):
+        return len(self._dados)
+
+
+class RedisTier:
+    """Camada compartilhada; falhas do Redis viram miss (nunca derrubam o endpoint)"""
+
+    def __init__(self, url: str, ttl: int = RESPONSE_CACHE_SHARED_TTL):
+        self.ttl = ttl
+        self._client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+    def get(self, chave: str) -> Tuple[bool, Any]:
+        try:
+            bruto = self._client.get(_PREFIXO + chave)
+        except Exception as e:
+            logger.warning(f"[CACHE] Redis indisponível (get): {e}")
+            return False, None
+        if bruto is None:
+            return False, None
+        return True, json.loads(bruto)
+
+    def set(self, chave: str, valor: Any):
+        try:
+            self._client.set(_PREFIXO + chave, json.dumps(valor, default=str), ex=self.ttl)
+        except Exception as e:
+            logger.warning(f"[CACHE] Redis indisponível (set): {e}")
+
+
+class ResponseCache:
+    """Cache de respostas em duas camadas, chaveado por endpoint + parâmetros + versões"""
+
+    def __init__(self, local: Optional[LRUTier] = None, shared: Optional[Any] = None):
+        self.local = local or LRUTier()
+        self.shared = shared
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def chave(endpoint: str, params: Dict, versoes: Dict) -> str:
+        bruto = json.dumps([endpoint, params, versoes], sort_keys=True, default=str)
+        return hashlib.sha1(bruto.encode('utf-8')).hexdigest()
+
+    def get_or_compute(self, endpoint: str, params: Dict, versoes: Dict, calcular: Callable[[], Any]) -> Any:
+        """
+        Resposta em cache ou recém-calculada. O valor devolvido pela camada em
+        memória é compartilhado entre requisições: não deve ser modificado.
+        """
+        chave = self.chave(endpoint, params, versoes)
+        achou, valor = self._buscar(chave)
+        if achou:
+            return valor
+        valor = calcular()
+        self._guardar(chave, valor)
+        return valor
+
+    async def get_or_compute_async(self, endpoint: str, params: Dict, versoes: Dict,
+                                   calcular: Callable[[], Awaitable[Any]]) -> Any:
+        """get_or_compute com `calcular` assíncrono (rotas que usam AsyncBPADatabase)"""
+        chave = self.chave(endpoint, params, versoes)
+        achou, valor = self._buscar(chave)
+        if achou:
+            return valor
+        valor = await calcular()
+        self._guardar(chave, valor)
+        return valor
+
+    def _buscar(self, chave: str) -> Tuple[bool, Any]:
+        achou, valor = self.local.get(chave)
+        if achou:
+            self.hits += 1
+            return True, valor
+
+        if self.shared is not None:
+            achou, valor = self.shared.get(chave)
+            if achou:
+                self.hits += 1
+                self.local.set(chave, valor)
+                return True, valor
+
+        self.misses += 1
+        return False, None
+
+    def _guardar(self, chave: str, valor: Any) -> None:
+        self.local.set(chave, valor)
+        if self.shared is not None:
+            self.shared.set(chave, valor)
+
+    def stats(self) -> Dict:
+        return {
+            'entradas': len(self.local),
+            'hits': self.hits,
+            'misses': self.misses,
+            'compartilhado': self.shared is not None,
+        }
+
+
+_cache: Optional[ResponseCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """Cache do processo (camada Redis se configurada e disponível)"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                shared = None
+                if RESPONSE_CACHE_REDIS_URL:
+                    if REDIS_AVAILABLE:
+                        shared = RedisTier(RESPONSE_CACHE_REDIS_URL)
+                    else:
+                        logger.warning("[CACHE] RESPONSE_CACHE_REDIS_URL definido, mas o pacote redis não está instalado")
+                _cache = ResponseCache(shared=shared)
+    return _cache
+
+
+# ========== VERSÕES DOS DADOS ==========
+
+def competencia_sigtap(competencia: Optional[str] = None) -> str:
+    """Competência SIGTAP efetiva (a informada ou a ativa)"""
+    if competencia:
+        return competencia
+    from services.sigtap_manager_service import get_sigtap_manager
+    return get_sigtap_manager().get_active_competencia() or 'LEGACY'
+
+
+def versoes_dados(
+    bpa: Optional[Tuple[Optional[str], Optional[str]]] = None,
+    cadastro: bool = False,
+    sigtap: Optional[str] = None
+) -> Dict[str, Any]:
+    """
+    Versões atuais dos dados de que uma resposta depende, numa só consulta
+
+    Args:
+        bpa: (cnes, competencia); competencia None = todas do CNES, cnes None = toda a produção
+        cadastro: depende de profissionais/pacientes
+        sigtap: competência SIGTAP efetiva (ver competencia_sigtap)
+    """
+    from database import get_connection
+
+    consulta = _versoes_consulta(bpa, cadastro, sigtap)
+    encontradas: Dict[str, str] = {}
+    if consulta:
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(*consulta)
+                encontradas = dict(cursor.fetchall())
+    return _versoes_encontradas(encontradas, bpa, cadastro, sigtap)
+
+
+def _versoes_consulta(bpa, cadastro: bool, sigtap: Optional[str]) -> Optional[Tuple[str, List]]:
+    """(sql, params) das versões pedidas em versoes_dados; None se nenhuma vem do banco"""
+    condicoes = []
+    params = []
+    if bpa is not None:
+        cnes, competencia = bpa
+        condicao = "escopo = 'bpa'"
+        if cnes:
+            condicao += " AND cnes = %s"
+            params.append(cnes)
+        if competencia:
+            condicao += " AND competencia = %s"
+            params.append(competencia)
+        condicoes.append(f"({condicao})")
+    if cadastro:
+        condicoes.append("(escopo = 'cadastro')")
+    if sigtap is not None:
+        condicoes.append("(escopo = 'sigtap' AND competencia = %s)")
+        params.append(sigtap)
+
+    if not condicoes:
+        return None
+    # Todas as linhas do escopo entram na versão, não só o MAX: com várias
+    # unidades/competências, uma escrita que pegou um valor menor da sequência
+    # pode confirmar depois de outra com valor maior, e o MAX não mudaria
+    return f'''
+        SELECT escopo, md5(string_agg(cnes || '/' || competencia || '=' || versao, ','
+                                      ORDER BY cnes, competencia)) AS versao
+        FROM dados_versao
+        WHERE {" OR ".join(condicoes)}
+        GROUP BY escopo
+    ''', params
+
+
+def _versoes_encontradas(encontradas: Dict[str, str], bpa, cadastro: bool,
+                         sigtap: Optional[str]) -> Dict[str, Any]:
+    """Versões no formato da chave do cache (hash das linhas do escopo; 0 = ainda sem escrita)"""
+    versoes: Dict[str, Any] = {}
+    if bpa is not None:
+        versoes['bpa'] = encontradas.get('bpa', 0)
+    if cadastro:
+        versoes['cadastro'] = encontradas.get('cadastro', 0)
+    if sigtap is not None:
+        versoes['sigtap'] = [sigtap, encontradas.get('sigtap', 0)]
+    return versoes
+
+
+def incrementar_versao(escopo: str, cnes: str = '', competencia: str = '') -> Optional[int]:
+    """Incrementa uma versão fora dos triggers (ex.: importação/ativação da SIGTAP)"""
+    from database import get_connection
+
+    try:
+        with get_connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT dados_versao_incrementar(%s, %s, %s)', (escopo, cnes, competencia))
+                versao = cursor.fetchone()[0]
+                conn.commit()
+                return versao
+    except Exception as e:
+        logger.warning(f"[CACHE] Não foi possível incrementar a versão {escopo}/{cnes}/{competencia}: {e}")
+        return None
+
+
+def cached(endpoint: str, params: Dict, versoes: Callable[[], Dict], calcular: Callable[[], Any]) -> Any:
+    """
+    Resposta de `calcular()` em cache para as versões atuais dos dados
+
+    `versoes` é chamado a cada requisição; se a leitura das versões falhar (ou o
+    cache estiver desligado) a resposta é calculada sem cache.
+    """
+    if not RESPONSE_CACHE_ENABLED:
+        return calcular()
+    try:
+        versoes_atuais = versoes()
+    except Exception as e:
+        logger.warning(f"[CACHE] Versões indisponíveis para {endpoint}, sem cache: {e}")
+        return calcular()
+    return get_response_cache().get_or_compute(endpoint, params, versoes_atuais, calcular)
+
+
+async def cached_async(endpoint: str, params: Dict, versoes: Callable[[], Awaitable[Dict]],
+                       calcular: Callable[[], Awaitable[Any]]) -> Any:
+    """
+    `cached` para rotas assíncronas: versões e cálculo são awaitables, ex.:
+
+        await cached_async('bpa/stats', {...}, lambda: adb.versoes_dados(bpa=(cnes, None)),
+                           lambda: adb.get_bpa_stats(cnes))
+    """
+    if not RESPONSE_CACHE_ENABLED:
+        return await calcular()
+    try:
+        versoes_atuais = await versoes()
+    except Exception as e:
+        logger.warning(f"[CACHE] Versões indisponíveis para {endpoint}, sem cache: {e}")
+        return await calcular()
+    return await get_response_cache().get_or_compute_async(endpoint, params, versoes_atuais, calcular)
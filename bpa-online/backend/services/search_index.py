@@ -0,0 +1,172 @@
+"""
+Índice de busca em memória para autocomplete (procedimentos e CBOs)
+
+Normaliza como exporter.remove_accents (NFD sem acentos) + maiúsculas, indexa
+trigramas dos nomes (índice invertido) e prefixos curtos das palavras, e
+mantém os códigos ordenados para busca por prefixo (trie implícita via bisect).
+Resultados saem ranqueados: código exato, prefixo de código, nome começando
+pelo termo, termo no início de palavra e, por fim, termo em qualquer posição.
+"""
+import re
+import heapq
+import unicodedata
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+_NAO_ALFANUMERICO = re.compile(r'[^A-Z0-9]+')
+_NAO_DIGITO = re.compile(r'\D')
+
+
+def normalize(text: str) -> str:
+    """Maiúsculas, sem acentos e sem pontuação ('Consulta médica' -> 'CONSULTA MEDICA')"""
+    if not text:
+        return ''
+    normalized = unicodedata.normalize('NFD', str(text))
+    sem_acento = ''.join(c for c in normalized if unicodedata.category(c) != 'Mn')
+    return _NAO_ALFANUMERICO.sub(' ', sem_acento.upper()).strip()
+
+
+class SearchIndex:
+    """
+    Busca por código ou nome sobre entradas (chave, texto).
+
+    Termos com 3+ caracteres usam a interseção das listas de trigramas e são
+    confirmados por substring; termos de 1-2 caracteres casam com início de
+    palavra. Consultas só com dígitos (e pontuação) buscam prefixo de código.
+    """
+
+    def __init__(self, entries: Iterable[Tuple[str, str]]):
+        self.keys: List[str] = []
+        self.names: List[str] = []
+        self._texts: List[str] = []
+        self._trigramas: Dict[str, List[int]] = {}
+        self._prefixos: Dict[str, List[int]] = {}
+
+        for doc_id, (key, text) in enumerate(entries):
+            name = normalize(text)
+            self.keys.append(key)
+            self.names.append(name)
+            # Código entra no texto pesquisável: '0101' também casa no meio do código
+            self._texts.append(f" {key} {name} ")
+
+            trigramas = set()
+            prefixos = set()
+            for token in f"{key} {name}".split():
+                prefixos.add(token[:1])
+                prefixos.add(token[:2])
+                for i in range(len(token) - 2):
+                    trigramas.add(token[i:i + 3])
+            for gram in trigramas:
+                self._trigramas.setdefault(gram, []).append(doc_id)
+            for prefixo in prefixos:
+                self._prefixos.setdefault(prefixo, []).append(doc_id)
+
+        self._codigos = sorted((key, doc_id) for doc_id, key in enumerate(self.keys))
+
+        # Prefixos curtos já na ordem do ranking: termos de 1-2 letras casam com
+        # milhares de nomes, e o top-k sai direto do início da lista
+        for prefixo, docs in self._prefixos.items():
+            docs.sort(key=lambda d: (
+                not self.names[d].startswith(prefixo), len(self.names[d]), self.names[d]
+            ))
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _candidates(self, term: str) -> Set[int]:
+        if len(term) < 3:
+            return set(self._prefixos.get(term, ()))
+        postings = []
+        for i in range(len(term) - 2):
+            lista = self._trigramas.get(term[i:i + 3])
+            if not lista:
+                return set()
+            postings.append(lista)
+        postings.sort(key=len)
+        result = set(postings[0])
+        for lista in postings[1:]:
+            result.intersection_update(lista)
+            if not result:
+                break
+        return result
+
+    def _matches(self, doc_id: int, terms: List[str]) -> bool:
+        text = self._texts[doc_id]
+        for term in terms:
+            if len(term) < 3:
+                if f" {term}" not in text:
+                    return False
+            elif term not in text:
+                return False
+        return True
+
+    def _code_prefix(self, prefix: str) -> List[int]:
+        """Documentos cujo código começa com prefix, em ordem de código"""
+        inicio = bisect_left(self._codigos, (prefix, -1))
+        fim = bisect_left(self._codigos, (prefix + '\uffff', -1), inicio)
+        return [doc_id for _, doc_id in self._codigos[inicio:fim]]
+
+    def search(self, query: str, limit: Optional[int] = None, allowed: Optional[Set[str]] = None) -> List[str]:
+        """
+        Chaves que casam com a consulta, da mais para a menos relevante
+
+        Args:
+            query: Código (com ou sem pontuação) ou termos do nome, em qualquer acentuação
+            limit: Top-k (None = todos os resultados)
+            allowed: Restringe às chaves deste conjunto
+        """
+        if query and not re.search(r'[A-Za-zÀ-ÿ]', query):
+            digits = _NAO_DIGITO.sub('', query)
+            terms = [digits] if digits else []
+        else:
+            terms = normalize(query).split()
+        if not terms:
+            return []
+
+        phrase = ' '.join(terms)
+        compact = ''.join(terms)
+
+        prefix_docs = self._code_prefix(compact) if compact.isdigit() else []
+        if allowed is not None:
+            prefix_docs = [d for d in prefix_docs if self.keys[d] in allowed]
+        if limit is not None and len(prefix_docs) >= limit:
+            # Autocomplete por código: a faixa da trie já está ordenada (exato primeiro)
+            return [self.keys[d] for d in prefix_docs[:limit]]
+
+        if len(terms) == 1 and len(compact) < 3 and not compact.isdigit():
+            docs = self._prefixos.get(compact, ())
+            if allowed is not None:
+                docs = [d for d in docs if self.keys[d] in allowed]
+            return [self.keys[d] for d in docs[:limit]]
+
+        candidates = None
+        for term in sorted(terms, key=len, reverse=True):
+            found = self._candidates(term)
+            candidates = found if candidates is None else candidates & found
+            if not candidates:
+                break
+        candidates = candidates or set()
+        candidates.update(prefix_docs)
+
+        def rank(doc_id: int):
+            key = self.keys[doc_id]
+            name = self.names[doc_id]
+            if key == compact:
+                return (0, 0, key)
+            if key.startswith(compact):
+                return (1, 0, key)
+            if name.startswith(phrase):
+                return (2, len(name), name)
+            if f" {phrase}" in f" {name}":
+                return (3, len(name), name)
+            return (4, len(name), name)
+
+        matches = [
+            d for d in candidates
+            if (allowed is None or self.keys[d] in allowed) and self._matches(d, terms)
+        ]
+        if limit is not None:
+            ordered = heapq.nsmallest(limit, matches, key=rank)
+        else:
+            ordered = sorted(matches, key=rank)
+        return [self.keys[d] for d in ordered]
@@ -1,9 +1,10 @@
 """
 Serviço de filtragem de procedimentos usando tabelas SIGTAP diretamente dos arquivos TXT
 """
-from typing import List, Dict, Optional, Set, Union
+from typing import Iterable, List, Dict, Optional, Set, Union
 from services.sigtap_parser import SigtapParser
 from services.sigtap_manager_service import get_sigtap_manager
+from services.sigtap_index import SigtapIndex, get_sigtap_parser, procedimento_info_dict
 import logging
 
 logger = logging.getLogger(__name__)
@@ -18,7 +19,7 @@ class SigtapFilterService:
         # Retrocompatibilidade
         if sigtap_dir:
             logger.info(f"Modo SIGTAP legado ativado: {sigtap_dir}")
-            self._parsers["LEGACY"] = SigtapParser(sigtap_dir)
+            self._parsers["LEGACY"] = get_sigtap_parser(sigtap_dir)
 
     def _get_parser(self, competencia: str = None) -> SigtapParser:
         if not competencia:
@@ -31,7 +32,7 @@ class SigtapFilterService:
                     dir_path = self.manager.get_sigtap_dir(None)
                     competencia = "LEGACY_AUTO"
                     if competencia not in self._parsers:
-                         self._parsers[competencia] = SigtapParser(dir_path)
+                         self._parsers[competencia] = get_sigtap_parser(dir_path)
                     return self._parsers[competencia]
                 except Exception as e:
                      logger.error(f"Não foi possível obter parser SIGTAP: {e}")
@@ -40,7 +41,7 @@ class SigtapFilterService:
         if competencia not in self._parsers:
             try:
                 dir_path = self.manager.get_sigtap_dir(competencia)
-                self._parsers[competencia] = SigtapParser(dir_path)
+                self._parsers[competencia] = get_sigtap_parser(dir_path)
             except Exception as e:
                 if "LEGACY" in self._parsers:
                     logger.warning(f"Competência {competencia} não encontrada, usando LEGACY.")
@@ -49,7 +50,16 @@ class SigtapFilterService:
             
         return self._parsers[competencia]
     
+    def _get_index(self, competencia: str = None) -> Optional[SigtapIndex]:
+        """Índice pré-compilado da competência (None se o parser não tiver índice)"""
+        index = getattr(self._get_parser(competencia), 'index', None)
+        return index if isinstance(index, SigtapIndex) else None
+    
     def _get_procedimento_registro_map(self, competencia: str = None) -> Dict[str, Set[str]]:
+        index = self._get_index(competencia)
+        if index is not None:
+            return index.registro_map
+        
         relacoes = self._get_parser(competencia).parse_procedimento_registro()
         result = {}
         for rel in relacoes:
@@ -61,6 +71,10 @@ class SigtapFilterService:
         return result
     
     def _get_procedimento_cbo_map(self, competencia: str = None) -> Dict[str, Set[str]]:
+        index = self._get_index(competencia)
+        if index is not None:
+            return index.cbo_map
+        
         relacoes = self._get_parser(competencia).parse_procedimento_ocupacao()
         result = {}
         for rel in relacoes:
@@ -72,6 +86,10 @@ class SigtapFilterService:
         return result
     
     def _get_procedimento_servico_map(self, competencia: str = None) -> Dict[str, Set[tuple]]:
+        index = self._get_index(competencia)
+        if index is not None:
+            return index.servico_map
+        
         relacoes = self._get_parser(competencia).parse_procedimento_servico()
         result = {}
         for rel in relacoes:
@@ -98,6 +116,7 @@ class SigtapFilterService:
         Retorna procedimentos filtrados por múltiplos critérios
         """
         parser = self._get_parser(competencia)
+        index = self._get_index(competencia)
         todos_procedimentos = parser.parse_procedimentos()
         registro_map = self._get_procedimento_registro_map(competencia)
 
@@ -105,6 +124,10 @@ class SigtapFilterService:
         # Mas para performance, vamos filtrar primeiro
         procedimentos = todos_procedimentos
         
+        # Busca pelo índice (sem acento, ranqueada); filtros abaixo preservam a ordem
+        if termo_busca and index is not None:
+            procedimentos = [index.por_codigo[c] for c in index.busca.search(termo_busca)]
+        
         # Filtrar por tipo de registro (BPA-I, BPA-C, etc) - Lógica OR para lista
         if tipo_registro:
             if isinstance(tipo_registro, str):
@@ -137,8 +160,8 @@ class SigtapFilterService:
                 )
             ]
         
-        # Filtrar por termo de busca no nome
-        if termo_busca:
+        # Filtrar por termo de busca no nome (parser sem índice)
+        if termo_busca and index is None:
             termo_upper = termo_busca.upper()
             filtered = []
             for p in procedimentos:
@@ -199,6 +222,10 @@ class SigtapFilterService:
     def get_registros(self, competencia: str = None) -> List[Dict[str, str]]:
         return self._get_parser(competencia).parse_registros()
 
+    def reload_competencia(self, competencia: str):
+        """Descarta o parser em cache (competência reimportada)"""
+        self._parsers.pop(competencia, None)
+    
     def get_parser(self, competencia: str = None) -> SigtapParser:
         """Retorna o parser da competência informada (ou ativa)"""
         return self._get_parser(competencia)
@@ -213,40 +240,42 @@ class SigtapFilterService:
             
         Returns:
             Dict com dados do procedimento ou None se não encontrado
+            (compartilhado com o índice da competência: não alterar)
         """
-        parser = self._get_parser(competencia)
-        procedimentos = parser.parse_procedimentos()
+        return self.get_procedimentos_info([codigo], competencia).get(codigo)
+    
+    def get_procedimentos_info(self, codigos: Iterable[str], competencia: str = None) -> Dict[str, Dict]:
+        """
+        Busca em lote: {codigo: info} para os códigos encontrados na competência
         
-        for proc in procedimentos:
-            if proc['CO_PROCEDIMENTO'] == codigo:
-                # Obter valores financeiros
-                valores = parser.get_procedimento_valor(codigo)
-                
-                # Obter registros permitidos
-                registro_map = self._get_procedimento_registro_map(competencia)
-                registros = list(registro_map.get(codigo, set()))
-                
-                # Obter CBOs permitidos
-                cbo_map = self._get_procedimento_cbo_map(competencia)
-                cbos = list(cbo_map.get(codigo, set()))
-                
-                return {
-                    'codigo': proc['CO_PROCEDIMENTO'],
-                    'nome': proc['NO_PROCEDIMENTO'],
-                    'complexidade': proc.get('TP_COMPLEXIDADE', ''),
-                    'sexo': proc.get('TP_SEXO', ''),
-                    'idade_minima': proc.get('VL_IDADE_MINIMA', ''),
-                    'idade_maxima': proc.get('VL_IDADE_MAXIMA', ''),
-                    'valor_sa': valores['valor_sa'],
-                    'valor_sh': valores['valor_hospitalar'],
-                    'valor_sp': valores['valor_sp'],
-                    'valor_total': valores['valor_sa'] + valores['valor_hospitalar'] + valores['valor_sp'],
-                    'registros': registros,
-                    'cbos': cbos,
-                    'raw': proc
-                }
+        Usa o índice da competência (lookup por código); parsers sem índice
+        montam os mapas uma única vez para todo o lote.
+        """
+        index = self._get_index(competencia)
+        if index is not None:
+            result = {}
+            for codigo in codigos:
+                info = index.procedimento_info(codigo)
+                if info is not None:
+                    result[codigo] = info
+            return result
+        
+        parser = self._get_parser(competencia)
+        procedimentos = {p['CO_PROCEDIMENTO']: p for p in parser.parse_procedimentos()}
+        registro_map = self._get_procedimento_registro_map(competencia)
+        cbo_map = self._get_procedimento_cbo_map(competencia)
         
-        return None
+        result = {}
+        for codigo in codigos:
+            proc = procedimentos.get(codigo)
+            if proc is not None:
+                result[codigo] = procedimento_info_dict(
+                    proc,
+                    parser.get_procedimento_valor(codigo),
+                    registro_map.get(codigo, set()),
+                    cbo_map.get(codigo, set())
+                )
+        return result
     
     def verificar_procedimento_valido(
         self,
@@ -267,6 +296,18 @@ class SigtapFilterService:
     
     def get_estatisticas(self, competencia: str = None) -> Dict:
         parser = self._get_parser(competencia)
+        index = self._get_index(competencia)
+        if index is not None:
+            return {
+                'competencia': competencia or self.manager.get_active_competencia() or 'LEGACY',
+                'total_procedimentos': len(index.procedimentos),
+                'total_cbos': len(index.ocupacoes),
+                'total_servicos': len(index.servicos),
+                'total_instrumentos': len(index.registros),
+                'total_relacoes_cbo': index.totais['relacoes_cbo'],
+                'total_relacoes_servico': index.totais['relacoes_servico'],
+                'total_relacoes_registro': index.totais['relacoes_registro'],
+            }
         return {
             'competencia': competencia or self.manager.get_active_competencia() or 'LEGACY',
             'total_procedimentos': len(parser.parse_procedimentos()),
@@ -0,0 +1,297 @@
+"""
+Índice SIGTAP pré-compilado por competência
+
+Consolida numa única estrutura tudo que o sistema consulta por procedimento
+(linha da tb_procedimento, valores, registros, CBOs, serviços e CIDs) e grava
+em binário (pickle). Carregar o índice evita re-parsear os arquivos fixed-width
+e reconstruir os mapas a cada requisição.
+
+O pickle fica em INDEX_DIR, fora do diretório da competência: esse diretório
+recebe o conteúdo do ZIP enviado pelo usuário, e unpickle de arquivo vindo de
+fora executa código. Só se carrega índice gravado pelo próprio servidor.
+"""
+import os
+import hashlib
+import pickle
+import logging
+import threading
+from pathlib import Path
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+from services.search_index import SearchIndex
+from services.sigtap_parser import SigtapParser
+
+logger = logging.getLogger(__name__)
+
+INDEX_DIR = Path(os.getenv(
+    'SIGTAP_INDEX_DIR', str(Path(__file__).parent.parent / 'data' / 'sigtap_index')
+))
+INDEX_VERSION = 2
+
+Fingerprint = Tuple[Tuple[str, int, int], ...]
+
+
+def index_path(sigtap_dir: str) -> Path:
+    """Arquivo do índice da competência (em INDEX_DIR, nunca dentro do diretório dela)"""
+    sigtap_dir = Path(sigtap_dir).resolve()
+    chave = hashlib.sha256(str(sigtap_dir).encode('utf-8')).hexdigest()[:16]
+    return INDEX_DIR / f"{sigtap_dir.name}-{chave}.pkl"
+
+
+def _source_fingerprint(sigtap_dir: Path) -> Fingerprint:
+    """(nome, tamanho, mtime) de cada TXT: detecta arquivo substituído sem reimportar"""
+    return tuple(
+        (p.name, p.stat().st_size, p.stat().st_mtime_ns)
+        for p in sorted(Path(sigtap_dir).glob('*.txt'))
+    )
+
+
+def _parse_optional(parse, nome: str) -> List[Dict[str, str]]:
+    """Relações ausentes no pacote (ex.: rl_procedimento_ocupacao) viram lista vazia"""
+    try:
+        return parse()
+    except FileNotFoundError as e:
+        logger.warning(f"[SIGTAP INDEX] {nome} não encontrado, relação vazia: {e.filename}")
+        return []
+
+
+def _group(relacoes: List[Dict[str, str]], key) -> Dict[str, FrozenSet]:
+    grupos: Dict[str, set] = {}
+    for rel in relacoes:
+        grupos.setdefault(rel['CO_PROCEDIMENTO'], set()).add(key(rel))
+    return {proc: frozenset(valores) for proc, valores in grupos.items()}
+
+
+def _invert(mapa: Dict[str, FrozenSet]) -> Dict[str, FrozenSet[str]]:
+    inverso: Dict[str, set] = {}
+    for proc, valores in mapa.items():
+        for valor in valores:
+            inverso.setdefault(valor, set()).add(proc)
+    return {valor: frozenset(procs) for valor, procs in inverso.items()}
+
+
+def procedimento_info_dict(
+    proc: Dict[str, str],
+    valores: Dict[str, float],
+    registros,
+    cbos
+) -> Dict:
+    """Formato retornado por SigtapFilterService.get_procedimento_info"""
+    return {
+        'codigo': proc['CO_PROCEDIMENTO'],
+        'nome': proc['NO_PROCEDIMENTO'],
+        'complexidade': proc.get('TP_COMPLEXIDADE', ''),
+        'sexo': proc.get('TP_SEXO', ''),
+        'idade_minima': proc.get('VL_IDADE_MINIMA', ''),
+        'idade_maxima': proc.get('VL_IDADE_MAXIMA', ''),
+        'valor_sa': valores['valor_sa'],
+        'valor_sh': valores['valor_hospitalar'],
+        'valor_sp': valores['valor_sp'],
+        'valor_total': valores['valor_sa'] + valores['valor_hospitalar'] + valores['valor_sp'],
+        'registros': list(registros),
+        'cbos': list(cbos),
+        'raw': proc
+    }
+
+
+class SigtapIndex:
+    """Dados de uma competência SIGTAP prontos para consulta"""
+
+    def __init__(self):
+        self.version = INDEX_VERSION
+        self.fingerprint: Optional[Fingerprint] = None
+
+        # Tabelas (linhas como o parser retorna)
+        self.procedimentos: List[Dict[str, str]] = []
+        self.ocupacoes: List[Dict[str, str]] = []
+        self.servicos: List[Dict[str, str]] = []
+        self.registros: List[Dict[str, str]] = []
+
+        # procedimento -> dados
+        self.por_codigo: Dict[str, Dict[str, str]] = {}
+        self.valores: Dict[str, Dict[str, float]] = {}
+        self.registro_map: Dict[str, FrozenSet[str]] = {}
+        self.cbo_map: Dict[str, FrozenSet[str]] = {}
+        self.servico_map: Dict[str, FrozenSet[Tuple[str, str]]] = {}
+        self.cid_map: Dict[str, FrozenSet[str]] = {}
+
+        # valor -> procedimentos (consultas inversas do parser)
+        self.procs_por_registro: Dict[str, FrozenSet[str]] = {}
+        self.procs_por_cbo: Dict[str, FrozenSet[str]] = {}
+        self.ambulatoriais: FrozenSet[str] = frozenset()
+
+        # Quantidade de linhas das relações (get_estatisticas)
+        self.totais: Dict[str, int] = {}
+
+        # Memos montados sob demanda (não persistidos)
+        self._info: Dict[str, Dict] = {}
+        self._busca: Optional[SearchIndex] = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_info'] = {}
+        state['_busca'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._info = {}
+        self._busca = None
+
+    @property
+    def busca(self) -> SearchIndex:
+        """Índice de busca por código/nome dos procedimentos"""
+        if self._busca is None:
+            self._busca = SearchIndex(
+                (p['CO_PROCEDIMENTO'], p['NO_PROCEDIMENTO']) for p in self.procedimentos
+            )
+        return self._busca
+
+    def procedimento_info(self, codigo: str) -> Optional[Dict]:
+        """
+        Dados consolidados do procedimento (O(1), montados uma vez por código).
+        O dict retornado é compartilhado: não alterar.
+        """
+        info = self._info.get(codigo)
+        if info is None:
+            proc = self.por_codigo.get(codigo)
+            if proc is None:
+                return None
+            info = procedimento_info_dict(
+                proc,
+                self.valores[codigo],
+                self.registro_map.get(codigo, ()),
+                self.cbo_map.get(codigo, ())
+            )
+            self._info[codigo] = info
+        return info
+
+    @classmethod
+    def build(cls, parser: SigtapParser) -> 'SigtapIndex':
+        """Monta o índice a partir dos TXT (parse completo, feito uma vez por competência)"""
+        index = cls()
+        index.fingerprint = _source_fingerprint(parser.sigtap_dir)
+
+        index.procedimentos = parser.parse_procedimentos()
+        index.ocupacoes = _parse_optional(parser.parse_ocupacoes, 'tb_ocupacao')
+        index.servicos = _parse_optional(parser.parse_servicos, 'tb_servico')
+        index.registros = _parse_optional(parser.parse_registros, 'tb_registro')
+
+        index.por_codigo = {p['CO_PROCEDIMENTO']: p for p in index.procedimentos}
+        for codigo in index.por_codigo:
+            index.valores[codigo] = parser.get_procedimento_valor(codigo)
+
+        rel_registro = _parse_optional(parser.parse_procedimento_registro, 'rl_procedimento_registro')
+        rel_ocupacao = _parse_optional(parser.parse_procedimento_ocupacao, 'rl_procedimento_ocupacao')
+        rel_servico = _parse_optional(parser.parse_procedimento_servico, 'rl_procedimento_servico')
+        rel_cid = _parse_optional(parser.parse_procedimento_cid, 'rl_procedimento_cid')
+
+        index.registro_map = _group(rel_registro, lambda r: r['CO_REGISTRO'])
+        index.cbo_map = _group(rel_ocupacao, lambda r: r['CO_OCUPACAO'])
+        index.servico_map = _group(rel_servico, lambda r: (r['CO_SERVICO'], r['CO_CLASSIFICACAO']))
+        index.cid_map = _group(rel_cid, lambda r: r['CO_CID'])
+
+        index.procs_por_registro = _invert(index.registro_map)
+        index.procs_por_cbo = _invert(index.cbo_map)
+        index.ambulatoriais = frozenset(
+            codigo for codigo, valores in index.valores.items() if valores['valor_sa'] > 0
+        )
+
+        index.totais = {
+            'relacoes_cbo': len(rel_ocupacao),
+            'relacoes_servico': len(rel_servico),
+            'relacoes_registro': len(rel_registro),
+            'relacoes_cid': len(rel_cid),
+        }
+        return index
+
+    def save(self, path: Path):
+        """Grava de forma atômica (arquivo temporário + rename)"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        try:
+            with open(tmp_path, 'wb') as f:
+                pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+
+    @classmethod
+    def load(cls, path: Path) -> Optional['SigtapIndex']:
+        """Carrega o índice; None se não existir, for de outra versão ou estiver corrompido"""
+        try:
+            with open(path, 'rb') as f:
+                index = pickle.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"[SIGTAP INDEX] Índice inválido em {path}: {e}")
+            return None
+        if not isinstance(index, cls) or getattr(index, 'version', None) != INDEX_VERSION:
+            logger.info(f"[SIGTAP INDEX] Versão do índice desatualizada em {path}")
+            return None
+        return index
+
+
+def build_index(sigtap_dir: str) -> SigtapIndex:
+    """Parseia a competência e grava o índice em INDEX_DIR"""
+    sigtap_dir = Path(sigtap_dir)
+    index = SigtapIndex.build(SigtapParser(str(sigtap_dir)))
+    index.save(index_path(sigtap_dir))
+    logger.info(
+        f"[SIGTAP INDEX] Índice gerado em {sigtap_dir} "
+        f"({len(index.procedimentos)} procedimentos)"
+    )
+    return index
+
+
+def load_or_build_index(sigtap_dir: str) -> SigtapIndex:
+    """
+    Carrega o índice da competência; se ausente ou desatualizado em relação aos
+    TXT, gera de novo (se INDEX_DIR não for gravável, apenas não persiste)
+    """
+    sigtap_dir = Path(sigtap_dir)
+    path = index_path(sigtap_dir)
+    index = SigtapIndex.load(path)
+    if index is not None and index.fingerprint == _source_fingerprint(sigtap_dir):
+        return index
+
+    index = SigtapIndex.build(SigtapParser(str(sigtap_dir)))
+    try:
+        index.save(path)
+    except OSError as e:
+        logger.warning(f"[SIGTAP INDEX] Não foi possível gravar índice em {path}: {e}")
+    return index
+
+
+_shared_parsers: Dict[str, SigtapParser] = {}
+_shared_lock = threading.Lock()
+
+
+def get_sigtap_parser(sigtap_dir: str) -> SigtapParser:
+    """
+    Parser compartilhado por diretório de competência, já alimentado pelo índice.
+
+    Extração, relatórios, dashboard financeiro e filtros usam a mesma instância,
+    em vez de cada requisição montar um SigtapParser e re-parsear os TXT.
+    """
+    key = str(Path(sigtap_dir).resolve())
+    with _shared_lock:
+        parser = _shared_parsers.get(key)
+        if parser is None:
+            parser = SigtapParser(key)
+            try:
+                parser.load_index(load_or_build_index(key))
+            except Exception as e:
+                # Sem índice o parser continua funcional (parse sob demanda dos TXT)
+                logger.warning(f"[SIGTAP INDEX] Usando parser sem índice para {key}: {e}")
+            _shared_parsers[key] = parser
+        return parser
+
+
+def invalidate_sigtap_parser(sigtap_dir: str):
+    """Descarta o parser compartilhado (após reimportar a competência)"""
+    with _shared_lock:
+        _shared_parsers.pop(str(Path(sigtap_dir).resolve()), None)
@@ -7,6 +7,10 @@ from pathlib import Path
 from typing import List, Dict, Optional
 from datetime import datetime
 
+from services.sigtap_index import build_index, invalidate_sigtap_parser
+from services.response_cache import incrementar_versao
+from services.sigtap_precos import carregar_precos_competencia
+
 logger = logging.getLogger(__name__)
 
 class SigtapManagerService:
@@ -94,8 +98,22 @@ class SigtapManagerService:
         config["active_competencia"] = competencia
         config["last_update"] = datetime.now().isoformat()
         self._save_config(config)
+        incrementar_versao('sigtap', competencia=competencia)
+        self._carregar_precos(competencia)
         logger.info(f"Competência ativa alterada para: {competencia}")
 
+    def _carregar_precos(self, competencia: str) -> bool:
+        """
+        Carrega a versão de preços da competência no Postgres (dashboard financeiro).
+        Falhas não impedem importação/ativação: a carga é refeita no primeiro uso.
+        """
+        try:
+            carregar_precos_competencia(competencia)
+            return True
+        except Exception as e:
+            logger.warning(f"Não foi possível carregar os preços SIGTAP de {competencia}: {e}")
+            return False
+
     def get_sigtap_dir(self, competencia: str = None) -> str:
         """
         Retorna o caminho absoluto para o diretório da competência.
@@ -147,6 +165,24 @@ class SigtapManagerService:
                 else:
                     raise ValueError("Arquivo tb_procedimento.txt não encontrado no ZIP")
             
+            # Pickles vindos no ZIP nunca são carregados (o índice fica em
+            # INDEX_DIR); remove para não deixar nada executável na competência
+            for pkl in target_dir.rglob('*.pkl'):
+                logger.warning(f"Removendo {pkl.name} extraído do ZIP da competência {competencia}")
+                pkl.unlink()
+
+            # Índice pré-compilado. Se falhar, a competência continua
+            # utilizável: o índice é gerado no primeiro uso.
+            invalidate_sigtap_parser(str(target_dir))
+            incrementar_versao('sigtap', competencia=competencia)
+            index_gerado = True
+            try:
+                build_index(str(target_dir))
+            except Exception as e:
+                index_gerado = False
+                logger.warning(f"Não foi possível gerar índice SIGTAP para {competencia}: {e}")
+            precos_carregados = self._carregar_precos(competencia)
+            
             # Define como ativa automaticamente se for a única
             if not self.get_active_competencia():
                 self.set_active_competencia(competencia)
@@ -154,6 +190,8 @@ class SigtapManagerService:
             return {
                 "success": True,
                 "competencia": competencia,
+                "index": index_gerado,
+                "precos": precos_carregados,
                 "message": "Importação concluída com sucesso"
             }
             
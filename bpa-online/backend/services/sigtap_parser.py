@@ -36,6 +36,22 @@ class SigtapParser:
         self._rel_ocupacao_cache = None
         self._rel_servico_cache = None
         self._rel_registro_cache = None
+        self._rel_cid_cache = None
+        
+        # Índice pré-compilado da competência (ver services/sigtap_index.py)
+        self.index = None
+    
+    def load_index(self, index):
+        """
+        Alimenta os caches a partir de um SigtapIndex já carregado,
+        dispensando o parsing dos TXT
+        """
+        self.index = index
+        self._procedimentos_cache = index.procedimentos
+        self._valores_cache = index.valores
+        self._ocupacoes_cache = index.ocupacoes
+        self._servicos_cache = index.servicos
+        self._registros_cache = index.registros
         
     def read_layout(self, layout_file: str) -> List[ColumnLayout]:
         """
@@ -157,6 +173,18 @@ class SigtapParser:
             self._rel_registro_cache = self.parse_file('rl_procedimento_registro.txt', 'rl_procedimento_registro_layout.txt')
         return self._rel_registro_cache
     
+    def parse_procedimento_cid(self) -> List[Dict[str, str]]:
+        """Parse da relação procedimento x CID"""
+        if self._rel_cid_cache is None:
+            self._rel_cid_cache = self.parse_file('rl_procedimento_cid.txt', 'rl_procedimento_cid_layout.txt')
+        return self._rel_cid_cache
+    
+    def get_procedimentos_map(self) -> Dict[str, Dict[str, str]]:
+        """Mapa código -> linha da tb_procedimento"""
+        if self.index is not None:
+            return self.index.por_codigo
+        return {p['CO_PROCEDIMENTO']: p for p in self.parse_procedimentos()}
+    
     def get_procedimentos_by_tipo_registro(self, tipo_registro: str = '02') -> List[str]:
         """
         Retorna lista de códigos de procedimentos para um tipo de registro
@@ -170,6 +198,9 @@ class SigtapParser:
         Returns:
             Lista de códigos de procedimentos
         """
+        if self.index is not None:
+            return list(self.index.procs_por_registro.get(tipo_registro, ()))
+        
         registros = self.parse_procedimento_registro()
         return [
             r['CO_PROCEDIMENTO'] 
@@ -187,6 +218,9 @@ class SigtapParser:
         Returns:
             Lista de códigos de procedimentos
         """
+        if self.index is not None:
+            return list(self.index.procs_por_cbo.get(cbo, ()))
+        
         relacoes = self.parse_procedimento_ocupacao()
         return [
             r['CO_PROCEDIMENTO']
@@ -205,6 +239,12 @@ class SigtapParser:
         Returns:
             Lista de códigos de procedimentos
         """
+        if self.index is not None:
+            return [
+                proc for proc, pares in self.index.servico_map.items()
+                if any(s == servico and (not classificacao or c == classificacao) for s, c in pares)
+            ]
+        
         relacoes = self.parse_procedimento_servico()
         
         if classificacao:
@@ -234,6 +274,15 @@ class SigtapParser:
         if not servicos:
             return set()
         
+        if self.index is not None:
+            return {
+                proc for proc, pares in self.index.servico_map.items()
+                if any(
+                    s in servicos and (classificacoes is None or c in classificacoes)
+                    for s, c in pares
+                )
+            }
+        
         codigos = set()
         relacoes = self.parse_procedimento_servico()
         
@@ -255,6 +304,9 @@ class SigtapParser:
         Returns:
             Set de códigos de procedimentos com VL_SA > 0
         """
+        if self.index is not None:
+            return set(self.index.ambulatoriais)
+        
         # Garante que o cache de valores está preenchido
         if self._valores_cache is None:
             self.get_procedimento_valor("0000000000")  # Força inicialização do cache
@@ -0,0 +1,133 @@
+"""
+Carga dos valores SIGTAP no Postgres (sigtap_preco / sigtap_preco_ocupacao)
+
+Uma versão por competência SIGTAP: a carga substitui as linhas da competência
+numa só transação (COPY), então consultas concorrentes veem a versão anterior
+ou a nova inteira. É feita na importação e na ativação da competência e, se
+faltar (competência instalada antes desta tabela existir), no primeiro uso.
+"""
+import logging
+from typing import Dict, Iterable, Optional, Tuple
+
+from services.sigtap_parser import SigtapParser
+
+logger = logging.getLogger(__name__)
+
+# Diretório SIGTAP legado (sem competência importada); ver get_sigtap_dir
+COMPETENCIA_LEGADA = 'LEGACY'
+
+PRECO_COLUNAS = ('competencia', 'co_procedimento', 'no_procedimento', 'vl_sa', 'vl_sh', 'vl_sp')
+OCUPACAO_COLUNAS = ('competencia', 'co_ocupacao', 'no_ocupacao')
+
+
+def _centavos(valor: Optional[str]) -> float:
+    """Valores do SIGTAP vêm em centavos (ex.: 000000001247 = R$ 12,47)"""
+    try:
+        return int((valor or '').strip() or 0) / 100.0
+    except ValueError:
+        return 0.0
+
+
+def linhas_precos(competencia: str, parser: SigtapParser) -> Iterable[Tuple]:
+    """Linhas de sigtap_preco (na ordem de PRECO_COLUNAS) a partir da tb_procedimento"""
+    vistos = set()
+    for proc in parser.parse_procedimentos():
+        codigo = (proc.get('CO_PROCEDIMENTO') or '').strip()
+        if not codigo or codigo in vistos:
+            continue
+        vistos.add(codigo)
+        yield (
+            competencia,
+            codigo,
+            (proc.get('NO_PROCEDIMENTO') or '').strip()[:250],
+            _centavos(proc.get('VL_SA')),
+            _centavos(proc.get('VL_SH')),
+            _centavos(proc.get('VL_SP')),
+        )
+
+
+def linhas_ocupacoes(competencia: str, parser: SigtapParser) -> Iterable[Tuple]:
+    """Linhas de sigtap_preco_ocupacao (na ordem de OCUPACAO_COLUNAS)"""
+    vistos = set()
+    for ocupacao in parser.parse_ocupacoes():
+        codigo = (ocupacao.get('CO_OCUPACAO') or '').strip()
+        if not codigo or codigo in vistos:
+            continue
+        vistos.add(codigo)
+        yield (competencia, codigo, (ocupacao.get('NO_OCUPACAO') or '').strip()[:150])
+
+
+def carregar_precos(conn, parser: SigtapParser, competencia: str) -> Dict[str, int]:
+    """
+    Substitui a versão de preços da competência (na conexão informada; faz commit)
+
+    Usa um advisory lock por competência para cargas concorrentes (ex.: dois
+    workers ativando a mesma competência) não se intercalarem.
+    """
+    from database import _copy_rows
+
+    precos = list(linhas_precos(competencia, parser))
+    ocupacoes = list(linhas_ocupacoes(competencia, parser))
+
+    with conn.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_xact_lock(hashtext('sigtap_preco:' || %s))", (competencia,))
+        cursor.execute('DELETE FROM sigtap_preco WHERE competencia = %s', (competencia,))
+        cursor.execute('DELETE FROM sigtap_preco_ocupacao WHERE competencia = %s', (competencia,))
+        _copy_rows(cursor, 'sigtap_preco', PRECO_COLUNAS, precos)
+        _copy_rows(cursor, 'sigtap_preco_ocupacao', OCUPACAO_COLUNAS, ocupacoes)
+        cursor.execute('''
+            INSERT INTO sigtap_preco_versao (competencia, procedimentos, ocupacoes)
+            VALUES (%s, %s, %s)
+            ON CONFLICT (competencia) DO UPDATE SET
+                procedimentos = EXCLUDED.procedimentos,
+                ocupacoes = EXCLUDED.ocupacoes,
+                carregado_em = CURRENT_TIMESTAMP
+        ''', (competencia, len(precos), len(ocupacoes)))
+    conn.commit()
+
+    logger.info(f"[SIGTAP] Preços da competência {competencia} carregados: "
+                f"{len(precos)} procedimentos, {len(ocupacoes)} ocupações")
+    return {'procedimentos': len(precos), 'ocupacoes': len(ocupacoes)}
+
+
+def carregar_precos_competencia(competencia: Optional[str] = None) -> Dict[str, int]:
+    """Carrega a versão de preços de uma competência instalada (None = ativa)"""
+    from database import get_connection
+    from services.response_cache import incrementar_versao
+    from services.sigtap_index import get_sigtap_parser
+    from services.sigtap_manager_service import get_sigtap_manager
+
+    manager = get_sigtap_manager()
+    alvo = competencia or manager.get_active_competencia() or COMPETENCIA_LEGADA
+    sigtap_dir = manager.get_sigtap_dir(None if alvo == COMPETENCIA_LEGADA else alvo)
+
+    with get_connection() as conn:
+        resultado = carregar_precos(conn, get_sigtap_parser(sigtap_dir), alvo)
+    # Respostas valoradas com a versão anterior (ou sem preços) deixam de valer
+    incrementar_versao('sigtap', competencia=alvo)
+    return resultado
+
+
+def precos_carregados(competencia: str) -> bool:
+    """True se a competência já tem versão de preços no Postgres"""
+    from database import get_connection
+
+    with get_connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT 1 FROM sigtap_preco_versao WHERE competencia = %s', (competencia,))
+            return cursor.fetchone() is not None
+
+
+def garantir_precos(competencia: str) -> bool:
+    """
+    Garante a versão de preços da competência, carregando-a se faltar
+
+    Retorna False se não foi possível (o dashboard segue, sem valores).
+    """
+    try:
+        if not precos_carregados(competencia):
+            carregar_precos_competencia(competencia)
+        return True
+    except Exception as e:
+        logger.warning(f"[SIGTAP] Preços da competência {competencia} indisponíveis: {e}")
+        return False
@@ -0,0 +1,113 @@
+import asyncio
+from contextlib import asynccontextmanager, contextmanager
+from unittest.mock import MagicMock
+
+import database
+from async_database import AsyncBPADatabase
+from services.bpa_paginacao import pagina_bpa_async
+
+
+class FakeAsyncCursor:
+    def __init__(self, rows, rowcount):
+        self.rows = rows
+        self.rowcount = rowcount
+
+    async def fetchall(self):
+        return self.rows
+
+    async def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+
+class FakeAsyncPool:
+    """Pool psycopg 3 em memória: responde por trecho de SQL e registra os comandos"""
+
+    def __init__(self, respostas):
+        self.respostas = respostas
+        self.executed = []
+        self.transacoes = 0
+
+    @asynccontextmanager
+    async def connection(self):
+        yield self
+
+    @asynccontextmanager
+    async def transaction(self):
+        self.transacoes += 1
+        yield
+
+    async def execute(self, sql, params=None):
+        sql = ' '.join(sql.split())
+        self.executed.append((sql, params))
+        for trecho, (rows, rowcount) in self.respostas.items():
+            if trecho in sql:
+                return FakeAsyncCursor(rows, rowcount)
+        return FakeAsyncCursor([], 0)
+
+
+def test_stats_by_cnes_on_async_pool():
+    pool = FakeAsyncPool({
+        'FROM producao_resumo': ([
+            {'tipo': 'bpa_i', 'competencia': '202512', 'total': 10, 'pendentes': 4, 'exportados': 6},
+            {'tipo': 'bpa_c', 'competencia': '202511', 'total': 3, 'pendentes': 3, 'exportados': 0},
+        ], 2),
+        'AS profissionais': ([{'profissionais': 7, 'pacientes': 120}], 1),
+    })
+    adb = AsyncBPADatabase(sync_db=MagicMock(), pool=pool)
+
+    stats = asyncio.run(adb.get_stats_by_cnes('2755289'))
+
+    assert stats['bpai_total'] == 10 and stats['bpai_pendente'] == 4 and stats['bpac_total'] == 3
+    assert stats['bpai_competencias'] == ['202512'] and stats['bpac_competencias'] == ['202511']
+    assert stats['profissionais'] == 7 and stats['pacientes'] == 120
+    assert pool.executed[0][1] == ['2755289']
+
+
+def test_query_timeout_is_local_to_transaction():
+    pool = FakeAsyncPool({'FROM pacientes': ([{'cns': '700000000000000'}], 1)})
+    adb = AsyncBPADatabase(sync_db=MagicMock(), pool=pool)
+
+    rows = asyncio.run(adb._consultar('SELECT * FROM pacientes', timeout_ms=1500))
+
+    assert rows == [{'cns': '700000000000000'}]
+    assert pool.transacoes == 1
+    assert pool.executed[0] == ("SELECT set_config('statement_timeout', %s, true)", ('1500',))
+
+
+def test_methods_without_native_version_run_in_thread():
+    sync_db = MagicMock()
+    sync_db.save_bpa_consolidado_batch.return_value = {'inserted': 2}
+    adb = AsyncBPADatabase(sync_db=sync_db, pool=FakeAsyncPool({}))
+
+    resultado = asyncio.run(adb.save_bpa_consolidado_batch([{'prd_uid': '2755289'}], batch_size=500))
+
+    assert resultado == {'inserted': 2}
+    sync_db.save_bpa_consolidado_batch.assert_called_once_with([{'prd_uid': '2755289'}], batch_size=500)
+
+
+def test_without_pool_uses_psycopg2(monkeypatch):
+    conn = MagicMock()
+    cursor = conn.cursor.return_value.__enter__.return_value
+    cursor.rowcount = 1
+
+    @contextmanager
+    def fake_connection():
+        yield conn
+
+    monkeypatch.setattr(database, 'get_connection', fake_connection)
+    adb = AsyncBPADatabase(sync_db=MagicMock())
+
+    assert asyncio.run(adb.delete_bpa_individualizado(42)) is True
+    cursor.execute.assert_called_once_with('DELETE FROM bpa_individualizado WHERE id = %s', (42,))
+    conn.commit.assert_called_once()
+
+
+def test_async_page_uses_keyset():
+    pool = FakeAsyncPool({'FROM bpa_consolidado': ([{'id': 5}, {'id': 6}, {'id': 7}], 3)})
+    adb = AsyncBPADatabase(sync_db=database.BPADatabase.__new__(database.BPADatabase), pool=pool)
+
+    pagina = asyncio.run(pagina_bpa_async(adb, 'bpa_consolidado', '2755289', '202512', limit=2))
+
+    assert [r['id'] for r in pagina['data']] == [5, 6] and pagina['next_cursor']
+    sql, params = pool.executed[0]
+    assert sql.endswith('ORDER BY id LIMIT %s OFFSET %s') and params == ['2755289', '202512', 3, 0]
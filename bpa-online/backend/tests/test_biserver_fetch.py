@@ -0,0 +1,125 @@
+import random
+import threading
+import time
+
+import pytest
+
+from services.biserver_client import BiServerConfig, BiServerExtractionService, TokenBucket
+
+
+def _page(prefix, page, size):
+    return [{'prd_pa': '0301010072', 'id': f'{prefix}-{page}-{i}'} for i in range(size)]
+
+
+class TestParallelPageFetch:
+    @pytest.fixture
+    def service(self, monkeypatch):
+        monkeypatch.setattr(BiServerConfig, 'RATE_LIMIT', 1000.0)
+        return BiServerExtractionService(enable_sigtap_validation=False)
+
+    def test_pages_reassembled_in_order(self, service, monkeypatch):
+        # BPA: 4 páginas cheias + 1 parcial; odonto: 1 cheia + 1 parcial
+        sizes = {None: [500, 500, 500, 500, 7], 'odonto': [500, 3]}
+        calls = []
+        in_flight = {'now': 0, 'max': 0}
+        lock = threading.Lock()
+
+        def fake_fetch(endpoint, params, max_retries=5, base_delay=2.0, stop=None):
+            with lock:
+                in_flight['now'] += 1
+                in_flight['max'] = max(in_flight['max'], in_flight['now'])
+            time.sleep(random.uniform(0, 0.02))
+            with lock:
+                in_flight['now'] -= 1
+                calls.append((params.get('tables'), params['page']))
+            stream = sizes[params.get('tables')]
+            page = params['page']
+            size = stream[page] if page < len(stream) else 0
+            return {'registros': _page(params.get('tables') or 'bpa', page, size)}
+
+        monkeypatch.setattr(service, '_fetch_page_with_retry', fake_fetch)
+
+        result = service.extract_and_separate_bpa('2755289', '202512', max_in_flight=3)
+
+        assert result['success']
+        ids = [r['id'] for r in result['bpa_i']]
+        expected = [r['id'] for p, n in enumerate(sizes[None]) for r in _page('bpa', p, n)]
+        expected += [r['id'] for p, n in enumerate(sizes['odonto']) for r in _page('odonto', p, n)]
+        assert ids == expected
+        assert result['stats']['odonto'] == 503
+        assert all(r['_source'] == 'odonto' for r in result['bpa_i'][-503:])
+        assert in_flight['max'] <= 3
+
+    def test_stream_applies_offset_limit_and_stops_early(self, service, monkeypatch):
+        calls = []
+
+        def fake_fetch(endpoint, params, max_retries=5, base_delay=2.0, stop=None):
+            calls.append(params['page'])
+            return {'registros': _page('bpa', params['page'], 500)}
+
+        monkeypatch.setattr(service, '_fetch_page_with_retry', fake_fetch)
+
+        counters = {}
+        pages = list(service.iter_extracted_pages(
+            '2467925', '202512', limit=700, offset=300, max_in_flight=2, counters=counters
+        ))
+
+        ids = [r['id'] for page in pages for r in page]
+        assert ids[0] == 'bpa-0-300'
+        assert ids[-1] == 'bpa-1-499'
+        assert len(ids) == 700
+        assert [len(page) for page in pages] == [200, 500]
+        assert counters == {'bpa': 1000, 'odonto': 0}
+        assert max(calls) < 4  # não busca a competência inteira
+
+    def test_error_after_first_pages_keeps_partial_data(self, service, monkeypatch):
+        def fake_fetch(endpoint, params, max_retries=5, base_delay=2.0, stop=None):
+            if params['page'] >= 2:
+                raise Exception('Erro HTTP 400: bad request')
+            return {'registros': _page('bpa', params['page'], 500)}
+
+        monkeypatch.setattr(service, '_fetch_page_with_retry', fake_fetch)
+
+        result = service.extract_and_separate_bpa('2467925', '202512', max_in_flight=4)
+
+        assert result['success']
+        assert len(result['bpa_i']) == 1000
+
+    def test_error_on_first_page_fails(self, service, monkeypatch):
+        def fake_fetch(endpoint, params, max_retries=5, base_delay=2.0, stop=None):
+            raise Exception('Erro HTTP 401: unauthorized')
+
+        monkeypatch.setattr(service, '_fetch_page_with_retry', fake_fetch)
+
+        result = service.extract_and_separate_bpa('2467925', '202512')
+
+        assert not result['success']
+        assert '401' in result['error']
+
+
+    def test_last_page_interrupts_prefetch_in_backoff(self, service, monkeypatch):
+        # Páginas além do fim ficam em 502; ao ver a página parcial a extração
+        # não pode esperar o backoff delas
+        class FakeClient:
+            def get(self, endpoint, params=None, retry=False, timeout=None):
+                if params['page'] >= 2:
+                    raise Exception('Erro HTTP 502: bad gateway')
+                time.sleep(0.05)
+                return {'registros': _page('bpa', params['page'], 500 if params['page'] == 0 else 10)}
+
+        service.client = FakeClient()
+
+        start = time.monotonic()
+        pages = list(service.iter_extracted_pages('2467925', '202512', max_in_flight=4))
+
+        assert [len(page) for page in pages] == [500, 10]
+        assert time.monotonic() - start < 1.5
+
+
+def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=50, capacity=1)
+    start = time.monotonic()
+    for _ in range(6):
+        bucket.acquire()
+    # 1 token imediato + 5 a 50/s => ~0.1s
+    assert time.monotonic() - start >= 0.08
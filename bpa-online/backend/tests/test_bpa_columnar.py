@@ -0,0 +1,132 @@
+import random
+
+import pytest
+
+from services import bpa_columnar
+from services.biserver_client import BiServerExtractionService, StreamingBPAClassifier
+
+pytestmark = pytest.mark.skipif(not bpa_columnar.NUMPY_AVAILABLE, reason="NumPy não instalado")
+
+REGISTRO_MAP = {
+    '0301010072': {'02'},            # BPA-I
+    '0301100039': {'01'},            # BPA-C
+    '0101040024': {'01', '02'},      # dual -> BPA-C
+    '0301010030': {'02', '10'},
+}
+
+
+class FakeSigtap:
+    def _get_procedimento_registro_map(self, competencia=None):
+        return REGISTRO_MAP
+
+
+@pytest.fixture
+def service():
+    svc = BiServerExtractionService(enable_sigtap_validation=False)
+    svc.enable_sigtap_validation = True
+    svc.sigtap = FakeSigtap()
+    return svc
+
+
+def _records(n, seed=7):
+    rnd = random.Random(seed)
+    codigos = list(REGISTRO_MAP) + ['0214010015', '9999999999']
+    records = []
+    for i in range(n):
+        rec = {
+            'prd_uid': rnd.choice(['2755289', '2492555']),
+            'prd_cbo': rnd.choice(['225125', '322205']),
+            'prd_pa': rnd.choice(codigos),
+            'prd_cnsmed': f'70000000000{i % 7:04d}',
+            'prd_qt_p': rnd.choice([1, 2, '3', None]),
+            'id': i,
+        }
+        if rnd.random() < 0.5:
+            rec['prd_idade'] = str(rnd.randint(0, 90))
+        else:
+            rec['prd_dtnasc'] = f'19{rnd.randint(40, 99)}-0{rnd.randint(1, 9)}-15'
+            rec['prd_dtaten'] = '2025-12-10'
+        if rnd.random() < 0.1:
+            rec['procedimento'] = rec.pop('prd_pa')
+        records.append(rec)
+    return records
+
+
+def _run(service, pages, columnar):
+    classifier = StreamingBPAClassifier(service, '202512')
+    if not columnar:
+        classifier.lookup = None
+    bpa_i = []
+    for page in pages:
+        bpa_i.extend(classifier.feed(page))
+    return bpa_i, classifier.finish()
+
+
+def test_columnar_classifier_matches_python_loop(service):
+    records = _records(3000)
+    pages = [records[i:i + 500] for i in range(0, len(records), 500)]
+
+    bpa_i_loop, result_loop = _run(service, pages, columnar=False)
+    bpa_i_cols, result_cols = _run(service, pages, columnar=True)
+
+    assert [r['id'] for r in bpa_i_cols] == [r['id'] for r in bpa_i_loop]
+    assert result_cols['bpa_c'] == result_loop['bpa_c']
+    assert result_cols['stats'] == result_loop['stats']
+    assert result_cols['stats']['converted'] > 0
+    assert result_cols['stats']['removed_sem_registro'] > 0
+
+
+def test_columnar_fast_path_matches_python_loop(service):
+    """Registros no formato do BiServer (5 campos da chave preenchidos)"""
+    rnd = random.Random(11)
+    records = []
+    for i in range(4000):
+        records.append({
+            'prd_uid': '2755289',
+            'prd_cmp': rnd.choice(['202512', '2025-12']),
+            'prd_cbo': rnd.choice(['225125', '322205']),
+            'prd_pa': rnd.choice(list(REGISTRO_MAP)),
+            'prd_idade': rnd.choice(['7', '007', '45', '045', '102']),
+            'prd_qt_p': rnd.choice([1, 2, '3']),
+            'id': i,
+        })
+    # Idade vazia numa página: cai na normalização por registro
+    records[2500]['prd_idade'] = ''
+    pages = [records[i:i + 1000] for i in range(0, len(records), 1000)]
+
+    bpa_i_loop, result_loop = _run(service, pages, columnar=False)
+    bpa_i_cols, result_cols = _run(service, pages, columnar=True)
+
+    assert [r['id'] for r in bpa_i_cols] == [r['id'] for r in bpa_i_loop]
+    assert result_cols['bpa_c'] == result_loop['bpa_c']
+    assert result_cols['stats'] == result_loop['stats']
+
+
+def test_separate_and_filter_use_masks(service):
+    records = _records(200)
+    esperado_i = [r for r in records if '02' in REGISTRO_MAP.get(r.get('prd_pa', r.get('procedimento', '')), ())]
+
+    separated = service._separate_bpa_by_sigtap(records)
+    assert separated['bpa_i'] == esperado_i
+    assert separated['stats']['bpa_i'] + separated['stats']['bpa_c'] + \
+        separated['stats']['removed_sem_registro'] == len(records)
+
+    validos, removidos = service._filter_records_by_sigtap(records, tipo_bpa='02')
+    assert validos == esperado_i
+    assert removidos == len(records) - len(esperado_i)
+
+
+def test_bpac_pendente_ate_confirmar(service):
+    """BPA-C de uma página só entra no agregado após confirmar; descartar a abandona"""
+    records = _records(2000)
+    pages = [records[i:i + 500] for i in range(0, len(records), 500)]
+    _, esperado = _run(service, pages[:3], columnar=True)
+
+    classifier = StreamingBPAClassifier(service, '202512')
+    for page in pages[:3]:
+        classifier.feed(page)
+        classifier.confirmar()
+    classifier.feed(pages[3])
+    classifier.descartar()
+
+    assert classifier.finish()['bpa_c'] == esperado['bpa_c']
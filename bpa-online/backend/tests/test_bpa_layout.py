@@ -0,0 +1,201 @@
+import random
+import time
+from datetime import date, datetime
+
+import pytest
+
+from services.bpa_layout import BPAC, BPAI, HEADER, data_yyyymmdd, decodificar_linha
+from services.bpa_report_generator import BPAExportConfig, BPAFileGenerator
+
+
+class LegacyLines:
+    """Montagem anterior das linhas (concatenação campo a campo), referência do layout"""
+
+    VERSION = "04.10"
+
+    def __init__(self, config):
+        self.config = config
+
+    def format_date_yyyymmdd(self, date_str):
+        if not date_str:
+            return "        "
+        date_str = str(date_str)[:10]
+        if len(date_str) == 8 and date_str.isdigit():
+            return date_str
+        for formato in ('%Y-%m-%d', '%d/%m/%Y'):
+            try:
+                return datetime.strptime(date_str, formato).strftime('%Y%m%d')
+            except ValueError:
+                pass
+        return "        "
+
+    def pad_left(self, value, size):
+        return str(value or '').zfill(size)[:size]
+
+    def pad_right(self, value, size):
+        return str(value or '').ljust(size)[:size]
+
+    def calculate_age(self, birth_date, ref_date=None):
+        birth = self.format_date_yyyymmdd(birth_date)
+        if not birth.strip():
+            return 0
+        ref = ref_date or datetime.now().strftime('%Y%m%d')
+        if isinstance(ref, str) and len(ref) == 8:
+            ref_year, ref_month, ref_day = int(ref[:4]), int(ref[4:6]), int(ref[6:8])
+        else:
+            ref_year, ref_month, ref_day = datetime.now().year, datetime.now().month, datetime.now().day
+        age = ref_year - int(birth[:4])
+        if (ref_month, ref_day) < (int(birth[4:6]), int(birth[6:8])):
+            age -= 1
+        return max(0, min(999, age))
+
+    def header(self, total_registros, total_bpas, campo_controle):
+        linha = "01#BPA#" + self.config.competencia
+        linha += self.pad_left(str(total_registros), 6)
+        linha += self.pad_left(str(total_bpas), 6)
+        linha += self.pad_left(campo_controle, 4)
+        linha += " " * 52 + "0" * 14 + " " * 41 + "D" + self.VERSION
+        return linha
+
+    def bpac(self, record, folha, seq):
+        linha = "02"
+        linha += self.pad_left(self.config.cnes, 7)
+        linha += self.config.competencia
+        linha += self.pad_left(record.get('prd_cbo', ''), 6)
+        linha += self.pad_left(str(folha), 3)
+        linha += self.pad_left(str(seq), 2)
+        linha += self.pad_left(record.get('prd_pa', ''), 10)
+        linha += self.pad_left(str(record.get('prd_idade', 0)), 3)
+        linha += self.pad_left(str(record.get('prd_qt_p', 1)), 6)
+        linha += self.pad_left(str(record.get('seq_paciente', 1)), 3)
+        linha += "BPA"
+        return linha
+
+    def bpai(self, record, folha, seq):
+        linha = "03"
+        linha += self.pad_left(self.config.cnes, 7)
+        linha += self.config.competencia
+        linha += self.pad_left(record.get('prd_cbo', ''), 6)
+        linha += self.pad_right(record.get('prd_cnspac', ''), 15)
+        linha += self.format_date_yyyymmdd(record.get('prd_dtaten', ''))
+        linha += self.pad_left(str(folha), 3)
+        linha += self.pad_left(str(seq), 2)
+        linha += self.pad_left(record.get('prd_pa', ''), 10)
+        linha += self.pad_right(record.get('prd_cnsmed', ''), 15)
+        linha += self.pad_right(record.get('prd_sexo', ''), 1)
+        linha += self.pad_left(record.get('prd_ibge', ''), 6)
+        linha += self.pad_right(record.get('prd_cid', ''), 4)
+        idade = self.calculate_age(record.get('prd_dtnasc', ''), record.get('prd_dtaten', ''))
+        linha += self.pad_left(str(idade), 3)
+        linha += self.pad_left(str(record.get('prd_qt_p', 1)), 6)
+        linha += self.pad_left(record.get('prd_caten', '01'), 2)
+        linha += self.pad_right(record.get('prd_naut', ''), 13)
+        linha += "BPA"
+        linha += self.pad_right(record.get('prd_nmpac', ''), 30)
+        linha += self.format_date_yyyymmdd(record.get('prd_dtnasc', ''))
+        linha += self.pad_left(record.get('prd_raca', '99'), 2)
+        linha += self.pad_right(record.get('prd_etnia', ''), 4)
+        linha += self.pad_left(record.get('prd_nac', '010'), 3)
+        linha += " " * 34
+        linha += self.pad_left(record.get('prd_cep_pcnte', ''), 8)
+        linha += self.pad_left(record.get('prd_lograd_pcnte', ''), 3)
+        linha += self.pad_right(record.get('prd_end_pcnte', ''), 30)
+        linha += self.pad_right(record.get('prd_compl_pcnte', ''), 10)
+        linha += self.pad_right(record.get('prd_num_pcnte', ''), 5)
+        linha += self.pad_right(record.get('prd_bairro_pcnte', ''), 30)
+        telefone = str(record.get('prd_ddtel_pcnte', '') or '') + str(record.get('prd_tel_pcnte', '') or '')
+        linha += self.pad_right(telefone, 11)
+        linha += " " * 89
+        return linha
+
+
+CONFIG = BPAExportConfig(cnes='2755289', competencia='202512', sigla='CAPSAD')
+
+
+def _records(n, seed=16):
+    rnd = random.Random(seed)
+    datas = ['20251210', '2025-12-03', '05/12/2025', '2025-1-5', '', None, '2025-02-30', 'xx', date(2025, 12, 1)]
+    records = []
+    for i in range(n):
+        record = {
+            'prd_cbo': rnd.choice(['225125', '', None, '2251']),
+            'prd_cnspac': rnd.choice(['700000000000001', '', None]),
+            'prd_dtaten': rnd.choice(datas), 'prd_dtnasc': rnd.choice(datas + ['19800101', '20121231']),
+            'prd_pa': rnd.choice(['0301010072', '301010072', '']), 'prd_cnsmed': '700000000000002',
+            'prd_sexo': rnd.choice(['M', 'F', '', None]), 'prd_ibge': rnd.choice(['172100', '', None]),
+            'prd_cid': rnd.choice(['F102', '', 'Z0000']), 'prd_qt_p': rnd.choice([1, 12, 1234567, '3']),
+            'prd_nmpac': f'PACIENTE COM UM NOME BEM COMPRIDO {i}', 'prd_end_pcnte': 'RUA 1',
+            'prd_num_pcnte': rnd.choice(['12', 'SN', '123456']), 'prd_tel_pcnte': rnd.choice(['', '32120000']),
+        }
+        for chave in ('prd_caten', 'prd_raca', 'prd_nac', 'prd_etnia', 'prd_ddtel_pcnte', 'prd_idade'):
+            if rnd.random() < 0.5:
+                record[chave] = rnd.choice(['', '02', '1', '030'])
+        records.append(record)
+    return records
+
+
+def test_encoded_lines_match_legacy_concatenation():
+    generator = BPAFileGenerator(CONFIG)
+    legacy = LegacyLines(CONFIG)
+
+    for i, record in enumerate(_records(3000)):
+        folha, seq = i // 20 + 1, i % 20 + 1
+        assert generator.generate_set_bpai_line(record, folha, seq) == legacy.bpai(record, folha, seq)
+        assert generator.generate_set_bpac_line(record, folha, seq) == legacy.bpac(record, folha, seq)
+    assert generator.generate_set_header(1234, 62, '0042') == legacy.header(1234, 62, '0042')
+    assert len(generator.generate_set_bpai_line({}, 1, 1)) == BPAI.tamanho == 379
+
+
+@pytest.mark.parametrize('valor', [
+    '20251210', '2025-12-03', '05/12/2025', '2025-1-5', '5/1/2025', '2025-02-30', '31/02/2025',
+    '', None, 'abc', '2025/12/03', date(2025, 12, 1), datetime(2025, 12, 1, 10, 30),
+])
+def test_fast_date_matches_strptime(valor):
+    assert data_yyyymmdd(valor) == LegacyLines(CONFIG).format_date_yyyymmdd(valor)
+
+
+def test_decoder_round_trip():
+    generator = BPAFileGenerator(CONFIG)
+    record = _records(1)[0] | {'prd_dtaten': '20251210', 'prd_dtnasc': '19800101', 'prd_cid': 'F102'}
+
+    tipo, campos = decodificar_linha(generator.generate_set_bpai_line(record, 7, 3))
+    assert tipo == '03'
+    assert campos['folha'] == '007' and campos['seq'] == '03'
+    assert campos['data_atendimento'] == '20251210' and campos['idade'] == '045'
+    assert campos['nome_paciente'] == record['prd_nmpac'][:30].rstrip()
+    assert campos['cid'] == 'F102'
+
+    tipo, campos = decodificar_linha(generator.generate_set_header(1234, 62, '0042'))
+    assert (tipo, campos['total_registros'], campos['total_bpas'], campos['campo_controle']) == \
+        ('01', '001234', '000062', '0042')
+
+    with pytest.raises(ValueError):
+        BPAC.decodificar(generator.generate_set_bpac_line(record, 1, 1)[:-3] + 'XXX')
+    with pytest.raises(ValueError):
+        HEADER.decodificar('01#BPA#')
+
+
+def test_none_numeric_fields_are_zero_filled():
+    # A concatenação antiga gravava "None" (str(None).zfill) nesses campos
+    linha = BPAFileGenerator(CONFIG).generate_set_bpac_line({'prd_idade': None, 'prd_qt_p': None}, 1, 1)
+    campos = BPAC.decodificar(linha)
+    assert campos['idade'] == '000' and campos['quantidade'] == '000000'
+
+
+def test_benchmark_100k_bpai_lines():
+    records = _records(1000) * 100
+    generator = BPAFileGenerator(CONFIG)
+    legacy = LegacyLines(CONFIG)
+
+    inicio = time.perf_counter()
+    antes = [legacy.bpai(r, 1, 1) for r in records]
+    tempo_antes = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    depois = [generator.generate_set_bpai_line(r, 1, 1) for r in records]
+    tempo_depois = time.perf_counter() - inicio
+
+    print(f"\n[BENCH] BPA-I 100k linhas: concatenação {len(records) / tempo_antes:,.0f} linhas/s, "
+          f"layout compilado {len(records) / tempo_depois:,.0f} linhas/s "
+          f"({tempo_antes / tempo_depois:.1f}x)")
+    assert depois == antes
@@ -0,0 +1,87 @@
+import json
+from contextlib import contextmanager
+from datetime import datetime
+from decimal import Decimal
+from unittest.mock import MagicMock
+
+import pytest
+
+import database
+from database import BPADatabase
+from services.bpa_paginacao import (
+    CursorInvalido, decode_cursor, encode_cursor, linhas_ndjson, ndjson_bpa, pagina_bpa
+)
+
+FILTROS = {'tabela': 'bpa_individualizado', 'cnes': '2755289', 'competencia': '202512', 'exportado': None}
+
+
+def test_cursor_round_trip_and_filter_mismatch():
+    cursor = encode_cursor(1234, FILTROS)
+
+    assert decode_cursor(cursor, FILTROS) == 1234
+    assert decode_cursor(None, FILTROS) is None
+    with pytest.raises(CursorInvalido):
+        decode_cursor(cursor, {**FILTROS, 'competencia': '202511'})
+    with pytest.raises(CursorInvalido):
+        decode_cursor('nao-e-um-cursor', FILTROS)
+
+
+def test_pagina_bpa_fetches_one_extra_row_for_next_cursor():
+    fake_db = MagicMock()
+    fake_db.list_bpa_individualizado.return_value = [{'id': 10}, {'id': 11}, {'id': 12}]
+
+    pagina = pagina_bpa(fake_db, 'bpa_individualizado', '2755289', '202512', limit=2)
+
+    assert pagina['data'] == [{'id': 10}, {'id': 11}]
+    assert fake_db.list_bpa_individualizado.call_args.kwargs == {'limit': 3, 'after_id': None}
+
+    fake_db.list_bpa_individualizado.return_value = [{'id': 12}]
+    ultima = pagina_bpa(fake_db, 'bpa_individualizado', '2755289', '202512',
+                        limit=2, cursor=pagina['next_cursor'])
+
+    assert fake_db.list_bpa_individualizado.call_args.kwargs == {'limit': 3, 'after_id': 11}
+    assert ultima == {'data': [{'id': 12}], 'next_cursor': None, 'limit': 2}
+
+
+def test_list_bpa_uses_keyset_instead_of_offset(monkeypatch):
+    conn = MagicMock()
+    cursor = conn.cursor.return_value.__enter__.return_value
+    cursor.fetchall.return_value = []
+
+    @contextmanager
+    def fake_connection():
+        yield conn
+
+    monkeypatch.setattr(database, 'get_connection', fake_connection)
+    db = object.__new__(BPADatabase)
+    db.list_bpa_consolidado('2755289', '202512', limit=501, after_id=9000)
+
+    sql, params = cursor.execute.call_args[0]
+    assert sql == ('SELECT * FROM bpa_consolidado WHERE prd_uid = %s AND prd_cmp = %s '
+                   'AND id > %s ORDER BY id LIMIT %s OFFSET %s')
+    assert params == ['2755289', '202512', 9000, 501, 0]
+
+
+def test_ndjson_streams_one_record_per_line():
+    blocos = [
+        [{'id': 1, 'prd_dtaten': datetime(2025, 12, 1, 8, 30), 'valor': Decimal('10.50')}],
+        [{'id': 2, 'prd_nmpac': 'JOÃO'}, {'id': 3, 'prd_nmpac': None}],
+    ]
+
+    partes = list(linhas_ndjson(iter(blocos)))
+
+    assert len(partes) == 2
+    linhas = b''.join(partes).decode('utf-8').splitlines()
+    assert [json.loads(linha) for linha in linhas] == [
+        {'id': 1, 'prd_dtaten': '2025-12-01T08:30:00', 'valor': 10.5},
+        {'id': 2, 'prd_nmpac': 'JOÃO'},
+        {'id': 3, 'prd_nmpac': None},
+    ]
+
+
+def test_ndjson_rejects_bad_cursor_before_streaming():
+    fake_db = MagicMock()
+
+    with pytest.raises(CursorInvalido):
+        ndjson_bpa(fake_db, 'bpa_consolidado', '2755289', '202512', cursor=encode_cursor(5, FILTROS))
+    fake_db.iter_bpa_lista.assert_not_called()
@@ -0,0 +1,89 @@
+import random
+
+from services.bpa_report_generator import BPAExportConfig, BPAFileGenerator, calcular_campo_controle
+
+CNES = '2755289'
+COMPETENCIA = '202512'
+
+
+def _bpai(id_, rnd):
+    return {
+        'id': id_, 'prd_uid': CNES, 'prd_cmp': COMPETENCIA,
+        'prd_cnsmed': rnd.choice(['700000000000002', '700000000000003', '700000000000004']),
+        'prd_cbo': rnd.choice(['225125', '322205']), 'prd_pa': '0301010072',
+        'prd_cnspac': f'7{id_:014d}', 'prd_nmpac': f'PACIENTE {id_}', 'prd_dtnasc': '19800101',
+        'prd_dtaten': f'202512{rnd.randint(1, 28):02d}', 'prd_sexo': 'M', 'prd_raca': '01',
+        'prd_ibge': '172100', 'prd_qt_p': 1, 'prd_cid': '', 'prd_caten': '01',
+    }
+
+
+def _bpac(id_, rnd):
+    return {
+        'id': id_, 'prd_uid': CNES, 'prd_cmp': COMPETENCIA, 'prd_cbo': rnd.choice(['225125', '322205']),
+        'prd_pa': '0301010048', 'prd_idade': str(rnd.randint(1, 90)).zfill(3), 'prd_qt_p': rnd.randint(1, 9),
+    }
+
+
+class FakeDatabase:
+    """iter_bpa_for_report/get_bpa_stats sobre listas, com as ordenações do SQL"""
+
+    ORDENS = {
+        'id': lambda r: r['id'],
+        'profissional': lambda r: (r['prd_cnsmed'], r['prd_cbo'], r['prd_dtaten'], r['id']),
+        'cbo': lambda r: (r['prd_cbo'], r['id']),
+    }
+
+    def __init__(self, bpai, bpac):
+        self.tabelas = {'bpa_individualizado': bpai, 'bpa_consolidado': bpac}
+
+    def get_bpa_stats(self, cnes, competencia):
+        return {'bpai_total': len(self.tabelas['bpa_individualizado']),
+                'bpac_total': len(self.tabelas['bpa_consolidado'])}
+
+    def iter_bpa_for_report(self, tabela, cnes, competencia, ordem='id', chunk_size=1000):
+        rows = sorted(self.tabelas[tabela], key=self.ORDENS[ordem])
+        for start in range(0, len(rows), chunk_size):
+            yield rows[start:start + chunk_size]
+
+
+def test_streamed_reports_cover_more_than_10k_records(tmp_path):
+    rnd = random.Random(14)
+    bpai = [_bpai(i, rnd) for i in range(1, 12346)]
+    bpac = [_bpac(i, rnd) for i in range(1, 10052)]
+    generator = BPAFileGenerator(BPAExportConfig(cnes=CNES, competencia=COMPETENCIA, sigla='CAPSAD'))
+
+    resultado = generator.write_reports(FakeDatabase(bpai, bpac), str(tmp_path), 'DEZ')
+
+    # 12345 BPA-I (618 folhas de 20) + 10051 BPA-C (503 folhas)
+    assert resultado['total_registros'] == 22396
+    assert resultado['total_bpas'] == 618 + 503
+    assert resultado['campo_controle'] == calcular_campo_controle(22396, 1121)
+    assert resultado['files'] == ['PACAPSAD.DEZ', 'RELEXP.PRN', 'BPAI_REL.TXT', 'BPAC_REL.TXT']
+
+    with open(tmp_path / 'PACAPSAD.DEZ', encoding='latin-1') as f:
+        remessa = f.read()
+    esperado, _, _ = generator.generate_set_file(bpai, bpac)
+    assert remessa == esperado
+    linhas = remessa.split('\n')
+    assert len(linhas) == 1 + 22396
+    assert linhas[0][13:29] == f'{22396:06d}{1121:06d}{resultado["campo_controle"]}'
+
+    with open(tmp_path / 'BPAI_REL.TXT', encoding='latin-1') as f:
+        # Entre CBOs do mesmo profissional a ordem é a do CBO (ORDER BY do banco)
+        assert f.read() == generator.generate_bpai_report(
+            sorted(bpai, key=lambda r: (r['prd_cnsmed'], r['prd_cbo'], r['id']))
+        )
+    with open(tmp_path / 'RELEXP.PRN', encoding='latin-1') as f:
+        assert f' REGISTROS GRAVADOS : 022396' in f.read()
+
+
+def test_streamed_bpac_report_matches_in_memory_when_grouped(tmp_path):
+    rnd = random.Random(3)
+    # Agrupado por CBO na ordem do id: mesma ordem de generate_bpac_report
+    bpac = sorted((_bpac(i, rnd) for i in range(1, 200)), key=lambda r: (r['prd_cbo'], r['id']))
+    generator = BPAFileGenerator(BPAExportConfig(cnes=CNES, competencia=COMPETENCIA))
+
+    generator.write_reports(FakeDatabase([], bpac), str(tmp_path), 'DEZ', tipo='bpac')
+
+    with open(tmp_path / 'BPAC_REL.TXT', encoding='latin-1') as f:
+        assert f.read() == generator.generate_bpac_report(bpac)
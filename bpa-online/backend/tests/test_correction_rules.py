@@ -0,0 +1,263 @@
+import random
+
+import pytest
+
+from services.correction_rules import get_compiled_corrections, process_records
+from services.corrections import BPACorrections, CorrectionResult
+
+PACIENTES = {
+    ('MARIA DA SILVA', '19800101'): {'cns': '700000000000001', 'cpf': None},
+    ('JOAO SEM CNS', '19750505'): {'cns': None, 'cpf': '12345678901'},
+}
+
+
+class LegacyCorrections:
+    """
+    apply_corrections anterior às regras compiladas (passos 1 a 16 em sequência),
+    referência das regras; as tabelas são as de BPACorrections
+    """
+
+    def __init__(self, cnes):
+        self.c = BPACorrections(cnes)
+
+    def apply(self, record, tipo, pacientes):
+        c = self.c
+        corrections = []
+        corrected = record.copy()
+
+        def resultado(delete_reason=None):
+            return CorrectionResult(record, corrected, corrections, delete_reason is not None, delete_reason)
+
+        def definir(campo, prd, valor):
+            corrected[campo] = valor
+            if prd in corrected:
+                corrected[prd] = valor
+
+        procedimento = record.get('procedimento') or record.get('prd_pa') or ''
+        if procedimento in c.PROCEDIMENTOS_EXCLUIR:
+            return resultado(f"Procedimento {procedimento} não pertence ao BPA")
+        if not procedimento or procedimento.strip() == '':
+            return resultado("Procedimento vazio ou nulo")
+
+        if tipo == 'BPI':
+            cns = record.get('cns_paciente') or record.get('prd_cnspac') or ''
+            cpf = record.get('cpf_paciente') or record.get('prd_cpf_pcnte') or ''
+            cns, cpf = str(cns), str(cpf)
+            cns_valido = bool(cns and cns.strip() != '')
+            cpf_valido = bool(cpf and cpf.strip() != '' and len(cpf.strip()) >= 11)
+            if not cns_valido and not cpf_valido:
+                nome = record.get('nome_paciente') or record.get('prd_nmpac') or ''
+                data_nasc = record.get('data_nascimento') or record.get('prd_dtnasc') or ''
+                paciente = pacientes.get((nome, data_nasc)) if nome and data_nasc else None
+                if paciente and paciente.get('cns'):
+                    cns, cns_valido = paciente['cns'], True
+                    definir('cns_paciente', 'prd_cnspac', cns)
+                    corrections.append(f"CNS recuperado do cadastro: {cns}")
+                elif paciente and paciente.get('cpf'):
+                    cpf, cpf_valido = paciente['cpf'], True
+                    corrections.append(f"CPF recuperado do cadastro: {cpf}")
+            if not cns_valido and not cpf_valido:
+                return resultado("CNS/CPF do paciente vazio (obrigatório para BPI)")
+            if not cns_valido:
+                definir('cns_paciente', 'prd_cnspac', cpf.strip())
+                corrections.append(f"Usando CPF como identificador: {cpf.strip()}")
+
+        if procedimento in c.PROCEDIMENTOS_REVOGADOS:
+            novo = c.PROCEDIMENTOS_REVOGADOS[procedimento]
+            definir('procedimento', 'prd_pa', novo)
+            corrections.append(f"Procedimento revogado: {procedimento} → {novo}")
+
+        raca = str(record.get('raca_cor') or record.get('prd_raca') or '01')
+        if raca in ('05', '06'):
+            definir('raca_cor', 'prd_raca', '03')
+            corrections.append(f"Raça/Cor corrigida: {raca} → 03")
+
+        if tipo == 'BPI' and c.is_upa:
+            if (record.get('carater_atendimento') or record.get('prd_caten') or '01') == '01':
+                definir('carater_atendimento', 'prd_caten', '02')
+                corrections.append("Caráter de atendimento UPA: 01 → 02")
+
+        atual = corrected.get('procedimento') or corrected.get('prd_pa') or ''
+        if atual in c.CORRECOES_CID:
+            cid_correto = c.CORRECOES_CID[atual]
+            cid = record.get('cid') or record.get('prd_cid') or ''
+            if cid != cid_correto:
+                definir('cid', 'prd_cid', cid_correto)
+                corrections.append(f"CID corrigido para PA {atual}: {cid} → {cid_correto}")
+
+        if atual in c.LIMITES_QUANTIDADE:
+            limite = c.LIMITES_QUANTIDADE[atual]
+            qtd = int(record.get('quantidade') or record.get('prd_qt_p') or 1)
+            if qtd > limite:
+                definir('quantidade', 'prd_qt_p', limite)
+                corrections.append(f"Quantidade limitada: {qtd} → {limite} (PA {atual})")
+
+        if tipo == 'BPI':
+            cep = str(record.get('cep') or record.get('prd_cep_pcnte') or '')
+            if not cep or cep.strip() == '' or cep in c.CEPS_INVALIDOS:
+                definir('cep', 'prd_cep_pcnte', c.CEP_PADRAO)
+                corrections.append(f"CEP inválido corrigido: {cep} → {c.CEP_PADRAO}" if cep
+                                   else f"CEP vazio preenchido: {c.CEP_PADRAO}")
+
+        ibge = record.get('municipio_ibge') or record.get('prd_ibge') or ''
+        if not ibge or ibge.strip() == '':
+            definir('municipio_ibge', 'prd_ibge', c.IBGE_PADRAO)
+            corrections.append(f"IBGE vazio preenchido: {c.IBGE_PADRAO}")
+
+        if tipo == 'BPI':
+            logradouro = record.get('logradouro_codigo') or record.get('prd_lograd_pcnte') or ''
+            if not logradouro or logradouro.strip() == '':
+                definir('logradouro_codigo', 'prd_lograd_pcnte', c.LOGRADOURO_PADRAO)
+                corrections.append(f"Logradouro vazio preenchido: {c.LOGRADOURO_PADRAO}")
+            for campo, prd, rotulo in (('endereco', 'prd_end_pcnte', 'Endereço'),
+                                       ('bairro', 'prd_bairro_pcnte', 'Bairro')):
+                valor = record.get(campo) or record.get(prd) or ''
+                if not valor or valor.strip() == '':
+                    definir(campo, prd, 'NAO LOCALIZADO')
+                    corrections.append(f"{rotulo} vazio preenchido: NAO LOCALIZADO")
+            numero = str(record.get('numero') or record.get('prd_num_pcnte') or '')
+            if numero.upper() in {'', '00', '000', '0000', '00000', 'S/N', 'cs02', 'SN'}:
+                definir('numero', 'prd_num_pcnte', '01')
+                corrections.append(f"Número inválido corrigido: '{numero}' → 01")
+
+        if atual in c.SERVICO_CLASSIFICACAO:
+            servico, classificacao = c.SERVICO_CLASSIFICACAO[atual]
+            if servico:
+                definir('servico', 'prd_servico', servico)
+                corrections.append(f"Serviço definido: {servico}")
+            if classificacao:
+                definir('classificacao', 'prd_classificacao', classificacao)
+                corrections.append(f"Classificação definida: {classificacao}")
+
+        if tipo == 'BPI':
+            sexo = str(record.get('sexo') or record.get('prd_sexo') or '')
+            novo = {'0': 'M', '1': 'F'}.get(sexo, sexo if sexo in ('M', 'F') else 'M')
+            if novo != sexo:
+                definir('sexo', 'prd_sexo', novo)
+                corrections.append(f"Sexo corrigido: {sexo} → {novo}")
+
+        return resultado()
+
+
+def _records(n, seed):
+    rnd = random.Random(seed)
+    procedimentos = (
+        ['0301010072', '0301010048', '0214010015', ''] +
+        list(BPACorrections.PROCEDIMENTOS_REVOGADOS) +
+        list(BPACorrections.CORRECOES_CID)[:5] +
+        list(BPACorrections.LIMITES_QUANTIDADE)[:4] +
+        list(BPACorrections.SERVICO_CLASSIFICACAO) +
+        ['0101010001']
+    )
+    pessoas = [('MARIA DA SILVA', '19800101'), ('JOAO SEM CNS', '19750505'), ('SEM CADASTRO', '19700101')]
+    records = []
+    for i in range(n):
+        nome, nasc = rnd.choice(pessoas)
+        campos = {
+            'procedimento': rnd.choice(procedimentos),
+            'cns_paciente': rnd.choice(['', '', '123456789012345']),
+            'cpf_paciente': rnd.choice(['', '123', '98765432100']),
+            'nome_paciente': nome,
+            'data_nascimento': nasc,
+            'raca_cor': rnd.choice(['01', '05', '06', None]),
+            'carater_atendimento': rnd.choice(['01', '02', None]),
+            'cid': rnd.choice(['', 'N318', 'Z000']),
+            'quantidade': rnd.choice([1, 5, 30, '2', None]),
+            'cep': rnd.choice(['', '  ', '77001324', '77024899', '77100000']),
+            'municipio_ibge': rnd.choice(['', '172100', ' ']),
+            'logradouro_codigo': rnd.choice(['', '081']),
+            'endereco': rnd.choice(['', 'RUA 1']),
+            'bairro': rnd.choice(['', 'CENTRO']),
+            'numero': rnd.choice(['', 's/n', 'SN', '000', '12', 'cs02']),
+            'sexo': rnd.choice(['0', '1', 'M', 'F', 'X', '']),
+        }
+        if rnd.random() < 0.5:
+            # Formato do banco: colunas prd_* (e às vezes as duas formas)
+            prd = {
+                'prd_pa': campos.pop('procedimento'), 'prd_cnspac': campos.pop('cns_paciente'),
+                'prd_cpf_pcnte': campos.pop('cpf_paciente'), 'prd_nmpac': campos.pop('nome_paciente'),
+                'prd_dtnasc': campos.pop('data_nascimento'), 'prd_raca': campos.pop('raca_cor'),
+                'prd_caten': campos.pop('carater_atendimento'), 'prd_cid': campos.pop('cid'),
+                'prd_qt_p': campos.pop('quantidade'), 'prd_cep_pcnte': campos.pop('cep'),
+                'prd_ibge': campos.pop('municipio_ibge'), 'prd_lograd_pcnte': campos.pop('logradouro_codigo'),
+                'prd_end_pcnte': campos.pop('endereco'), 'prd_bairro_pcnte': campos.pop('bairro'),
+                'prd_num_pcnte': campos.pop('numero'), 'prd_sexo': campos.pop('sexo'),
+                'prd_servico': '', 'prd_classificacao': '',
+            }
+            campos.update(prd)
+        campos['id'] = i
+        records.append(campos)
+    return records
+
+
+def _reference_batch(cnes, records, tipo, pacientes):
+    """process_batch de referência: LegacyCorrections registro a registro"""
+    legacy = LegacyCorrections(cnes)
+    corrected_records = []
+    stats = BPACorrections.empty_stats()
+    stats['total_input'] = len(records)
+    for record in records:
+        result = legacy.apply(record, tipo, pacientes)
+        if result.should_delete:
+            stats['deleted'] += 1
+            reason = result.delete_reason or 'Desconhecido'
+            stats['delete_reasons'][reason] = stats['delete_reasons'].get(reason, 0) + 1
+        else:
+            corrected_records.append(result.corrected)
+            if result.corrections_applied:
+                stats['corrected'] += 1
+                for correction in result.corrections_applied:
+                    correction_type = correction.split(':')[0] if ':' in correction else correction
+                    stats['correction_types'][correction_type] = stats['correction_types'].get(correction_type, 0) + 1
+            else:
+                stats['unchanged'] += 1
+    stats['total_output'] = len(corrected_records)
+    return corrected_records, stats
+
+
+@pytest.mark.parametrize('cnes', ['2492555', '2755289', None])
+@pytest.mark.parametrize('tipo', ['BPI', 'BPA'])
+def test_apply_corrections_matches_legacy_rules(cnes, tipo):
+    corrections = BPACorrections(cnes)
+    legacy = LegacyCorrections(cnes)
+
+    for record in _records(2000, seed=hash((cnes, tipo)) & 0xffff):
+        assert corrections.apply_corrections(record, tipo, pacientes=PACIENTES) == legacy.apply(record, tipo, PACIENTES)
+
+
+@pytest.mark.parametrize('cnes', ['2492555', '2755289', None])
+@pytest.mark.parametrize('tipo', ['BPI', 'BPA'])
+def test_apply_corrections_uses_compiled_rules(cnes, tipo, monkeypatch):
+    compiled = get_compiled_corrections(cnes, tipo)
+    chamadas = []
+    original = compiled.apply
+    monkeypatch.setattr(compiled, 'apply', lambda record, pacientes=None: chamadas.append(record) or
+                        original(record, pacientes))
+    record = _records(1, seed=3)[0]
+
+    result = BPACorrections(cnes).apply_corrections(record, tipo, pacientes=PACIENTES)
+
+    assert chamadas == [record]
+    assert result == original(record, PACIENTES)
+
+
+@pytest.mark.parametrize('tipo', ['BPI', 'BPA'])
+def test_stats_only_batch_matches_reference(tipo):
+    records = _records(3000, seed=5)
+
+    esperado = _reference_batch('2492555', records, tipo, PACIENTES)
+    obtido = process_records('2492555', tipo, records, PACIENTES, parallel_threshold=0)
+
+    assert obtido == esperado
+    assert esperado[1]['deleted'] and esperado[1]['corrected']
+
+
+def test_parallel_chunks_match_serial():
+    records = _records(1000, seed=9)
+
+    serial = process_records('2755289', 'BPI', records, PACIENTES, parallel_threshold=0)
+    paralelo = process_records(
+        '2755289', 'BPI', records, PACIENTES, parallel_threshold=100, chunk_size=300, workers=2
+    )
+
+    assert paralelo == serial
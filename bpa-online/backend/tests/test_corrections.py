@@ -341,6 +341,64 @@ def test_gerador_id():
     print("✅ Gerador de IDs (GEN_S_PRD_ID): OK")
 
 
+def test_merge_stats_por_pagina():
+    """Testa soma de estatísticas por página (pipeline em streaming)"""
+    corrections = BPACorrections('2755289')
+    records = [
+        {'procedimento': '0301010064', 'cns_paciente': '123456789012345', 'sexo': '1'},
+        {'procedimento': '0101010001', 'cns_paciente': '123456789012345'},
+        {'procedimento': '0301010072', 'cns_paciente': '', 'cep': '77001324'},
+        {'procedimento': '0301010072', 'cns_paciente': '123456789012345', 'raca_cor': '05'},
+    ]
+    
+    _, stats_lote = corrections.process_batch(records, 'BPI')
+    
+    total = BPACorrections.empty_stats()
+    for start in range(0, len(records), 3):
+        _, stats_pagina = corrections.process_batch(records[start:start + 3], 'BPI')
+        BPACorrections.merge_stats(total, stats_pagina)
+    
+    assert total == stats_lote
+    print("✅ Estatísticas por página: OK")
+
+
+def test_recuperacao_paciente_em_lote(monkeypatch):
+    """Testa pré-passo do lote: uma consulta ao cadastro para todos os pacientes sem CNS/CPF"""
+    import database
+
+    consultas = []
+
+    class FakeDatabase:
+        def get_pacientes_by_nome_nascimento(self, pares):
+            consultas.append(set(pares))
+            return {('MARIA DA SILVA', '19800101'): {'cns': '700000000000001', 'cpf': None}}
+
+        def get_paciente_by_nome_nascimento(self, nome, data_nascimento):
+            raise AssertionError("busca individual dentro do lote")
+
+    monkeypatch.setattr(database, 'BPADatabase', FakeDatabase)
+
+    corrections = BPACorrections('2755289')
+    records = [
+        {'procedimento': '0301010072', 'cns_paciente': '', 'nome_paciente': 'MARIA DA SILVA',
+         'data_nascimento': '19800101', 'prd_cnspac': ''},
+        {'procedimento': '0301010072', 'cns_paciente': '', 'nome_paciente': 'MARIA DA SILVA',
+         'data_nascimento': '19800101'},
+        {'procedimento': '0301010072', 'cns_paciente': '', 'nome_paciente': 'JOSE SEM CADASTRO',
+         'data_nascimento': '19700101'},
+        {'procedimento': '0301010072', 'cns_paciente': '123456789012345', 'nome_paciente': 'COM CNS',
+         'data_nascimento': '19900101'},
+    ]
+
+    corrected, stats = corrections.process_batch(records, 'BPI')
+
+    assert consultas == [{('MARIA DA SILVA', '19800101'), ('JOSE SEM CADASTRO', '19700101')}]
+    assert stats['deleted'] == 1
+    assert [r['cns_paciente'] for r in corrected] == ['700000000000001', '700000000000001', '123456789012345']
+    assert corrected[0]['prd_cnspac'] == '700000000000001'
+    print("✅ Recuperação de pacientes em lote: OK")
+
+
 if __name__ == '__main__':
     print("=" * 50)
     print("TESTES DO SERVIÇO DE CORREÇÕES BPA")
@@ -364,6 +422,7 @@ if __name__ == '__main__':
     test_sequenciamento_bpi()
     test_sequenciamento_bpa()
     test_gerador_id()
+    test_merge_stats_por_pagina()
     
     print()
     print("=" * 50)
@@ -0,0 +1,229 @@
+from contextlib import contextmanager
+from unittest.mock import MagicMock
+
+import pytest
+
+import database
+from database import BPADatabase, BPAI_COLUMNS, _bpai_params, _copy_rows, _copy_value
+
+
+class TestCopyHelpers:
+    def test_copy_value_escapes_and_nulls(self):
+        assert _copy_value(None) == '\\N'
+        assert _copy_value(True) == 't'
+        assert _copy_value(12) == '12'
+        assert _copy_value('') == ''
+        assert _copy_value('RUA A\tB\nC\\D') == 'RUA A\\tB\\nC\\\\D'
+
+    def test_copy_rows_sends_one_line_per_row(self):
+        cursor = MagicMock()
+        _copy_rows(cursor, '_bpai_staging', ('ord', 'prd_pa'), [(0, '0301010072'), (1, None)])
+
+        sql, buffer = cursor.copy_expert.call_args[0]
+        assert sql == 'COPY _bpai_staging (ord, prd_pa) FROM STDIN'
+        assert buffer.read() == '0\t0301010072\n1\t\\N\n'
+
+    def test_bpai_params_defaults(self):
+        params = _bpai_params({'prd_uid': '2755289', 'prd_cmp': '202512'})
+
+        assert set(params) == set(BPAI_COLUMNS)
+        assert params['prd_raca'] == '99'
+        assert params['prd_org'] == 'BPI'
+        assert params['prd_mvm'] == '202512'
+
+
+class TestBpaiBulkStreaming:
+    def test_generator_is_copied_in_chunks_without_ids(self, monkeypatch):
+        conn = MagicMock()
+        cursor = conn.cursor.return_value.__enter__.return_value
+        cursor.rowcount = 2
+        copied = []
+
+        @contextmanager
+        def fake_connection():
+            yield conn
+
+        monkeypatch.setattr(database, 'get_connection', fake_connection)
+        monkeypatch.setattr(
+            database, '_copy_rows',
+            lambda cur, table, columns, rows: copied.append([row[0] for row in rows])
+        )
+
+        def records():
+            for i in range(5):
+                yield {'prd_uid': '2755289', 'prd_cmp': '202512', 'prd_pa': '0301010072', 'prd_seq': i + 1}
+
+        db = object.__new__(BPADatabase)
+        result = db.save_bpa_individualizado_bulk(records(), chunk_size=2, return_ids=False)
+
+        assert copied == [[0, 1], [2, 3], [4]]
+        assert result['success'] and result['saved'] == 6 and result['failed'] == 0 and result['ids'] == []
+        insert_sql = [c[0][0] for c in cursor.execute.call_args_list if 'INSERT INTO bpa_individualizado' in c[0][0]][0]
+        assert 'RETURNING' not in insert_sql
+        # Um commit por bloco
+        assert conn.commit.call_count == 3
+
+    def test_failed_chunk_is_saved_row_by_row(self, monkeypatch):
+        conn = MagicMock()
+        cursor = conn.cursor.return_value.__enter__.return_value
+        cursor.rowcount = 1
+        copied = []
+
+        @contextmanager
+        def fake_connection():
+            yield conn
+
+        def fake_copy(cur, table, columns, rows):
+            copied.append([row[0] for row in rows])
+            if any(row[columns.index('prd_pa')] == 'INVALIDO' for row in rows):
+                raise ValueError('invalid input syntax')
+
+        monkeypatch.setattr(database, 'get_connection', fake_connection)
+        monkeypatch.setattr(database, '_copy_rows', fake_copy)
+
+        records = [{'prd_uid': '2755289', 'prd_cmp': '202512', 'prd_pa': pa}
+                   for pa in ('0301010072', 'INVALIDO', '0301010056', '0301010064')]
+
+        db = object.__new__(BPADatabase)
+        result = db.save_bpa_individualizado_bulk(records, chunk_size=3, return_ids=False)
+
+        assert copied == [[0, 1, 2], [0], [1], [2], [3]]
+        assert not result['success']
+        assert result['saved'] == 3 and result['failed'] == 1
+        assert result['errors'] == ['registro 1: invalid input syntax']
+
+    def test_generator_error_keeps_committed_chunks(self, monkeypatch):
+        conn = MagicMock()
+
+        @contextmanager
+        def fake_connection():
+            yield conn
+
+        monkeypatch.setattr(database, 'get_connection', fake_connection)
+        monkeypatch.setattr(database, '_copy_rows', lambda *args: None)
+
+        def records():
+            yield {'prd_uid': '2755289', 'prd_cmp': '202512'}
+            raise RuntimeError('falha na extração')
+
+        db = object.__new__(BPADatabase)
+        with pytest.raises(RuntimeError):
+            db.save_bpa_individualizado_bulk(records(), chunk_size=1)
+
+        conn.commit.assert_called_once()
+        conn.rollback.assert_not_called()
+
+    def test_bad_row_does_not_lose_the_chunk_in_postgres(self, postgres):
+        base = {'prd_uid': '2755289', 'prd_cmp': '202512', 'prd_pa': '0301010072',
+                'prd_cnspac': '898000000000001', 'prd_nmpac': 'PACIENTE'}
+        records = [dict(base, prd_seq=1), dict(base, prd_seq=2, prd_qt_p='x'), dict(base, prd_seq=3)]
+
+        db = object.__new__(BPADatabase)
+        result = db.save_bpa_individualizado_bulk(records, chunk_size=10)
+
+        assert result['saved'] == 2 and result['failed'] == 1 and len(result['ids']) == 2
+        with postgres() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT prd_seq FROM bpa_individualizado ORDER BY id')
+                assert [row[0] for row in cursor.fetchall()] == [1, 3]
+
+
+    def test_ids_follow_input_order_in_postgres(self, postgres):
+        base = {'prd_uid': '2755289', 'prd_cmp': '202512', 'prd_pa': '0301010072'}
+        seqs = [7, 3, 9, 1, 5, 8, 2]
+        records = [dict(base, prd_seq=seq) for seq in seqs]
+
+        db = object.__new__(BPADatabase)
+        result = db.save_bpa_individualizado_bulk(records, chunk_size=4)
+
+        assert result['saved'] == len(seqs)
+        with postgres() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT id, prd_seq FROM bpa_individualizado WHERE id = ANY(%s)', (result['ids'],))
+                seq_by_id = dict(cursor.fetchall())
+        assert [seq_by_id[i] for i in result['ids']] == seqs
+
+
+class TestBpacBatchUpsert:
+    def test_batch_aggregates_and_counts_inserted_updated(self, monkeypatch):
+        conn = MagicMock()
+        captured = {}
+
+        @contextmanager
+        def fake_connection():
+            yield conn
+
+        def fake_execute_values(cursor, sql, rows, page_size=None, fetch=False):
+            captured['sql'] = sql
+            captured['rows'] = rows
+            captured['page_size'] = page_size
+            return [(True,), (False,)]
+
+        monkeypatch.setattr(database, 'get_connection', fake_connection)
+        monkeypatch.setattr(database, 'execute_values', fake_execute_values)
+
+        base = {'prd_uid': '2755289', 'prd_cmp': '202512', 'prd_cbo': '225125', 'prd_idade': '030'}
+        records = [
+            {**base, 'prd_pa': '0301060029', 'prd_qt_p': 2},
+            {**base, 'prd_pa': '0301060029', 'prd_qt_p': 3},
+            {**base, 'prd_pa': '0301100039', 'prd_qt_p': 1, 'prd_idade': None},
+        ]
+
+        db = object.__new__(BPADatabase)  # sem __init__: não conecta ao banco
+        result = db.save_bpa_consolidado_batch(records)
+
+        assert result == {'success': True, 'saved': 2, 'inserted': 1, 'updated': 1, 'errors': []}
+        assert 'ON CONFLICT' in captured['sql']
+        assert captured['page_size'] == 2
+        quantidades = {(row[5], row[7]): row[6] for row in captured['rows']}
+        assert quantidades == {('0301060029', '030'): 5, ('0301100039', '000'): 1}
+        conn.commit.assert_called_once()
+
+    def test_single_and_batch_share_the_pending_row_in_postgres(self, postgres):
+        record = {'prd_uid': '2755289', 'prd_cmp': '202512', 'prd_pa': '0301100039',
+                  'prd_cbo': None, 'prd_idade': None, 'prd_qt_p': 2}
+
+        db = object.__new__(BPADatabase)
+        first = db.save_bpa_consolidado(record)
+        second = db.save_bpa_consolidado(record)
+        batch = db.save_bpa_consolidado_batch([record])
+
+        assert first == second
+        assert batch == {'success': True, 'saved': 1, 'inserted': 0, 'updated': 1, 'errors': []}
+        with postgres() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT prd_cbo, prd_idade, prd_qt_p FROM bpa_consolidado')
+                assert cursor.fetchall() == [('', '000', 6)]
+
+        novo = db.save_bpa_consolidado_batch([dict(record, prd_pa='0301060029')])
+        assert novo == {'success': True, 'saved': 1, 'inserted': 1, 'updated': 0, 'errors': []}
+
+
+class TestPacientesEmLote:
+    def test_single_query_maps_back_to_input_pairs(self, monkeypatch):
+        conn = MagicMock()
+        cursor = conn.cursor.return_value.__enter__.return_value
+        cursor.fetchall.return_value = [
+            {'id': 3, 'cns': '700000000000001', 'nome': 'Maria  da Silva',
+             'data_nascimento': '19800101', '_nome_busca': 'MARIA DA SILVA'},
+        ]
+
+        @contextmanager
+        def fake_connection():
+            yield conn
+
+        monkeypatch.setattr(database, 'get_connection', fake_connection)
+
+        db = object.__new__(BPADatabase)
+        result = db.get_pacientes_by_nome_nascimento([
+            ('maria da silva', '19800101'),
+            ('MARIA  DA SILVA ', '19800101'),
+            ('JOSE', '19700101'),
+            ('', '19700101'),
+        ])
+
+        assert cursor.execute.call_count == 1
+        nomes, datas = cursor.execute.call_args[0][1]
+        assert sorted(zip(nomes, datas)) == [('JOSE', '19700101'), ('MARIA DA SILVA', '19800101')]
+        assert set(result) == {('maria da silva', '19800101'), ('MARIA  DA SILVA ', '19800101')}
+        assert '_nome_busca' not in result[('maria da silva', '19800101')]
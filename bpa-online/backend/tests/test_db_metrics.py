@@ -0,0 +1,155 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+import database
+from database import _CursorMedido, _cursor_medido
+from services import db_metrics
+from services.db_metrics import (
+    POOL_WAIT, QUERY_ROWS, QUERY_SECONDS, Histogram, consultas_lentas, instrumentar_metodos
+)
+
+
+class FakeCursor:
+    rowcount = 3
+
+    def __init__(self):
+        self.executados = []
+
+    def execute(self, query, vars=None):
+        self.executados.append((query, vars))
+
+
+class FakeRepositorio:
+    def __init__(self):
+        self.cursor = _cursor_medido(FakeCursor)()
+
+    def contar(self, cnes):
+        self.cursor.execute('SELECT COUNT(*) FROM bpa_individualizado WHERE prd_uid = %s', (cnes,))
+        return 3
+
+    def blocos(self):
+        for _ in range(2):
+            self.cursor.execute('SELECT * FROM bpa_consolidado')
+            yield [{'id': 1}]
+
+
+instrumentar_metodos(FakeRepositorio)
+
+
+def _total(histograma, *rotulos):
+    serie = histograma.series().get(rotulos)
+    return serie['total'] if serie else 0
+
+
+def test_histogram_prometheus_exposition():
+    histograma = Histogram('bpa_teste_seconds', 'Teste', ('metodo',), buckets=(0.1, 1.0))
+    histograma.observe(0.05, 'get_bpa_stats')
+    histograma.observe(0.5, 'get_bpa_stats')
+    histograma.observe(5, 'get_bpa_stats')
+    histograma.observe(0.1, 'a"b')
+
+    linhas = list(histograma.exposicao())
+
+    assert linhas[:2] == ['# HELP bpa_teste_seconds Teste', '# TYPE bpa_teste_seconds histogram']
+    assert 'bpa_teste_seconds_bucket{metodo="a\\"b",le="0.1"} 1' in linhas
+    assert linhas[-5:] == [
+        'bpa_teste_seconds_bucket{metodo="get_bpa_stats",le="0.1"} 1',
+        'bpa_teste_seconds_bucket{metodo="get_bpa_stats",le="1"} 2',
+        'bpa_teste_seconds_bucket{metodo="get_bpa_stats",le="+Inf"} 3',
+        'bpa_teste_seconds_sum{metodo="get_bpa_stats"} 5.55',
+        'bpa_teste_seconds_count{metodo="get_bpa_stats"} 3',
+    ]
+
+
+def test_queries_are_labelled_with_calling_method():
+    antes = _total(QUERY_SECONDS, 'contar'), _total(QUERY_ROWS, 'contar'), _total(QUERY_SECONDS, 'blocos')
+    repositorio = FakeRepositorio()
+
+    assert repositorio.contar('2755289') == 3
+    assert list(repositorio.blocos()) == [[{'id': 1}], [{'id': 1}]]
+    repositorio.cursor.execute('SELECT 1')
+
+    assert _total(QUERY_SECONDS, 'contar') == antes[0] + 1
+    assert _total(QUERY_ROWS, 'contar') == antes[1] + 1
+    assert _total(QUERY_SECONDS, 'blocos') == antes[2] + 2
+    assert repositorio.cursor.executados[0] == (
+        'SELECT COUNT(*) FROM bpa_individualizado WHERE prd_uid = %s', ('2755289',)
+    )
+    assert issubclass(_cursor_medido(FakeCursor), _CursorMedido)
+
+
+def test_slow_query_keeps_parameter_shape_not_values(monkeypatch):
+    monkeypatch.setattr(db_metrics, 'DB_SLOW_QUERY_MS', 0)
+    monkeypatch.setattr(db_metrics, 'DB_SLOW_QUERY_EXPLAIN', False)
+
+    FakeRepositorio().contar('2755289')
+
+    lenta = consultas_lentas()[0]
+    assert lenta['metodo'] == 'contar'
+    assert lenta['sql'] == 'SELECT COUNT(*) FROM bpa_individualizado WHERE prd_uid = %s'
+    assert lenta['parametros'] == ['str(7)']
+    assert '2755289' not in str(lenta)
+
+
+def test_explain_only_sampled_for_reads(monkeypatch):
+    monkeypatch.setattr(db_metrics, '_ultimo_explain', {})
+
+    assert not db_metrics._amostrar_explain('save_paciente', 'INSERT INTO pacientes (cns) VALUES (%s)')
+    assert not db_metrics._amostrar_explain('x', 'WITH d AS (DELETE FROM jobs RETURNING id) SELECT * FROM d')
+    assert db_metrics._amostrar_explain('get_bpa_stats', 'SELECT * FROM producao_resumo')
+    # Um por método no intervalo
+    assert not db_metrics._amostrar_explain('get_bpa_stats', 'SELECT * FROM producao_resumo')
+    assert db_metrics._amostrar_explain('list_profissionais', 'SELECT * FROM profissionais')
+
+
+@pytest.mark.parametrize('sql', [
+    "SELECT bpa_remover_particao(%s, %s, FALSE, %s)",
+    "SELECT bpa_garantir_particao(t, c) FROM unnest(%s) AS t, unnest(%s) AS c",
+    "SELECT dados_versao_incrementar('bpa', prd_uid, prd_cmp) FROM producao_resumo",
+    "SELECT pg_advisory_xact_lock(hashtext(%s)), id FROM jobs",
+    "SELECT 1",
+])
+def test_explain_skips_side_effecting_selects(monkeypatch, sql):
+    monkeypatch.setattr(db_metrics, '_ultimo_explain', {})
+
+    assert not db_metrics._amostrar_explain('metodo', sql)
+
+
+def test_explain_accepts_reads_with_known_functions(monkeypatch):
+    monkeypatch.setattr(db_metrics, '_ultimo_explain', {})
+
+    assert db_metrics._amostrar_explain('get_bpa_stats', """
+        SELECT prd_cmp, COUNT(*) FILTER (WHERE prd_exportado), COALESCE(SUM(prd_qt_p), 0)
+        FROM bpa_individualizado WHERE prd_uid = %s AND prd_nmpac ILIKE 'x(' GROUP BY prd_cmp
+    """)
+
+
+def test_explain_runs_in_read_only_transaction(monkeypatch):
+    import psycopg2
+
+    conn = MagicMock()
+    cursor = conn.cursor.return_value.__enter__.return_value
+    cursor.fetchall.return_value = [('Seq Scan on jobs',)]
+    monkeypatch.setattr(psycopg2, 'connect', lambda **kwargs: conn)
+    registro = {'metodo': 'list_jobs'}
+
+    db_metrics._explain(registro, 'SELECT * FROM jobs', None)
+
+    executados = [chamada.args[0] for chamada in cursor.execute.call_args_list]
+    assert executados[0] == 'SET TRANSACTION READ ONLY'
+    assert executados[-1] == 'EXPLAIN (ANALYZE, BUFFERS) SELECT * FROM jobs'
+    assert registro['plano'] == 'Seq Scan on jobs'
+    conn.rollback.assert_called_once()
+
+
+def test_pool_checkout_wait_is_recorded(monkeypatch):
+    fake_pool = MagicMock()
+    monkeypatch.setattr(database, 'connection_pool', fake_pool)
+    antes = _total(POOL_WAIT, 'psycopg2')
+
+    with database.get_connection() as conn:
+        assert conn is fake_pool.getconn.return_value
+
+    assert _total(POOL_WAIT, 'psycopg2') == antes + 1
+    fake_pool.putconn.assert_called_once_with(conn)
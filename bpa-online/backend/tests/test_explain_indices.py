@@ -0,0 +1,214 @@
+"""
+EXPLAIN das consultas do BPADatabase contra um Postgres semeado
+
+Cada caso chama o método de verdade, captura os comandos que ele executou e
+confere no plano que as tabelas listadas são lidas por um dos índices
+esperados, nunca por Seq Scan. Os planos saem com enable_seqscan = off: o
+resultado não depende do volume semeado (se ainda sobra Seq Scan, nenhum
+índice atende a consulta) e um índice "qualquer" percorrido inteiro, como a
+chave primária, não passa porque não está entre os esperados.
+
+Usa o Postgres de teste do fixture `postgres` (conftest.py; precisa de
+BPA_TEST_DATABASE_URL). A produção é semeada em blocos por CNES/competência,
+como nas importações: ids contíguos por unidade, como no banco real.
+"""
+from unittest.mock import MagicMock
+
+import psycopg2.extensions
+import pytest
+
+from database import (
+    INDICES_CONSULTAS, INDICES_OBSOLETOS, PACIENTES_SEM_PRODUCAO_SQL, BPADatabase, garantir_indices
+)
+
+CNES = '2755289'
+COMPETENCIA = '202512'
+
+BPAI = {'idx_bpai_uid_cmp_exportado', 'idx_bpai_uid_id'}
+BPAC = {'idx_bpac_uid_cmp_exportado', 'idx_bpac_uid_id'}
+
+# (caso, chamada, {tabela: índices aceitos}). search_pacientes fica de fora:
+# ILIKE '%termo%' só teria índice com pg_trgm.
+CASOS = [
+    ('list_bpai', lambda db: db.list_bpa_individualizado(CNES), {'bpa_individualizado': BPAI}),
+    ('list_bpai_competencia', lambda db: db.list_bpa_individualizado(CNES, COMPETENCIA, False, limit=50),
+     {'bpa_individualizado': BPAI}),
+    ('list_bpai_keyset', lambda db: db.list_bpa_individualizado(CNES, COMPETENCIA, limit=50, after_id=100),
+     {'bpa_individualizado': BPAI}),
+    ('list_bpac', lambda db: db.list_bpa_consolidado(CNES, COMPETENCIA, limit=50), {'bpa_consolidado': BPAC}),
+    ('iter_bpa_lista', lambda db: list(db.iter_bpa_lista('bpa_consolidado', CNES, COMPETENCIA)),
+     {'bpa_consolidado': BPAC}),
+    ('get_bpai', lambda db: db.get_bpa_individualizado(1), {'bpa_individualizado': {'bpa_individualizado_pkey'}}),
+    ('mark_exported_bpai', lambda db: db.mark_exported_bpai([1, 2, 3]),
+     {'bpa_individualizado': {'bpa_individualizado_pkey'}}),
+    ('get_bpai_for_export', lambda db: db.get_bpai_for_export(CNES, COMPETENCIA), {'bpa_individualizado': BPAI}),
+    ('get_bpac_for_export', lambda db: db.get_bpac_for_export(CNES, COMPETENCIA),
+     {'bpa_consolidado': BPAC | {'uq_bpac_agregacao_pendente'}}),
+    ('iter_bpai_for_export', lambda db: list(db.iter_bpai_for_export(
+        CNES, COMPETENCIA, procedimentos_corrigidos={'0301010072': '0301010056'})),
+     {'bpa_individualizado': BPAI}),
+    ('iter_bpac_for_export', lambda db: list(db.iter_bpac_for_export(CNES, COMPETENCIA)),
+     {'bpa_consolidado': BPAC}),
+    ('iter_bpa_for_report', lambda db: list(db.iter_bpa_for_report('bpa_individualizado', CNES, COMPETENCIA,
+                                                                   'profissional')),
+     {'bpa_individualizado': BPAI}),
+    ('reset_export_status', lambda db: db.reset_export_status(CNES, COMPETENCIA),
+     {'bpa_individualizado': BPAI, 'bpa_consolidado': BPAC}),
+    ('get_paciente', lambda db: db.get_paciente('800000000000001'), {'pacientes': {'pacientes_cns_key'}}),
+    ('get_paciente_by_nome_nascimento', lambda db: db.get_paciente_by_nome_nascimento('Paciente 7', '19800101'),
+     {'pacientes': {'idx_pacientes_nome_nascimento'}}),
+    ('get_pacientes_by_nome_nascimento',
+     lambda db: db.get_pacientes_by_nome_nascimento([('PACIENTE 7', '19800101'), ('PACIENTE 8', '19800101')]),
+     {'pacientes': {'idx_pacientes_nome_nascimento'}}),
+    ('get_profissional', lambda db: db.get_profissional(CNES, '700000000000001'),
+     {'profissionais': {'profissionais_cnes_cns_key'}}),
+    ('list_profissionais', lambda db: db.list_profissionais(CNES), {'profissionais': {'profissionais_cnes_cns_key'}}),
+]
+
+# Limpeza de pacientes: pacientes é lida inteira (é o que se apaga); o anti-join não
+LIMPEZA_PACIENTES = {'bpa_individualizado': {'idx_bpai_cnspac'}}
+
+SEMEAR_SQL = '''
+    SELECT bpa_garantir_particao(t, c)
+    FROM unnest(ARRAY['bpa_individualizado', 'bpa_consolidado']) AS t,
+         unnest(ARRAY['202511', '202512']) AS c;
+
+    INSERT INTO bpa_individualizado (
+        prd_uid, prd_cmp, prd_flh, prd_seq, prd_cnsmed, prd_cbo, prd_cnspac, prd_nmpac,
+        prd_dtnasc, prd_dtaten, prd_pa, prd_qt_p, prd_exportado
+    )
+    SELECT (2755280 + u)::text, c, i / 20 + 1, i % 20 + 1, '7' || lpad((i % 50)::text, 14, '0'), '225125',
+           '8' || lpad(i::text, 14, '0'), 'PACIENTE ' || i, '19800101', c || '15', '0301010072', 1, i % 3 = 0
+    FROM generate_series(0, 9) AS u, unnest(ARRAY['202511', '202512']) AS c, generate_series(1, 2000) AS i
+    ORDER BY u, c, i;
+
+    INSERT INTO bpa_consolidado (prd_uid, prd_cmp, prd_cbo, prd_pa, prd_idade, prd_qt_p, prd_exportado)
+    SELECT (2755280 + u)::text, c, '225125', lpad(i::text, 10, '0'), '030', i % 7 + 1, i % 3 = 0
+    FROM generate_series(0, 9) AS u, unnest(ARRAY['202511', '202512']) AS c, generate_series(1, 500) AS i
+    ORDER BY u, c, i;
+
+    INSERT INTO pacientes (cns, nome, data_nascimento)
+    SELECT '8' || lpad(i::text, 14, '0'), 'PACIENTE ' || i, '19800101'
+    FROM generate_series(1, 4000) AS i;
+
+    INSERT INTO profissionais (cnes, cns, nome, cbo)
+    SELECT (2755280 + u)::text, '7' || lpad(i::text, 14, '0'), 'PROFISSIONAL ' || i, '225125'
+    FROM generate_series(0, 9) AS u, generate_series(1, 100) AS i;
+
+    ANALYZE bpa_individualizado;
+    ANALYZE bpa_consolidado;
+    ANALYZE pacientes;
+    ANALYZE profissionais;
+'''
+
+_capturados = []
+
+
+def _capturando(factory: type) -> type:
+    class Capturando(factory):
+        def execute(self, query, vars=None):
+            _capturados.append((query, vars))
+            return super().execute(query, vars)
+    return Capturando
+
+
+class _ConexaoCapturada(psycopg2.extensions.connection):
+    """Conexão cujos cursores (inclusive RealDictCursor e nomeados) guardam os comandos executados"""
+
+    def cursor(self, *args, **kwargs):
+        kwargs['cursor_factory'] = _capturando(kwargs.get('cursor_factory') or psycopg2.extensions.cursor)
+        return super().cursor(*args, **kwargs)
+
+
+CONNECTION_FACTORY = _ConexaoCapturada
+
+
+@pytest.fixture(scope='module')
+def banco(postgres):
+    """(BPADatabase no schema de teste, conexão, {partição ou índice de partição: raiz}, {índice: tabela})"""
+    with postgres() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(SEMEAR_SQL)
+            cursor.execute('''
+                SELECT c.relname, p.relname
+                FROM pg_inherits i
+                JOIN pg_class c ON c.oid = i.inhrelid
+                JOIN pg_class p ON p.oid = i.inhparent
+                WHERE c.relnamespace = current_schema()::regnamespace
+            ''')
+            raizes = dict(cursor.fetchall())
+            cursor.execute('SELECT indexname, tablename FROM pg_indexes WHERE schemaname = current_schema()')
+            tabela_do_indice = dict(cursor.fetchall())
+        conn.commit()
+    return object.__new__(BPADatabase), postgres, raizes, tabela_do_indice
+
+
+def _varreduras(plano):
+    """(relação, índice ou None) de cada leitura de tabela do plano"""
+    if plano['Node Type'] == 'Seq Scan':
+        yield plano['Relation Name'], None
+    elif 'Index Name' in plano:
+        yield None, plano['Index Name']
+    for filho in plano.get('Plans', ()):
+        yield from _varreduras(filho)
+
+
+def _explicar(comandos, conectar, raizes, tabela_do_indice):
+    """{tabela raiz: [índice raiz ou 'Seq Scan', ...]} dos planos dos comandos"""
+    lidas = {}
+    with conectar() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            for query, vars in comandos:
+                cursor.execute('EXPLAIN (FORMAT JSON) ' + query, vars)
+                for relacao, indice in _varreduras(cursor.fetchone()[0][0]['Plan']):
+                    if indice is not None:
+                        relacao = tabela_do_indice[indice]
+                    lidas.setdefault(raizes.get(relacao, relacao), []).append(
+                        raizes.get(indice, indice) if indice else 'Seq Scan'
+                    )
+        conn.rollback()
+    return lidas
+
+
+def _conferir(lidas, esperado):
+    for tabela, aceitos in esperado.items():
+        assert lidas.get(tabela), f'{tabela} não aparece no plano'
+        assert set(lidas[tabela]) <= aceitos, f'{tabela}: {lidas[tabela]} (esperado um de {sorted(aceitos)})'
+
+
+@pytest.mark.parametrize('chamada, esperado', [caso[1:] for caso in CASOS], ids=[caso[0] for caso in CASOS])
+def test_consulta_usa_indice(banco, chamada, esperado):
+    db, conectar, raizes, tabela_do_indice = banco
+    _capturados.clear()
+    chamada(db)
+    comandos = [c for c in _capturados if c[0].lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE', 'WITH'))]
+    assert comandos
+
+    _conferir(_explicar(comandos, conectar, raizes, tabela_do_indice), esperado)
+
+
+def test_limpeza_de_pacientes_usa_indice_de_cnspac(banco):
+    _, conectar, raizes, tabela_do_indice = banco
+
+    _conferir(_explicar([(PACIENTES_SEM_PRODUCAO_SQL, None)], conectar, raizes, tabela_do_indice),
+              LIMPEZA_PACIENTES)
+
+
+def test_todo_indice_de_consulta_tem_caso():
+    cobertos = set().union(*(aceitos for esperado in [c[2] for c in CASOS] + [LIMPEZA_PACIENTES]
+                             for aceitos in esperado.values()))
+
+    assert {nome for nome, _, _ in INDICES_CONSULTAS} <= cobertos
+
+
+def test_garantir_indices_cria_os_de_consulta_e_remove_obsoletos():
+    cursor = MagicMock()
+    garantir_indices(cursor)
+
+    executados = [chamada.args[0] for chamada in cursor.execute.call_args_list]
+    assert 'CREATE INDEX IF NOT EXISTS idx_bpai_uid_cmp_exportado ON bpa_individualizado ' \
+           '(prd_uid, prd_cmp, prd_exportado)' in executados
+    assert 'CREATE INDEX IF NOT EXISTS idx_pacientes_nome_nascimento ON pacientes ' \
+           '((UPPER(TRIM(nome))), data_nascimento)' in executados
+    assert executados[-len(INDICES_OBSOLETOS):] == [f'DROP INDEX IF EXISTS {nome}' for nome in INDICES_OBSOLETOS]
@@ -0,0 +1,81 @@
+import re
+from unittest.mock import MagicMock
+
+from exporter import FirebirdExporter
+from services.corrections import BPACorrections
+
+
+def _bpai(id_, cnsmed, pa, dtaten):
+    return {
+        'id': id_, 'prd_uid': '2755289', 'prd_cmp': '202512', 'prd_cnsmed': cnsmed,
+        'prd_cbo': '225125', 'prd_flh': '001', 'prd_seq': '01', 'prd_pa': pa,
+        'prd_cnspac': '700000000000001', 'prd_nmpac': 'PACIENTE', 'prd_dtnasc': '19800101',
+        'prd_sexo': 'M', 'prd_raca': '01', 'prd_nac': '010', 'prd_ibge': '172100',
+        'prd_dtaten': dtaten, 'prd_qt_p': 1, 'prd_cid': '', 'prd_caten': '01',
+        'prd_cep_pcnte': '77001324', 'prd_lograd_pcnte': '081', 'prd_end_pcnte': 'RUA 1',
+        'prd_num_pcnte': '12', 'prd_bairro_pcnte': 'CENTRO',
+    }
+
+
+def _exporter(tmp_path, bpai_chunks, bpac_chunks=()):
+    exporter = FirebirdExporter.__new__(FirebirdExporter)
+    exporter.output_dir = str(tmp_path)
+    exporter.cnes = '2755289'
+    exporter.corrections = BPACorrections('2755289')
+    exporter.db = MagicMock()
+    exporter.db.iter_bpai_for_export.side_effect = lambda *a, **k: iter(bpai_chunks)
+    exporter.db.iter_bpac_for_export.side_effect = lambda *a, **k: iter(bpac_chunks)
+    exporter.get_unit_name = lambda cnes: 'UNIDADE'
+    return exporter
+
+
+def _inserts(path):
+    with open(path, encoding='latin-1') as f:
+        return re.findall(r'INSERT INTO .*?;', f.read(), re.S)
+
+
+def test_streamed_bpai_matches_in_memory_sequence(tmp_path):
+    # 230 registros de 2 profissionais, já na ordem de sort_key_bpi, em blocos de 50
+    raw = [_bpai(i, cnsmed, '0301010072', f'202512{d:02d}')
+           for i, (cnsmed, d) in enumerate(
+               [('700000000000002', d % 28 + 1) for d in range(150)] +
+               [('700000000000003', d % 28 + 1) for d in range(80)])]
+    raw.sort(key=lambda r: (r['prd_cnsmed'], r['prd_dtaten'], r['id']))
+    chunks = [raw[i:i + 50] for i in range(0, len(raw), 50)]
+    exporter = _exporter(tmp_path, chunks)
+
+    result = exporter.export_bpai('2755289', '202512', aplicar_correcoes=False)
+
+    esperados = exporter.corrections.assign_sequence_bpi(
+        [exporter.map_record(r, exporter.FIELD_MAP_BPAI) for r in raw]
+    )
+    assert result['total'] == 230
+    assert _inserts(result['filepath']) == [exporter.generate_bpai_insert(r).strip() for r in esperados]
+    exportados = [id_ for call in exporter.db.mark_exported_bpai.call_args_list for id_ in call.args[0]]
+    assert exportados == [r['id'] for r in raw]
+
+
+def test_header_totals_are_backfilled(tmp_path):
+    raw = [_bpai(i, '700000000000002', '0301010072', '20251210') for i in range(7)]
+    bpac = [{'id': 1, 'prd_uid': '2755289', 'prd_cmp': '202512', 'prd_cbo': '225125',
+             'prd_pa': '0301010072', 'prd_idade': '030', 'prd_qt_p': 4}]
+    exporter = _exporter(tmp_path, [raw[:4], raw[4:]], [bpac])
+
+    result = exporter.export_all('2755289', '202512')
+
+    with open(result['filepath'], encoding='latin-1') as f:
+        linhas = f.read().splitlines()
+    assert result['bpai_count'] == 7 and result['bpac_count'] == 1
+    assert '-- BPA-I: 7 registros' in [l.rstrip() for l in linhas]
+    assert '-- BPA-C: 1 registros' in [l.rstrip() for l in linhas]
+    assert '-- Total de registros: 8' in [l.rstrip() for l in linhas]
+    assert '-- === CORRECOES APLICADAS AUTOMATICAMENTE ===' in linhas
+
+
+def test_empty_export_leaves_no_file(tmp_path):
+    exporter = _exporter(tmp_path, [])
+
+    result = exporter.export_bpai('2755289', '202512')
+
+    assert result['status'] == 'warning' and result['filename'] is None
+    assert list(tmp_path.iterdir()) == []
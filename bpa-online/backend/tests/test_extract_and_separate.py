@@ -0,0 +1,107 @@
+"""
+run_extract_and_separate com BiServer, SIGTAP e banco falsos: gravação por
+página e ponto de retomada quando a extração para no meio
+"""
+import pytest
+from fastapi import HTTPException
+
+import database
+import main
+from services import sigtap_index
+from services.corrections import BPACorrections
+
+
+class _Parser:
+    def parse_procedimentos(self):
+        return []
+
+    def get_procedimento_valor(self, codigo):
+        return {}
+
+
+class _Service:
+    enable_sigtap_validation = False  # classificador repassa tudo como BPA-I
+    sigtap = None
+
+    def __init__(self, pages, erro):
+        self.pages = pages
+        self.erro = erro
+        self.fechado = False
+
+    def _normalize_competencia(self, competencia):
+        return competencia
+
+    def iter_extracted_pages(self, cnes, competencia, limit=None, offset=0, counters=None):
+        counters.update(bpa=0, odonto=0)
+        try:
+            for page in self.pages:
+                counters['bpa'] += len(page)
+                yield page
+            raise self.erro
+        finally:
+            self.fechado = True
+
+
+class _Corrections(BPACorrections):
+    def __init__(self, cnes):
+        pass
+
+    def process_batch(self, records, tipo):
+        return records, BPACorrections.empty_stats()
+
+
+class _Database:
+    def __init__(self):
+        self.paginas = []
+        self.historico = None
+
+    def save_bpa_individualizado_bulk(self, records, return_ids=True):
+        pagina = list(records)
+        self.paginas.append([r['prd_seq'] for r in pagina])
+        return {'success': True, 'saved': len(pagina), 'failed': 0, 'errors': []}
+
+    def save_historico_extracao(self, data):
+        self.historico = data
+        return 1
+
+
+@pytest.fixture
+def ambiente(monkeypatch, tmp_path):
+    banco = _Database()
+    monkeypatch.setenv('SIGTAP_DIR', str(tmp_path))
+    monkeypatch.setattr(sigtap_index, 'get_sigtap_parser', lambda sigtap_dir: _Parser())
+    monkeypatch.setattr(main, 'BPACorrections', _Corrections)
+    monkeypatch.setattr(database, 'BPADatabase', lambda: banco)
+
+    def usar(pages, erro):
+        service = _Service(pages, erro)
+        monkeypatch.setattr(main, 'get_extraction_service', lambda: service)
+        return service, banco
+    return usar
+
+
+def _registros(n):
+    return [{'prd_pa': '0301010072', 'prd_qt_p': 1, 'prd_nmpac': 'PACIENTE'} for _ in range(n)]
+
+
+def test_erro_no_meio_grava_paginas_lidas_e_devolve_retomada(ambiente):
+    service, banco = ambiente([_registros(2), _registros(3)], ConnectionError('BiServer fora do ar'))
+
+    result = main.run_extract_and_separate('2755289', '202512', limit=100, offset=10)
+
+    assert banco.paginas == [[1, 2], [3, 4, 5]]
+    assert not result['success']
+    assert result['retomar'] == {'offset': 15, 'limit': 95}
+    assert result['stats']['saved']['bpa_i'] == 5
+    assert banco.historico['status'] == 'erro'
+    assert service.fechado
+
+
+def test_erro_na_primeira_pagina_nao_grava_nada(ambiente):
+    _, banco = ambiente([], ConnectionError('BiServer fora do ar'))
+
+    with pytest.raises(HTTPException) as exc:
+        main.run_extract_and_separate('2755289', '202512')
+
+    assert exc.value.status_code == 500
+    assert banco.paginas == [] and banco.historico is None
@@ -0,0 +1,127 @@
+from contextlib import contextmanager
+from datetime import datetime
+from unittest.mock import MagicMock
+
+import services.inconsistency_service as inconsistency_service
+from services.correction_rules import RULESET_VERSION
+from services.inconsistency_service import InconsistencyService
+
+
+def _record(id_, **campos):
+    record = {
+        'id': id_, 'prd_uid': '2755289', 'prd_cmp': '202512', 'updated_at': datetime(2025, 12, 20),
+        'prd_nmpac': 'PACIENTE', 'prd_pa': '0301010072', 'prd_dtaten': '20251210',
+        'prd_cnspac': '700000000000001', 'prd_cbo': '225125', 'prd_cid': '', 'prd_raca': '01',
+        'prd_sexo': 'M', 'prd_cep_pcnte': '77001324', 'prd_ibge': '172100', 'prd_lograd_pcnte': '081',
+        'prd_end_pcnte': 'RUA 1', 'prd_bairro_pcnte': 'CENTRO', 'prd_num_pcnte': '12',
+        'prd_qt_p': 1, 'prd_caten': '01',
+    }
+    record.update(campos)
+    return record
+
+
+def test_analyze_rows_match_apply_corrections():
+    service = InconsistencyService()
+    records = [
+        _record(1),
+        _record(2, prd_cep_pcnte='', prd_sexo='1'),
+        _record(3, prd_cnspac=''),
+    ]
+
+    rows = service._analyze(records)
+
+    assert [(r[0], r[5], r[6]) for r in rows] == [
+        (1, None, []),
+        (2, 'warning', ['CEP vazio preenchido', 'Sexo corrigido']),
+        (3, 'critical', ['CNS/CPF do paciente vazio (obrigatório para BPI)']),
+    ]
+    assert all(r[3] == RULESET_VERSION and r[4] == datetime(2025, 12, 20) for r in rows)
+    esperado = service.corrector.apply_corrections(records[1], 'BPI')
+    assert rows[1][7] == '["CEP vazio preenchido: 77001324", "Sexo corrigido: 1 → F"]'
+    assert esperado.corrections_applied == ['CEP vazio preenchido: 77001324', 'Sexo corrigido: 1 → F']
+
+
+def test_report_is_paginated_from_materialized_table(monkeypatch):
+    conn = MagicMock()
+    cursor = conn.cursor.return_value.__enter__.return_value
+    cursor.fetchall.side_effect = [
+        [{'tipo': 'critical', 'total': 2}, {'tipo': 'warning', 'total': 5}],
+        [{'regra': 'CEP vazio preenchido', 'total': 4}],
+        [{'bpa_id': 7, 'tipo': 'warning', 'corrections': ['CEP vazio preenchido: 77001324'],
+          'delete_reason': None, 'prd_nmpac': 'ANA', 'prd_pa': '0301010072', 'prd_dtaten': '20251210'}],
+    ]
+    cursor.fetchone.return_value = {'total': 4}
+
+    @contextmanager
+    def fake_connection():
+        yield conn
+
+    monkeypatch.setattr(inconsistency_service, 'get_connection', fake_connection)
+    service = InconsistencyService()
+    monkeypatch.setattr(service, 'refresh', lambda cnes, competencia: 0)
+
+    report = service.get_inconsistency_report(
+        '2755289', '202512', page=2, page_size=3, regra='CEP vazio preenchido'
+    )
+
+    assert report['summary'] == {
+        'total': 7, 'critical': 2, 'warnings': 5, 'por_regra': {'CEP vazio preenchido': 4}
+    }
+    assert report['pagination'] == {'page': 2, 'page_size': 3, 'total': 4, 'pages': 2}
+    assert report['details'] == [{
+        'id': 7, 'paciente': 'ANA', 'procedimento': '0301010072', 'data': '2025-12-10',
+        'tipo': 'warning', 'mensagem': 'CEP vazio preenchido: 77001324',
+        'corrections': ['CEP vazio preenchido: 77001324'], 'should_delete': False, 'delete_reason': None,
+    }]
+    sql, params = cursor.execute.call_args[0]
+    assert 'LIMIT %s OFFSET %s' in sql
+    assert params == ['2755289', '202512', 'CEP vazio preenchido', 3, 3]
+
+
+def test_only_rows_without_identification_keep_cadastro_version(monkeypatch):
+    service = InconsistencyService()
+    monkeypatch.setattr(service.corrector, 'buscar_pacientes_sem_identificacao', lambda records: {})
+    records = [
+        _record(1, prd_dtnasc='19800101'),
+        _record(2, prd_cnspac='', prd_dtnasc='19800101'),
+        _record(3, prd_cnspac='', prd_cpf_pcnte='12345678901', prd_dtnasc='19800101'),
+    ]
+
+    rows = service._analyze(records, cadastro_versao=42)
+
+    assert [r[9] for r in rows] == [None, 42, None]
+
+
+def test_patient_registration_refreshes_dependent_rows(postgres, monkeypatch):
+    monkeypatch.setattr(inconsistency_service, 'get_connection', postgres)
+    with postgres() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                SELECT bpa_garantir_particao('bpa_individualizado', '202512');
+                INSERT INTO bpa_individualizado (
+                    prd_uid, prd_cmp, prd_flh, prd_seq, prd_cnsmed, prd_cbo, prd_cnspac, prd_nmpac,
+                    prd_dtnasc, prd_dtaten, prd_pa, prd_qt_p
+                ) VALUES
+                    ('2755289', '202512', 1, 1, '700000000000001', '225125', '800000000000001',
+                     'COM CNS', '19800101', '20251210', '0301010072', 1),
+                    ('2755289', '202512', 1, 2, '700000000000001', '225125', '',
+                     'SEM CNS', '19800101', '20251210', '0301010072', 1);
+            """)
+        conn.commit()
+    service = InconsistencyService()
+
+    assert service.refresh('2755289', '202512') == 2
+    assert service.get_inconsistency_report('2755289', '202512')['summary']['critical'] == 1
+    assert service.refresh('2755289', '202512') == 0
+
+    with postgres() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO pacientes (cns, nome, data_nascimento)
+                VALUES ('800000000000002', 'SEM CNS', '19800101')
+            """)
+        conn.commit()
+
+    # Só o registro que consulta o cadastro é refeito; agora o CNS é recuperado
+    assert service.refresh('2755289', '202512') == 1
+    assert service.get_inconsistency_report('2755289', '202512')['summary']['critical'] == 0
@@ -0,0 +1,186 @@
+import threading
+
+import pytest
+
+import database
+from services import biserver_client, job_service as job_module
+from services.job_service import JobCancelled, JobService
+
+
+class FakeJobStore:
+    """Substitui os métodos de jobs do BPADatabase (sem PostgreSQL)"""
+
+    def __init__(self):
+        self.jobs = {}
+        self.progress = []
+        self.lock = threading.Lock()
+
+    def create_job(self, job_id, tipo, params, usuario_id=None):
+        with self.lock:
+            self.jobs[job_id] = {
+                'id': job_id, 'tipo': tipo, 'status': 'pending', 'params': params,
+                'usuario_id': usuario_id, 'cancel_requested': False, 'result': None, 'error': None,
+            }
+            return dict(self.jobs[job_id])
+
+    def start_job(self, job_id, worker_id=None):
+        with self.lock:
+            job = self.jobs[job_id]
+            if job['status'] != 'pending' or job['cancel_requested']:
+                return False
+            job.update(status='running', worker_id=worker_id)
+            return True
+
+    def update_job_progress(self, job_id, current, total=None, message=None):
+        with self.lock:
+            self.progress.append((job_id, current, total, message))
+            return self.jobs[job_id]['cancel_requested']
+
+    def finish_job(self, job_id, status, result=None, error=None, message=None):
+        with self.lock:
+            self.jobs[job_id].update(status=status, result=result, error=error)
+
+    def request_job_cancel(self, job_id):
+        with self.lock:
+            job = self.jobs[job_id]
+            job['cancel_requested'] = True
+            if job['status'] == 'pending':
+                job['status'] = 'cancelled'
+            return job['status']
+
+    def heartbeat_jobs(self, worker_id):
+        return 0
+
+    def fail_stale_jobs(self, stale_seconds):
+        return []
+
+    def get_job(self, job_id, include_result=True):
+        with self.lock:
+            return dict(self.jobs[job_id]) if job_id in self.jobs else None
+
+
+@pytest.fixture
+def store(monkeypatch):
+    fake = FakeJobStore()
+    for name in ('create_job', 'start_job', 'update_job_progress', 'finish_job',
+                 'request_job_cancel', 'get_job', 'heartbeat_jobs', 'fail_stale_jobs'):
+        monkeypatch.setattr(job_module.db, name, getattr(fake, name))
+    return fake
+
+
+def test_job_reports_progress_and_result(store):
+    service = JobService(max_workers=1)
+
+    def handler(job, cnes, paginas):
+        for page in range(1, paginas + 1):
+            job.progress(page, paginas, f"Página {page}")
+        return {'cnes': cnes, 'paginas': paginas}
+
+    service.register('extracao', handler)
+    job = service.submit('extracao', {'cnes': '2755289', 'paginas': 3}, usuario_id=7)
+    service.executor.shutdown(wait=True)
+
+    final = store.jobs[job['id']]
+    assert final['status'] == 'completed'
+    assert final['result'] == {'cnes': '2755289', 'paginas': 3}
+    assert final['usuario_id'] == 7
+    assert final['worker_id'] == service.worker_id
+    assert [p[1] for p in store.progress] == [1, 2, 3]
+
+
+def test_cancel_stops_running_job_at_next_progress(store):
+    service = JobService(max_workers=1)
+    started = threading.Event()
+    release = threading.Event()
+    pages = []
+
+    def handler(job):
+        job.progress(1, 10)
+        pages.append(1)
+        started.set()
+        release.wait(2)
+        for page in range(2, 11):
+            job.progress(page, 10)
+            pages.append(page)
+        return {'done': True}
+
+    service.register('longo', handler)
+    job = service.submit('longo', {})
+    assert started.wait(2)
+    assert service.cancel(job['id']) == 'running'
+    release.set()
+    service.executor.shutdown(wait=True)
+
+    assert store.jobs[job['id']]['status'] == 'cancelled'
+    assert pages == [1]
+
+
+def test_handler_error_is_recorded(store):
+    service = JobService(max_workers=1)
+
+    class FakeHTTPException(Exception):
+        detail = 'Diretório SIGTAP não encontrado'
+
+    def handler(job):
+        raise FakeHTTPException()
+
+    service.register('relatorio', handler)
+    job = service.submit('relatorio', {})
+    service.executor.shutdown(wait=True)
+
+    assert store.jobs[job['id']]['status'] == 'error'
+    assert store.jobs[job['id']]['error'] == 'Diretório SIGTAP não encontrado'
+
+
+def test_unknown_job_type_is_rejected(store):
+    with pytest.raises(ValueError):
+        JobService(max_workers=1).submit('inexistente', {})
+
+
+def test_job_already_claimed_by_another_worker_is_skipped(store):
+    service = JobService(max_workers=1)
+    calls = []
+    service.register('longo', lambda job: calls.append(1))
+    job = store.create_job('j1', 'longo', {})
+    store.jobs['j1'].update(status='running', worker_id='outro:1')
+
+    service._enqueue(job['id'], 'longo', {})
+    service.executor.shutdown(wait=True)
+
+    assert calls == []
+    assert store.jobs['j1']['worker_id'] == 'outro:1'
+
+
+def test_extract_all_propagates_cancellation(monkeypatch):
+    service = object.__new__(biserver_client.BiServerExtractionService)
+    service.mock_mode = False
+    service._extracted_data = {}
+    result = biserver_client.ExtractionResult(success=True, total_records=2, records=[{}, {}], message='')
+    monkeypatch.setattr(service, 'extract_bpa_individualizado', lambda **k: result, raising=False)
+
+    def cancelar(*args):
+        raise JobCancelled('cancelado')
+
+    with pytest.raises(JobCancelled):
+        service.extract_all_bpa_individualizado('2755289', '202512', batch_size=2, on_batch_complete=cancelar)
+
+
+def test_only_jobs_without_recent_heartbeat_are_failed(postgres):
+    with postgres() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO jobs (id, tipo, status, worker_id, heartbeat_at) VALUES
+                    ('vivo', 'extract', 'running', 'a:1', CURRENT_TIMESTAMP),
+                    ('morto', 'extract', 'running', 'b:2', CURRENT_TIMESTAMP - INTERVAL '10 minutes'),
+                    ('fila', 'extract', 'pending', NULL, NULL)
+            """)
+        conn.commit()
+
+    db = object.__new__(database.BPADatabase)
+    state = db.reset_interrupted_jobs(120)
+
+    assert state == {'interrupted': ['morto'], 'pending': ['fila']}
+    assert db.heartbeat_jobs('a:1') == 1
+    assert db.start_job('fila', 'c:3')
+    assert not db.start_job('fila', 'd:4')
+    assert db.get_job('fila')['worker_id'] == 'c:3'
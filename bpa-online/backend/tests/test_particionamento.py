@@ -0,0 +1,163 @@
+from contextlib import contextmanager
+from unittest.mock import MagicMock
+
+import database
+from database import BPADatabase, remover_producao
+
+
+class ScriptedCursor:
+    """Cursor que responde por trecho de SQL e registra tudo o que foi executado"""
+
+    def __init__(self, respostas):
+        self.respostas = respostas
+        self.executed = []
+        self.rowcount = 0
+        self._rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        sql = ' '.join(sql.split())
+        self.executed.append((sql, params))
+        self._rows, self.rowcount = [(True,)], 0
+        for trecho, resposta in self.respostas.items():
+            if trecho in sql:
+                resposta = resposta(params) if callable(resposta) else resposta
+                self._rows, self.rowcount = resposta
+                break
+
+    def fetchone(self):
+        return self._rows[0] if self._rows else None
+
+    def fetchall(self):
+        return self._rows
+
+    def sql(self, trecho):
+        return [sql for sql, _ in self.executed if trecho in sql]
+
+
+def test_remover_producao_drops_exclusive_months():
+    cursor = ScriptedCursor({
+        'bool_and(prd_uid = %s)': ([('202511', True), ('202512', False)], 2),
+        'bpa_remover_particao': ([(120,)], 1),
+        'DELETE FROM bpa_individualizado': ([], 7),
+    })
+
+    assert remover_producao(cursor, 'bpa_individualizado', '2755289') == 127
+    assert cursor.executed[1] == (
+        'SELECT bpa_remover_particao(%s, %s, FALSE, %s)', ('bpa_individualizado', '202511', '2755289')
+    )
+    assert cursor.executed[2] == (
+        'DELETE FROM bpa_individualizado WHERE prd_uid = %s AND prd_cmp = %s', ('2755289', '202512')
+    )
+
+
+def test_remover_producao_without_partition_falls_back_to_delete():
+    cursor = ScriptedCursor({
+        'bool_and(prd_uid = %s)': ([('202512', True)], 1),
+        'bpa_remover_particao': ([(None,)], 1),
+        'DELETE FROM bpa_consolidado': ([], 3),
+    })
+
+    assert remover_producao(cursor, 'bpa_consolidado', '2755289', '202512') == 3
+    _, params = cursor.executed[0]
+    assert params == ['2755289', 'bpa_c', 'bpa_c', '2755289', '202512']
+
+
+def test_init_migrates_plain_tables_to_partitions(monkeypatch):
+    colunas = {
+        'bpa_individualizado': ['id', 'prd_uid', 'prd_cmp', 'prd_pa'],
+        'bpa_individualizado_legado': ['id', 'prd_uid', 'prd_cmp', 'prd_pa', 'coluna_antiga'],
+        'bpa_consolidado': ['id', 'prd_uid', 'prd_cmp'],
+        'bpa_consolidado_legado': ['id', 'prd_uid', 'prd_cmp'],
+    }
+    cursor = ScriptedCursor({
+        'SELECT relkind FROM pg_class': ([('r',)], 1),
+        'FROM pg_indexes': lambda params: ([(f'idx_{params[0]}_uid',)], 1),
+        'FROM information_schema.columns': lambda params: (
+            [(t, c) for t in params for c in colunas[t]], 1
+        ),
+        'INSERT INTO bpa_individualizado (': ([], 8107),
+    })
+    conn = MagicMock()
+    conn.cursor.return_value = cursor
+
+    @contextmanager
+    def fake_connection():
+        yield conn
+
+    monkeypatch.setattr(database, 'get_connection', fake_connection)
+    database.init_database()
+
+    assert cursor.sql('RENAME TO bpa_individualizado_legado')
+    assert cursor.sql('DROP INDEX idx_bpa_individualizado_legado_uid')
+    criacao = cursor.sql('CREATE TABLE IF NOT EXISTS bpa_individualizado (')[0]
+    assert 'PRIMARY KEY (id, prd_cmp) ) PARTITION BY LIST (prd_cmp)' in criacao
+
+    copia = cursor.sql('INSERT INTO bpa_individualizado (')[0]
+    assert copia == ("INSERT INTO bpa_individualizado (id, prd_uid, prd_cmp, prd_pa) "
+                     "SELECT id, prd_uid, COALESCE(prd_cmp, ''), prd_pa FROM bpa_individualizado_legado")
+    ordem = [sql for sql, _ in cursor.executed]
+    assert ordem.index('DROP TABLE IF EXISTS bpa_inconsistencias') < ordem.index(
+        'DROP TABLE bpa_individualizado_legado CASCADE')
+    assert cursor.sql('DROP TABLE bpa_consolidado_legado CASCADE')
+    assert cursor.sql('FOREIGN KEY (bpa_id, prd_cmp) REFERENCES bpa_individualizado(id, prd_cmp)')
+    # Resumo recalculado depois da migração
+    assert any(sql.startswith('INSERT INTO producao_resumo') for sql in ordem)
+    conn.commit.assert_called_once()
+
+
+def test_batch_save_creates_partitions_before_insert(monkeypatch):
+    cursor = MagicMock()
+    cursor.__enter__.return_value = cursor
+    conn = MagicMock()
+    conn.cursor.return_value = cursor
+    executados = []
+    cursor.execute.side_effect = lambda sql, params=None: executados.append((' '.join(sql.split()), params))
+
+    @contextmanager
+    def fake_connection():
+        yield conn
+
+    monkeypatch.setattr(database, 'get_connection', fake_connection)
+    monkeypatch.setattr(database, 'execute_values', lambda *args, **kwargs: [(True,), (True,)])
+
+    db = object.__new__(BPADatabase)
+    resultado = db.save_bpa_consolidado_batch([
+        {'prd_uid': '2755289', 'prd_cmp': '202512', 'prd_pa': '0301010072', 'prd_cbo': '225125'},
+        {'prd_uid': '2755289', 'prd_cmp': '202511', 'prd_pa': '0301010072', 'prd_cbo': '225125'},
+    ])
+
+    assert resultado['inserted'] == 2
+    assert executados == [
+        ('SELECT bpa_garantir_particao(%s, c) FROM unnest(%s::text[]) AS c',
+         ('bpa_consolidado', ['202511', '202512']))
+    ]
+
+
+def test_partition_with_other_unit_is_not_dropped(postgres):
+    with postgres() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT bpa_garantir_particao('bpa_individualizado', '202601')")
+            cursor.execute('''
+                INSERT INTO bpa_individualizado (prd_uid, prd_cmp, prd_qt_p)
+                VALUES ('2755289', '202601', 1), ('2755289', '202601', 1), ('2492555', '202601', 1)
+            ''')
+            # Resumo lido antes da gravação da outra unidade: o mês parece exclusivo
+            cursor.execute("DELETE FROM producao_resumo WHERE prd_uid = '2492555'")
+        conn.commit()
+
+        with conn.cursor() as cursor:
+            assert remover_producao(cursor, 'bpa_individualizado', '2755289', '202601') == 2
+            conn.commit()
+            cursor.execute("SELECT prd_uid FROM bpa_individualizado_202601")
+            assert cursor.fetchall() == [('2492555',)]
+
+            cursor.execute("SELECT bpa_remover_particao('bpa_individualizado', '202601', FALSE, '2492555')")
+            assert cursor.fetchone()[0] == 0
+            cursor.execute("SELECT to_regclass('bpa_individualizado_202601')")
+            assert cursor.fetchone()[0] is None
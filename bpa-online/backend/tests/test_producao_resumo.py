@@ -0,0 +1,162 @@
+from contextlib import contextmanager
+from datetime import datetime
+from unittest.mock import MagicMock
+
+import database
+from database import BPADatabase
+
+RESUMO = [
+    {'tipo': 'bpa_i', 'cnes': '2755289', 'competencia': '202512', 'total': 8107, 'pendentes': 107,
+     'exportados': 8000, 'quantidade': 8200, 'quantidade_pendente': 110,
+     'primeira_insercao': datetime(2026, 1, 5, 8, 0), 'ultima_insercao': datetime(2026, 1, 20, 17, 30)},
+    {'tipo': 'bpa_c', 'cnes': '2755289', 'competencia': '202512', 'total': 40, 'pendentes': 40,
+     'exportados': 0, 'quantidade': 900, 'quantidade_pendente': 900,
+     'primeira_insercao': datetime(2026, 1, 6), 'ultima_insercao': datetime(2026, 1, 6)},
+    {'tipo': 'bpa_i', 'cnes': '2755289', 'competencia': '202511', 'total': 7000, 'pendentes': 0,
+     'exportados': 7000, 'quantidade': 7000, 'quantidade_pendente': 0,
+     'primeira_insercao': None, 'ultima_insercao': None},
+    {'tipo': 'bpa_i', 'cnes': '2492555', 'competencia': '202512', 'total': 12, 'pendentes': 12,
+     'exportados': 0, 'quantidade': 12, 'quantidade_pendente': 0,
+     'primeira_insercao': None, 'ultima_insercao': None},
+]
+
+
+class FakeCursor:
+    """Responde producao_resumo (com filtros) e contagens de cadastro; registra o SQL"""
+
+    def __init__(self, executed):
+        self.executed = executed
+        self._rows = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, sql, params=None):
+        self.executed.append(sql)
+        if 'FROM producao_resumo' in sql:
+            rows = RESUMO
+            params = list(params or [])
+            if 'prd_uid = %s' in sql:
+                cnes = params.pop(0)
+                rows = [r for r in rows if r['cnes'] == cnes]
+            if 'prd_cmp = %s' in sql:
+                competencia = params.pop(0)
+                rows = [r for r in rows if r['competencia'] == competencia]
+            self._rows = [{'competencia': r['competencia']} for r in rows] if 'DISTINCT' in sql else rows
+        else:
+            self._rows = [{'total': 3}]
+
+    def fetchone(self):
+        return self._rows[0]
+
+    def fetchall(self):
+        return self._rows
+
+
+def _db(monkeypatch, executed):
+    conn = MagicMock()
+    conn.cursor.side_effect = lambda **kwargs: FakeCursor(executed)
+
+    @contextmanager
+    def fake_connection():
+        yield conn
+
+    monkeypatch.setattr(database, 'get_connection', fake_connection)
+    return object.__new__(BPADatabase)
+
+
+def _varre_producao(executed):
+    return [sql for sql in executed if 'bpa_individualizado' in sql or 'bpa_consolidado' in sql]
+
+
+def test_stats_are_read_from_rollup(monkeypatch):
+    executed = []
+    db = _db(monkeypatch, executed)
+
+    assert db.get_stats()['bpai_total'] == 8107 + 7000 + 12
+    stats = db.get_stats_by_cnes('2755289')
+    assert (stats['bpai_total'], stats['bpai_pendente'], stats['bpai_exportado']) == (15107, 107, 15000)
+    assert (stats['bpac_total'], stats['bpac_pendente']) == (40, 40)
+    assert stats['bpai_competencias'] == ['202512', '202511']
+    assert stats['bpac_competencias'] == ['202512']
+    assert db.get_bpa_stats('2755289', '202512') == {
+        'bpai_total': 8107, 'bpai_pendente': 107, 'bpai_exportado': 8000,
+        'bpac_total': 40, 'bpac_pendente': 40, 'bpac_exportado': 0,
+    }
+    assert db.get_bpa_stats('9999999', '202512')['bpai_total'] == 0
+
+    assert _varre_producao(executed) == []
+
+
+def test_database_overview_shape(monkeypatch):
+    executed = []
+    overview = _db(monkeypatch, executed).get_database_overview()
+
+    assert overview['cnes_list'] == ['2492555', '2755289'] and overview['total_cnes'] == 2
+    assert overview['totals'] == {'bpa_i': 15119, 'bpa_c': 40, 'profissionais': 3, 'pacientes': 3}
+    primeira = overview['bpa_i'][0]
+    assert primeira['tipo'] == 'bpa_i' and primeira['competencia'] == '202512'
+    assert primeira['primeira_insercao'] == '2026-01-05T08:00:00'
+    assert overview['bpa_c'][0]['quantidade'] == 900
+    assert _varre_producao(executed) == []
+
+
+def test_init_creates_statement_triggers_for_both_tables(monkeypatch):
+    conn = MagicMock()
+    cursor = conn.cursor.return_value.__enter__.return_value
+    cursor.fetchone.return_value = (True,)
+    executed = []
+    cursor.execute.side_effect = lambda sql, params=None: executed.append(' '.join(sql.split()))
+
+    @contextmanager
+    def fake_connection():
+        yield conn
+
+    monkeypatch.setattr(database, 'get_connection', fake_connection)
+    database.init_database()
+
+    triggers = [sql for sql in executed if sql.startswith('CREATE TRIGGER trg_producao_resumo')]
+    assert len(triggers) == 8
+    assert all('FOR EACH STATEMENT' in sql for sql in triggers)
+    assert ('CREATE TRIGGER trg_producao_resumo_upd AFTER UPDATE ON bpa_consolidado '
+            'REFERENCING OLD TABLE AS antigos NEW TABLE AS novos') in ' | '.join(triggers)
+    # Tabela recém-criada: resumo recalculado a partir da produção existente
+    assert any(sql.startswith('INSERT INTO producao_resumo') and 'FROM bpa_individualizado' in sql
+               for sql in executed)
+    conn.commit.assert_called_once()
+
+
+def test_triggers_keep_rollup_in_postgres(postgres):
+    db = object.__new__(BPADatabase)
+    with postgres() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute('''
+                SELECT bpa_garantir_particao(t, '202512')
+                FROM unnest(ARRAY['bpa_individualizado', 'bpa_consolidado']) AS t
+            ''')
+            cursor.execute('''
+                INSERT INTO bpa_individualizado (prd_uid, prd_cmp, prd_qt_p)
+                VALUES ('2755289', '202512', 2), ('2755289', '202512', 3), (NULL, '202512', 1)
+            ''')
+            cursor.execute('''
+                INSERT INTO bpa_consolidado (prd_uid, prd_cmp, prd_cbo, prd_pa, prd_idade, prd_qt_p)
+                VALUES ('2755289', '202512', '225125', '0301010072', '030', 40)
+            ''')
+            cursor.execute("UPDATE bpa_individualizado SET prd_exportado = TRUE WHERE prd_qt_p = 2")
+            cursor.execute("DELETE FROM bpa_individualizado WHERE prd_uid IS NULL")
+        conn.commit()
+
+    assert db.get_bpa_stats('2755289', '202512') == {
+        'bpai_total': 2, 'bpai_pendente': 1, 'bpai_exportado': 1,
+        'bpac_total': 1, 'bpac_pendente': 1, 'bpac_exportado': 0,
+    }
+    resumo = {(r['tipo'], r['cnes']): r for r in db.get_producao_resumo()}
+    # Linha sem CNES entrou com prd_uid '' e saiu com o DELETE
+    assert set(resumo) == {('bpa_i', '2755289'), ('bpa_c', '2755289')}
+    assert (resumo['bpa_i', '2755289']['quantidade'], resumo['bpa_i', '2755289']['quantidade_pendente']) == (5, 3)
+
+    assert db.reset_export_status('2755289', '202512')['bpai_reset'] == 2
+    assert db.get_bpa_stats('2755289', '202512')['bpai_pendente'] == 2
@@ -0,0 +1,107 @@
+import json
+from concurrent.futures import Future
+
+import pytest
+
+import services.remessa_batch as remessa_batch
+from services.bpa_report_generator import calcular_campo_controle
+from services.job_errors import JobCancelled
+
+COMPETENCIA = '202512'
+
+# CNES -> quantidade de BPA-I (o terceiro não tem produção)
+PRODUCAO = {'6061478': 45, '2467968': 3, '2755289': 0}
+
+
+class FakeDatabase:
+    def __init__(self):
+        pass
+
+    def get_bpa_stats(self, cnes, competencia):
+        return {'bpai_total': PRODUCAO[cnes], 'bpac_total': 0}
+
+    def iter_bpa_for_report(self, tabela, cnes, competencia, ordem='id', chunk_size=1000):
+        if tabela != 'bpa_individualizado' or not PRODUCAO[cnes]:
+            return iter(())
+        return iter([[
+            {'id': i, 'prd_uid': cnes, 'prd_cmp': competencia, 'prd_cnsmed': '700000000000002',
+             'prd_cbo': '225125', 'prd_pa': '0301010072', 'prd_cnspac': '700000000000001',
+             'prd_nmpac': 'PACIENTE', 'prd_dtnasc': '19800101', 'prd_dtaten': '20251210', 'prd_qt_p': 1}
+            for i in range(PRODUCAO[cnes])
+        ]])
+
+
+@pytest.fixture
+def lote(monkeypatch, tmp_path):
+    monkeypatch.setattr(remessa_batch, 'carregar_valores', lambda sigtap_dir: {'0301010072': 12.5})
+    monkeypatch.setattr(remessa_batch, 'sigtap_dir_competencia', lambda competencia: f'sigtap/{competencia}')
+    return tmp_path
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_batch_writes_bundles_and_manifest(lote, workers):
+    progresso = []
+
+    manifesto = remessa_batch.gerar_remessas_competencia(
+        COMPETENCIA, list(PRODUCAO), workers=workers, reports_dir=str(lote),
+        on_progress=lambda atual, total, msg: progresso.append((atual, total)), db_factory=FakeDatabase
+    )
+
+    unidades = {u['cnes']: u for u in manifesto['unidades']}
+    assert [u['cnes'] for u in manifesto['unidades']] == list(PRODUCAO)
+    assert unidades['6061478']['status'] == 'ok'
+    assert unidades['6061478']['total_registros'] == 45
+    assert unidades['6061478']['total_bpas'] == 3
+    assert unidades['6061478']['campo_controle'] == calcular_campo_controle(45, 3)
+    assert unidades['6061478']['files'][0] == '/api/reports/download/6061478_202512/PACAPSAD.DEZ'
+    assert unidades['2755289']['status'] == 'vazio'
+    assert manifesto['totais']['geradas'] == 2 and manifesto['totais']['total_registros'] == 48
+    assert sorted(progresso) == [(1, 3), (2, 3), (3, 3)]
+
+    with open(lote / 'LOTE_202512' / 'MANIFESTO.json', encoding='utf-8') as f:
+        assert json.load(f)['unidades'] == manifesto['unidades']
+
+    # Tabela de valores pré-carregada chega aos relatórios (também nos workers)
+    with open(lote / '2467968_202512' / 'BPAI_REL.TXT', encoding='latin-1') as f:
+        assert '12,50' in f.read()
+
+
+def test_sigtap_of_the_competencia_is_used(monkeypatch):
+    class Manager:
+        def get_sigtap_dir(self, competencia=None):
+            if competencia == '202601':
+                raise FileNotFoundError(competencia)
+            return f'sigtap/{competencia or "ativa"}'
+
+    monkeypatch.setattr('services.sigtap_manager_service.get_sigtap_manager', lambda: Manager())
+
+    assert remessa_batch.sigtap_dir_competencia('202512') == 'sigtap/202512'
+    assert remessa_batch.sigtap_dir_competencia('202601') == 'sigtap/ativa'
+
+
+def test_cancel_does_not_wait_for_remaining_units(lote, monkeypatch):
+    desligamentos = []
+
+    class Executor:
+        def __init__(self, **kwargs):
+            assert kwargs['mp_context'].get_start_method() == 'spawn'
+
+        def submit(self, fn, cnes, competencia, tipo, reports_dir):
+            future = Future()
+            future.set_result(remessa_batch.gerar_unidade(cnes, competencia, tipo, {}, reports_dir, FakeDatabase()))
+            return future
+
+        def shutdown(self, wait=True, cancel_futures=False):
+            desligamentos.append((wait, cancel_futures))
+
+    def cancelar(atual, total, msg):
+        raise JobCancelled('cancelado')
+
+    monkeypatch.setattr(remessa_batch, 'ProcessPoolExecutor', Executor)
+
+    with pytest.raises(JobCancelled):
+        remessa_batch.gerar_remessas_competencia(
+            COMPETENCIA, list(PRODUCAO), workers=2, reports_dir=str(lote), on_progress=cancelar
+        )
+
+    assert desligamentos == [(False, True)]
@@ -0,0 +1,133 @@
+import os
+import random
+
+import pytest
+
+from services.bpa_report_generator import BPAExportConfig, BPAFileGenerator
+from services.remessa_reader import (
+    BPACRelReader, RemessaReader, cnes_competencia_da_pasta, reconciliar
+)
+
+CNES = '2755289'
+COMPETENCIA = '202512'
+AMOSTRA = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'reports', '2755289_202512')
+
+
+class FakeDatabase:
+    """iter_bpa_for_report sobre listas, com as ordenações do SQL"""
+
+    ORDENS = {
+        'id': lambda r: r['id'],
+        'profissional': lambda r: (r['prd_cnsmed'], r['prd_cbo'], r['prd_dtaten'], r['id']),
+        'cbo': lambda r: (r['prd_cbo'], r['id']),
+    }
+
+    def __init__(self, bpai, bpac):
+        self.tabelas = {'bpa_individualizado': bpai, 'bpa_consolidado': bpac}
+
+    def get_bpa_stats(self, cnes, competencia):
+        return {'bpai_total': len(self.tabelas['bpa_individualizado']),
+                'bpac_total': len(self.tabelas['bpa_consolidado'])}
+
+    def iter_bpa_for_report(self, tabela, cnes, competencia, ordem='id', chunk_size=1000):
+        rows = sorted(self.tabelas[tabela], key=self.ORDENS[ordem])
+        for start in range(0, len(rows), chunk_size):
+            yield rows[start:start + chunk_size]
+
+
+def _producao(seed=17):
+    rnd = random.Random(seed)
+    bpai = [{
+        'id': i, 'prd_uid': CNES, 'prd_cmp': COMPETENCIA,
+        'prd_cnsmed': rnd.choice(['700000000000002', '700000000000003']),
+        'prd_cbo': rnd.choice(['225125', '322205']), 'prd_pa': rnd.choice(['0301010072', '0301100039']),
+        'prd_cnspac': rnd.choice([f'7{i:014d}', '']), 'prd_nmpac': f'PACIENTE {i}', 'prd_dtnasc': '19800101',
+        'prd_dtaten': f'202512{rnd.randint(1, 28):02d}', 'prd_sexo': 'F', 'prd_raca': '01',
+        'prd_ibge': '172100', 'prd_qt_p': 1,
+    } for i in range(1, 2001)]
+    bpac = [{
+        'id': i, 'prd_uid': CNES, 'prd_cmp': COMPETENCIA, 'prd_cbo': rnd.choice(['225125', '322205']),
+        'prd_pa': '0301010048', 'prd_idade': str(rnd.randint(1, 90)).zfill(3), 'prd_qt_p': 2,
+    } for i in range(1, 401)]
+    return bpai, bpac
+
+
+@pytest.fixture
+def gerados(tmp_path):
+    bpai, bpac = _producao()
+    generator = BPAFileGenerator(BPAExportConfig(cnes=CNES, competencia=COMPETENCIA, sigla='CAPSAD'))
+    pasta = tmp_path / f'{CNES}_{COMPETENCIA}'
+    pasta.mkdir()
+    generator.write_reports(FakeDatabase(bpai, bpac), str(pasta), 'DEZ')
+    return pasta, bpai, bpac
+
+
+@pytest.mark.parametrize('arquivo', ['PACAPSAD.DEZ', 'BPAI_REL.TXT', 'BPAC_REL.TXT'])
+def test_generated_files_reconcile_with_database(gerados, arquivo):
+    pasta, bpai, bpac = gerados
+
+    resultado = reconciliar(str(pasta / arquivo), FakeDatabase(bpai, bpac), CNES, COMPETENCIA)
+
+    esperados = {'PACAPSAD.DEZ': 2400, 'BPAI_REL.TXT': 2000, 'BPAC_REL.TXT': 400}[arquivo]
+    assert resultado['registros_arquivo'] == resultado['registros_banco'] == esperados
+    assert resultado['so_no_arquivo'] == resultado['so_no_banco'] == 0
+    assert resultado['ok'] is True
+    if arquivo == 'PACAPSAD.DEZ':
+        assert resultado['cabecalho']['valido'] and resultado['cabecalho']['bpas'] == 100 + 20
+
+
+def test_divergences_are_reported_by_key(gerados):
+    pasta, bpai, bpac = gerados
+    # Banco mudou depois da geração: um procedimento trocado e um registro a mais no fim
+    original = dict(bpai[0])
+    bpai = [dict(r) for r in bpai]
+    bpai[0]['prd_pa'] = '0301080232'
+    bpai.append(dict(bpai[-1], id=2001, prd_cnspac='799999999999999'))
+
+    resultado = reconciliar(str(pasta / 'PACAPSAD.DEZ'), FakeDatabase(bpai, bpac), CNES, COMPETENCIA)
+
+    assert resultado['ok'] is False
+    assert (resultado['so_no_arquivo'], resultado['so_no_banco']) == (1, 2)
+    assert resultado['exemplos_so_no_arquivo'] == [['03', 1, 1, original['prd_pa'], original['prd_cnspac']]]
+    assert sorted(resultado['exemplos_so_no_banco']) == sorted([
+        ['03', 1, 1, '0301080232', original['prd_cnspac']],
+        ['03', 101, 1, bpai[-1]['prd_pa'], '799999999999999'],
+    ])
+
+
+def test_header_divergence_and_lazy_records(gerados):
+    pasta, _, _ = gerados
+    path = pasta / 'PACAPSAD.DEZ'
+    conteudo = path.read_bytes()
+    # Cabeçalho com um registro a menos e campo de controle antigo
+    path.write_bytes(conteudo[:13] + b'002399' + conteudo[19:])
+
+    with RemessaReader(str(path)) as remessa:
+        validacao = remessa.validar()
+        assert validacao['valido'] is False
+        assert validacao['registros'] == 2400
+        assert any('2399 registros' in erro for erro in validacao['erros'])
+        assert any('Campo de controle' in erro for erro in validacao['erros'])
+
+        assert len(remessa) == 2401
+        tipo, campos = remessa.registro(2400)
+        assert (tipo, campos['folha'], campos['seq']) == ('03', '100', '20')
+
+
+def test_empty_report_and_folder_name(tmp_path):
+    pasta = tmp_path / '6061478_202511'
+    pasta.mkdir()
+    (pasta / 'BPAC_REL.TXT').write_bytes(b'')
+
+    with BPACRelReader(str(pasta / 'BPAC_REL.TXT')) as rel:
+        assert rel.tamanho == 0 and list(rel.chaves()) == []
+    assert cnes_competencia_da_pasta(str(pasta / 'BPAC_REL.TXT')) == ('6061478', '202511')
+    assert cnes_competencia_da_pasta(str(tmp_path / 'x.txt')) == (None, None)
+
+
+@pytest.mark.skipif(not os.path.exists(os.path.join(AMOSTRA, 'PAUPANORTE.DEZ')), reason='amostra ausente')
+def test_sample_remessa_header_is_consistent():
+    with RemessaReader(os.path.join(AMOSTRA, 'PAUPANORTE.DEZ')) as remessa:
+        validacao = remessa.validar()
+    assert validacao['valido'], validacao['erros']
+    assert validacao['registros'] == validacao['cabecalho']['total_registros']
@@ -0,0 +1,160 @@
+import asyncio
+from contextlib import contextmanager
+from unittest.mock import MagicMock
+
+import database
+from services import response_cache
+from services.response_cache import LRUTier, ResponseCache, cached, versoes_dados
+
+
+class DictTier:
+    """Camada compartilhada em memória, no lugar do Redis"""
+
+    def __init__(self):
+        self.dados = {}
+
+    def get(self, chave):
+        return (chave in self.dados), self.dados.get(chave)
+
+    def set(self, chave, valor):
+        self.dados[chave] = valor
+
+
+def test_lru_discards_least_recently_used():
+    tier = LRUTier(max_entries=2)
+    tier.set('a', 1)
+    tier.set('b', 2)
+    assert tier.get('a') == (True, 1)
+    tier.set('c', 3)
+
+    assert tier.get('b') == (False, None)
+    assert tier.get('a') == (True, 1) and tier.get('c') == (True, 3)
+    assert len(tier) == 2
+
+
+def test_new_version_is_a_miss():
+    cache = ResponseCache(local=LRUTier(10))
+    calculos = []
+
+    def calcular():
+        calculos.append(1)
+        return {'total': len(calculos)}
+
+    params = {'cnes': '2755289', 'competencia': '202512'}
+    assert cache.get_or_compute('bpa/stats', params, {'bpa': 7}, calcular) == {'total': 1}
+    assert cache.get_or_compute('bpa/stats', params, {'bpa': 7}, calcular) == {'total': 1}
+    assert cache.get_or_compute('bpa/stats', params, {'bpa': 8}, calcular) == {'total': 2}
+    assert cache.get_or_compute('bpa/stats', {**params, 'cnes': '2492555'}, {'bpa': 8}, calcular) == {'total': 3}
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 3
+
+
+def test_shared_tier_serves_other_process():
+    compartilhado = DictTier()
+    primeiro = ResponseCache(local=LRUTier(10), shared=compartilhado)
+    segundo = ResponseCache(local=LRUTier(10), shared=compartilhado)
+
+    primeiro.get_or_compute('sigtap/cbos', {'competencia': '202512'}, {'sigtap': ['202512', 3]}, lambda: ['225125'])
+    calcular = MagicMock()
+    assert segundo.get_or_compute(
+        'sigtap/cbos', {'competencia': '202512'}, {'sigtap': ['202512', 3]}, calcular
+    ) == ['225125']
+    calcular.assert_not_called()
+    assert len(segundo.local) == 1
+
+
+def test_cached_computes_directly_without_versions(monkeypatch):
+    cache = ResponseCache(local=LRUTier(10))
+    monkeypatch.setattr(response_cache, '_cache', cache)
+
+    def sem_banco():
+        raise RuntimeError('relation "dados_versao" does not exist')
+
+    assert cached('bpa/stats', {}, sem_banco, lambda: {'bpai_total': 1}) == {'bpai_total': 1}
+    assert len(cache.local) == 0
+
+    monkeypatch.setattr(response_cache, 'RESPONSE_CACHE_ENABLED', False)
+    assert cached('bpa/stats', {}, lambda: {'bpa': 1}, lambda: {'bpai_total': 2}) == {'bpai_total': 2}
+    assert len(cache.local) == 0
+
+
+def test_versoes_dados_reads_all_scopes_in_one_query(monkeypatch):
+    conn = MagicMock()
+    cursor = conn.cursor.return_value.__enter__.return_value
+    cursor.fetchall.return_value = [('bpa', 'a1'), ('sigtap', 'b2')]
+
+    @contextmanager
+    def fake_connection():
+        yield conn
+
+    monkeypatch.setattr(database, 'get_connection', fake_connection)
+    versoes = versoes_dados(bpa=('2755289', None), cadastro=True, sigtap='202512')
+
+    assert versoes == {'bpa': 'a1', 'cadastro': 0, 'sigtap': ['202512', 'b2']}
+    cursor.execute.assert_called_once()
+    sql, params = cursor.execute.call_args[0]
+    assert "escopo = 'bpa' AND cnes = %s" in sql and 'competencia = %s AND competencia' not in sql
+    assert params == ['2755289', '202512']
+
+
+def test_init_creates_version_triggers_for_cadastros(monkeypatch):
+    conn = MagicMock()
+    cursor = conn.cursor.return_value.__enter__.return_value
+    cursor.fetchone.return_value = (True,)
+    executed = []
+    cursor.execute.side_effect = lambda sql, params=None: executed.append(' '.join(sql.split()))
+
+    @contextmanager
+    def fake_connection():
+        yield conn
+
+    monkeypatch.setattr(database, 'get_connection', fake_connection)
+    database.init_database()
+
+    assert any('CREATE TABLE IF NOT EXISTS dados_versao' in sql for sql in executed)
+    triggers = [sql for sql in executed if sql.startswith('CREATE TRIGGER trg_dados_versao')]
+    assert [sql.split(' ON ')[1].split()[0] for sql in triggers] == ['profissionais', 'pacientes']
+    assert all("dados_versao_trigger('cadastro')" in sql for sql in triggers)
+    # Produção versionada pelo próprio trigger do resumo
+    resumo = next(sql for sql in executed if 'FUNCTION producao_resumo_trigger' in sql)
+    assert 'dados_versao_incrementar' in resumo
+
+
+def test_cached_async_reuses_response_for_same_versions(monkeypatch):
+    monkeypatch.setattr(response_cache, '_cache', ResponseCache(local=LRUTier(10)))
+    calculos = []
+
+    async def versoes():
+        return {'bpa': 3}
+
+    async def calcular():
+        calculos.append(1)
+        return {'bpai_total': 10}
+
+    async def duas_vezes():
+        primeira = await response_cache.cached_async('bpa/stats', {'cnes': '2755289'}, versoes, calcular)
+        segunda = await response_cache.cached_async('bpa/stats', {'cnes': '2755289'}, versoes, calcular)
+        return primeira, segunda
+
+    assert asyncio.run(duas_vezes()) == ({'bpai_total': 10}, {'bpai_total': 10})
+    assert len(calculos) == 1
+
+
+def test_version_changes_when_lower_sequence_value_commits_late(postgres, monkeypatch):
+    monkeypatch.setattr(database, 'get_connection', postgres)
+    with postgres() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                INSERT INTO dados_versao (escopo, cnes, competencia, versao) VALUES
+                    ('bpa', '2755289', '202511', 5), ('bpa', '2755289', '202512', 11)
+            """)
+        conn.commit()
+    antes = versoes_dados(bpa=('2755289', None))
+
+    # Escrita em 202511 que pegou 10 da sequência confirma depois da que pegou 11
+    with postgres() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("UPDATE dados_versao SET versao = 10 WHERE competencia = '202511'")
+        conn.commit()
+
+    assert versoes_dados(bpa=('2755289', None)) != antes
+    assert versoes_dados(bpa=('2755289', '202511')) != versoes_dados(bpa=('2755289', '202512'))
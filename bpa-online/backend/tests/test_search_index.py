@@ -0,0 +1,60 @@
+import json
+
+from services.dbf_manager_service import DBFManagerService
+from services.search_index import SearchIndex, normalize
+
+ENTRIES = [
+    ('0301010072', 'CONSULTA MEDICA EM ATENÇÃO ESPECIALIZADA'),
+    ('0301010064', 'CONSULTA MEDICA EM ATENÇÃO PRIMÁRIA'),
+    ('0301010110', 'CONSULTA PRÉ-NATAL'),
+    ('0302010033', 'ATENDIMENTO FISIOTERAPÊUTICO EM PACIENTES'),
+    ('0101040083', 'MEDIÇÃO DE PESO'),
+    ('0211060232', 'TESTE ORTÓPTICO'),
+]
+
+
+def test_normalize_remove_acentos_e_pontuacao():
+    assert normalize('Atenção pré-natal') == 'ATENCAO PRE NATAL'
+    assert normalize(None) == ''
+
+
+def test_busca_sem_acento_e_ranqueada():
+    index = SearchIndex(ENTRIES)
+
+    assert index.search('atencao primaria') == ['0301010064']
+    assert index.search('FISIOTERAPEUTICO') == ['0302010033']
+    # Nome começando pelo termo vem antes do termo no meio do nome
+    assert index.search('medic') == ['0101040083', '0301010064', '0301010072']
+    assert index.search('consulta', limit=1) == ['0301010110']
+    assert index.search('xyz') == []
+
+
+def test_prefixo_curto_e_codigo():
+    index = SearchIndex(ENTRIES)
+
+    assert index.search('co', limit=10) == ['0301010110', '0301010064', '0301010072']
+    assert index.search('03.01.01', limit=2) == ['0301010064', '0301010072']
+    assert index.search('0301010072') == ['0301010072']
+    # Trecho do meio do código também casa (como a busca por substring antiga)
+    assert index.search('010072') == ['0301010072']
+
+
+def test_allowed_restringe_resultados():
+    index = SearchIndex(ENTRIES)
+
+    assert index.search('consulta', allowed={'0301010072'}) == ['0301010072']
+    assert index.search('0301', limit=1, allowed={'0301010110'}) == ['0301010110']
+
+
+def test_busca_sem_dbf_mantem_cache_expirado(tmp_path):
+    cache = tmp_path / 'procedimentos_info_cache.json'
+    cache.write_text(json.dumps({
+        'timestamp': '2020-01-01T00:00:00',
+        'data': {'0301010072': {'codigo': '0301010072', 'descricao': 'CONSULTA MEDICA'}},
+    }), encoding='utf-8')
+    service = DBFManagerService(dbf_path=str(tmp_path / 'sem_dbf'))
+    service.cache_dir = str(tmp_path)
+
+    assert [p['codigo'] for p in service.search_procedimentos('consulta')] == ['0301010072']
+    # Reconstrução vazia (DBFs ausentes) não sobrescreve o cache em disco
+    assert json.loads(cache.read_text(encoding='utf-8'))['timestamp'] == '2020-01-01T00:00:00'
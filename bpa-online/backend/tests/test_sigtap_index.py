@@ -0,0 +1,165 @@
+import os
+import pickle
+import shutil
+import tempfile
+
+import pytest
+
+from services import sigtap_index
+from services.sigtap_filter_service import SigtapFilterService
+from services.sigtap_index import SigtapIndex, build_index, index_path, load_or_build_index
+from services.sigtap_parser import SigtapParser
+
+LAYOUTS = {
+    'tb_procedimento': "CO_PROCEDIMENTO,10,1,10,C\nNO_PROCEDIMENTO,20,11,30,C\nVL_SA,10,31,40,N\n",
+    'rl_procedimento_registro': "CO_PROCEDIMENTO,10,1,10,C\nCO_REGISTRO,2,11,12,C\n",
+    'rl_procedimento_servico': "CO_PROCEDIMENTO,10,1,10,C\nCO_SERVICO,3,11,13,C\nCO_CLASSIFICACAO,3,14,16,C\n",
+    'rl_procedimento_cid': "CO_PROCEDIMENTO,10,1,10,C\nCO_CID,4,11,14,C\n",
+}
+
+DATA = {
+    'tb_procedimento': (
+        "0301010072CONSULTA MEDICA     0000001000\n"
+        "0301010048CONSULTA ORTOPEDIA  0000002000\n"
+        "0415010012CIRURGIA            0000000000\n"
+    ),
+    'rl_procedimento_registro': "030101007201\n030101007202\n030101004802\n",
+    'rl_procedimento_servico': "0301010072115001\n0301010048114002\n",
+    'rl_procedimento_cid': "0301010072F200\n0301010072F329\n",
+}
+
+
+@pytest.fixture(autouse=True)
+def index_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(sigtap_index, 'INDEX_DIR', tmp_path / 'sigtap_index')
+    return tmp_path / 'sigtap_index'
+
+
+@pytest.fixture
+def sigtap_dir():
+    temp_dir = tempfile.mkdtemp()
+    for nome, layout in LAYOUTS.items():
+        with open(os.path.join(temp_dir, f'{nome}_layout.txt'), 'w', encoding='utf-8') as f:
+            f.write("Coluna,Tamanho,Inicio,Fim,Tipo\n" + layout)
+        with open(os.path.join(temp_dir, f'{nome}.txt'), 'w', encoding='latin-1') as f:
+            f.write(DATA[nome])
+    yield temp_dir
+    shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def test_index_roundtrip_matches_parser(sigtap_dir):
+    build_index(sigtap_dir)
+    index = SigtapIndex.load(index_path(sigtap_dir))
+
+    assert [p['CO_PROCEDIMENTO'] for p in index.procedimentos] == ['0301010072', '0301010048', '0415010012']
+    assert index.valores['0301010048']['valor_sa'] == 20.00
+    assert index.registro_map['0301010072'] == {'01', '02'}
+    assert index.servico_map['0301010048'] == {('114', '002')}
+    assert index.cid_map['0301010072'] == {'F200', 'F329'}
+    # rl_procedimento_ocupacao ausente no pacote: relação vazia
+    assert index.cbo_map == {}
+    assert index.ambulatoriais == {'0301010072', '0301010048'}
+
+    parser = SigtapParser(sigtap_dir)
+    indexed = SigtapParser(sigtap_dir)
+    indexed.load_index(index)
+    assert sorted(indexed.get_procedimentos_by_tipo_registro('02')) == sorted(parser.get_procedimentos_by_tipo_registro('02'))
+    assert indexed.get_procedimentos_by_servicos(['115', '114']) == parser.get_procedimentos_by_servicos(['115', '114'])
+    assert indexed.get_procedimento_valor('0301010072') == parser.get_procedimento_valor('0301010072')
+
+
+def test_stale_index_is_rebuilt(sigtap_dir):
+    build_index(sigtap_dir)
+    with open(os.path.join(sigtap_dir, 'tb_procedimento.txt'), 'a', encoding='latin-1') as f:
+        f.write("0301010099CONSULTA NOVA       0000003000\n")
+
+    index = load_or_build_index(sigtap_dir)
+
+    assert '0301010099' in index.por_codigo
+
+
+def test_stale_relation_is_rebuilt(sigtap_dir):
+    build_index(sigtap_dir)
+    with open(os.path.join(sigtap_dir, 'rl_procedimento_cid.txt'), 'a', encoding='latin-1') as f:
+        f.write("0301010048M545\n")
+
+    index = load_or_build_index(sigtap_dir)
+
+    assert index.cid_map['0301010048'] == {'M545'}
+
+
+_executados = []
+
+
+def _payload():
+    _executados.append(True)
+
+
+class _Malicioso:
+    def __reduce__(self):
+        return (_payload, ())
+
+
+def test_pickle_da_competencia_nunca_e_carregado(sigtap_dir, index_dir):
+    # Diretório da competência vem do ZIP enviado: pickle ali não é do servidor
+    for nome in ('sigtap_index.pkl', os.path.basename(index_path(sigtap_dir))):
+        with open(os.path.join(sigtap_dir, nome), 'wb') as f:
+            pickle.dump(_Malicioso(), f)
+
+    index = load_or_build_index(sigtap_dir)
+
+    assert not _executados
+    assert '0301010072' in index.por_codigo
+    assert index_path(sigtap_dir).parent == index_dir
+    assert not str(index_path(sigtap_dir)).startswith(os.path.realpath(sigtap_dir))
+
+
+def test_filter_service_uses_index_maps(sigtap_dir):
+    svc = SigtapFilterService()
+    parser = SigtapParser(sigtap_dir)
+    parser.load_index(load_or_build_index(sigtap_dir))
+    svc._parsers['TESTE'] = parser
+
+    assert svc._get_procedimento_registro_map('TESTE') is parser.index.registro_map
+    res = svc.get_procedimentos_filtrados(tipo_registro='01', competencia='TESTE')
+    assert [p['CO_PROCEDIMENTO'] for p in res] == ['0301010072']
+    assert svc.get_estatisticas('TESTE')['total_relacoes_registro'] == 3
+
+
+def test_procedimento_info_lookup_and_bulk(sigtap_dir):
+    svc = SigtapFilterService()
+    parser = SigtapParser(sigtap_dir)
+    parser.load_index(load_or_build_index(sigtap_dir))
+    svc._parsers['TESTE'] = parser
+
+    info = svc.get_procedimento_info('0301010072', competencia='TESTE')
+    assert info['nome'] == 'CONSULTA MEDICA'
+    assert info['valor_total'] == 10.00
+    assert sorted(info['registros']) == ['01', '02']
+    # Mesma instância em chamadas repetidas (sem remontar o dict)
+    assert svc.get_procedimento_info('0301010072', competencia='TESTE') is info
+    assert svc.get_procedimento_info('9999999999', competencia='TESTE') is None
+
+    lote = svc.get_procedimentos_info(['0301010048', '9999999999', '0415010012'], competencia='TESTE')
+    assert sorted(lote) == ['0301010048', '0415010012']
+
+    # Parser sem índice: mesmo resultado
+    with open(os.path.join(sigtap_dir, 'rl_procedimento_ocupacao_layout.txt'), 'w', encoding='utf-8') as f:
+        f.write("Coluna,Tamanho,Inicio,Fim,Tipo\nCO_PROCEDIMENTO,10,1,10,C\nCO_OCUPACAO,6,11,16,C\n")
+    open(os.path.join(sigtap_dir, 'rl_procedimento_ocupacao.txt'), 'w').close()
+    svc._parsers['SEM_INDICE'] = SigtapParser(sigtap_dir)
+    sem_indice = svc.get_procedimento_info('0301010072', competencia='SEM_INDICE')
+    assert {k: v for k, v in sem_indice.items() if k != 'registros'} == \
+        {k: v for k, v in info.items() if k != 'registros'}
+
+
+def test_filtrados_busca_pelo_indice(sigtap_dir):
+    svc = SigtapFilterService()
+    parser = SigtapParser(sigtap_dir)
+    parser.load_index(load_or_build_index(sigtap_dir))
+    svc._parsers['TESTE'] = parser
+
+    res = svc.get_procedimentos_filtrados(termo_busca='consulta médica', competencia='TESTE')
+    assert [p['CO_PROCEDIMENTO'] for p in res] == ['0301010072']
+    res = svc.get_procedimentos_filtrados(termo_busca='consulta', tipo_registro='02', competencia='TESTE')
+    assert [p['CO_PROCEDIMENTO'] for p in res] == ['0301010072', '0301010048']
@@ -43,6 +43,16 @@ class TestSigtapManager:
         # Verifica se definiu como ativa automaticamente (pois é a primeira)
         assert manager.get_active_competencia() == "202512"
 
+    def test_import_remove_pickle_do_zip(self, manager):
+        zip_path = self.create_dummy_zip()
+        with zipfile.ZipFile(zip_path, 'a') as zf:
+            zf.writestr('sigtap_index.pkl', b'nao carregar')
+            zf.writestr('sub/outro.pkl', b'nao carregar')
+
+        manager.import_competencia(zip_path, "202512")
+
+        assert list(Path(manager.get_sigtap_dir("202512")).rglob('*.pkl')) == []
+
     def test_switch_active_competencia(self, manager):
         # Importar duas competências
         zip_path = self.create_dummy_zip()
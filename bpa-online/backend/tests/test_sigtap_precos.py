@@ -0,0 +1,107 @@
+from contextlib import contextmanager
+from decimal import Decimal
+from unittest.mock import MagicMock
+
+import database
+from database import BPADatabase
+from services import financial_service
+from services.financial_service import FinancialService
+from services.sigtap_precos import carregar_precos, linhas_precos
+
+
+class FakeParser:
+    def parse_procedimentos(self):
+        return [
+            {'CO_PROCEDIMENTO': '0301010072', 'NO_PROCEDIMENTO': 'CONSULTA MEDICA EM ATENCAO ESPECIALIZADA ',
+             'VL_SA': '000000001000', 'VL_SH': '', 'VL_SP': '000000000000'},
+            {'CO_PROCEDIMENTO': '0101010010', 'NO_PROCEDIMENTO': 'ATIVIDADE EDUCATIVA',
+             'VL_SA': '000000000247', 'VL_SH': '0', 'VL_SP': 'x'},
+            {'CO_PROCEDIMENTO': '0301010072', 'NO_PROCEDIMENTO': 'DUPLICADO', 'VL_SA': '1', 'VL_SH': '', 'VL_SP': ''},
+        ]
+
+    def parse_ocupacoes(self):
+        return [{'CO_OCUPACAO': '225125', 'NO_OCUPACAO': 'MEDICO CLINICO'}]
+
+
+def test_linhas_precos_converts_centavos_and_skips_duplicates():
+    assert list(linhas_precos('202512', FakeParser())) == [
+        ('202512', '0301010072', 'CONSULTA MEDICA EM ATENCAO ESPECIALIZADA', 10.0, 0.0, 0.0),
+        ('202512', '0101010010', 'ATIVIDADE EDUCATIVA', 2.47, 0.0, 0.0),
+    ]
+
+
+def test_carregar_precos_replaces_competencia_version():
+    conn = MagicMock()
+    cursor = conn.cursor.return_value.__enter__.return_value
+    copiados = {}
+    cursor.copy_expert.side_effect = lambda sql, buffer: copiados.setdefault(sql.split()[1], buffer.getvalue())
+
+    assert carregar_precos(conn, FakeParser(), '202512') == {'procedimentos': 2, 'ocupacoes': 1}
+
+    executados = [' '.join(c.args[0].split()) for c in cursor.execute.call_args_list]
+    assert executados[1] == 'DELETE FROM sigtap_preco WHERE competencia = %s'
+    assert executados[-1].startswith('INSERT INTO sigtap_preco_versao')
+    assert copiados['sigtap_preco'].splitlines()[1] == '202512\t0101010010\tATIVIDADE EDUCATIVA\t2.47\t0.0\t0.0'
+    assert copiados['sigtap_preco_ocupacao'] == '202512\t225125\tMEDICO CLINICO\n'
+    conn.commit.assert_called_once()
+
+
+def test_financial_dashboard_is_one_query(monkeypatch):
+    conn = MagicMock()
+    cursor = conn.cursor.return_value.__enter__.return_value
+    cursor.fetchall.return_value = []
+
+    @contextmanager
+    def fake_connection():
+        yield conn
+
+    monkeypatch.setattr(database, 'get_connection', fake_connection)
+    db = object.__new__(BPADatabase)
+    db.get_financial_dashboard('202512', competencia_inicio='202401', cnes_list=['2755289'], tipo_bpa='BPA-I')
+
+    cursor.execute.assert_called_once()
+    sql, params = cursor.execute.call_args[0]
+    assert 'GROUPING SETS' in sql and 'bpa_consolidado' not in sql
+    assert params == ['202401', ['2755289'], '202512', '202512', '202512', 10]
+
+    cursor.execute.reset_mock()
+    db.get_financial_dashboard('202512', cbo='225125')
+    sql, params = cursor.execute.call_args[0]
+    assert 'UNION ALL' in sql
+    assert params == ['225125', '225125', '202512', '202512', '202512', 10]
+
+
+def test_dashboard_stats_shape(monkeypatch):
+    linhas = [
+        {'grupo': 'cbo', 'competencia': None, 'procedimento': None, 'cbo': '225125', 'quantidade': 30,
+         'valor': Decimal('300.00'), 'itens': 2, 'no_procedimento': None, 'no_ocupacao': 'MEDICO CLINICO'},
+        {'grupo': 'cbo', 'competencia': None, 'procedimento': None, 'cbo': '322205', 'quantidade': 5,
+         'valor': Decimal('12.35'), 'itens': 2, 'no_procedimento': None, 'no_ocupacao': None},
+        {'grupo': 'evolucao', 'competencia': '202511', 'procedimento': None, 'cbo': None, 'quantidade': 10,
+         'valor': Decimal('100.00'), 'itens': 2, 'no_procedimento': None, 'no_ocupacao': None},
+        {'grupo': 'evolucao', 'competencia': '202512', 'procedimento': None, 'cbo': None, 'quantidade': 25,
+         'valor': Decimal('212.35'), 'itens': 2, 'no_procedimento': None, 'no_ocupacao': None},
+        {'grupo': 'procedimento', 'competencia': None, 'procedimento': '0301010072', 'cbo': None, 'quantidade': 30,
+         'valor': Decimal('300.00'), 'itens': 1, 'no_procedimento': 'CONSULTA MEDICA', 'no_ocupacao': None},
+        {'grupo': 'total', 'competencia': None, 'procedimento': None, 'cbo': None, 'quantidade': 35,
+         'valor': Decimal('312.345'), 'itens': 1, 'no_procedimento': None, 'no_ocupacao': None},
+    ]
+    fake_db = MagicMock()
+    fake_db.get_financial_dashboard.return_value = linhas
+    monkeypatch.setattr(financial_service, 'db', fake_db)
+    garantidas = []
+    monkeypatch.setattr(financial_service, 'garantir_precos', garantidas.append)
+
+    service = object.__new__(FinancialService)
+    service.sigtap_manager = MagicMock()
+    stats = service.get_dashboard_stats(competencia_inicio='202511', competencia_fim='202512')
+
+    assert garantidas == ['202511']
+    assert fake_db.get_financial_dashboard.call_args[0] == ('202511',)
+    assert stats['kpis'] == {'total_faturado': 312.35, 'total_procedimentos': 35, 'total_cbos_atuantes': 2}
+    graficos = stats['graficos']
+    assert [e['competencia'] for e in graficos['evolucao_faturamento']] == ['202511', '202512']
+    assert graficos['top_procedimentos_valor'] == [
+        {'codigo': '0301010072', 'nome': 'CONSULTA MEDICA', 'quantidade': 30, 'valor': 300.0}
+    ]
+    assert [c['nome'] for c in graficos['top_cbos_valor']] == ['MEDICO CLINICO', 'CBO 322205']
@@ -0,0 +1,16 @@
+from rest_framework.renderers import BaseRenderer
+from rest_framework.settings import api_settings
+
+
+class NDJSONRenderer(BaseRenderer):
+	"""Aceita ?format=ndjson; a view devolve o stream pronto (StreamingHttpResponse)"""
+
+	media_type = "application/x-ndjson"
+	format = "ndjson"
+	charset = "utf-8"
+
+	def render(self, data, accepted_media_type=None, renderer_context=None):
+		return data
+
+
+LISTAGEM_RENDERERS = [*api_settings.DEFAULT_RENDERER_CLASSES, NDJSONRenderer]
@@ -6,6 +6,7 @@ app_name = "api"
 
 urlpatterns = [
     path("health", views.health_check, name="health"),
+    path("metrics", views.metrics, name="metrics"),
     path("auth/login", views.login, name="login"),
     path("auth/register", views.register, name="register"),
     path("auth/me", views.get_me, name="me"),
@@ -20,7 +21,9 @@ urlpatterns = [
     path("admin/historico-extracoes", views.admin_historico_extracoes, name="admin-historico-extracoes"),
     path("admin/fix-encoding", views.admin_fix_encoding, name="admin-fix-encoding"),
     path("admin/delete-data", views.admin_delete_data, name="admin-delete-data"),
+    path("admin/competencias/<str:competencia>", views.admin_remover_competencia, name="admin-remover-competencia"),
     path("admin/dashboard/stats", views.admin_dashboard_stats, name="admin-dashboard-stats"),
+    path("admin/db/consultas-lentas", views.admin_consultas_lentas, name="admin-consultas-lentas"),
     path("dashboard/stats", views.dashboard_stats, name="dashboard-stats"),
     path("bpa/stats", views.bpa_stats, name="bpa-stats"),
     path("profissionais", views.profissionais, name="profissionais"),
@@ -47,10 +50,13 @@ urlpatterns = [
     path("sigtap/competencias", views.sigtap_competencias, name="sigtap-competencias"),
     path("sigtap/competencias/<str:competencia>/activate", views.sigtap_activate_competencia, name="sigtap-activate"),
     path("sigtap/procedimentos", views.sigtap_procedimentos, name="sigtap-procedimentos"),
+    path("sigtap/procedimentos/lote", views.sigtap_procedimentos_lote, name="sigtap-procedimentos-lote"),
     path("sigtap/estatisticas", views.sigtap_estatisticas, name="sigtap-estatisticas"),
     path("sigtap/registros", views.sigtap_registros, name="sigtap-registros"),
     path("reports/generate", views.reports_generate, name="reports-generate"),
+    path("reports/generate-batch", views.reports_generate_batch, name="reports-generate-batch"),
     path("reports/download/<str:folder>/<str:filename>", views.reports_download, name="reports-download"),
+    path("reports/reconcile/<str:folder>/<str:filename>", views.reports_reconcile, name="reports-reconcile"),
     path("reports/list", views.reports_list, name="reports-list"),
     path("biserver/test-connection", views.biserver_test_connection, name="biserver-test"),
     path("biserver/extract", views.biserver_extract, name="biserver-extract"),
@@ -8,16 +8,17 @@ from django.contrib.auth import get_user_model
 from django.contrib.auth.hashers import check_password
 from django.db import IntegrityError
 from django.db import connection
-from django.http import FileResponse
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
 from rest_framework.parsers import FormParser, MultiPartParser
 from rest_framework import status
-from rest_framework.decorators import api_view, parser_classes, permission_classes
+from rest_framework.decorators import api_view, parser_classes, permission_classes, renderer_classes
 from rest_framework.permissions import AllowAny
 from rest_framework.response import Response
 
 from .authentication import encode_token
 from .legacy import get_bpa_database, get_dbf_manager
 from .permissions import IsAdminPerfil
+from .renderers import LISTAGEM_RENDERERS
 from .models import Paciente, Profissional
 from .serializers import (
 	LoginSerializer,
@@ -36,6 +37,15 @@ def health_check(request):
 	return Response({"status": "ok"})
 
 
+def metrics(request):
+	"""Métricas do banco (Prometheus); fora do DRF para o token não passar pela autenticação JWT"""
+	from services.db_metrics import PROMETHEUS_CONTENT_TYPE, metrics_autorizado, prometheus_text
+
+	if not metrics_autorizado(request.headers.get("Authorization")):
+		return HttpResponse("Token de metricas invalido", status=401)
+	return HttpResponse(prometheus_text(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+
 def _verify_legacy_password(raw_password: str, stored_hash: str) -> bool:
 	if stored_hash.startswith("$2a$") or stored_hash.startswith("$2b$"):
 		return bcrypt.checkpw(raw_password.encode("utf-8"), stored_hash.encode("utf-8"))
@@ -317,104 +327,7 @@ def admin_list_cbos(request):
 @permission_classes([IsAdminPerfil])
 def admin_database_overview(request):
 	try:
-		with connection.cursor() as cursor:
-			cursor.execute(
-				"""
-				SELECT 
-					prd_uid as cnes,
-					prd_cmp as competencia,
-					COUNT(*) as total_bpa_i,
-					SUM(CASE WHEN prd_exportado = FALSE THEN 1 ELSE 0 END) as pendentes,
-					SUM(CASE WHEN prd_exportado = TRUE THEN 1 ELSE 0 END) as exportados,
-					MIN(created_at) as primeira_insercao,
-					MAX(created_at) as ultima_insercao
-				FROM bpa_individualizado
-				GROUP BY prd_uid, prd_cmp
-				ORDER BY prd_uid, prd_cmp DESC;
-				"""
-			)
-			bpa_i_data = [
-				{
-					"cnes": row[0],
-					"competencia": row[1],
-					"total": row[2],
-					"pendentes": row[3],
-					"exportados": row[4],
-					"primeira_insercao": row[5].isoformat() if row[5] else None,
-					"ultima_insercao": row[6].isoformat() if row[6] else None,
-					"tipo": "bpa_i",
-				}
-				for row in cursor.fetchall()
-			]
-
-			cursor.execute(
-				"""
-				SELECT 
-					prd_uid as cnes,
-					prd_cmp as competencia,
-					COUNT(*) as total_bpa_c,
-					SUM(CASE WHEN prd_exportado = FALSE THEN 1 ELSE 0 END) as pendentes,
-					SUM(CASE WHEN prd_exportado = TRUE THEN 1 ELSE 0 END) as exportados,
-					MIN(created_at) as primeira_insercao,
-					MAX(created_at) as ultima_insercao
-				FROM bpa_consolidado
-				GROUP BY prd_uid, prd_cmp
-				ORDER BY prd_uid, prd_cmp DESC;
-				"""
-			)
-			bpa_c_data = [
-				{
-					"cnes": row[0],
-					"competencia": row[1],
-					"total": row[2],
-					"pendentes": row[3],
-					"exportados": row[4],
-					"primeira_insercao": row[5].isoformat() if row[5] else None,
-					"ultima_insercao": row[6].isoformat() if row[6] else None,
-					"tipo": "bpa_c",
-				}
-				for row in cursor.fetchall()
-			]
-
-			cursor.execute(
-				"""
-				SELECT DISTINCT prd_uid 
-				FROM bpa_individualizado
-				UNION
-				SELECT DISTINCT prd_uid 
-				FROM bpa_consolidado
-				ORDER BY prd_uid;
-				"""
-			)
-			cnes_list = [row[0] for row in cursor.fetchall()]
-
-			cursor.execute("SELECT COUNT(*) FROM bpa_individualizado;")
-			total_bpa_i = cursor.fetchone()[0]
-
-			cursor.execute("SELECT COUNT(*) FROM bpa_consolidado;")
-			total_bpa_c = cursor.fetchone()[0]
-
-			cursor.execute("SELECT COUNT(*) FROM profissionais;")
-			total_prof = cursor.fetchone()[0]
-
-			cursor.execute("SELECT COUNT(*) FROM pacientes;")
-			total_pac = cursor.fetchone()[0]
-
-		return Response(
-			{
-				"success": True,
-				"cnes_list": cnes_list,
-				"total_cnes": len(cnes_list),
-				"bpa_i": bpa_i_data,
-				"bpa_c": bpa_c_data,
-				"totals": {
-					"bpa_i": total_bpa_i,
-					"bpa_c": total_bpa_c,
-					"profissionais": total_prof,
-					"pacientes": total_pac,
-				},
-			}
-		)
+		return Response(get_bpa_database().get_database_overview())
 	except Exception as exc:
 		return Response(
 			{"detail": str(exc)},
@@ -445,9 +358,9 @@ def admin_fix_encoding(request):
 	sigtap_dir = os.getenv("SIGTAP_DIR", "/app/sigtap")
 	if os.path.exists(sigtap_dir):
 		try:
-			from services.sigtap_parser import SigtapParser
+			from services.sigtap_index import get_sigtap_parser
 
-			sigtap_parser = SigtapParser(sigtap_dir)
+			sigtap_parser = get_sigtap_parser(sigtap_dir)
 		except Exception:
 			sigtap_parser = None
 
@@ -476,50 +389,23 @@ def admin_delete_data(request):
 			status=status.HTTP_400_BAD_REQUEST,
 		)
 
+	from database import remover_pacientes_sem_producao, remover_producao
+
 	deleted_count = 0
 	with connection.cursor() as cursor:
+		# Meses em que o CNES e a unica unidade saem com DROP da particao
 		if tipo in {"bpa_i", "all"}:
-			if competencia:
-				cursor.execute(
-					"DELETE FROM bpa_individualizado WHERE prd_uid = %s AND prd_cmp = %s",
-					[cnes, competencia],
-				)
-			else:
-				cursor.execute(
-					"DELETE FROM bpa_individualizado WHERE prd_uid = %s",
-					[cnes],
-				)
-			deleted_count += cursor.rowcount
+			deleted_count += remover_producao(cursor, "bpa_individualizado", cnes, competencia)
 
 		if tipo in {"bpa_c", "all"}:
-			if competencia:
-				cursor.execute(
-					"DELETE FROM bpa_consolidado WHERE prd_uid = %s AND prd_cmp = %s",
-					[cnes, competencia],
-				)
-			else:
-				cursor.execute(
-					"DELETE FROM bpa_consolidado WHERE prd_uid = %s",
-					[cnes],
-				)
-			deleted_count += cursor.rowcount
+			deleted_count += remover_producao(cursor, "bpa_consolidado", cnes, competencia)
 
 		if tipo in {"profissionais", "all"}:
 			cursor.execute("DELETE FROM profissionais WHERE cnes = %s", [cnes])
 			deleted_count += cursor.rowcount
 
 		if tipo in {"pacientes", "all"}:
-			cursor.execute(
-				"""
-				DELETE FROM pacientes
-				WHERE cns NOT IN (
-					SELECT DISTINCT prd_cnspac
-					FROM bpa_individualizado
-					WHERE prd_cnspac IS NOT NULL
-				)
-				"""
-			)
-			deleted_count += cursor.rowcount
+			deleted_count += remover_pacientes_sem_producao(cursor)
 
 	return Response(
 		{
@@ -533,6 +419,37 @@ def admin_delete_data(request):
 	)
 
 
+@api_view(["DELETE"])
+@permission_classes([IsAdminPerfil])
+def admin_remover_competencia(request, competencia: str):
+	tipo = request.query_params.get("tipo", "all")
+	arquivar = request.query_params.get("arquivar", "false").lower() in {"1", "true", "sim"}
+	if tipo not in {"bpa_i", "bpa_c", "all"}:
+		return Response(
+			{"detail": "tipo deve ser bpa_i, bpa_c ou all"},
+			status=status.HTTP_400_BAD_REQUEST,
+		)
+
+	resultado = get_bpa_database().remover_competencia(competencia, tipo, arquivar)
+	return Response(
+		{
+			"success": True,
+			"competencia": competencia,
+			"arquivada": arquivar,
+			"removidos": resultado,
+			"deleted": sum(resultado.values()),
+		}
+	)
+
+
+@api_view(["GET"])
+@permission_classes([IsAdminPerfil])
+def admin_consultas_lentas(request):
+	from services.db_metrics import DB_SLOW_QUERY_MS, consultas_lentas
+
+	return Response({"limite_ms": DB_SLOW_QUERY_MS, "consultas": consultas_lentas()})
+
+
 @api_view(["GET"])
 def dashboard_stats(request):
 	cnes_filter = request.query_params.get("cnes_filter")
@@ -555,8 +472,15 @@ def dashboard_stats(request):
 			}
 		)
 
+	from services.response_cache import cached, versoes_dados
+
 	db = get_bpa_database()
-	stats = db.get_stats_by_cnes(cnes)
+	stats = cached(
+		"dashboard/stats",
+		{"cnes": cnes},
+		lambda: versoes_dados(bpa=(cnes, None), cadastro=True),
+		lambda: db.get_stats_by_cnes(cnes),
+	)
 
 	return Response(
 		{
@@ -589,8 +513,15 @@ def bpa_stats(request):
 	if not cnes:
 		return Response({"detail": "CNES obrigatorio"}, status=status.HTTP_400_BAD_REQUEST)
 
+	from services.response_cache import cached, versoes_dados
+
 	db = get_bpa_database()
-	stats = db.get_bpa_stats(cnes, competencia)
+	stats = cached(
+		"bpa/stats",
+		{"cnes": cnes, "competencia": competencia},
+		lambda: versoes_dados(bpa=(cnes, competencia)),
+		lambda: db.get_bpa_stats(cnes, competencia),
+	)
 	return Response(stats)
 
 
@@ -690,12 +621,17 @@ def procedures_search(request):
 	else:
 		allowed = None
 
+	if query:
+		encontrados = dbf_manager.search_procedimentos(query, limit=limit, allowed=allowed)
+	else:
+		encontrados = (
+			info for codigo, info in procedimentos_info.items()
+			if allowed is None or codigo in allowed
+		)
+
 	results = []
-	for codigo, info in procedimentos_info.items():
-		if allowed is not None and codigo not in allowed:
-			continue
-		if query and query.lower() not in codigo.lower() and query.lower() not in info.get("descricao", "").lower():
-			continue
+	for info in encontrados:
+		codigo = info.get("codigo")
 		valor = float(info.get("valor_sh", 0) or 0) + float(info.get("valor_sp", 0) or 0) + float(info.get("valor_sa", 0) or 0)
 		results.append({"codigo": codigo, "descricao": info.get("descricao"), "valor": valor})
 		if len(results) >= limit:
@@ -743,12 +679,54 @@ def bpa_inconsistencies(request):
 
 	from services.inconsistency_service import InconsistencyService
 
+	try:
+		page = int(request.query_params.get("page", 1))
+		page_size = int(request.query_params.get("page_size", 100))
+	except ValueError:
+		return Response(
+			{"detail": "page e page_size devem ser inteiros"},
+			status=status.HTTP_400_BAD_REQUEST,
+		)
+
 	service = InconsistencyService()
-	report = service.get_inconsistency_report(cnes, competencia)
+	report = service.get_inconsistency_report(
+		cnes,
+		competencia,
+		page=page,
+		page_size=page_size,
+		tipo=request.query_params.get("tipo") or None,
+		regra=request.query_params.get("regra") or None,
+	)
 	return Response(report)
 
 
+def _listar_bpa(request, tabela: str, competencia: str, exportado):
+	"""Array completo (sem limit/cursor), pagina por keyset ou stream NDJSON (format=ndjson)"""
+	from services.bpa_paginacao import NDJSON_MEDIA_TYPE, CursorInvalido, ndjson_bpa, pagina_bpa
+
+	db = get_bpa_database()
+	cnes = request.user.cnes
+	limit = request.query_params.get("limit")
+	cursor = request.query_params.get("cursor")
+	try:
+		if request.query_params.get("format") == "ndjson":
+			linhas = ndjson_bpa(db, tabela, cnes, competencia, exportado, cursor)
+			return StreamingHttpResponse(linhas, content_type=NDJSON_MEDIA_TYPE)
+		if limit or cursor:
+			limit_value = int(limit) if limit else None
+			return Response(pagina_bpa(db, tabela, cnes, competencia, exportado, limit_value, cursor))
+	except CursorInvalido as exc:
+		return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+	except ValueError:
+		return Response({"detail": "limit invalido"}, status=status.HTTP_400_BAD_REQUEST)
+
+	if tabela == "bpa_individualizado":
+		return Response(db.list_bpa_individualizado(cnes, competencia, exportado))
+	return Response(db.list_bpa_consolidado(cnes, competencia))
+
+
 @api_view(["GET", "POST"])
+@renderer_classes(LISTAGEM_RENDERERS)
 def bpa_individualizado(request):
 	if request.method == "GET":
 		competencia = request.query_params.get("competencia")
@@ -763,9 +741,7 @@ def bpa_individualizado(request):
 		if exportado is not None:
 			exportado_value = str(exportado).lower() in {"1", "true", "yes"}
 
-		db = get_bpa_database()
-		records = db.list_bpa_individualizado(request.user.cnes, competencia, exportado_value)
-		return Response(records)
+		return _listar_bpa(request, "bpa_individualizado", competencia, exportado_value)
 
 	data = request.data
 	bpa_data = {
@@ -817,6 +793,7 @@ def bpa_individualizado_detail(request, record_id: int):
 
 
 @api_view(["GET", "POST"])
+@renderer_classes(LISTAGEM_RENDERERS)
 def bpa_consolidado(request):
 	if request.method == "GET":
 		competencia = request.query_params.get("competencia")
@@ -825,9 +802,7 @@ def bpa_consolidado(request):
 				{"detail": "competencia obrigatoria"},
 				status=status.HTTP_400_BAD_REQUEST,
 			)
-		db = get_bpa_database()
-		records = db.list_bpa_consolidado(request.user.cnes, competencia)
-		return Response(records)
+		return _listar_bpa(request, "bpa_consolidado", competencia, None)
 
 	data = request.data
 	bpa_data = {
@@ -1059,10 +1034,9 @@ def reports_generate(request):
 	extensao = EXTENSOES_MES.get(mes, "TXT")
 
 	db = get_bpa_database()
-	bpai_records = db.list_bpa_individualizado(cnes, competencia, limit=10000)
-	bpac_records = db.list_bpa_consolidado(cnes, competencia, limit=10000)
+	counts = db.get_bpa_stats(cnes, competencia)
 
-	if not bpai_records and not bpac_records:
+	if not counts["bpai_total"] and not counts["bpac_total"]:
 		return Response(
 			{
 				"success": False,
@@ -1074,7 +1048,7 @@ def reports_generate(request):
 
 	sigtap_parser = None
 	try:
-		from services.sigtap_parser import SigtapParser
+		from services.sigtap_index import get_sigtap_parser
 
 		sigtap_dir = os.path.join(
 			Path(__file__).resolve().parents[2],
@@ -1082,7 +1056,7 @@ def reports_generate(request):
 			"TabelaUnificada_202512_v2601161858",
 		)
 		if os.path.exists(sigtap_dir):
-			sigtap_parser = SigtapParser(sigtap_dir)
+			sigtap_parser = get_sigtap_parser(sigtap_dir)
 	except Exception:
 		sigtap_parser = None
 
@@ -1098,45 +1072,17 @@ def reports_generate(request):
 	)
 	generator = BPAFileGenerator(config, sigtap_parser=sigtap_parser)
 
-	set_content, total_registros, total_bpas = generator.generate_set_file(
-		bpai_records, bpac_records
-	)
-	campo_controle = str((total_registros * 7 + total_bpas * 3) % 10000).zfill(4)
-	relexp_content = generator.generate_relexp(total_registros, total_bpas, campo_controle, extensao)
-	bpai_rel_content = generator.generate_bpai_report(bpai_records)
-	bpac_rel_content = generator.generate_bpac_report(bpac_records)
-
 	reports_dir = Path(__file__).resolve().parents[2] / "backend" / "reports"
 	reports_dir.mkdir(exist_ok=True)
 	export_dir = reports_dir / f"{cnes}_{competencia}"
 	export_dir.mkdir(exist_ok=True)
 
-	files = {}
-	gerar_remessa = tipo in {"remessa", "all"}
-	gerar_relexp = tipo in {"remessa", "relexp", "all"}
-	gerar_bpai = tipo in {"bpai", "all"}
-	gerar_bpac = tipo in {"bpac", "all"}
-
-	if gerar_remessa:
-		set_filename = f"PA{sigla}.{extensao}"
-		with open(export_dir / set_filename, "w", encoding="latin-1") as handle:
-			handle.write(set_content)
-		files[set_filename] = f"/api/reports/download/{cnes}_{competencia}/{set_filename}"
-
-	if gerar_relexp:
-		with open(export_dir / "RELEXP.PRN", "w", encoding="latin-1") as handle:
-			handle.write(relexp_content)
-		files["RELEXP.PRN"] = f"/api/reports/download/{cnes}_{competencia}/RELEXP.PRN"
-
-	if gerar_bpai:
-		with open(export_dir / "BPAI_REL.TXT", "w", encoding="latin-1") as handle:
-			handle.write(bpai_rel_content)
-		files["BPAI_REL.TXT"] = f"/api/reports/download/{cnes}_{competencia}/BPAI_REL.TXT"
-
-	if gerar_bpac:
-		with open(export_dir / "BPAC_REL.TXT", "w", encoding="latin-1") as handle:
-			handle.write(bpac_rel_content)
-		files["BPAC_REL.TXT"] = f"/api/reports/download/{cnes}_{competencia}/BPAC_REL.TXT"
+	# Arquivos gravados lendo o banco em blocos (sem limite de registros)
+	resultado = generator.write_reports(db, str(export_dir), extensao, tipo)
+	files = {
+		nome: f"/api/reports/download/{cnes}_{competencia}/{nome}"
+		for nome in resultado["files"]
+	}
 
 	tipo_msg = {
 		"remessa": "Arquivo de remessa",
@@ -1151,17 +1097,38 @@ def reports_generate(request):
 			"success": True,
 			"message": f"{tipo_msg.get(tipo, 'Relatorios')} gerado(s) com sucesso para competencia {competencia}",
 			"stats": {
-				"total_registros": total_registros,
-				"total_bpas": total_bpas,
-				"bpai_count": len(bpai_records),
-				"bpac_count": len(bpac_records),
-				"campo_controle": campo_controle,
+				"total_registros": resultado["total_registros"],
+				"total_bpas": resultado["total_bpas"],
+				"bpai_count": resultado["bpai_count"],
+				"bpac_count": resultado["bpac_count"],
+				"campo_controle": resultado["campo_controle"],
 			},
 			"files": files,
 		}
 	)
 
 
+@api_view(["POST"])
+@permission_classes([IsAdminPerfil])
+def reports_generate_batch(request):
+	data = request.data
+	competencia = data.get("competencia")
+	if not competencia:
+		return Response(
+			{"detail": "competencia e obrigatoria"},
+			status=status.HTTP_400_BAD_REQUEST,
+		)
+
+	from services.remessa_batch import gerar_remessas_competencia
+
+	manifesto = gerar_remessas_competencia(
+		competencia,
+		cnes_list=data.get("cnes") or None,
+		tipo=data.get("tipo") or "all",
+	)
+	return Response(manifesto)
+
+
 @api_view(["GET"])
 def reports_download(request, folder: str, filename: str):
 	reports_dir = Path(__file__).resolve().parents[2] / "backend" / "reports"
@@ -1178,6 +1145,35 @@ def reports_download(request, folder: str, filename: str):
 	return FileResponse(open(filepath, "rb"), content_type=media_type, filename=filename)
 
 
+@api_view(["GET"])
+def reports_reconcile(request, folder: str, filename: str):
+	reports_dir = (Path(__file__).resolve().parents[2] / "backend" / "reports").resolve()
+	filepath = (reports_dir / folder / filename).resolve()
+	if reports_dir not in filepath.parents or not filepath.is_file():
+		return Response({"detail": "Arquivo nao encontrado"}, status=status.HTTP_404_NOT_FOUND)
+
+	cnes = request.query_params.get("cnes")
+	competencia = request.query_params.get("competencia")
+	if not cnes or not competencia:
+		partes = folder.split("_")
+		if len(partes) != 2:
+			return Response(
+				{"detail": "cnes e competencia sao obrigatorios"},
+				status=status.HTTP_400_BAD_REQUEST,
+			)
+		cnes = cnes or partes[0]
+		competencia = competencia or partes[1]
+
+	from services.remessa_reader import reconciliar
+
+	try:
+		limite = min(int(request.query_params.get("limite", 50)), 1000)
+		resultado = reconciliar(str(filepath), get_bpa_database(), cnes, competencia, limite)
+	except ValueError as exc:
+		return Response({"detail": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+	return Response(resultado)
+
+
 @api_view(["GET"])
 def reports_list(request):
 	reports_dir = Path(__file__).resolve().parents[2] / "backend" / "reports"
@@ -1381,7 +1377,7 @@ def biserver_extract_and_separate(request):
 	import time
 	from services.biserver_client import get_extraction_service
 	from services.corrections import BPACorrections
-	from services.sigtap_parser import SigtapParser
+	from services.sigtap_index import get_sigtap_parser
 	from database import BPADatabase
 
 	inicio = time.time()
@@ -1397,7 +1393,7 @@ def biserver_extract_and_separate(request):
 		msg = f"Diretorio SIGTAP nao encontrado: {sigtap_dir}"
 		return Response({"detail": msg}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-	sigtap_parser = SigtapParser(sigtap_dir)
+	sigtap_parser = get_sigtap_parser(sigtap_dir)
 	try:
 		procs_map = {
 			p["CO_PROCEDIMENTO"]: p["NO_PROCEDIMENTO"] for p in sigtap_parser.parse_procedimentos()
@@ -1479,6 +1475,7 @@ def biserver_extract_and_separate(request):
 	CNES_URGENCIA = ["2755289", "2492555", "2829606"]
 	carater = "02" if cnes in CNES_URGENCIA else "01"
 
+	bpai_records_to_save = []
 	for record in result.get("bpa_i", []):
 		if len(errors) >= max_errors:
 			stopped_early = True
@@ -1490,7 +1487,7 @@ def biserver_extract_and_separate(request):
 			quantidade = int(record.get("quantidade") or 1)
 			valor = float(record.get("valor_total") or 0)
 
-			db.save_bpa_individualizado(
+			bpai_records_to_save.append(
 				{
 					"prd_uid": cnes,
 					"prd_cmp": competencia,
@@ -1512,7 +1509,6 @@ def biserver_extract_and_separate(request):
 					"prd_org": "BISERVER",
 				}
 			)
-			saved_bpa_i += 1
 			procedimentos_counter_i[procedimento] += quantidade
 			profissionais_counter[record.get("cns_profissional")] += quantidade
 			distribuicao_dias[record.get("data_atendimento")] += quantidade
@@ -1520,6 +1516,15 @@ def biserver_extract_and_separate(request):
 		except Exception as exc:
 			errors.append(str(exc))
 
+	# Grava o que foi preparado mesmo após o stop point: o salvamento em lote
+	# confirma por bloco e só deixa de fora os registros com erro
+	failed_bpa_i = 0
+	if bpai_records_to_save:
+		save_result = db.save_bpa_individualizado_bulk(bpai_records_to_save, return_ids=False)
+		saved_bpa_i = save_result.get("saved", 0)
+		failed_bpa_i = save_result.get("failed", 0)
+		errors.extend(save_result.get("errors", [])[:5])
+
 	for record in result.get("bpa_c", []):
 		if len(errors) >= max_errors:
 			stopped_early = True
@@ -1564,6 +1569,7 @@ def biserver_extract_and_separate(request):
 					"bpa_i": saved_bpa_i,
 					"bpa_c": saved_bpa_c,
 				},
+				"failed": {"bpa_i": failed_bpa_i},
 				"corrections": {"bpai": stats_corr_bpi, "bpac": stats_corr_bpc},
 				"valores": {
 					"bpa_i": float(valor_total_bpa_i),
@@ -1577,6 +1583,7 @@ def biserver_extract_and_separate(request):
 			"message": (
 				f"Salvos: {saved_bpa_i} BPA-I (R$ {valor_total_bpa_i:.2f}), "
 				f"{saved_bpa_c} BPA-C (R$ {valor_total_bpa_c:.2f}). Total: R$ {(valor_total_bpa_i + valor_total_bpa_c):.2f}"
+				+ (f" ({failed_bpa_i} BPA-I nao gravados, veja errors)" if failed_bpa_i else "")
 			),
 		}
 	)
@@ -1648,42 +1655,14 @@ def consolidation_stats(request):
 		)
 
 	from services.consolidation_service import get_consolidation_service
+	from services.response_cache import cached, versoes_dados
 
-	consolidation_service = get_consolidation_service()
-	db = get_bpa_database()
-	bpai_records = db.list_bpa_individualizado(cnes, competencia, exportado=False)
-
-	stats = {
-		"total_bpai": len(bpai_records),
-		"pode_consolidar_geral": 0,
-		"pode_consolidar_idade": 0,
-		"manter_bpai": 0,
-		"procedimentos_geral": [],
-		"procedimentos_idade": [],
-		"procedimentos_manter": [],
-	}
-
-	proc_geral = set()
-	proc_idade = set()
-	proc_manter = set()
-
-	for record in bpai_records:
-		procedimento = record.get("prd_pa", "")
-		info = consolidation_service.verificar_procedimento(procedimento)
-		if info["tipo"] == "BPA-C":
-			if info["subtipo"] == "geral":
-				stats["pode_consolidar_geral"] += 1
-				proc_geral.add(procedimento)
-			else:
-				stats["pode_consolidar_idade"] += 1
-				proc_idade.add(procedimento)
-		else:
-			stats["manter_bpai"] += 1
-			proc_manter.add(procedimento)
-
-	stats["procedimentos_geral"] = sorted(proc_geral)
-	stats["procedimentos_idade"] = sorted(proc_idade)
-	stats["procedimentos_manter"] = sorted(proc_manter)
+	stats = cached(
+		"consolidation/stats",
+		{"cnes": cnes, "competencia": competencia},
+		lambda: versoes_dados(bpa=(cnes, competencia)),
+		lambda: get_consolidation_service().estatisticas(cnes, competencia),
+	)
 
 	return Response(stats)
 
@@ -1702,15 +1681,24 @@ def admin_dashboard_stats(request):
 		cnes_list = request.query_params.getlist("cnes[]")
 
 	from services.financial_service import get_financial_service
+	from services.response_cache import cached, competencia_sigtap, versoes_dados
 
 	service = get_financial_service()
-	stats = service.get_dashboard_stats(
-		competencia_inicio=competencia_inicio,
-		competencia_fim=competencia_fim,
-		cnes_list=cnes_list or None,
-		tipo_bpa=tipo_bpa,
-		cbo=cbo,
-		procedimento=procedimento,
+	params = {
+		"competencia_inicio": competencia_inicio,
+		"competencia_fim": competencia_fim,
+		"cnes_list": sorted(cnes_list) or None,
+		"tipo_bpa": tipo_bpa,
+		"cbo": cbo,
+		"procedimento": procedimento,
+	}
+	stats = cached(
+		"admin/dashboard/stats",
+		params,
+		lambda: versoes_dados(
+			bpa=(None, None), sigtap=competencia_sigtap(competencia_inicio or competencia_fim)
+		),
+		lambda: service.get_dashboard_stats(**params),
 	)
 
 	return Response({"success": True, **stats})
@@ -1752,6 +1740,9 @@ def sigtap_competencias(request):
 
 	try:
 		result = manager.import_competencia(str(temp_path), competencia)
+		from services.sigtap_filter_service import get_sigtap_filter_service
+
+		get_sigtap_filter_service().reload_competencia(competencia)
 		return Response(result)
 	finally:
 		if temp_path.exists():
@@ -1813,19 +1804,52 @@ def sigtap_procedimentos(request):
 	)
 
 
+@api_view(["GET"])
+def sigtap_procedimentos_lote(request):
+	from services.sigtap_filter_service import get_sigtap_filter_service
+
+	codigos = request.query_params.getlist("codigos")
+	if not codigos:
+		return Response({"detail": "codigos e obrigatorio"}, status=status.HTTP_400_BAD_REQUEST)
+
+	service = get_sigtap_filter_service()
+	infos = service.get_procedimentos_info(codigos, request.query_params.get("competencia"))
+	return Response(
+		{codigo: {k: v for k, v in info.items() if k != "raw"} for codigo, info in infos.items()}
+	)
+
+
 @api_view(["GET"])
 def sigtap_estatisticas(request):
+	from services.response_cache import cached, competencia_sigtap, versoes_dados
 	from services.sigtap_filter_service import get_sigtap_filter_service
 
 	competencia = request.query_params.get("competencia")
+	alvo = competencia_sigtap(competencia)
 	service = get_sigtap_filter_service()
-	return Response(service.get_estatisticas(competencia))
+	return Response(
+		cached(
+			"sigtap/estatisticas",
+			{"competencia": alvo},
+			lambda: versoes_dados(sigtap=alvo),
+			lambda: service.get_estatisticas(competencia),
+		)
+	)
 
 
 @api_view(["GET"])
 def sigtap_registros(request):
+	from services.response_cache import cached, competencia_sigtap, versoes_dados
 	from services.sigtap_filter_service import get_sigtap_filter_service
 
 	competencia = request.query_params.get("competencia")
+	alvo = competencia_sigtap(competencia)
 	service = get_sigtap_filter_service()
-	return Response(service.get_registros(competencia))
+	return Response(
+		cached(
+			"sigtap/registros",
+			{"competencia": alvo},
+			lambda: versoes_dados(sigtap=alvo),
+			lambda: service.get_registros(competencia),
+		)
+	)
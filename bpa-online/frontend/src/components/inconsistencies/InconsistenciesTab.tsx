@@ -9,14 +9,23 @@ interface InconsistencyReport {
         total: number;
         critical: number;
         warnings: number;
+        por_regra?: Record<string, number>;
     };
     details: any[];
+    pagination?: {
+        page: number;
+        page_size: number;
+        total: number;
+        pages: number;
+    };
 }
 
 const InconsistenciesTab: React.FC = () => {
     const [loading, setLoading] = useState(false);
     const [report, setReport] = useState<InconsistencyReport | null>(null);
     const [error, setError] = useState<string | null>(null);
+    const [page, setPage] = useState(1);
+    const [tipoFiltro, setTipoFiltro] = useState('');
 
     // Filters
     const [selectedCnes, setSelectedCnes] = useState('');
@@ -25,7 +34,7 @@ const InconsistenciesTab: React.FC = () => {
         return `${now.getFullYear()}${String(now.getMonth() + 1).padStart(2, '0')}`;
     });
 
-    const loadReport = async () => {
+    const loadReport = async (targetPage = 1, tipo = tipoFiltro) => {
         if (!selectedCnes || !selectedComp) return;
 
         setLoading(true);
@@ -34,8 +43,11 @@ const InconsistenciesTab: React.FC = () => {
             const token = localStorage.getItem('token');
             const params = new URLSearchParams({
                 cnes: selectedCnes,
-                competencia: selectedComp
+                competencia: selectedComp,
+                page: String(targetPage),
+                page_size: '100'
             });
+            if (tipo) params.set('tipo', tipo);
 
             const response = await fetch(`/api/bpa/inconsistencies?${params}`, {
                 headers: {
@@ -46,6 +58,7 @@ const InconsistenciesTab: React.FC = () => {
             if (response.ok) {
                 const data = await response.json();
                 setReport(data);
+                setPage(targetPage);
             } else {
                 const errData = await response.json();
                 setError(errData.detail || 'Erro ao carregar relatório');
@@ -122,7 +135,7 @@ const InconsistenciesTab: React.FC = () => {
 
                     <div className="flex items-end">
                         <button
-                            onClick={loadReport}
+                            onClick={() => loadReport(1)}
                             disabled={loading || !selectedCnes}
                             className="w-full h-[42px] bg-blue-600 text-white rounded-lg hover:bg-blue-700 disabled:opacity-50 flex items-center justify-center gap-2 font-medium"
                         >
@@ -153,6 +166,39 @@ const InconsistenciesTab: React.FC = () => {
                         critical={report.summary.critical}
                         warnings={report.summary.warnings}
                     />
+                    <div className="flex items-center justify-between gap-4">
+                        <select
+                            value={tipoFiltro}
+                            onChange={(e) => {
+                                setTipoFiltro(e.target.value);
+                                loadReport(1, e.target.value);
+                            }}
+                            className="px-3 py-2 border border-gray-300 rounded-lg focus:ring-2 focus:ring-blue-500"
+                        >
+                            <option value="">Todos os tipos</option>
+                            <option value="critical">Críticos</option>
+                            <option value="warning">Avisos</option>
+                        </select>
+                        {report.pagination && report.pagination.pages > 1 && (
+                            <div className="flex items-center gap-3 text-sm text-gray-600">
+                                <button
+                                    onClick={() => loadReport(page - 1)}
+                                    disabled={loading || page <= 1}
+                                    className="px-3 py-1 border border-gray-300 rounded-lg disabled:opacity-50"
+                                >
+                                    Anterior
+                                </button>
+                                <span>Página {report.pagination.page} de {report.pagination.pages}</span>
+                                <button
+                                    onClick={() => loadReport(page + 1)}
+                                    disabled={loading || page >= report.pagination.pages}
+                                    className="px-3 py-1 border border-gray-300 rounded-lg disabled:opacity-50"
+                                >
+                                    Próxima
+                                </button>
+                            </div>
+                        )}
+                    </div>
                     <InconsistencyList details={report.details} />
                 </>
             )}
@@ -16,6 +16,7 @@ import {
   Terminal
 } from 'lucide-react';
 import { useAuth } from '../contexts/AuthContext';
+import { waitForJob } from '../services/api';
 import { ESTABELECIMENTOS, getEstabelecimentoByCnes } from '../constants/estabelecimentos';
 
 interface SaveResult {
@@ -306,13 +307,24 @@ const BiServerExtractionPage: React.FC = () => {
         }
       );
       
-      const data = await response.json();
-      const elapsed = ((Date.now() - startTime) / 1000).toFixed(1);
+      let data = await response.json();
       
       if (!response.ok) {
         throw new Error(data.detail || 'Erro na extração');
       }
 
+      // Por padrão o endpoint roda como job em background
+      if (data.job_id) {
+        let lastMessage: string | null = null;
+        data = await waitForJob(data.job_id, job => {
+          if (job.message && job.message !== lastMessage) {
+            lastMessage = job.message;
+            addLog('download', job.message, 'info');
+          }
+        });
+      }
+      const elapsed = ((Date.now() - startTime) / 1000).toFixed(1);
+
       // Mapeia stats da API (formato: stats.extracted e stats.saved)
       const extractedStats = data.stats?.extracted || {};
       const savedStats = data.stats?.saved || {};
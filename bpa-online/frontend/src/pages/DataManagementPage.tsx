@@ -20,6 +20,7 @@ import {
   Save
 } from 'lucide-react';
 import { useAuth } from '../contexts/AuthContext';
+import { waitForJob } from '../services/api';
 import { getEstabelecimentoByCnes, ESTABELECIMENTOS } from '../constants/estabelecimentos';
 import FinancialDashboard from '../components/dashboard/FinancialDashboard';
 import InconsistenciesTab from '../components/inconsistencies/InconsistenciesTab';
@@ -283,13 +284,24 @@ const DataManagementPage: React.FC = () => {
         }
       });
 
-      const result = await response.json();
-      const elapsed = ((Date.now() - startTime) / 1000).toFixed(1);
+      let result = await response.json();
 
       if (!response.ok) {
         throw new Error(result.detail || 'Erro na extração');
       }
 
+      // Por padrão o endpoint roda como job em background
+      if (result.job_id) {
+        let lastMessage: string | null = null;
+        result = await waitForJob(result.job_id, job => {
+          if (job.message && job.message !== lastMessage) {
+            lastMessage = job.message;
+            addLog('download', job.message, 'info');
+          }
+        });
+      }
+      const elapsed = ((Date.now() - startTime) / 1000).toFixed(1);
+
       // Atualiza stats
       const stats = result.stats || {};
       const extractedStats = stats.extracted || {};
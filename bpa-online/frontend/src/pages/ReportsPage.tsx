@@ -15,6 +15,7 @@ import {
   Database
 } from 'lucide-react';
 import { useAuth } from '../contexts/AuthContext';
+import { waitForJob } from '../services/api';
 import { ESTABELECIMENTOS, getEstabelecimentoByCnes } from '../constants/estabelecimentos';
 
 const API_URL = process.env.REACT_APP_API_URL || 'http://localhost:8000/api';
@@ -167,7 +168,14 @@ const ReportsPage: React.FC = () => {
         })
       });
 
-      const data: GenerateResponse = await response.json();
+      let data = await response.json();
+      if (!response.ok) {
+        throw new Error(data.detail || 'Erro ao gerar relatórios');
+      }
+      // Por padrão o endpoint roda como job em background
+      if (data.job_id) {
+        data = await waitForJob<GenerateResponse>(data.job_id);
+      }
 
       if (data.success) {
         setMessage({ type: 'success', text: data.message });
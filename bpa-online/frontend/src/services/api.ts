@@ -352,4 +352,40 @@ export const getBPAStats = async (cnes: string, competencia: string): Promise<BP
   return response.data;
 };
 
+// ========== JOBS ==========
+
+export interface JobStatus {
+  id: string;
+  status: 'pending' | 'running' | 'completed' | 'error' | 'cancelled';
+  progress: number | null;
+  current: number | null;
+  total: number | null;
+  message: string | null;
+  error: string | null;
+}
+
+// Acompanha um job em background (endpoints longos devolvem {job_id}) até o fim
+// e retorna o mesmo resultado que o endpoint daria executando na requisição
+export const waitForJob = async <T = any>(
+  jobId: string,
+  onProgress?: (job: JobStatus) => void,
+  intervalMs: number = 2000
+): Promise<T> => {
+  for (;;) {
+    const { data: job } = await api.get<JobStatus>(`/jobs/${jobId}`);
+    onProgress?.(job);
+    if (job.status === 'error') {
+      throw new Error(job.error || 'Erro no job');
+    }
+    if (job.status === 'completed' || job.status === 'cancelled') {
+      const { data } = await api.get(`/jobs/${jobId}/result`);
+      if (data.result == null) {
+        throw new Error('Job cancelado');
+      }
+      return data.result as T;
+    }
+    await new Promise(resolve => setTimeout(resolve, intervalMs));
+  }
+};
+
 export default api;